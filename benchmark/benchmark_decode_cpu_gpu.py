@@ -0,0 +1,96 @@
+# benchmark/benchmark_decode_cpu_gpu.py
+"""
+decode_chunk の CPU / GPU バックエンド比較 (rows/sec)
+
+- CPU: parse_binary_chunk_cpu + decode_chunk(backend="cpu")
+- GPU: parse_binary_chunk_gpu + decode_chunk(backend="gpu")
+
+PostgreSQL 不要。lineorder 相当 (int4 / text / numeric / date) の COPY BINARY を合成して計測する。
+GPU が無い環境では --skip-gpu で CPU のみ計測する。
+
+使い方:
+    python -m benchmark.benchmark_decode_cpu_gpu --rows 2000000 --repeat 3
+"""
+
+import argparse
+import time
+import datetime
+from decimal import Decimal
+
+import numpy as np
+
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.gpu_decoder_v2 import decode_chunk
+from test.pg_copy_fixtures import PGCOPY_HEADER, PGCOPY_TRAILER, encode_row, make_column_meta
+
+# int4 x 6, text x 2, numeric x 3, date x 1
+OIDS = [23] * 6 + [25] * 2 + [1700] * 3 + [1082]
+NAMES = [f"c{i}" for i in range(len(OIDS))]
+NUMERIC_PARAMS = {f"c{i}": (15, 2) for i in range(8, 11)}
+BLOCK_ROWS = 10_000
+
+
+def make_copy_data(rows: int) -> np.ndarray:
+    """BLOCK_ROWS 行を繰り返して rows 行程度の COPY BINARY を作る"""
+    rng = np.random.default_rng(0)
+    block_rows = []
+    for _ in range(BLOCK_ROWS):
+        ints = [int(v) for v in rng.integers(0, 1 << 30, 6)]
+        texts = ["x" * int(rng.integers(1, 25)) for _ in range(2)]
+        nums = [Decimal(int(v)).scaleb(-2) for v in rng.integers(0, 10**9, 3)]
+        day = datetime.date(1992, 1, 1) + datetime.timedelta(days=int(rng.integers(0, 2500)))
+        block_rows.append(ints + texts + nums + [day])
+    block = b"".join(encode_row(OIDS, r) for r in block_rows)
+    repeat = max(1, rows // BLOCK_ROWS)
+    return np.frombuffer(PGCOPY_HEADER + block * repeat + PGCOPY_TRAILER, dtype=np.uint8)
+
+
+def run_cpu(raw_host, columns):
+    offs, lens = parse_binary_chunk_cpu(raw_host, len(columns))
+    return decode_chunk(raw_host, offs, lens, columns, backend="cpu")
+
+
+def run_gpu(raw_host, columns):
+    from numba import cuda
+    from src.gpu_parse_wrapper import parse_binary_chunk_gpu
+
+    raw_dev = cuda.to_device(raw_host)
+    offs, lens = parse_binary_chunk_gpu(raw_dev, len(columns))
+    batch = decode_chunk(raw_dev, offs, lens, columns, backend="gpu")
+    cuda.synchronize()
+    return batch
+
+
+def bench(fn, repeat):
+    fn()  # JIT ウォームアップ
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="decode_chunk CPU vs GPU throughput")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="合成行数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-gpu", action="store_true", help="GPU の計測を省略")
+    args = parser.parse_args()
+
+    raw_host = make_copy_data(args.rows)
+    columns = make_column_meta(NAMES, OIDS, NUMERIC_PARAMS)
+    print(f"データサイズ: {raw_host.size / (1 << 20):,.1f} MB, 列数: {len(columns)}")
+
+    t_cpu, batch_cpu = bench(lambda: run_cpu(raw_host, columns), args.repeat)
+    print(f"cpu  : {t_cpu * 1000:9.2f} ms  {batch_cpu.num_rows / t_cpu:14,.0f} rows/s")
+
+    if not args.skip_gpu:
+        t_gpu, batch_gpu = bench(lambda: run_gpu(raw_host, columns), args.repeat)
+        print(f"gpu  : {t_gpu * 1000:9.2f} ms  {batch_gpu.num_rows / t_gpu:14,.0f} rows/s")
+        print(f"gpu/cpu: {t_cpu / t_gpu:7.2f}x")
+        print(f"RecordBatch 一致: {batch_cpu.equals(batch_gpu)}")
+
+
+if __name__ == "__main__":
+    main()
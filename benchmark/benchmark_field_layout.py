@@ -0,0 +1,129 @@
+# benchmark/benchmark_field_layout.py
+"""
+field_offsets / field_lengths のレイアウト (行優先 vs 列優先) による pass1/pass2 の差
+
+- row: (rows, ncols) C order。列スライス [:, cidx] のストライドは ncols*4 バイト
+- col: (rows, ncols) F order。列スライスが連続になり、1 warp の読み出しが coalesce する
+
+PostgreSQL 不要。lineorder 相当 (17 列) と 200 列の横長テーブルを合成して、
+パース済みのフィールド表から pass1 (ビットマップ) + pass2 (固定長 / 可変長 scatter)
+にかかる時間と、フィールド表読み出しの実効帯域を計測する。
+
+使い方:
+    python -m benchmark.benchmark_field_layout --rows 2000000 --repeat 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+from numba import cuda
+
+from src.cuda_kernels.arrow_gpu_pass2 import pass2_scatter_varlen
+from src.cuda_kernels.arrow_gpu_pass2_fixed import pass2_scatter_fixed
+from src.gpu_decoder_v2 import run_pass1_bitmaps
+from src.gpu_parse_wrapper import parse_binary_chunk_gpu
+from test.pg_copy_fixtures import PGCOPY_HEADER, PGCOPY_TRAILER, encode_row
+
+# lineorder 相当: int4 x 13, text x 4
+LINEORDER_OIDS = [23] * 9 + [25] * 2 + [23] * 4 + [25] * 2
+# 横長テーブル: int8 x 150, text x 50
+WIDE_OIDS = ([20] * 3 + [25]) * 50
+BLOCK_ROWS = 2_000
+THREADS = 256
+
+
+def make_copy_data(oids, rows: int) -> np.ndarray:
+    """BLOCK_ROWS 行を繰り返して rows 行程度の COPY BINARY を作る"""
+    rng = np.random.default_rng(0)
+    block_rows = []
+    for _ in range(BLOCK_ROWS):
+        block_rows.append([
+            "x" * int(rng.integers(1, 25)) if oid == 25 else int(rng.integers(0, 1 << 30))
+            for oid in oids
+        ])
+    block = b"".join(encode_row(oids, r) for r in block_rows)
+    repeat = max(1, rows // BLOCK_ROWS)
+    return np.frombuffer(PGCOPY_HEADER + block * repeat + PGCOPY_TRAILER, dtype=np.uint8)
+
+
+def prepare_outputs(oids, rows):
+    """pass2 の出力バッファ (列ごと)"""
+    outs = []
+    for oid in oids:
+        if oid == 25:
+            outs.append((cuda.device_array(rows + 1, np.int32), cuda.device_array(rows * 32, np.uint8)))
+        else:
+            esize = 8 if oid == 20 else 4
+            outs.append((esize, cuda.device_array(rows * esize, np.uint8)))
+    return outs
+
+
+def run_pass1_pass2(raw_dev, offs_dev, lens_dev, oids, var_indices_dev, n_var, outs):
+    rows = offs_dev.shape[0]
+    blocks = (rows + THREADS - 1) // THREADS
+    d_var_lens, _, _ = run_pass1_bitmaps(lens_dev, var_indices_dev, n_var)
+    for cidx, oid in enumerate(oids):
+        if oid == 25:
+            # offsets は prefix sum の代わりに固定幅 32 バイトのスロット (run_table で初期化)
+            d_offsets, d_values = outs[cidx]
+            pass2_scatter_varlen[blocks, THREADS](
+                raw_dev, offs_dev[:, cidx], lens_dev[:, cidx], d_offsets, d_values
+            )
+        else:
+            esize, d_vals = outs[cidx]
+            pass2_scatter_fixed[blocks, THREADS](raw_dev, offs_dev[:, cidx], esize, d_vals, esize)
+    cuda.synchronize()
+    return d_var_lens
+
+
+def bench(fn, repeat):
+    fn()  # JIT ウォームアップ
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def run_table(label, oids, rows, repeat):
+    raw_host = make_copy_data(oids, rows)
+    raw_dev = cuda.to_device(raw_host)
+    ncols = len(oids)
+    var_indices = np.full(ncols, -1, np.int32)
+    var_cols = [i for i, oid in enumerate(oids) if oid == 25]
+    var_indices[var_cols] = np.arange(len(var_cols), dtype=np.int32)
+    var_indices_dev = cuda.to_device(var_indices)
+
+    print(f"\n[{label}] データサイズ: {raw_host.size / (1 << 20):,.1f} MB, 列数: {ncols}")
+    results = {}
+    for layout in ("row", "col"):
+        offs_dev, lens_dev = parse_binary_chunk_gpu(raw_dev, ncols, layout=layout)
+        nrows = offs_dev.shape[0]
+        outs = prepare_outputs(oids, nrows)
+        # varlen offsets は固定幅スロットで 1 度だけ初期化
+        for cidx in var_cols:
+            outs[cidx][0].copy_to_device(np.arange(0, (nrows + 1) * 32, 32, dtype=np.int32))
+        t = bench(lambda: run_pass1_pass2(raw_dev, offs_dev, lens_dev, oids, var_indices_dev,
+                                          len(var_cols), outs), repeat)
+        # pass1 は lengths を 1 回、pass2 は各列の offsets (+ varlen は lengths) を読む
+        index_bytes = nrows * ncols * 4 * 2 + nrows * len(var_cols) * 4
+        results[layout] = t
+        print(f"  {layout:4s}: {t * 1000:9.2f} ms  index read {index_bytes / t / 1e9:7.2f} GB/s  rows={nrows:,}")
+    print(f"  col/row speedup: {results['row'] / results['col']:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Field index layout (row vs column major) for pass1/pass2")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="合成行数 (17 列テーブル)")
+    parser.add_argument("--wide-rows", type=int, default=200_000, help="合成行数 (200 列テーブル)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_table("lineorder 17 cols", LINEORDER_OIDS, args.rows, args.repeat)
+    run_table("wide 200 cols", WIDE_OIDS, args.wide_rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@
 """
 複数GPUを使用してPostgreSQLからデータを取得しParquetファイルに変換するスクリプト
 各GPUが独立したプロセスで動作し、CUDAコンテキストの競合を避けます
+
+テーブルは LIMIT/OFFSET ではなく ChunkSpec (ctid 範囲 / キー範囲 / ハッシュ分割) で
+GPU 数に分割するため、各プロセスの走査コストは担当チャンクの大きさにだけ比例します。
+
+出力は 1 つの Parquet データセット (--output) です。各プロセスが ParquetDatasetWriter で
+Hive 形式のパーティション (--partition_by) に目標サイズのファイルを書き、
+最後に親プロセスが _metadata / _common_metadata をまとめて書きます。
 """
 
 import os
@@ -9,49 +16,45 @@ import sys
 import time
 import argparse
 import multiprocessing as mp
-from src.main import PgGpuProcessor
-from src.pg_connector import PostgresConnector
-
-# from src.utils import get_available_gpus # TODO: Verify if get_available_gpus is still needed and where it is located.
 
 # gpuPaserパッケージのパスを追加
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from gpupaser.main import PgGpuProcessor
-from gpupaser.pg_connector import PostgresConnector
-from gpupaser.utils import get_available_gpus
+from src.dataset_writer import DEFAULT_TARGET_FILE_BYTES, PARTITION_TRANSFORMS, write_dataset_metadata
+from src.pg_connector import connect_to_postgres
+from src.pg_partition import plan_chunks
+
 
+def get_available_gpus():
+    """利用可能な GPU ID のリスト (子プロセスで CUDA を初期化するため親では数えるだけ)"""
+    from numba import cuda
+    return list(range(len(cuda.gpus)))
 
-def process_chunk_on_gpu(gpu_id, table_name, start_row, chunk_size, output_path, db_params, queue):
+
+def process_chunk_on_gpu(gpu_id, table_name, spec, output_path, db_params, queue, dataset_options=None):
     """
     単一GPUでデータチャンクを処理する関数
     
     Args:
         gpu_id: 使用するGPU ID
         table_name: 処理対象のテーブル名
-        start_row: 処理開始行
-        chunk_size: 処理する行数
+        spec: 担当するチャンク (pg_partition.ChunkSpec)
         output_path: 出力ディレクトリパス
         db_params: データベース接続パラメータ
         queue: マルチプロセス間通信用キュー
+        dataset_options: ParquetDatasetWriter への引数 (partition_by など)
     """
     try:
-        # GPUを指定
+        # GPUを指定 (CUDA 初期化より前に設定する)
         os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+        from src.dataset_writer import ParquetDatasetWriter
+        from src.main import PgGpuProcessor
         
-        print(f"GPU {gpu_id}: チャンク処理開始 (行 {start_row} から {start_row + chunk_size - 1})")
+        print(f"GPU {gpu_id}: チャンク処理開始 (チャンク {spec.index}: {spec.where_clause()})")
         
         # 処理時間計測
         start_time = time.time()
         
-        # PostgreSQL接続
-        pg_conn = PostgresConnector(
-            dbname=db_params.get("dbname", "postgres"),
-            user=db_params.get("user", "postgres"),
-            password=db_params.get("password", "postgres"),
-            host=db_params.get("host", "localhost")
-        )
-        
         # GPUプロセッサーを初期化
         processor = PgGpuProcessor(
             dbname=db_params.get("dbname", "postgres"),
@@ -60,24 +63,21 @@ def process_chunk_on_gpu(gpu_id, table_name, start_row, chunk_size, output_path,
             host=db_params.get("host", "localhost")
         )
         
-        # クエリを実行（LIMIT と OFFSET を使用して指定範囲のみ取得）
-        query = f"SELECT * FROM {table_name} LIMIT {chunk_size} OFFSET {start_row}"
-        print(f"GPU {gpu_id}: 実行クエリ: {query}")
-        
-        # GPUでデータを処理
-        result_df = processor.process_query(query)
+        # 担当チャンクを COPY → GPU 変換 → Parquet データセットへ出力
+        # (ファイル名の接頭辞をチャンクごとに変え、_metadata は親プロセスがまとめて書く)
+        try:
+            with ParquetDatasetWriter(output_path, file_prefix=f"chunk{spec.index:04d}-", write_metadata=False,
+                                      **(dataset_options or {})) as writer:
+                stats = processor.process_table_chunk(table_name, spec, sink=writer)
+            output_files = [os.path.join(output_path, f.path) for f in writer.files]
+        finally:
+            processor.close()
         
-        if result_df is not None and not result_df.empty:
+        if stats is not None and stats.rows > 0:
             # 処理行数を確認
-            processed_rows = len(result_df)
+            processed_rows = stats.rows
             print(f"GPU {gpu_id}: {processed_rows}行のデータを処理しました")
-            
-            # データフレームをPyArrowテーブルに変換してParquetに保存
-            output_file = os.path.join(output_path, f"{table_name}_chunk_{gpu_id}.parquet")
-            table = pa.Table.from_pandas(result_df)
-            pq.write_table(table, output_file)
-            
-            print(f"GPU {gpu_id}: 結果をParquetファイルに保存: {output_file}")
+            print(f"GPU {gpu_id}: 結果をParquetファイルに保存: {len(output_files)}ファイル")
             
             # 処理時間
             elapsed_time = time.time() - start_time
@@ -87,9 +87,9 @@ def process_chunk_on_gpu(gpu_id, table_name, start_row, chunk_size, output_path,
             # 結果をキューに入れる
             queue.put({
                 "gpu_id": gpu_id,
-                "start_row": start_row,
+                "chunk": spec.index,
                 "processed_rows": processed_rows,
-                "output_file": output_file,
+                "output_files": output_files,
                 "elapsed_time": elapsed_time,
                 "success": True
             })
@@ -97,7 +97,7 @@ def process_chunk_on_gpu(gpu_id, table_name, start_row, chunk_size, output_path,
             print(f"GPU {gpu_id}: データが空または処理に失敗しました")
             queue.put({
                 "gpu_id": gpu_id,
-                "start_row": start_row,
+                "chunk": spec.index,
                 "success": False,
                 "error": "空のデータセットまたは処理失敗"
             })
@@ -106,7 +106,7 @@ def process_chunk_on_gpu(gpu_id, table_name, start_row, chunk_size, output_path,
         print(f"GPU {gpu_id}: エラー発生: {str(e)}")
         queue.put({
             "gpu_id": gpu_id,
-            "start_row": start_row,
+            "chunk": spec.index,
             "success": False,
             "error": str(e)
         })
@@ -117,11 +117,18 @@ def main():
     """
     parser = argparse.ArgumentParser(description="複数GPUを使用してPostgreSQLデータをParquetに変換")
     parser.add_argument("--table", "-t", required=True, help="処理するテーブル名")
-    parser.add_argument("--rows", "-r", type=int, default=10000, help="処理する総行数 (デフォルト: 10000)")
     parser.add_argument("--output", "-o", default="./ray_output", help="出力ディレクトリ (デフォルト: ./ray_output)")
     parser.add_argument("--gpus", "-g", type=int, help="使用するGPU数 (指定しない場合は自動検出)")
     parser.add_argument("--gpu_ids", "-i", help="使用するGPU IDのカンマ区切りリスト (例: '0,2')")
-    parser.add_argument("--chunk_size", "-c", type=int, help="チャンクサイズ (指定しない場合は自動計算)")
+    parser.add_argument("--chunk_method", "-m", choices=["ctid", "key", "hash"], default="ctid",
+                        help="チャンクの分け方: ctid=ブロック範囲, key=整数キー範囲, hash=キーのハッシュ分割")
+    parser.add_argument("--chunk_key", "-k", help="--chunk_method key/hash で使う列名")
+    parser.add_argument("--partition_by", help="パーティションに使う列名 (例: lo_orderdate)")
+    parser.add_argument("--partition_transform", choices=PARTITION_TRANSFORMS, default="identity",
+                        help="パーティションキー: identity=値そのまま, year / month=年・年月 (整数は YYYYMMDD とみなす)")
+    parser.add_argument("--target_file_mb", type=int, default=DEFAULT_TARGET_FILE_BYTES >> 20,
+                        help="1 ファイルの目標サイズ (MB)")
+    parser.add_argument("--encode_threads", type=int, default=4, help="プロセスごとの Parquet エンコードスレッド数")
     
     # PostgreSQL接続パラメータ
     parser.add_argument("--db_name", "-d", default="postgres", help="データベース名")
@@ -157,15 +164,6 @@ def main():
         print("エラー: 使用可能なGPUが見つかりません")
         return
     
-    # チャンクサイズの決定
-    if args.chunk_size:
-        chunk_size = args.chunk_size
-    else:
-        # デフォルトは1GPUあたり均等に分割
-        chunk_size = (args.rows + num_gpus - 1) // num_gpus
-    
-    print(f"総行数: {args.rows}, GPU数: {num_gpus}, チャンクサイズ: {chunk_size}")
-    
     # PostgreSQL接続パラメータ
     db_params = {
         "dbname": args.db_name,
@@ -174,32 +172,42 @@ def main():
         "host": args.db_host
     }
     
+    # GPU 1 個につき 1 チャンク (互いに素で全行を覆う)
+    conn = connect_to_postgres(args.db_name, args.db_user, args.db_password, args.db_host)
+    try:
+        specs = plan_chunks(conn, args.table, num_gpus, args.chunk_method, args.chunk_key)
+    finally:
+        conn.close()
+    
+    print(f"GPU数: {num_gpus}, チャンク方式: {args.chunk_method}, チャンク数: {len(specs)}")
+    
+    dataset_options = {
+        "partition_by": args.partition_by,
+        "partition_transform": args.partition_transform,
+        "target_file_bytes": args.target_file_mb << 20,
+        "max_workers": args.encode_threads,
+    }
+
+    # 子プロセスで CUDA を初期化するため spawn で起動する
+    ctx = mp.get_context("spawn")
     # マルチプロセス間通信用のキュー
-    result_queue = Queue()
+    result_queue = ctx.Queue()
     
     # 処理プロセスのリスト
     processes = []
     
     # 各GPUに処理を割り当て
-    for i, gpu_id in enumerate(gpu_ids):
-        start_row = i * chunk_size
-        # 最大行数を超えないようにする
-        current_chunk_size = min(chunk_size, args.rows - start_row)
-        
-        if current_chunk_size <= 0:
-            # このGPUには割り当てるデータがない
-            continue
-        
+    for gpu_id, spec in zip(gpu_ids, specs):
         # 新しいプロセスを作成
-        process = Process(
+        process = ctx.Process(
             target=process_chunk_on_gpu,
-            args=(gpu_id, args.table, start_row, current_chunk_size, args.output, db_params, result_queue)
+            args=(gpu_id, args.table, spec, args.output, db_params, result_queue, dataset_options)
         )
         processes.append(process)
         
         # プロセスを開始
         process.start()
-        print(f"プロセス開始: GPU {gpu_id}, 開始行: {start_row}, チャンクサイズ: {current_chunk_size}")
+        print(f"プロセス開始: GPU {gpu_id}, チャンク {spec.index}: {spec.where_clause()}")
     
     # 結果の収集
     results = []
@@ -210,6 +218,9 @@ def main():
     # 全プロセスの終了を待機
     for process in processes:
         process.join()
+
+    # 全ファイルのフッタから _metadata / _common_metadata を作る
+    num_files = write_dataset_metadata(args.output)
     
     # 結果を表示
     successful_files = []
@@ -218,43 +229,21 @@ def main():
     
     for result in results:
         if result["success"]:
-            successful_files.append(result["output_file"])
+            successful_files.extend(result["output_files"])
             total_rows += result["processed_rows"]
             total_time = max(total_time, result["elapsed_time"])
     
     print("\n=== 処理結果 ===")
-    print(f"成功したGPU: {len(successful_files)}/{len(processes)}")
+    print(f"成功したGPU: {sum(r['success'] for r in results)}/{len(processes)}")
     print(f"処理された合計行数: {total_rows}")
     print(f"最大処理時間: {total_time:.2f}秒")
     
     if total_time > 0:
         print(f"総合スループット: {total_rows / total_time:.2f}行/秒")
     
-    print(f"出力ファイル: {successful_files}")
-    
-    # 全てのParquetファイルを結合することも可能
-    # 以下のコメントを解除すると結合処理が実行されます
-    """
-    if len(successful_files) > 0:
-        print("\n全Parquetファイルを結合中...")
-        combined_file = os.path.join(args.output, f"{args.table}_combined.parquet")
-        
-        # 各ファイルを読み込んでDataFrameのリストを作成
-        dfs = []
-        for file in successful_files:
-            df = pd.read_parquet(file)
-            dfs.append(df)
-        
-        # DataFrameを結合
-        if dfs:
-            combined_df = pd.concat(dfs, ignore_index=True)
-            
-            # 結合したDataFrameをParquetとして保存
-            table = pa.Table.from_pandas(combined_df)
-            pq.write_table(table, combined_file)
-            
-            print(f"結合ファイルを保存しました: {combined_file} (合計 {len(combined_df)}行)")
-    """
+    print(f"出力ファイル ({num_files}個): {successful_files}")
+    # データセット全体は pyarrow.dataset.parquet_dataset(os.path.join(args.output, "_metadata"),
+    # partitioning="hive") などで、各ファイルを開かずに絞り込んで読める
 
 if __name__ == "__main__":
     main()
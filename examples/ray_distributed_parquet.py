@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 """
 マルチGPUでPostgreSQLデータを並列処理し、Parquetファイルに出力するRayスクリプト
+
+テーブルは LIMIT/OFFSET ではなく ChunkSpec (ctid 範囲 / キー範囲 / ハッシュ分割) で
+分割する。各チャンクの走査コストはチャンクの大きさにだけ比例し、チャンク間で
+行の重複・欠落は起きない。
+
+出力は 1 つの Parquet データセット (--output_dir) で、各タスクが ParquetDatasetWriter で
+Hive 形式のパーティション (--partition_by) に目標サイズのファイルを書き、
+全タスクの終了後にドライバが _metadata / _common_metadata をまとめて書く。
 """
 
 import ray
@@ -10,17 +18,29 @@ import time
 import glob
 from typing import Dict, List, Optional, Tuple
 
+from src.dataset_writer import DEFAULT_TARGET_FILE_BYTES, PARTITION_TRANSFORMS, ParquetDatasetWriter, \
+    write_dataset_metadata
 from src.main import PgGpuProcessor
+from src.pg_connector import connect_to_postgres
+from src.pg_partition import ChunkSpec, plan_chunks
 
 def parse_args():
     """コマンドライン引数の解析"""
     parser = argparse.ArgumentParser(description='PostgreSQL GPU Parser - Ray分散処理版')
     parser.add_argument('--table', required=True, help='処理するテーブル名')
-    parser.add_argument('--total_rows', type=int, required=True, help='処理する合計行数')
     parser.add_argument('--num_gpus', type=int, default=None, help='使用するGPU数（指定しない場合は利用可能なすべてのGPUを使用）')
     parser.add_argument('--gpu_ids', help='使用するGPU IDのカンマ区切りリスト (例: "0,1,2")')
     parser.add_argument('--output_dir', default='./parquet_output', help='Parquet出力ディレクトリ')
-    parser.add_argument('--chunk_size', type=int, default=None, help='1チャンクあたりの行数（指定しない場合は自動計算）')
+    parser.add_argument('--num_chunks', type=int, default=None, help='チャンク数（指定しない場合はGPU数）')
+    parser.add_argument('--chunk_method', choices=['ctid', 'key', 'hash'], default='ctid',
+                        help='チャンクの分け方: ctid=ブロック範囲, key=整数キー範囲, hash=キーのハッシュ分割')
+    parser.add_argument('--chunk_key', default=None, help='--chunk_method key/hash で使う列名')
+    parser.add_argument('--partition_by', default=None, help='パーティションに使う列名 (例: lo_orderdate)')
+    parser.add_argument('--partition_transform', choices=PARTITION_TRANSFORMS, default='identity',
+                        help='パーティションキー: identity=値そのまま, year / month=年・年月 (整数は YYYYMMDD とみなす)')
+    parser.add_argument('--target_file_mb', type=int, default=DEFAULT_TARGET_FILE_BYTES >> 20,
+                        help='1 ファイルの目標サイズ (MB)')
+    parser.add_argument('--encode_threads', type=int, default=4, help='タスクごとの Parquet エンコードスレッド数')
     parser.add_argument('--db_name', default='postgres', help='データベース名')
     parser.add_argument('--db_user', default='postgres', help='データベースユーザー')
     parser.add_argument('--db_password', default='postgres', help='データベースパスワード')
@@ -29,22 +49,22 @@ def parse_args():
 
 
 @ray.remote(num_gpus=1, num_cpus=4)
-def process_chunk(table_name: str, chunk_size: int, offset: int, output_file: str,
+def process_chunk(table_name: str, spec: ChunkSpec, output_dir: str,
                   db_name: str = 'postgres', db_user: str = 'postgres',
                   db_password: str = 'postgres', db_host: str = 'localhost',
-                  gpu_id: int = None):
+                  gpu_id: int = None, dataset_options: Optional[Dict] = None):
     """1つのGPUで1チャンクを処理
 
     Args:
         table_name: 処理するテーブル名
-        chunk_size: 処理する行数
-        offset: 開始行オフセット
-        output_file: Parquet出力ファイルパス
+        spec: 処理するチャンク (ドライバが plan_table_chunks で作成)
+        output_dir: Parquet データセットのディレクトリ
         db_name: データベース名
         db_user: データベースユーザー
         db_password: データベースパスワード
         db_host: データベースホスト
         gpu_id: 使用するGPU ID（Noneの場合はRayが自動割り当て）
+        dataset_options: ParquetDatasetWriter への引数 (partition_by など)
 
     Returns:
         処理結果情報
@@ -55,35 +75,37 @@ def process_chunk(table_name: str, chunk_size: int, offset: int, output_file: st
         os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
         print(f"GPU #{gpu_id} で処理を実行")
 
-    print(f"GPU処理開始: {table_name}テーブル {offset}～{offset+chunk_size}行")
+    print(f"GPU処理開始: {table_name}テーブル チャンク {spec.index} ({spec.where_clause()})")
     start_time = time.time()
 
-    # GPUプロセッサの初期化（Parquet出力設定）
+    # GPUプロセッサの初期化
     processor = PgGpuProcessor(
         dbname=db_name,
         user=db_user,
         password=db_password,
         host=db_host,
-        parquet_output=output_file
     )
-
     try:
         # 指定範囲のみを処理
-        result = processor.process_table_chunk(table_name, chunk_size, offset, output_file)
+        # (タスクごとにファイル名の接頭辞を変え、_metadata はドライバがまとめて書く)
+        with ParquetDatasetWriter(output_dir, file_prefix=f"chunk{spec.index:04d}-", write_metadata=False,
+                                  **(dataset_options or {})) as writer:
+            stats = processor.process_table_chunk(table_name, spec, sink=writer)
+        files = writer.files
 
         processing_time = time.time() - start_time
-        print(f"GPU処理完了: {output_file} 処理時間: {processing_time:.3f}秒")
+        print(f"GPU処理完了: {len(files)}ファイル 処理時間: {processing_time:.3f}秒")
 
         return {
-            "output_file": output_file,
-            "rows_processed": chunk_size,
+            "output_files": [os.path.join(output_dir, f.path) for f in files],
+            "rows_processed": stats.rows if stats is not None else 0,
             "processing_time": processing_time,
-            "offset": offset,
+            "chunk": spec.index,
             "gpu_id": gpu_id
         }
 
     except Exception as e:
-        print(f"チャンク処理エラー ({offset}～{offset+chunk_size}): {e}")
+        print(f"チャンク処理エラー (チャンク {spec.index}): {e}")
         raise
     finally:
         # リソース解放
@@ -120,16 +142,17 @@ def main():
     print(f"Ray初期化完了: 利用可能なGPU: {available_gpus} 使用するGPU: {num_gpus}")
     print(f"使用するGPU ID: {gpu_ids}")
 
-    # チャンクサイズと数の計算
-    if args.chunk_size:
-        chunk_size = args.chunk_size
-        num_chunks = (args.total_rows + chunk_size - 1) // chunk_size  # 切り上げ
-    else:
-        # 各GPUに均等に分配（最低でも1チャンク）
-        num_chunks = max(num_gpus, 1)
-        chunk_size = (args.total_rows + num_chunks - 1) // num_chunks
+    # チャンクの計画 (互いに素で全行を覆う ChunkSpec のリスト)
+    num_chunks = args.num_chunks if args.num_chunks else max(num_gpus, 1)
+    # (ドライバは GPU を使わないので DB 接続だけで計画する)
+    conn = connect_to_postgres(args.db_name, args.db_user, args.db_password, args.db_host)
+    try:
+        specs = plan_chunks(conn, args.table, num_chunks, args.chunk_method, args.chunk_key)
+    finally:
+        conn.close()
+    num_chunks = len(specs)
 
-    print(f"チャンク設定: サイズ={chunk_size}行 数={num_chunks}個")
+    print(f"チャンク設定: 方式={args.chunk_method} 数={num_chunks}個")
 
     # タスク実行
     results = []
@@ -160,34 +183,35 @@ def main():
         
     print(f"チャンク割り当て計画: {gpu_assignments}")
 
-    print(f"{len(results)}個のチャンクを処理中...")
-    for i in range(num_chunks):
-        offset = i * chunk_size
-
-        # 最後のチャンクは残りすべて（total_rowsを超えないように）
-        current_chunk_size = min(chunk_size, args.total_rows - offset)
-        if current_chunk_size <= 0:
-            break
+    dataset_options = {
+        "partition_by": args.partition_by,
+        "partition_transform": args.partition_transform,
+        "target_file_bytes": args.target_file_mb << 20,
+        "max_workers": args.encode_threads,
+    }
 
-        output_file = os.path.join(args.output_dir, f"{args.table}_chunk_{i}.parquet")
+    print(f"{len(specs)}個のチャンクを処理中...")
+    for i, spec in enumerate(specs):
         gpu_id = gpu_assignments[i]
 
         # 非同期実行（特定のGPU IDを指定）
         result = process_chunk.remote(
             args.table,
-            current_chunk_size,
-            offset,
-            output_file,
+            spec,
+            args.output_dir,
             args.db_name,
             args.db_user,
             args.db_password,
             args.db_host,
-            gpu_id
+            gpu_id,
+            dataset_options
         )
         results.append(result)
 
     # すべての結果を待機
     output_info = ray.get(results)
+    # 全ファイルのフッタから _metadata / _common_metadata を作る (読み手はこれでファイルを絞り込む)
+    num_files = write_dataset_metadata(args.output_dir)
 
     # 処理終了時間を記録（ファイルリスト表示やcuDF検証など前）
     processing_end_time = time.time()
@@ -217,8 +241,8 @@ def main():
     print("\n--- 以下は参考情報（処理時間には含まれていません）---")
     
     # 出力ファイル一覧
-    output_files = [info["output_file"] for info in output_info]
-    print(f"\n出力ファイル ({len(output_files)}個):")
+    output_files = [f for info in output_info for f in info["output_files"]]
+    print(f"\n出力ファイル ({num_files}個, _metadata 付き):")
     for f in output_files:
         file_size = os.path.getsize(f) / (1024 * 1024)  # MBに変換
         print(f"  {f} ({file_size:.2f} MB)")
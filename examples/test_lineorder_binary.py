@@ -43,12 +43,9 @@ def test_lineorder_binary_format(limit=5000, parquet_output="lineorder_binary_te
     columns = pg_conn.get_table_info(table_name)
     print(f"列数: {len(columns)}")
     
-    # 行数取得（大規模テーブルの場合はCOUNT(*)が遅いため注意）
-    try:
-        total_rows = pg_conn.get_table_row_count(table_name)
-        print(f"テーブル合計行数: {total_rows}")
-    except KeyboardInterrupt:
-        print("行数カウントがキャンセルされました。処理を続行します。")
+    # 行数は統計情報からの推定値 (COUNT(*) による全件走査はしない)
+    total_rows = pg_conn.estimate_table_rows(table_name)
+    print(f"テーブル推定行数: {total_rows}")
     
     # 開始時間
     start_time = time.time()
@@ -10,9 +10,11 @@ Arrow 型まわりのユーティリティ関数群
 
 from __future__ import annotations
 
-from typing import List, Tuple
+import warnings
+from typing import List, Optional, Sequence, Tuple, Union
 
 import numpy as np
+import pyarrow as pa
 
 from .type_map import (
     ColumnMeta,
@@ -93,7 +95,140 @@ def build_gpu_meta_arrays(
     return type_ids, elem_sizes, param1, param2
 
 
+# ----------------------------------------------------------------------
+# PostgreSQL の日付/時刻は 2000-01-01 起点, Arrow は 1970-01-01 起点
+# ----------------------------------------------------------------------
+PG_DATE_EPOCH_OFFSET_DAYS = 10957                 # 1970-01-01 → 2000-01-01 の日数
+PG_TS_EPOCH_OFFSET_US = 946_684_800 * 1_000_000   # 同 マイクロ秒
+
+
+# ----------------------------------------------------------------------
+# Decimal128: 10**p (p = 0..38) を (hi, lo) uint64 に分けた表
+# unscaled 値が 10**precision 未満かどうか (桁あふれ) の判定に使う
+# ----------------------------------------------------------------------
+DECIMAL128_MAX_PRECISION = 38
+POW10_128_HI = np.array([(10 ** p) >> 64 for p in range(DECIMAL128_MAX_PRECISION + 1)], dtype=np.uint64)
+POW10_128_LO = np.array([(10 ** p) & 0xFFFFFFFFFFFFFFFF for p in range(DECIMAL128_MAX_PRECISION + 1)],
+                        dtype=np.uint64)
+
+
+# ----------------------------------------------------------------------
+# ColumnMeta → pyarrow DataType
+# ----------------------------------------------------------------------
+_SIMPLE_PA_TYPES = {
+    UTF8: pa.string(),
+    BINARY: pa.binary(),
+    INT16: pa.int16(),
+    INT32: pa.int32(),
+    INT64: pa.int64(),
+    FLOAT32: pa.float32(),
+    FLOAT64: pa.float64(),
+    BOOL: pa.bool_(),
+    DATE32: pa.date32(),
+}
+
+
+def arrow_type_for(col: ColumnMeta) -> pa.DataType:
+    """
+    ColumnMeta から出力 Arrow 型を決める (GPU / CPU デコーダ共通)
+
+    * DECIMAL128 : arrow_param = (precision, scale)。不正値は (38, 0)
+    * TS64_US    : arrow_param にタイムゾーン文字列があれば付与
+    * UNKNOWN 等 : binary にフォールバック
+    """
+    if col.arrow_id == DECIMAL128:
+        precision, scale = col.arrow_param or (38, 0)
+        if not (1 <= precision <= 38):
+            warnings.warn(f"Invalid precision {precision} for DECIMAL column {col.name}. Using (38, 0).")
+            precision, scale = 38, 0
+        return pa.decimal128(precision, scale)
+    if col.arrow_id == TS64_US:
+        tz_info = col.arrow_param  # None またはタイムゾーン文字列
+        if tz_info is not None and not isinstance(tz_info, str):
+            warnings.warn(f"Invalid timezone info in arrow_param for {col.name}: {tz_info}. Ignoring.")
+            tz_info = None
+        return pa.timestamp('us', tz=tz_info)
+    pa_type = _SIMPLE_PA_TYPES.get(col.arrow_id)
+    if pa_type is None:
+        warnings.warn(f"Unhandled arrow_id {col.arrow_id} for column {col.name}. Falling back to binary.")
+        return pa.binary()
+    return pa_type
+
+
+
+def arrow_schema_for(columns: List[ColumnMeta]) -> pa.Schema:
+    """ColumnMeta のリストから decode_chunk / decode_chunk_cpu の出力スキーマを作る"""
+    return pa.schema([pa.field(c.name, arrow_type_for(c)) for c in columns])
+
+
+def projection_indices(columns: List[ColumnMeta],
+                       projection: Optional[Sequence[Union[int, str]]]) -> List[int]:
+    """
+    射影 (列名または列番号のリスト) → columns 内の列番号 (出力順)
+
+    None は全列。存在しない列名は KeyError、範囲外の番号・重複は ValueError。
+    """
+    if projection is None:
+        return list(range(len(columns)))
+    by_name = {c.name: i for i, c in enumerate(columns)}
+    indices = []
+    for p in projection:
+        if isinstance(p, str):
+            if p not in by_name:
+                raise KeyError(f"column {p!r} not found (available: {list(by_name)})")
+            indices.append(by_name[p])
+        else:
+            i = int(p)
+            if not 0 <= i < len(columns):
+                raise ValueError(f"column index {i} out of range for {len(columns)} columns")
+            indices.append(i)
+    if len(set(indices)) != len(indices):
+        raise ValueError(f"duplicate columns in projection: {list(projection)}")
+    return indices
+
+
+def host_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    GPU 上のバッファ (decode_chunk がゼロコピーで包んだ pyarrow.cuda のバッファ) を
+    含む RecordBatch をホストへコピーする。全バッファがホスト上ならそのまま返す。
+
+    ``pa.Table.from_batches`` / ``cast`` / Parquet・IPC の書き込みなどホスト側の処理は
+    デバイスのポインタを読めないので、sink へ渡す前にこれを通す
+    (コピーした時点で元のバッファはプールへ返却できる)。
+    """
+    if all(_on_host(arr) for arr in batch.columns):
+        return batch
+    return pa.RecordBatch.from_arrays([_host_array(arr) for arr in batch.columns], schema=batch.schema)
+
+
+def _on_host(arr: pa.Array) -> bool:
+    return all(buf is None or buf.is_cpu for buf in arr.buffers())
+
+
+def _host_array(arr: pa.Array) -> pa.Array:
+    if _on_host(arr):
+        return arr
+    bufs = [buf if buf is None or buf.is_cpu else _copy_to_host(buf) for buf in arr.buffers()]
+    return pa.Array.from_buffers(arr.type, len(arr), bufs, null_count=arr.null_count, offset=arr.offset)
+
+
+def _copy_to_host(buf) -> pa.Buffer:
+    if hasattr(buf, "copy_to_host"):       # pyarrow.cuda.CudaBuffer
+        return buf.copy_to_host()
+    import pyarrow.cuda as pa_cuda
+    return pa_cuda.CudaBuffer.from_buffer(buf).copy_to_host()
+
+
 __all__ = [
     "arrow_elem_size",
     "build_gpu_meta_arrays",
+    "arrow_type_for",
+    "arrow_schema_for",
+    "projection_indices",
+    "host_batch",
+    "PG_DATE_EPOCH_OFFSET_DAYS",
+    "PG_TS_EPOCH_OFFSET_US",
+    "DECIMAL128_MAX_PRECISION",
+    "POW10_128_HI",
+    "POW10_128_LO",
 ]
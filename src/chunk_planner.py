@@ -0,0 +1,349 @@
+"""GPU メモリ予算からチャンクサイズ (行数 / バイト数) を決めるプランナ
+
+1 チャンクを ``parse_binary_chunk_gpu`` → ``decode_chunk`` で処理する際のデバイスメモリを
+
+* raw COPY バッファ                        : raw_bytes_per_row * RAW_BUFFERS (H2D のダブルバッファ)
+* フィールドインデックス (offset, length)  : 8 * ncols
+* parse の作業領域 (行先頭 / 行長 / NULL フラグ) : 8 + ncols
+* 述語で行を絞る場合 (``filtered``)        : フラグ 4 + 選択ベクトル 4 + 詰め直した field 行列 8 * ncols
+* 出力バッファ
+    - 固定長 (融合 arena)                  : elem_size * プール丸め
+    - DECIMAL128 (arena)                    : 16 * プール丸め + 無効フラグ 1
+    - 可変長                                : (平均長 + offsets 4) * プール丸め
+                                              + pass-1 長さ 4 + prefix-sum (cp.cumsum) の一時領域 4
+    - validity ビットマップ                 : 1/8
+* 列ごとの定数 (arena アライメント, プールの最小サイズクラス)
+
+の「1 行あたり + 定数」で見積もり、空きメモリから headroom を除いた予算に収まる
+最大行数を返す。各段の一時領域は解放を待たずに全部を足し、プール由来のバッファは
+サイズクラスの丸め (最大 1/CLASS_STEPS) を上乗せしているので、見積りの行あたりバイト数が
+実データ以上である限り 1 チャンクの処理は予算を超えない。writer へ渡した後も
+GPU に残っているバッチ (ゼロコピーの RecordBatch / DeviceTable) は含まないので、
+その分は headroom で吸収する。
+
+見積りは COPY データの先頭サンプルから作り、実際のバッチが見積りより大きかった場合は
+``ChunkPlanner.observe`` で見積りを引き上げて再計画する。
+
+ストリーミング受信では ``StreamPlanner`` を使う。``chunk_bytes`` を ``iter_copy_chunks`` /
+``iter_binary_data`` / ``ParallelCopyReader`` のチャンクサイズとして渡し、受信した
+CopyChunk 列を ``track`` で包むと、先頭チャンクから計画を作り、以降のチャンクごとに
+実績を ``observe`` へ渡す (再計画したサイズは次に切り出すチャンクから使われる)。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+from numba import cuda
+
+from .type_map import ColumnMeta, DECIMAL128
+from .arrow_utils import arrow_elem_size
+from .cpu_parse_utils import detect_pg_header_size, parse_binary_chunk_cpu, scan_row_boundaries
+from .gpu_memory_pool import CLASS_STEPS, MIN_CLASS_BYTES, get_default_pool
+
+DEFAULT_HEADROOM = 0.1             # 空きメモリのうち使わずに残す割合
+DEFAULT_SAMPLE_BYTES = 1 << 20     # 見積り用サンプルのバイト数
+ARENA_ALIGN = 64                   # gpu_decoder_v2.ARENA_ALIGN と同じ
+POOL_ROUNDING = 1.0 + 1.0 / CLASS_STEPS
+GROWTH_MARGIN = 1.1                # 見積り超過時に観測値へ上乗せする余裕
+MIN_PLANNED_CHUNK_BYTES = 1 << 16  # StreamPlanner が返すチャンクサイズの下限
+RAW_BUFFERS = 2                    # H2D リング (PinnedBufferRing) のデバイス側スロット数
+
+
+@dataclass(frozen=True)
+class ChunkPlan:
+    """
+    チャンク計画
+
+    Attributes
+    ----------
+    rows : int
+        1 チャンクの最大行数
+    raw_bytes : int
+        1 チャンクの raw COPY バイト数の目安 (rows * raw_bytes_per_row)
+    device_bytes : int
+        rows 行を処理したときのデバイス使用量見積り (<= budget_bytes)
+    budget_bytes : int
+        空きメモリから headroom を除いた予算
+    row_bytes : float
+        1 行あたりのデバイス使用量見積り
+    """
+    rows: int
+    raw_bytes: int
+    device_bytes: int
+    budget_bytes: int
+    row_bytes: float
+
+
+# ----------------------------------------------------------------------
+# 見積り
+# ----------------------------------------------------------------------
+def sample_copy_stats(raw, ncols: int, sample_bytes: int = DEFAULT_SAMPLE_BYTES, header_size=None):
+    """
+    COPY BINARY の先頭 sample_bytes から行あたりバイト数と列ごとの平均長を求める。
+
+    Returns
+    -------
+    (raw_bytes_per_row, avg_lens, rows)
+        raw_bytes_per_row : float  完結した行の平均バイト数 (行ヘッダ・長さフィールド込み)
+        avg_lens          : np.ndarray float64 (ncols,)  NULL を 0 とした列ごとの平均長
+        rows              : int    サンプルに含まれた行数 (0 なら見積り不能)
+    """
+    raw = np.frombuffer(raw, dtype=np.uint8) if not isinstance(raw, np.ndarray) else raw
+    if header_size is None:
+        header_size = detect_pg_header_size(raw[:128])
+    end = min(raw.size, header_size + int(sample_bytes))
+    row_end, rows, _ = scan_row_boundaries(raw, header_size, end)
+    if rows == 0:
+        return 0.0, np.zeros(ncols, np.float64), 0
+
+    _, lens = parse_binary_chunk_cpu(raw[:row_end], ncols, header_size=header_size)
+    avg_lens = np.maximum(lens, 0).mean(axis=0, dtype=np.float64)
+    return (row_end - header_size) / rows, avg_lens, int(rows)
+
+
+def estimate_row_bytes(columns: Sequence[ColumnMeta], raw_bytes_per_row: float, avg_lens=None,
+                       filtered: bool = False) -> float:
+    """
+    1 行あたりのデバイス使用量 (raw + フィールドインデックス + 作業領域 + 出力) を見積もる。
+    filtered=True は述語で行を絞る場合 (``predicate.filter_rows_gpu`` の作業領域と
+    詰め直した field 行列を加える。残る行数は全行として数える)
+    """
+    ncols = len(columns)
+    total = float(raw_bytes_per_row) * RAW_BUFFERS + 8 * ncols + (8 + ncols) + ncols / 8.0
+    if filtered:
+        total += 4 + 4 + 8 * ncols
+    for cidx, col in enumerate(columns):
+        esize = arrow_elem_size(col.arrow_id)
+        if col.arrow_id == DECIMAL128:
+            total += 16 * POOL_ROUNDING + 1
+        elif esize > 0:
+            total += esize * POOL_ROUNDING
+        else:
+            avg = float(avg_lens[cidx]) if avg_lens is not None else 0.0
+            total += (avg + 4) * POOL_ROUNDING + 4 + 4
+    return total
+
+
+def fixed_overhead_bytes(columns: Sequence[ColumnMeta]) -> int:
+    """行数に依存しない分 (arena のアライメント, サイズクラスの最小単位)"""
+    return len(columns) * (ARENA_ALIGN + 2 * MIN_CLASS_BYTES)
+
+
+def available_device_bytes() -> int:
+    """現在の空きデバイスメモリ + プールにキャッシュされていて再利用できる分"""
+    free_b, _ = cuda.current_context().get_memory_info()
+    return int(free_b) + get_default_pool().bytes_cached
+
+
+def plan_chunk(
+    columns: Sequence[ColumnMeta],
+    raw_bytes_per_row: float,
+    avg_lens=None,
+    free_bytes: Optional[int] = None,
+    headroom: float = DEFAULT_HEADROOM,
+    max_rows: Optional[int] = None,
+    filtered: bool = False,
+) -> ChunkPlan:
+    """
+    予算に収まる最大行数のチャンク計画を返す。
+
+    Parameters
+    ----------
+    columns : list[ColumnMeta]
+    raw_bytes_per_row : float
+        raw COPY データの 1 行あたりバイト数 (``sample_copy_stats``)
+    avg_lens : array-like, optional
+        列ごとの平均長 (可変長列のみ使用)
+    free_bytes : int, optional
+        使えるデバイスメモリ。省略時は ``available_device_bytes()``
+    headroom : float
+        free_bytes のうち使わずに残す割合 (0 <= headroom < 1)
+    max_rows : int, optional
+        行数の上限 (テーブルの総行数など)
+    filtered : bool
+        述語で行を絞る (``estimate_row_bytes`` を参照)
+    """
+    if not 0.0 <= headroom < 1.0:
+        raise ValueError(f"headroom must be in [0, 1): {headroom}")
+    if free_bytes is None:
+        free_bytes = available_device_bytes()
+
+    budget = int(free_bytes * (1.0 - headroom))
+    overhead = fixed_overhead_bytes(columns)
+    row_bytes = estimate_row_bytes(columns, raw_bytes_per_row, avg_lens, filtered)
+    rows = int((budget - overhead) // row_bytes) if budget > overhead else 0
+    if max_rows is not None:
+        rows = min(rows, int(max_rows))
+    if rows < 1:
+        raise RuntimeError(
+            f"GPU memory budget too small: {budget} bytes for {row_bytes:.1f} bytes/row + {overhead} bytes overhead"
+        )
+
+    return ChunkPlan(
+        rows=rows,
+        raw_bytes=int(np.ceil(rows * raw_bytes_per_row)),
+        device_bytes=int(np.ceil(rows * row_bytes)) + overhead,
+        budget_bytes=budget,
+        row_bytes=row_bytes,
+    )
+
+
+# ----------------------------------------------------------------------
+# 適応プランナ
+# ----------------------------------------------------------------------
+class ChunkPlanner:
+    """
+    サンプルから見積もったチャンク計画を、実バッチの大きさに合わせて更新するプランナ
+
+    ``observe`` に処理したバッチの行数とバイト数を渡すと、見積りを超えていれば
+    観測値 (+ GROWTH_MARGIN) まで引き上げて再計画する。見積りより小さい場合は
+    観測値との平均へゆっくり下げる (再計画はしない)。
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[ColumnMeta],
+        raw_bytes_per_row: float,
+        avg_lens=None,
+        headroom: float = DEFAULT_HEADROOM,
+        max_rows: Optional[int] = None,
+        free_bytes: Optional[int] = None,
+        filtered: bool = False,
+    ):
+        self.columns: List[ColumnMeta] = list(columns)
+        self.raw_bytes_per_row = float(raw_bytes_per_row)
+        self.avg_lens = np.zeros(len(self.columns), np.float64) if avg_lens is None \
+            else np.asarray(avg_lens, np.float64).copy()
+        self.headroom = headroom
+        self.max_rows = max_rows
+        self.free_bytes = free_bytes     # None なら計画のたびに空きメモリを問い合わせる
+        self.filtered = filtered
+        self.replans = 0
+        self.current = self.plan()
+
+    @classmethod
+    def from_sample(cls, columns: Sequence[ColumnMeta], raw, sample_bytes: int = DEFAULT_SAMPLE_BYTES,
+                    header_size=None, **kwargs):
+        """COPY BINARY の先頭サンプルから見積りを作る (header_size は sample_copy_stats を参照)"""
+        bpr, avg_lens, rows = sample_copy_stats(raw, len(columns), sample_bytes, header_size)
+        if rows == 0:
+            raise ValueError("no complete row in the COPY sample; cannot estimate bytes per row")
+        return cls(columns, bpr, avg_lens, **kwargs)
+
+    def plan(self) -> ChunkPlan:
+        self.current = plan_chunk(
+            self.columns, self.raw_bytes_per_row, self.avg_lens,
+            free_bytes=self.free_bytes, headroom=self.headroom, max_rows=self.max_rows, filtered=self.filtered,
+        )
+        return self.current
+
+    def observe(self, rows: int, raw_bytes: int, varlen_bytes=None) -> bool:
+        """
+        処理したバッチの実績を反映する。
+
+        Parameters
+        ----------
+        rows : int
+            バッチの行数
+        raw_bytes : int
+            バッチの raw COPY バイト数
+        varlen_bytes : dict or array-like, optional
+            列 index → 可変長列の values 合計バイト数
+
+        Returns
+        -------
+        bool
+            見積りを超えていて再計画した場合 True (``current`` が更新される)
+        """
+        if rows <= 0:
+            return False
+        grew = False
+        bpr = raw_bytes / rows
+        if bpr > self.raw_bytes_per_row:
+            if varlen_bytes is None:
+                # 列ごとの実績が無い場合は可変長列の平均長も raw と同じ比率で引き上げる
+                self.avg_lens *= bpr * GROWTH_MARGIN / self.raw_bytes_per_row
+            self.raw_bytes_per_row = bpr * GROWTH_MARGIN
+            grew = True
+        else:
+            self.raw_bytes_per_row = (self.raw_bytes_per_row + bpr) / 2
+
+        if varlen_bytes is not None:
+            items = varlen_bytes.items() if isinstance(varlen_bytes, dict) else enumerate(varlen_bytes)
+            for cidx, nbytes in items:
+                avg = nbytes / rows
+                if avg > self.avg_lens[cidx]:
+                    self.avg_lens[cidx] = avg * GROWTH_MARGIN
+                    grew = True
+                else:
+                    self.avg_lens[cidx] = (self.avg_lens[cidx] + avg) / 2
+
+        if grew:
+            self.replans += 1
+            self.plan()
+        return grew
+
+
+class StreamPlanner:
+    """
+    COPY ストリームのチャンクサイズを ChunkPlanner で決める
+
+    ``chunk_bytes`` (引数なしで呼べる) をチャンクサイズとして ``iter_copy_chunks`` などへ渡し、
+    受信した CopyChunk 列を ``track`` で包む。計画ができるまでは initial_bytes
+    (見積り用サンプルの大きさ) を返し、先頭チャンクから ChunkPlanner を作った後は
+    計画の raw バイト数を返す。以降のチャンクの行数 / バイト数は ``ChunkPlanner.observe``
+    へ渡し、見積りを超えたら再計画する。
+
+    Parameters
+    ----------
+    columns : list[ColumnMeta]
+        COPY ストリームの全列
+    initial_bytes : int
+        先頭チャンク (計画前) のバイト数
+    **planner_kwargs
+        ChunkPlanner へ渡す (headroom / max_rows / free_bytes / filtered など)
+    """
+
+    def __init__(self, columns: Sequence[ColumnMeta], initial_bytes: int = DEFAULT_SAMPLE_BYTES, **planner_kwargs):
+        self.columns: List[ColumnMeta] = list(columns)
+        self.initial_bytes = int(initial_bytes)
+        self.planner_kwargs = planner_kwargs
+        self.planner: Optional[ChunkPlanner] = None
+
+    def chunk_bytes(self) -> int:
+        """次に切り出すチャンクの目標バイト数 (受信スレッドから呼ばれる)"""
+        planner = self.planner
+        if planner is None:
+            return self.initial_bytes
+        return max(planner.current.raw_bytes, MIN_PLANNED_CHUNK_BYTES)
+
+    def track(self, chunks: Iterable) -> Iterator:
+        """CopyChunk 列を素通ししながら、先頭チャンクで計画し、以降のチャンクで見積りを更新する"""
+        for chunk in chunks:
+            if self.planner is None:
+                self.planner = ChunkPlanner.from_sample(
+                    self.columns, chunk.data, sample_bytes=chunk.nbytes, header_size=chunk.header_size,
+                    **self.planner_kwargs,
+                )
+                plan = self.planner.current
+                print(f"GPUメモリに基づく最適チャンクサイズ: {plan.rows}行 "
+                      f"(raw {plan.raw_bytes} bytes, 見積り {plan.device_bytes} bytes)")
+            elif self.planner.observe(chunk.rows, chunk.nbytes):
+                plan = self.planner.current
+                print(f"チャンク再計画: {plan.rows}行 (raw {plan.raw_bytes} bytes)")
+            yield chunk
+
+
+__all__ = [
+    "ChunkPlan",
+    "ChunkPlanner",
+    "StreamPlanner",
+    "plan_chunk",
+    "estimate_row_bytes",
+    "fixed_overhead_bytes",
+    "sample_copy_stats",
+    "available_device_bytes",
+]
@@ -0,0 +1,349 @@
+"""CPU COPY BINARY → Arrow RecordBatch 2パス変換
+
+``gpu_decoder_v2.decode_chunk`` と同じ入力 (raw, field_offsets, field_lengths,
+columns) から同じ RecordBatch を作る CPU 実装。GPU を持たないホストや
+単体テストで使う。
+
+* pass1   : validity ビットマップ (+ null_count) と可変長列の長さ
+* prefix  : 可変長列のオフセット (int32, rows+1)
+* pass2   : 可変長 / 固定長 (ビッグエンディアン → リトルエンディアン) /
+            DECIMAL128 / BOOL (ビットパック) の scatter-copy
+* 組立    : ``pa.Array.from_buffers``
+
+出力バッファはすべて ``pa.allocate_buffer`` で確保した Arrow 所有のメモリに
+Numba カーネルから直接書き込むため、組立時の追加コピーは発生しない。
+"""
+
+from __future__ import annotations
+
+import warnings
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import pyarrow as pa
+from numba import njit
+
+from .type_map import (
+    ColumnMeta,
+    UTF8, BINARY, DECIMAL128, BOOL, DATE32, TS64_US, UNKNOWN,
+)
+from .arrow_utils import (
+    arrow_elem_size,
+    arrow_schema_for,
+    arrow_type_for,
+    projection_indices,
+    PG_DATE_EPOCH_OFFSET_DAYS,
+    PG_TS_EPOCH_OFFSET_US,
+    POW10_128_HI,
+    POW10_128_LO,
+)
+from .predicate import compile_predicate, filter_rows_cpu
+
+_U32 = np.uint64(32)
+_MASK32 = np.uint64(0xFFFFFFFF)
+_POW10_U64 = np.array([10 ** i for i in range(10)], dtype=np.uint64)
+
+# NUMERIC sign フィールド
+_NUMERIC_NEG = 0x4000
+_NUMERIC_NAN = 0xC000   # 0xD000 (+Inf) / 0xF000 (-Inf) も特殊値
+
+
+# ----------------------------------------------------------------------
+# pass-1: validity / 可変長オフセット
+# ----------------------------------------------------------------------
+@njit
+def _pack_validity(field_lengths, cidx, bitmap):
+    """field_lengths[:, cidx] != -1 を LSB 順のビットマップへ書き、null 数を返す"""
+    rows = field_lengths.shape[0]
+    nulls = 0
+    for b in range(bitmap.size):
+        bitmap[b] = 0
+    for r in range(rows):
+        if field_lengths[r, cidx] == -1:
+            nulls += 1
+        else:
+            bitmap[r >> 3] |= np.uint8(1 << (r & 7))
+    return nulls
+
+
+@njit
+def _varlen_offsets(field_lengths, cidx, offsets):
+    """可変長列のオフセット (NULL は長さ 0) を書き、総バイト数を返す"""
+    rows = field_lengths.shape[0]
+    total = np.int64(0)
+    offsets[0] = 0
+    for r in range(rows):
+        flen = field_lengths[r, cidx]
+        if flen > 0:
+            total += flen
+        offsets[r + 1] = total
+    return total
+
+
+# ----------------------------------------------------------------------
+# pass-2: scatter-copy
+# ----------------------------------------------------------------------
+@njit
+def _scatter_varlen(raw, field_offsets, field_lengths, cidx, offsets, values):
+    rows = field_offsets.shape[0]
+    for r in range(rows):
+        flen = field_lengths[r, cidx]
+        if flen <= 0:
+            continue
+        src = field_offsets[r, cidx]
+        dst = offsets[r]
+        values[dst:dst + flen] = raw[src:src + flen]
+
+
+@njit
+def _scatter_fixed(raw, field_offsets, field_lengths, cidx, elem_size, out):
+    """ビッグエンディアンの固定長値をバイト反転して rows * elem_size へ (NULL は 0)"""
+    rows = field_offsets.shape[0]
+    for r in range(rows):
+        dst = r * elem_size
+        if field_lengths[r, cidx] == -1:
+            for i in range(elem_size):
+                out[dst + i] = 0
+            continue
+        src = field_offsets[r, cidx]
+        for i in range(elem_size):
+            out[dst + i] = raw[src + elem_size - 1 - i]
+
+
+@njit
+def _scatter_bool(raw, field_offsets, field_lengths, cidx, bits):
+    """1 バイトの bool 値を Arrow のビットパック形式へ"""
+    rows = field_offsets.shape[0]
+    for b in range(bits.size):
+        bits[b] = 0
+    for r in range(rows):
+        if field_lengths[r, cidx] != -1 and raw[field_offsets[r, cidx]] != 0:
+            bits[r >> 3] |= np.uint8(1 << (r & 7))
+
+
+# ----------------------------------------------------------------------
+# DECIMAL128: 128 bit 整数を (hi, lo) uint64 で表し 32 bit 単位で演算
+# ----------------------------------------------------------------------
+@njit(inline="always")
+def _mul_small_128(hi, lo, m):
+    """(hi, lo) * m (m < 2**32) → (hi, lo, overflow)"""
+    p0 = (lo & _MASK32) * m
+    p1 = (lo >> _U32) * m + (p0 >> _U32)
+    new_lo = (p1 << _U32) | (p0 & _MASK32)
+    p2 = (hi & _MASK32) * m + (p1 >> _U32)
+    p3 = (hi >> _U32) * m + (p2 >> _U32)
+    new_hi = (p3 << _U32) | (p2 & _MASK32)
+    return new_hi, new_lo, (p3 >> _U32) != 0
+
+
+@njit(inline="always")
+def _add_small_128(hi, lo, a):
+    new_lo = lo + a
+    if new_lo < lo:
+        hi += np.uint64(1)
+    return hi, new_lo, hi == 0 and new_lo < lo
+
+
+@njit
+def _decode_numeric(raw, pos, scale, precision, out, r):
+    """
+    NUMERIC 1 値を scale 桁の Decimal128 (unscaled 値) として out[2r:2r+2] へ書く。
+    scale より下の桁は四捨五入 (0 から遠い方向へ丸め)。
+    戻り値: 0=OK, 1=NaN/Inf (NULL 扱い), 2=128 bit / precision 桁溢れ (NULL 扱い)
+    """
+    nd = (np.int64(raw[pos]) << 8) | np.int64(raw[pos + 1])
+    weight = (np.int64(raw[pos + 2]) << 8) | np.int64(raw[pos + 3])
+    if weight >= 0x8000:
+        weight -= 0x10000
+    sign = (np.int64(raw[pos + 4]) << 8) | np.int64(raw[pos + 5])
+    out[2 * r] = 0
+    out[2 * r + 1] = 0
+    if sign == _NUMERIC_NAN or sign == 0xD000 or sign == 0xF000:
+        return 1
+
+    hi = np.uint64(0)
+    lo = np.uint64(0)
+    ovf = False
+    round_digit = np.uint64(0)
+    unit_exp = 0    # 最後に取り込んだ桁の 10 進指数 (scale 適用後)
+    p = pos + 8
+    for i in range(nd):
+        d = np.uint64((np.int64(raw[p]) << 8) | np.int64(raw[p + 1]))
+        p += 2
+        ex = 4 * (weight - i) + scale
+        if ex >= 0:
+            hi, lo, o = _mul_small_128(hi, lo, np.uint64(10000))
+            ovf |= o
+            hi, lo, o = _add_small_128(hi, lo, d)
+            ovf |= o
+            unit_exp = ex
+            continue
+        # 小数部にかかる桁: 残す上位桁を取り込み、捨てる最上位桁で丸める
+        drop = -ex
+        if drop <= 4:
+            hi, lo, o = _mul_small_128(hi, lo, _POW10_U64[4 - drop])
+            ovf |= o
+            hi, lo, o = _add_small_128(hi, lo, d // _POW10_U64[drop])
+            ovf |= o
+            round_digit = (d // _POW10_U64[drop - 1]) % np.uint64(10)
+        unit_exp = 0
+        break
+    # 末尾の省略されたゼロ桁分を掛ける
+    while unit_exp > 0:
+        step = min(unit_exp, 9)
+        hi, lo, o = _mul_small_128(hi, lo, _POW10_U64[step])
+        ovf |= o
+        unit_exp -= step
+    if round_digit >= 5:
+        hi, lo, o = _add_small_128(hi, lo, np.uint64(1))
+        ovf |= o
+    p_hi = POW10_128_HI[precision]
+    if ovf or hi > p_hi or (hi == p_hi and lo >= POW10_128_LO[precision]):
+        return 2
+    if sign == _NUMERIC_NEG:
+        lo = ~lo + np.uint64(1)
+        hi = ~hi + (np.uint64(1) if lo == 0 else np.uint64(0))
+    out[2 * r] = lo
+    out[2 * r + 1] = hi
+    return 0
+
+
+@njit
+def _scatter_decimal128(raw, field_offsets, field_lengths, cidx, scale, precision, out, bitmap):
+    """
+    DECIMAL128 列を out (uint64, rows*2) へ書く。NaN/Inf と溢れは validity を
+    落として NULL にする。戻り値: (新たに NULL にした数, うち溢れの数)
+    """
+    rows = field_offsets.shape[0]
+    cleared = 0
+    overflow = 0
+    for r in range(rows):
+        flen = field_lengths[r, cidx]
+        if flen == -1:
+            out[2 * r] = 0
+            out[2 * r + 1] = 0
+            continue
+        status = 1   # ヘッダ 8 バイトに満たない値は不正として NULL
+        if flen >= 8:
+            status = _decode_numeric(raw, field_offsets[r, cidx], scale, precision, out, r)
+        if status != 0:
+            bitmap[r >> 3] &= np.uint8(~(1 << (r & 7)) & 0xFF)
+            cleared += 1
+            if status == 2:
+                overflow += 1
+    return cleared, overflow
+
+
+# ----------------------------------------------------------------------
+def _to_host(a):
+    """DeviceNDArray が渡された場合はホストへコピー"""
+    return a.copy_to_host() if hasattr(a, "copy_to_host") else np.asarray(a)
+
+
+def decode_chunk_cpu(
+    raw,                # uint8[:] (np.ndarray / bytes-like)
+    field_offsets,      # int32[:, :]
+    field_lengths,      # int32[:, :]
+    columns: List[ColumnMeta],
+    projection: Optional[Sequence[Union[int, str]]] = None,
+    predicate=None,
+) -> pa.RecordBatch:
+    """
+    COPY バイナリ解析結果を CPU 上で 2-pass で Arrow RecordBatch へ変換
+
+    Parameters
+    ----------
+    raw : np.ndarray[uint8] or bytes-like
+        COPY BINARY チャンク (field_offsets が指すバッファ)
+    field_offsets, field_lengths : np.ndarray[int32] (rows, ncols)
+        ``parse_binary_chunk_cpu`` / ``parse_binary_chunk_gpu`` の出力
+    columns : list of ColumnMeta
+        COPY ストリームの全列 (field 行列の列数と一致)
+    projection : list of str or int, optional
+        出力する列 (列名か列番号, この順で出力)。それ以外の列はバッファを確保せず変換もしない
+    predicate : predicate.Expr or CompiledPredicate, optional
+        残す行の条件。満たさない行は pass-1 の前に field 行列から取り除く
+        (全行が落ちた場合は 0 行の RecordBatch を返す)
+
+    Returns
+    -------
+    pa.RecordBatch
+    """
+    raw = _to_host(raw) if not isinstance(raw, (bytes, bytearray, memoryview)) \
+        else np.frombuffer(raw, dtype=np.uint8)
+    field_offsets = _to_host(field_offsets)
+    field_lengths = _to_host(field_lengths)
+    rows, ncols = field_lengths.shape
+    if rows == 0:
+        raise ValueError("rows == 0")
+    if ncols != len(columns):
+        raise ValueError(f"ncols mismatch: field matrix has {ncols}, columns has {len(columns)}")
+    if predicate is not None:
+        predicate = compile_predicate(predicate, columns)
+        field_offsets, field_lengths = filter_rows_cpu(raw, field_offsets, field_lengths, predicate)
+        rows = field_lengths.shape[0]
+        if rows == 0:
+            return pa.RecordBatch.from_pylist(
+                [], schema=arrow_schema_for([columns[i] for i in projection_indices(columns, projection)]))
+
+    bitmap_bytes = (rows + 7) // 8
+    arrays = []
+    out_cols = []
+    for cidx in projection_indices(columns, projection):
+        col = columns[cidx]
+        out_cols.append(col)
+        pa_type = arrow_type_for(col)
+
+        # --- pass-1: validity ---
+        validity = pa.allocate_buffer(bitmap_bytes)
+        bitmap = np.frombuffer(validity, dtype=np.uint8)
+        null_count = int(_pack_validity(field_lengths, cidx, bitmap))
+
+        # --- pass-2 ---
+        if col.arrow_id in (UTF8, BINARY, UNKNOWN):
+            offsets_buf = pa.allocate_buffer((rows + 1) * 4)
+            offsets = np.frombuffer(offsets_buf, dtype=np.int32)
+            total = int(_varlen_offsets(field_lengths, cidx, offsets))
+            if total > np.iinfo(np.int32).max:
+                raise OverflowError(f"column {col.name}: {total} bytes exceed int32 offsets")
+            values_buf = pa.allocate_buffer(total)
+            _scatter_varlen(raw, field_offsets, field_lengths, cidx, offsets,
+                            np.frombuffer(values_buf, dtype=np.uint8))
+            buffers = [validity, offsets_buf, values_buf]
+
+        elif col.arrow_id == BOOL:
+            data_buf = pa.allocate_buffer(bitmap_bytes)
+            _scatter_bool(raw, field_offsets, field_lengths, cidx, np.frombuffer(data_buf, dtype=np.uint8))
+            buffers = [validity, data_buf]
+
+        elif col.arrow_id == DECIMAL128:
+            data_buf = pa.allocate_buffer(rows * 16)
+            cleared, overflow = _scatter_decimal128(
+                raw, field_offsets, field_lengths, cidx, pa_type.scale, pa_type.precision,
+                np.frombuffer(data_buf, dtype=np.uint64), bitmap,
+            )
+            null_count += int(cleared)
+            if overflow:
+                warnings.warn(f"{overflow} values of DECIMAL column {col.name} overflowed {pa_type} and were set to NULL.")
+            buffers = [validity, data_buf]
+
+        else:
+            esize = arrow_elem_size(col.arrow_id)
+            data_buf = pa.allocate_buffer(rows * esize)
+            out = np.frombuffer(data_buf, dtype=np.uint8)
+            _scatter_fixed(raw, field_offsets, field_lengths, cidx, esize, out)
+            # PostgreSQL (2000-01-01 起点) → Arrow (1970-01-01 起点)
+            if col.arrow_id == DATE32:
+                out.view(np.int32)[:] += PG_DATE_EPOCH_OFFSET_DAYS
+            elif col.arrow_id == TS64_US:
+                out.view(np.int64)[:] += PG_TS_EPOCH_OFFSET_US
+            buffers = [validity, data_buf]
+
+        if null_count == 0:
+            buffers[0] = None
+        arrays.append(pa.Array.from_buffers(pa_type, rows, buffers, null_count=null_count))
+
+    return pa.RecordBatch.from_arrays(arrays, [c.name for c in out_cols])
+
+
+__all__ = ["decode_chunk_cpu"]
@@ -1,82 +1,372 @@
+"""
+COPY BINARY の CPU パーサー
+--------------------------
+GPU を持たないホスト向けのフォールバック兼 GPU パスのテスト用オラクル。
+``parse_binary_chunk_cpu`` は ``parse_binary_chunk_gpu`` と同じ
+field_offsets / field_lengths 行列を返す。
+
+大きなバッファはセグメントに分割して複数コアで処理する。各セグメントは
+投機的に推定した行先頭から走査し、セグメント境界の連鎖で推定を検証して
+外れたセグメントだけを辿り直す (GPU 版 ``pg_row_detect_kernels`` と同じ方式)。
+"""
+
 import numpy as np
+from numba import njit, prange, get_num_threads
 
-# CPUで複数行の開始位置を計算するヘルパー関数 (クリーンアップ版)
-def calculate_row_starts_cpu(raw_data, header_size, num_rows):
+# 行の連鎖が終わったことを示す値 (終端マーカー・データ切れ)
+CHAIN_END = -1
+
+
+@njit
+def scan_row_boundaries(buf, pos, end):
     """
-    CPU上でCOPY BINARYデータの各行の開始位置を計算します。
-    ヘッダー後の潜在的なパディング/フラグをスキップし、
-    各行のフィールドを正しく読み進めて次の行の開始位置を特定します。
+    buf[pos:end] を行単位で走査し、完結している行の末尾を返す (ストリーミング受信用)。
+
+    Returns
+    -------
+    (row_end, rows, eof)
+        row_end : 最後に完結した行の直後のオフセット (未完の行はここから始まる)
+        rows    : buf[pos:row_end] に含まれる行数
+        eof     : row_end に終端マーカー (0xFFFF) がある場合 True
+    """
+    rows = 0
+    while pos + 2 <= end:
+        nf = (np.int64(buf[pos]) << 8) | np.int64(buf[pos + 1])
+        if nf == 0xFFFF:
+            return pos, rows, True
+        cur = pos + 2
+        complete = True
+        for _ in range(nf):
+            if cur + 4 > end:
+                complete = False
+                break
+            flen = (np.int64(buf[cur]) << 24) | (np.int64(buf[cur + 1]) << 16) | \
+                   (np.int64(buf[cur + 2]) << 8) | np.int64(buf[cur + 3])
+            cur += 4
+            if flen < 0x80000000 and flen > 0:
+                if cur + flen > end:
+                    complete = False
+                    break
+                cur += flen
+        if not complete:
+            break
+        pos = cur
+        rows += 1
+    return pos, rows, False
+
+
+@njit(inline="always")
+def _read_uint16_be(buf, pos):
+    return (np.int64(buf[pos]) << 8) | np.int64(buf[pos + 1])
+
+
+@njit(inline="always")
+def _read_int32_be(buf, pos):
+    """ビッグエンディアン int32 を符号付きで読む"""
+    val = (np.int64(buf[pos]) << 24) | (np.int64(buf[pos + 1]) << 16) | \
+          (np.int64(buf[pos + 2]) << 8) | np.int64(buf[pos + 3])
+    if val >= 0x80000000:
+        val -= 0x100000000
+    return val
+
+
+@njit
+def _row_end_or_fail(buf, pos):
+    """pos から始まる行の終端位置 (行として成立しない場合は CHAIN_END)"""
+    n = buf.size
+    if pos + 2 > n:
+        return CHAIN_END
+    nf = _read_uint16_be(buf, pos)
+    if nf == 0xFFFF:
+        return CHAIN_END
+    cur = pos + 2
+    for _ in range(nf):
+        if cur + 4 > n:
+            return CHAIN_END
+        flen = _read_int32_be(buf, cur)
+        cur += 4
+        if flen > 0:
+            if cur + flen > n:
+                return CHAIN_END
+            cur += flen
+    return cur
+
+
+@njit
+def _is_plausible_row(buf, pos, ncols):
+    """投機用: 行ヘッダが ncols で行が完結し、次も行ヘッダ/終端/データ末尾であるか"""
+    n = buf.size
+    if pos + 2 > n or _read_uint16_be(buf, pos) != ncols:
+        return False
+    nxt = _row_end_or_fail(buf, pos)
+    if nxt == CHAIN_END:
+        return False
+    if nxt == n:
+        return True
+    if nxt + 2 > n:
+        return False
+    h = _read_uint16_be(buf, nxt)
+    return h == ncols or h == 0xFFFF
+
+
+@njit
+def _walk_segment(buf, seg_end, entry):
+    """entry から行を辿り (exit, seg_end より前に始まる行数) を返す"""
+    pos = entry
+    cnt = 0
+    while pos != CHAIN_END and pos < seg_end:
+        nxt = _row_end_or_fail(buf, pos)
+        if nxt == CHAIN_END:
+            pos = CHAIN_END
+            break
+        cnt += 1
+        pos = nxt
+    if pos != CHAIN_END and pos >= buf.size:
+        pos = CHAIN_END
+    return pos, cnt
+
+
+@njit(parallel=True)
+def find_row_starts_cpu(buf, header_size, ncols, segment_size):
+    """
+    行先頭オフセット (int32) をマルチコアで検出する。
+
+    結果は ``build_pg_row_starts_cpu`` の有効な (-1 以外の) 要素と一致する。
+    """
+    data_bytes = buf.size - header_size
+    if data_bytes <= 0:
+        return np.empty(0, np.int32)
+    nseg = (data_bytes + segment_size - 1) // segment_size
+    entries = np.empty(nseg, np.int64)
+    exits = np.empty(nseg, np.int64)
+    counts = np.empty(nseg, np.int64)
+
+    # 1. 投機的な行先頭の推定とセグメント内走査
+    for s in prange(nseg):
+        seg_start = header_size + s * segment_size
+        seg_end = min(seg_start + segment_size, buf.size)
+        entry = seg_end
+        if s == 0:
+            entry = header_size
+        else:
+            for p in range(seg_start, seg_end):
+                if _is_plausible_row(buf, p, ncols):
+                    entry = p
+                    break
+        entries[s] = entry
+        exits[s], counts[s] = _walk_segment(buf, seg_end, entry)
+
+    # 2. セグメント境界の連鎖で検証し、外れたセグメントだけ辿り直す
+    for s in range(1, nseg):
+        if entries[s] != exits[s - 1]:
+            entries[s] = exits[s - 1]
+            seg_end = min(header_size + (s + 1) * segment_size, buf.size)
+            exits[s], counts[s] = _walk_segment(buf, seg_end, entries[s])
+
+    # 3. プレフィックスサム位置へ書き込み
+    offsets = np.zeros(nseg + 1, np.int64)
+    for s in range(nseg):
+        offsets[s + 1] = offsets[s] + counts[s]
+    row_starts = np.empty(offsets[nseg], np.int32)
+    for s in prange(nseg):
+        seg_end = min(header_size + (s + 1) * segment_size, buf.size)
+        pos = entries[s]
+        out = offsets[s]
+        while pos != CHAIN_END and pos < seg_end:
+            nxt = _row_end_or_fail(buf, pos)
+            if nxt == CHAIN_END:
+                break
+            row_starts[out] = pos
+            out += 1
+            pos = nxt
+    return row_starts
+
+
+@njit(parallel=True)
+def parse_fields_cpu(buf, ncols, row_starts, field_offsets, field_lengths):
+    """
+    行先頭から各フィールドの (絶対オフセット, 長さ) を求める。
+    ``parse_fields_from_offsets_gpu`` と同じ規則: NULL / 欠損は offset 0, length -1。
+    """
+    n = buf.size
+    for r in prange(row_starts.size):
+        pos = np.int64(row_starts[r])
+        filled = 0
+        if pos >= 0 and pos + 2 <= n:
+            nf = _read_uint16_be(buf, pos)
+            if nf != 0xFFFF:
+                pos += 2
+                for c in range(min(nf, ncols)):
+                    if pos + 4 > n:
+                        break
+                    fl = _read_int32_be(buf, pos)
+                    if fl < 0:
+                        field_lengths[r, c] = -1
+                        field_offsets[r, c] = 0
+                        pos += 4
+                    else:
+                        if pos + 4 + fl > n:
+                            break
+                        field_lengths[r, c] = fl
+                        field_offsets[r, c] = pos + 4
+                        pos += 4 + fl
+                    filled = c + 1
+        for c in range(filled, ncols):
+            field_lengths[r, c] = -1
+            field_offsets[r, c] = 0
+
+
+def detect_pg_header_size(raw_data: np.ndarray) -> int:
+    """Detect COPY BINARY header size (11 + flags + ext)."""
+    base = 11
+    if raw_data.size < base:
+        return base
+
+    sig = b"PGCOPY\n\377\r\n\0"
+    if not np.array_equal(raw_data[:11], np.frombuffer(sig, np.uint8)):
+        # シグネチャなし = ストリーミング COPY の後続チャンク (行から始まる)
+        return 0
+
+    size = base + 4  # flags
+    if raw_data.size < size + 4:
+        return size
+    ext_len = int.from_bytes(raw_data[size : size + 4], "big")
+    size += 4 + ext_len if raw_data.size >= size + 4 + ext_len else 0
+    return size
+
+
+def default_segment_size(data_bytes: int) -> int:
+    """コア数の 4 倍程度のセグメントに分割 (最小 64KiB)"""
+    return max(1 << 16, data_bytes // (get_num_threads() * 4) + 1)
+
+
+def parse_binary_chunk_cpu(raw, ncols: int, header_size=None, segment_size=None, layout="col"):
     """
-    row_starts = np.full(num_rows, -1, dtype=np.int32) # Initialize with -1 (invalid)
-    pos = header_size
-    array_size = len(raw_data)
+    Parse COPY BINARY on CPU (multi-core).
+
+    Parameters
+    ----------
+    raw : np.ndarray (uint8) or bytes-like
+        COPY BINARY データ
+    ncols : int
+        列数
+    header_size : int, optional
+        省略時は ``detect_pg_header_size`` で判定
+    segment_size : int, optional
+        1 セグメントのバイト数。省略時はコア数から決める
+    layout : {"col", "row"}
+        出力配列のメモリレイアウト (列優先 / 行優先)。形状は常に (rows, ncols)
+
+    Returns
+    -------
+    (field_offsets, field_lengths) : np.ndarray int32 (rows, ncols)
+        ``parse_binary_chunk_gpu`` と同じ形式 (NULL は offset 0, length -1)
+    """
+    raw = np.frombuffer(raw, dtype=np.uint8) if not isinstance(raw, np.ndarray) else raw
+    if header_size is None:
+        header_size = detect_pg_header_size(raw[:128])
+    if segment_size is None:
+        segment_size = default_segment_size(raw.size - header_size)
+
+    row_starts = find_row_starts_cpu(raw, header_size, ncols, segment_size)
+    rows = row_starts.size
+    if layout not in ("col", "row"):
+        raise ValueError(f"unknown field index layout: {layout!r} (expected 'col' or 'row')")
+    order = "F" if layout == "col" else "C"
+    field_offsets = np.empty((rows, ncols), np.int32, order=order)
+    field_lengths = np.empty((rows, ncols), np.int32, order=order)
+    if rows > 0:
+        parse_fields_cpu(raw, ncols, row_starts, field_offsets, field_lengths)
+    return field_offsets, field_lengths
+
+
+@njit
+def build_row_starts_njit(buf, header_size, num_rows_expected):
+    """``build_pg_row_starts_cpu`` の本体 (逐次走査, -1 で埋めた固定長配列を返す)"""
+    row_starts = np.full(num_rows_expected, -1, np.int32)
+    pos = np.int64(header_size)
+    cur_row = 0
+    n = buf.size
+    while pos < n and cur_row < num_rows_expected:
+        if pos + 2 > n:
+            break
+        num_fields = _read_uint16_be(buf, pos)
+        if num_fields == 0xFFFF:
+            break
+        row_starts[cur_row] = pos
+        cur_row += 1
+        pos += 2
+        for _ in range(num_fields):
+            if pos + 4 > n:
+                row_starts[cur_row - 1:] = -1
+                return row_starts
+            fld_len = _read_int32_be(buf, pos)
+            pos += 4
+            if fld_len > 0:
+                if pos + fld_len > n:
+                    row_starts[cur_row - 1:] = -1
+                    return row_starts
+                pos += fld_len
+    return row_starts
+
+
+@njit
+def _calculate_row_starts_njit(raw_data, header_size, num_rows):
+    row_starts = np.full(num_rows, -1, dtype=np.int32)
+    pos = np.int64(header_size)
+    array_size = raw_data.size
     current_row_index = 0
 
     while current_row_index < num_rows and pos < array_size:
-        # --- Find the actual start of the row data ---
+        # --- 行の先頭を探す (妥当なフィールド数が現れるまで 1 バイトずつ進める) ---
         found_start = False
-        original_search_pos = pos
         while pos + 2 <= array_size:
-            potential_num_fields = (raw_data[pos] << 8) | raw_data[pos + 1]
-
-            if potential_num_fields == 0xFFFF: # EOF marker
-                 pos = array_size # Stop processing
-                 break
-
-            # Check for a reasonable number of fields
-            if potential_num_fields > 0 and potential_num_fields < 1000: # Adjust 1000 if needed
-                 found_start = True
-                 break # Found the likely start
-
-            # If not a valid field count or EOF, advance by one byte and retry
+            potential_num_fields = _read_uint16_be(raw_data, pos)
+            if potential_num_fields == 0xFFFF:  # EOF marker
+                pos = array_size
+                break
+            if potential_num_fields > 0 and potential_num_fields < 1000:
+                found_start = True
+                break
             pos += 1
 
         if not found_start or pos >= array_size:
-             break # Stop if no valid start found or reached end
-
-        # --- Process the row starting at the found 'pos' ---
-        row_starts[current_row_index] = pos
-
-        # Read the confirmed number of fields
-        if pos + 2 > array_size: # Should not happen if found_start is True, but safety check
-            row_starts[current_row_index] = -1 # Mark as invalid
             break
 
-        num_fields = (raw_data[pos] << 8) | raw_data[pos + 1]
-        pos += 2 # Advance past num_fields
+        row_starts[current_row_index] = pos
+        num_fields = _read_uint16_be(raw_data, pos)
+        pos += 2
 
-        # --- Inner loop to skip fields and find next row's start ---
+        # --- フィールドを読み飛ばして次の行の先頭へ ---
         inner_loop_broken = False
-        for field_idx in range(num_fields):
-            # Check if we can read field length
+        for _ in range(num_fields):
             if pos + 4 > array_size:
                 inner_loop_broken = True
-                pos = array_size # Ensure outer loop terminates
-                break # Break inner loop
-
-            # Read field length
-            field_len = int.from_bytes(raw_data[pos:pos+4], 'big', signed=True)
-            pos += 4 # Advance past field_len
-
-            # If field is not NULL, advance past data
+                pos = array_size
+                break
+            field_len = _read_int32_be(raw_data, pos)
+            pos += 4
             if field_len >= 0:
-                # Check if we can read field data
                 if pos + field_len > array_size:
                     inner_loop_broken = True
-                    pos = array_size # Ensure outer loop terminates
-                    break # Break inner loop
-                pos += field_len # Advance past field data
-            # else: # NULL case, pos already advanced by 4
+                    pos = array_size
+                    break
+                pos += field_len
 
-        # Move to the next row index
         current_row_index += 1
-
-        # If the inner loop was broken due to data ending, stop processing further rows
         if inner_loop_broken:
-             break
-
-    # Mark any remaining rows (if loop exited early) as invalid
-    if current_row_index < num_rows:
-        row_starts[current_row_index:] = -1
+            break
 
     return row_starts
+
+
+# CPUで複数行の開始位置を計算するヘルパー関数 (クリーンアップ版)
+def calculate_row_starts_cpu(raw_data, header_size, num_rows):
+    """
+    CPU上でCOPY BINARYデータの各行の開始位置を計算します。
+    ヘッダー後の潜在的なパディング/フラグをスキップし、
+    各行のフィールドを正しく読み進めて次の行の開始位置を特定します。
+    見つからなかった行は -1 になります。
+    """
+    raw_data = np.frombuffer(raw_data, dtype=np.uint8) if not isinstance(raw_data, np.ndarray) else raw_data
+    return _calculate_row_starts_njit(raw_data, header_size, num_rows)
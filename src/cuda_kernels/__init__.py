@@ -6,6 +6,7 @@ CUDA カーネル関連の定義
 from .pg_parser_kernels import parse_binary_format_kernel, parse_binary_format_kernel_one_row
 from .data_decoders import decode_int16, decode_int32, decode_numeric_postgres
 from .memory_utils import bulk_copy_64bytes
-from .arrow_gpu_pass1 import pass1_len_null
+from .arrow_gpu_pass1 import pass1_len_null, pass1_validity_bitmap
 from .arrow_gpu_pass2 import pass2_scatter_varlen
-from .arrow_gpu_pass2_fixed import pass2_scatter_fixed
+from .arrow_gpu_pass2_fixed import pass2_scatter_fixed, pass2_scatter_fixed_fused
+from .predicate_kernels import predicate_flags, compact_rows, gather_rows
@@ -60,4 +60,74 @@ def pass1_len_null(field_lengths, var_indices, d_var_lens, d_nulls):
             d_var_lens[v_idx, row] = 0 if is_null else flen
 
 
-__all__ = ["pass1_len_null"]
+# ----------------------------------------------------------------------
+# 列ごとの Arrow validity ビットマップを GPU 上で直接生成
+# ----------------------------------------------------------------------
+PASS1_BITMAP_THREADS = 256  # blockDim.x (共有メモリ集計のサイズと一致させる)
+
+
+@cuda.jit
+def pass1_validity_bitmap(field_lengths, src_cols, var_indices, d_var_lens, d_bitmaps, d_null_counts):
+    """
+    1 スレッド = (出力列, 8 行) でビットマップ 1 バイトを組み立てる。
+    grid = (ceil(bitmap_bytes / PASS1_BITMAP_THREADS), n_out), block = PASS1_BITMAP_THREADS
+
+    Parameters
+    ----------
+    field_lengths : int32[:, :]
+        各行×列のフィールド長 (-1 = NULL)。列数は COPY ストリームの全列
+    src_cols      : int32[:]
+        出力列 → field_lengths の列番号 (射影した列だけを処理する)
+    var_indices   : int32[:]
+        出力列 → 可変長列インデックス (固定長は -1)
+    d_var_lens    : int32[:, :]
+        (out) 可変長列 × 行 のバイト長 (NULL は 0)
+    d_bitmaps     : uint8[:, :]
+        (out) 出力列 × ceil(rows / 8) の validity ビットマップ
+        (Arrow 形式: LSB = 先頭行, 1 = 有効)。末尾の余りビットは 0
+    d_null_counts : int32[:]
+        (out, 事前に 0 初期化) 出力列ごとの NULL 数。ブロック内で共有メモリ集計し
+        ブロックあたり 1 回だけ atomic 加算する
+    """
+    sh_nulls = cuda.shared.array(PASS1_BITMAP_THREADS, dtype=np.int32)
+
+    tid = cuda.threadIdx.x
+    byte_idx = cuda.blockIdx.x * cuda.blockDim.x + tid
+    col = cuda.blockIdx.y
+    src = src_cols[col]
+    rows = field_lengths.shape[0]
+    v_idx = var_indices[col]
+
+    bits = 0
+    nulls = 0
+    if byte_idx < d_bitmaps.shape[1]:
+        row0 = byte_idx * 8
+        for b in range(8):
+            row = row0 + b
+            if row >= rows:
+                break
+            flen = field_lengths[row, src]
+            if flen == np.int32(-1):
+                nulls += 1
+                if v_idx != -1:
+                    d_var_lens[v_idx, row] = 0
+            else:
+                bits |= 1 << b
+                if v_idx != -1:
+                    d_var_lens[v_idx, row] = flen
+        d_bitmaps[col, byte_idx] = np.uint8(bits)
+
+    # ブロック内リダクション (NULL 数)
+    sh_nulls[tid] = nulls
+    cuda.syncthreads()
+    stride = PASS1_BITMAP_THREADS // 2
+    while stride > 0:
+        if tid < stride:
+            sh_nulls[tid] += sh_nulls[tid + stride]
+        cuda.syncthreads()
+        stride //= 2
+    if tid == 0 and sh_nulls[0] != 0:
+        cuda.atomic.add(d_null_counts, col, sh_nulls[0])
+
+
+__all__ = ["pass1_len_null", "pass1_validity_bitmap", "PASS1_BITMAP_THREADS"]
@@ -3,6 +3,7 @@ GPU Pass‑2 Kernel: 可変長列 scatter‑copy
 --------------------------------------
 1 カーネル呼び出しで「ある 1 つの可変長列」を処理する想定。
 launch する側 (gpu_decoder_v2.py) で列ごとに呼び出す。
+長いフィールドは pass2_scatter_varlen_group (複数スレッドで 1 行) を使う。
 
 * UTF8 / BINARY          : raw[off:off+len] → values_buf[offsets[row] : ]
 * NUMERIC (UTF8 文字列)  : numeric binary → 10進文字列化 → values_buf
@@ -52,4 +53,70 @@ def pass2_scatter_varlen(raw,          # uint8[:]
     _copy_bytes(raw, src_pos, values_buf, dst_pos, flen)
 
 
-__all__ = ["pass2_scatter_varlen"]
+# ----------------------------------------------------------------------
+# warp / sub-warp 協調コピー版
+# ----------------------------------------------------------------------
+@cuda.jit
+def pass2_scatter_varlen_group(raw,          # uint8[:]
+                               raw_words,    # uint32[:]  raw の 4 バイト単位ビュー
+                               field_offsets,# int32[:] (rows,)
+                               field_lengths,# int32[:] (rows,)
+                               offsets,      # int32[:] (rows+1,)
+                               values_buf,   # uint8[:]
+                               values_words, # uint32[:]  values_buf の 4 バイト単位ビュー
+                               group):       # int32      1 行を担当するスレッド数 (2 の冪, 4..32)
+    """
+    group 本のスレッド (lane) で 1 行を協調コピーする。
+
+    * 先頭: dst が 4 バイト境界に揃うまで (最大 3 バイト) をバイト単位
+    * 本体: dst 側は 4 バイト境界の word store。src 側は境界に揃った 2 word を
+      読んでシフト結合 (funnel shift) するので、src/dst のアライメントが違っても
+      load/store ともに word 単位になる。lane は word を group 刻みで担当するため
+      同じ行の連続 word が隣接 lane に割り当たり、load/store が coalesce する
+    * 末尾: 残り (最大 3 バイト) をバイト単位
+
+    raw / values_buf の先頭は 4 バイト境界にあること (ホスト側で確認)。
+    """
+    gid = cuda.grid(1)
+    row = gid // group
+    lane = gid % group
+    if row >= field_offsets.size:
+        return
+
+    flen = field_lengths[row]
+    if flen <= 0:
+        return
+    src = field_offsets[row]
+    dst = offsets[row]
+
+    head = (4 - (dst & 3)) & 3
+    if head > flen:
+        head = flen
+    if lane < head:
+        values_buf[dst + lane] = raw[src + lane]
+
+    nwords = (flen - head) >> 2
+    dst_w = (dst + head) >> 2
+    src_b = src + head
+    shift = (src_b & 3) * 8
+    src_w = src_b >> 2
+    for k in range(lane, nwords, group):
+        w = src_w + k
+        if shift == 0:
+            values_words[dst_w + k] = raw_words[w]
+        elif w + 1 < raw_words.size:
+            values_words[dst_w + k] = ((raw_words[w] >> shift) | (raw_words[w + 1] << (32 - shift))) & 0xFFFFFFFF
+        else:
+            # raw 末尾の端数 word: バイト単位
+            base = src_b + 4 * k
+            d = (dst_w + k) * 4
+            for i in range(4):
+                values_buf[d + i] = raw[base + i]
+
+    tail_start = head + nwords * 4
+    t = tail_start + lane
+    if t < flen:
+        values_buf[dst + t] = raw[src + t]
+
+
+__all__ = ["pass2_scatter_varlen", "pass2_scatter_varlen_group"]
@@ -5,264 +5,309 @@ GPU カーネル: PostgreSQL NUMERIC バイナリ形式から Arrow Decimal128 
 (Pass 2 - 固定長列処理の一部)
 
 128ビット整数は上位(hi)と下位(lo)の uint64 で表現する。
+乗除算は 32 bit limb 単位で行うため、途中結果はすべて uint64 に収まり
+(64x64 → 128 の乗算命令が不要)、結果は厳密になる。
+
+* 値は列の scale (ColumnMeta.arrow_param の (precision, scale)) に合わせた
+  unscaled 整数として書く。scale より下の桁は四捨五入 (0 から遠い方向へ丸め)
+* NaN / ±Inf、128 bit または 10**precision を超える値は NULL にする
+  (invalid_flags に 1 を立て、counters[0] = NULL にした数, counters[1] = うち桁あふれ数)
 """
 
-from numba import cuda, uint64, int64, uint16, int16, uint8, boolean
-import numpy as np # Host code might still use numpy for constants etc.
+from numba import cuda, uint64
+import numpy as np
+
+from ..arrow_utils import POW10_128_HI, POW10_128_LO
+
+MASK32 = 0xFFFFFFFF
+MASK64 = 0xFFFFFFFFFFFFFFFF
+POW10_U64 = np.array([10 ** i for i in range(20)], dtype=np.uint64)
+
+# NUMERIC sign フィールド
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_PINF = 0xD000
+NUMERIC_NINF = 0xF000
+
+# decode_numeric128 の戻り値
+DEC_OK = 0
+DEC_INVALID = 1     # NaN / Inf / 壊れた値
+DEC_OVERFLOW = 2    # 128 bit / precision 桁あふれ
 
 # ==================================================
 # 128-bit Arithmetic Helper Functions (Device)
-# Representing uint128 as (hi: uint64, lo: uint64)
+# Representing uint128 as (hi, lo)
 # ==================================================
 
 @cuda.jit(device=True, inline=True)
-def add128(a_hi, a_lo, b_hi, b_lo):
-    """Performs (a_hi, a_lo) + (b_hi, b_lo) -> (res_hi, res_lo)"""
-    res_lo = a_lo + b_lo
-    carry = uint64(1) if res_lo < a_lo else uint64(0) # Check for unsigned overflow
-    res_hi = a_hi + b_hi + carry
-    return res_hi, res_lo
+def add128_u64(hi, lo, a):
+    """(hi, lo) + a → (hi, lo, overflow)"""
+    carry = lo > uint64(MASK64) - a
+    if carry:
+        new_lo = lo - (uint64(MASK64) - a) - uint64(1)
+        if hi == uint64(MASK64):
+            return uint64(0), new_lo, True
+        return hi + uint64(1), new_lo, False
+    return hi, lo + a, False
+
 
 @cuda.jit(device=True, inline=True)
-def mul128_u64(a_hi, a_lo, b):
-    """Performs (a_hi, a_lo) * b (uint64) -> (res_hi, res_lo)"""
-    # Decompose b into 32-bit parts for standard 64x64->128 multiplication
-    b_lo32 = uint64(b & 0xFFFFFFFF)
-    b_hi32 = uint64(b >> 32)
-
-    # Multiply lower part of a by b
-    carry_hi = uint64(0)
-    res_lo = a_lo * b_lo32 # This fits in 128 bits (64*32 -> 96)
-    # Need full 64x64 -> 128 multiplication logic here.
-    # Python's arbitrary precision integers handle this, but Numba needs explicit logic.
-    # Let's use a simplified approach assuming intermediate results fit 64 bits,
-    # which is NOT generally correct for full 128x64 multiplication.
-    # A proper implementation requires splitting a_lo and a_hi further.
-
-    # --- Simplified (Potentially Incorrect for large values) ---
-    # This is a placeholder and needs a robust 128x64 bit multiplication implementation.
-    # For multiplying by 10000, this might suffice if a_hi is small.
-    p1_lo = a_lo * b # Calculate full 64x64 product, assuming it fits Python int
-    # How to get high bits in Numba without uint128? Tricky.
-    # Let's simulate the carry approximately. This is NOT robust.
-    # A proper implementation would use intrinsics or manual long multiplication.
-    # For now, we assume the product fits 128 bits and try to split.
-    # This part is highly problematic without native uint128 or intrinsics.
-
-    # Placeholder: Assume product fits 128 bits, split manually (approximate)
-    # This requires a full algorithm like Karatsuba or standard long multiplication.
-    # Let's try a very basic version for multiplying by a small constant like 10000.
-    mask64 = uint64(0xFFFFFFFFFFFFFFFF)
-    tmp_lo = a_lo * b
-    carry_from_lo = uint64(0) # Need a way to calculate the high bits of a_lo * b
-
-    # Estimate carry (very rough):
-    if a_lo > (mask64 // b): # Very rough overflow check
-         # This needs the actual high bits of the product
-         # carry_from_lo = ... (complex calculation)
-         pass # Cannot easily calculate carry in Numba
-
-    tmp_hi = a_hi * b + carry_from_lo
-
-    # Add the high part contribution (a_hi * b shifted left by 64)
-    # This also requires careful handling of carries.
-
-    # --- Returning placeholder values ---
-    # This function needs a correct 128x64 implementation.
-    # For the specific case of * 10000, let's implement that directly.
-
-    # Direct implementation for * 10000
-    multiplier = uint64(10000)
-    mask32 = uint64(0xFFFFFFFF)
-
-    a0 = a_lo & mask32
-    a1 = a_lo >> 32
-    a2 = a_hi & mask32
-    a3 = a_hi >> 32
-
-    m0 = multiplier & mask32 # 10000
-    m1 = multiplier >> 32    # 0
-
-    # Cross products (simplified as m1=0)
-    p00 = a0 * m0
-    p10 = a1 * m0
-    p20 = a2 * m0
-    p30 = a3 * m0
-
-    # Combine results with carries
-    c0 = p00 >> 32
-    r0 = p00 & mask32
-
-    p10 += c0
-    c1 = p10 >> 32
-    r1 = p10 & mask32
-
-    p20 += c1
-    c2 = p20 >> 32
-    r2 = p20 & mask32
-
-    p30 += c2
-    c3 = p30 >> 32
-    r3 = p30 & mask32
-
-    res_lo = (r1 << 32) | r0
-    res_hi = (r3 << 32) | r2
-
-    return res_hi, res_lo
+def mul128_u32(hi, lo, m):
+    """(hi, lo) * m (m < 2**32) → (hi, lo, overflow)。limb 積は uint64 に収まる"""
+    p0 = (lo & uint64(MASK32)) * m
+    p1 = (lo >> uint64(32)) * m + (p0 >> uint64(32))
+    p2 = (hi & uint64(MASK32)) * m + (p1 >> uint64(32))
+    p3 = (hi >> uint64(32)) * m + (p2 >> uint64(32))
+    new_lo = ((p1 & uint64(MASK32)) << uint64(32)) | (p0 & uint64(MASK32))
+    new_hi = ((p3 & uint64(MASK32)) << uint64(32)) | (p2 & uint64(MASK32))
+    return new_hi, new_lo, (p3 >> uint64(32)) != uint64(0)
 
 
 @cuda.jit(device=True, inline=True)
-def div128_u64(a_hi, a_lo, b):
-    """Performs (a_hi, a_lo) // b (uint64) -> (res_hi, res_lo)"""
-    # Placeholder: Integer division for 128-bit by 64-bit is complex.
-    # Needs a long division algorithm implementation.
-    # For the specific case of // 10000, let's implement that directly.
-    # This is also non-trivial.
-
-    # --- Simplified Placeholder ---
-    # Assume b is small (like 10000) and a_hi is 0 for simplicity.
-    # This is NOT a general solution.
-    if a_hi == 0:
-        res_lo = a_lo // b
-        res_hi = uint64(0)
-        return res_hi, res_lo
-    else:
-        # Proper 128/64 division needed here.
-        # Returning a placeholder (potentially incorrect).
-        # This needs a full long division implementation.
-        # For now, return 0 if a_hi is not 0.
-        return uint64(0), uint64(0)
+def divmod128_u32(hi, lo, d):
+    """(hi, lo) // d, (hi, lo) % d (0 < d < 2**32) → (q_hi, q_lo, rem)。limb ごとの筆算"""
+    cur = hi >> uint64(32)
+    q3 = cur // d
+    cur = ((cur % d) << uint64(32)) | (hi & uint64(MASK32))
+    q2 = cur // d
+    cur = ((cur % d) << uint64(32)) | (lo >> uint64(32))
+    q1 = cur // d
+    cur = ((cur % d) << uint64(32)) | (lo & uint64(MASK32))
+    q0 = cur // d
+    rem = cur % d
+    return (q3 << uint64(32)) | q2, (q1 << uint64(32)) | q0, rem
+
 
 @cuda.jit(device=True, inline=True)
 def neg128(hi, lo):
-    """Performs 2's complement negation of (hi, lo) -> (res_hi, res_lo)"""
-    neg_lo = ~lo + uint64(1)
-    # Check if adding 1 to ~lo caused a wrap-around (borrow)
-    borrow = uint64(1) if neg_lo == 0 and lo != 0 else uint64(0) # Correct borrow logic
-    neg_hi = ~hi + borrow
-    return neg_hi, neg_lo
-
-# 10000^e を返すヘルパー (128-bit版)
+    """2 の補数による符号反転 (hi, lo) → (hi, lo)"""
+    if lo == uint64(0):
+        if hi == uint64(0):
+            return hi, lo
+        return uint64(MASK64) - hi + uint64(1), lo
+    return uint64(MASK64) - hi, uint64(MASK64) - lo + uint64(1)
+
+
 @cuda.jit(device=True, inline=True)
-def pow10000_128(e):
-    """Calculates 10000^e for unsigned 128-bit integers represented by (hi, lo)."""
-    p_hi = uint64(0)
-    p_lo = uint64(1)
-    ten_thousand = uint64(10000)
-    # ループ展開はNumba/LLVMに任せる
-    for _ in range(e):
-        # オーバーフローチェックは省略 (入力桁数制限でカバー想定)
-        p_hi, p_lo = mul128_u64(p_hi, p_lo, ten_thousand)
-    return p_hi, p_lo
-
-# 16-B LE 一括書き込み用ヘルパ (Numbaデバイス関数)
+def ge128(a_hi, a_lo, b_hi, b_lo):
+    """(a_hi, a_lo) >= (b_hi, b_lo) (符号なし)"""
+    return a_hi > b_hi or (a_hi == b_hi and a_lo >= b_lo)
+
+
 @cuda.jit(device=True, inline=True)
-def _store_u128_le(hi, lo, dst_buf, base_byte_idx):
-    """Stores a (hi, lo) uint128 value into a uint8 buffer in little-endian format."""
-    # Write lower 64 bits (little-endian)
-    v = lo
-    for i in range(8):
-        dst_buf[base_byte_idx + i] = uint8(v & 0xFF)
-        v >>= 8
-    # Write higher 64 bits (little-endian)
-    v = hi
-    for i in range(8):
-        dst_buf[base_byte_idx + 8 + i] = uint8(v & 0xFF)
-        v >>= 8
+def mul128_pow10(hi, lo, e):
+    """(hi, lo) * 10**e → (hi, lo, overflow)。9 桁ずつ掛ける"""
+    ovf = False
+    while e > 0:
+        step = e if e < 9 else 9
+        hi, lo, o = mul128_u32(hi, lo, POW10_U64[step])
+        ovf = ovf or o
+        e -= step
+    return hi, lo, ovf
+
+
+# ==================================================
+# NUMERIC → Decimal128 (device)
+# ==================================================
+
+@cuda.jit(device=True, inline=True)
+def _read_u16(raw, pos):
+    return (np.int64(raw[pos]) << 8) | np.int64(raw[pos + 1])
+
+
+@cuda.jit(device=True)
+def decode_numeric128(raw, pos, flen, scale, precision):
+    """
+    NUMERIC 1 値 (raw[pos:pos+flen]) を 10**-scale 単位の符号付き 128 bit 整数にする。
+
+    Returns
+    -------
+    (status, hi, lo) : status は DEC_OK / DEC_INVALID / DEC_OVERFLOW
+    """
+    zero = uint64(0)
+    if flen < 8:
+        return DEC_INVALID, zero, zero
+    nd = _read_u16(raw, pos)
+    weight = _read_u16(raw, pos + 2)
+    if weight >= 0x8000:
+        weight -= 0x10000
+    sign = _read_u16(raw, pos + 4)
+    if sign != NUMERIC_POS and sign != NUMERIC_NEG:
+        return DEC_INVALID, zero, zero
+    if 8 + 2 * nd > flen:
+        return DEC_INVALID, zero, zero
+
+    hi = zero
+    lo = zero
+    ovf = False
+    round_up = False
+    unit_exp = 0    # 最後に取り込んだ桁の 10 進指数 (scale 適用後)
+    p = pos + 8
+    for i in range(nd):
+        d = uint64(_read_u16(raw, p))
+        p += 2
+        ex = 4 * (weight - i) + scale
+        if ex >= 0:
+            hi, lo, o = mul128_u32(hi, lo, uint64(10000))
+            ovf = ovf or o
+            hi, lo, o = add128_u64(hi, lo, d)
+            ovf = ovf or o
+            unit_exp = ex
+            continue
+        # 小数部にかかる桁: 残す上位桁を取り込み、捨てる最上位桁で丸める
+        drop = -ex
+        if drop <= 4:
+            hi, lo, o = mul128_u32(hi, lo, POW10_U64[4 - drop])
+            ovf = ovf or o
+            hi, lo, o = add128_u64(hi, lo, d // POW10_U64[drop])
+            ovf = ovf or o
+            round_up = (d // POW10_U64[drop - 1]) % uint64(10) >= uint64(5)
+        unit_exp = 0
+        break
+
+    # 末尾の省略されたゼロ桁分を掛ける
+    hi, lo, o = mul128_pow10(hi, lo, unit_exp)
+    ovf = ovf or o
+    if round_up:
+        hi, lo, o = add128_u64(hi, lo, uint64(1))
+        ovf = ovf or o
+    if ovf or ge128(hi, lo, POW10_128_HI[precision], POW10_128_LO[precision]):
+        return DEC_OVERFLOW, zero, zero
+    if sign == NUMERIC_NEG:
+        hi, lo = neg128(hi, lo)
+    return DEC_OK, hi, lo
+
 
 # ==================================================
 # Main Kernel
 # ==================================================
 
 @cuda.jit
-def pass2_scatter_decimal128(raw,          # const uint8_t* __restrict__
-                             field_offsets,# const int32_t* __restrict__ (size=rows)
-                             field_lengths,# const int32_t* __restrict__ (size=rows, unused but for signature)
-                             dst_buf,      # uint8_t* (output buffer)
-                             stride):      # int (must be 16)
+def pass2_scatter_decimal128(raw,            # uint8[:]
+                             field_offsets,  # int32[:] (rows,)
+                             field_lengths,  # int32[:] (rows,)  -1 = NULL
+                             scale,          # int32   列の scale
+                             precision,      # int32   列の precision (1..38)
+                             dst_words,      # uint64[:] (rows*2,)  出力 (lo, hi) リトルエンディアン
+                             invalid_flags,  # uint8[:] (rows,)  (out) NULL にした行 = 1
+                             counters):      # int32[:] (2,)  (out) [NULL にした数, うち桁あふれ]
     """
     GPU kernel to convert PostgreSQL NUMERIC binary format to Arrow Decimal128
-    (16-byte little-endian integer) format, using (hi, lo) uint64 representation.
+    (16-byte little-endian integer) format, rescaled to the column scale.
     """
     row = cuda.grid(1)
     rows = field_offsets.shape[0]
     if row >= rows:
         return
 
-    src_offset = field_offsets[row]
-    dst_byte_offset = row * stride # stride must be 16
+    hi = uint64(0)
+    lo = uint64(0)
+    bad = np.uint8(0)
+    flen = field_lengths[row]
+    if flen != -1:
+        status, hi, lo = decode_numeric128(raw, field_offsets[row], flen, scale, precision)
+        if status != DEC_OK:
+            bad = np.uint8(1)
+            cuda.atomic.add(counters, 0, 1)
+            if status == DEC_OVERFLOW:
+                cuda.atomic.add(counters, 1, 1)
+
+    dst_words[2 * row] = lo
+    dst_words[2 * row + 1] = hi
+    invalid_flags[row] = bad
 
-    # Handle NULL: Write 16 bytes of zeros
-    if src_offset == 0:
-        _store_u128_le(uint64(0), uint64(0), dst_buf, dst_byte_offset)
-        return
 
-    # --- Read NUMERIC header (8 bytes) ---
-    header_end_offset = src_offset + 8
-    if header_end_offset > raw.size:
-        _store_u128_le(uint64(0), uint64(0), dst_buf, dst_byte_offset)
+@cuda.jit
+def clear_validity_bits(bitmap, invalid_flags):
+    """invalid_flags が 1 の行の validity ビットを落とす (1 スレッド = 1 バイト)"""
+    i = cuda.grid(1)
+    if i >= bitmap.size:
         return
+    rows = invalid_flags.size
+    mask = 0
+    for b in range(8):
+        r = i * 8 + b
+        if r < rows and invalid_flags[r] != 0:
+            mask |= 1 << b
+    if mask != 0:
+        bitmap[i] = np.uint8(np.int64(bitmap[i]) & ~mask & 0xFF)
 
-    nd = (uint16(raw[src_offset]) << 8) | uint16(raw[src_offset + 1])
-    weight = int16((int16(raw[src_offset + 2]) << 8) | int16(raw[src_offset + 3]))
-    sign = (uint16(raw[src_offset + 4]) << 8) | uint16(raw[src_offset + 5])
-    dscale = (uint16(raw[src_offset + 6]) << 8) | uint16(raw[src_offset + 7])
-    current_read_offset = src_offset + 8
 
-    # Handle NaN
-    if sign == 0xC000:
-        _store_u128_le(uint64(0), uint64(0), dst_buf, dst_byte_offset)
-        return
+# ==================================================
+# 複数列を 1 launch で処理するカーネル
+# ==================================================
 
-    # Check digit capacity
-    if nd > 9:
-        _store_u128_le(uint64(0), uint64(0), dst_buf, dst_byte_offset)
+@cuda.jit
+def pass2_scatter_decimal128_multi(raw,               # uint8[:]
+                                   field_offsets,     # int32[:, :] (rows, ncols)
+                                   field_lengths,     # int32[:, :] (rows, ncols)  -1 = NULL
+                                   dec_cols,          # int32[:] 列スロット → 列インデックス
+                                   scales,            # int32[:] 列スロットごとの scale
+                                   precisions,        # int32[:] 列スロットごとの precision (1..38)
+                                   dst_word_offsets,  # int64[:] 列スロット → arena_words 内の先頭位置
+                                   arena_words,       # uint64[:] 全 DECIMAL128 列の出力 (lo, hi)
+                                   invalid_flags,     # uint8[:, :] (n_dec, rows)  (out) NULL にした行 = 1
+                                   counters):         # int32[:, :] (n_dec, 2)  (out) [NULL にした数, うち桁あふれ]
+    """
+    pass2_scatter_decimal128 の複数列版。grid = (ceil(rows / blockDim.x), n_dec):
+    blockIdx.y が列スロット、スレッドが行。列ごとの scale / precision は配列で渡す。
+    """
+    row = cuda.blockIdx.x * cuda.blockDim.x + cuda.threadIdx.x
+    rows = field_offsets.shape[0]
+    if row >= rows:
         return
 
-    # --- Read base-10000 digits ---
-    val_hi = uint64(0)
-    val_lo = uint64(0)
-    ten_thousand = uint64(10000)
+    slot = cuda.blockIdx.y
+    cidx = dec_cols[slot]
+    hi = uint64(0)
+    lo = uint64(0)
+    bad = np.uint8(0)
+    flen = field_lengths[row, cidx]
+    if flen != -1:
+        status, hi, lo = decode_numeric128(raw, field_offsets[row, cidx], flen, scales[slot], precisions[slot])
+        if status != DEC_OK:
+            bad = np.uint8(1)
+            cuda.atomic.add(counters, (slot, 0), 1)
+            if status == DEC_OVERFLOW:
+                cuda.atomic.add(counters, (slot, 1), 1)
+
+    dst = dst_word_offsets[slot] + 2 * row
+    arena_words[dst] = lo
+    arena_words[dst + 1] = hi
+    invalid_flags[slot, row] = bad
 
-    digits_end_offset = current_read_offset + nd * 2
-    if digits_end_offset > raw.size:
-        _store_u128_le(uint64(0), uint64(0), dst_buf, dst_byte_offset)
-        return
 
-    for i in range(nd):
-        digit = uint64((uint16(raw[current_read_offset]) << 8) | uint16(raw[current_read_offset + 1]))
-        # Accumulate: val = val * 10000 + digit
-        val_hi, val_lo = mul128_u64(val_hi, val_lo, ten_thousand)
-        val_hi, val_lo = add128(val_hi, val_lo, uint64(0), digit) # Add digit (fits in lo)
-        current_read_offset += 2
-
-    # --- Apply weight ---
-    exponent_base10000 = int(weight) - (int(nd) - 1) # Use int for calculation
-
-    if exponent_base10000 > 0:
-        pow_hi, pow_lo = pow10000_128(exponent_base10000)
-        # This multiplication needs a full 128x128 implementation if pow_hi can be non-zero
-        # Assuming pow_hi is 0 for reasonable exponents
-        if pow_hi == 0:
-             val_hi, val_lo = mul128_u64(val_hi, val_lo, pow_lo)
-        else:
-             # Handle 128x128 multiplication case (complex) - set to 0 for now
-             val_hi, val_lo = uint64(0), uint64(0)
-    elif exponent_base10000 < 0:
-        pow_hi, pow_lo = pow10000_128(-exponent_base10000)
-        # This division needs a full 128/128 implementation if pow_hi can be non-zero
-        # Assuming pow_hi is 0 for reasonable exponents
-        if pow_hi == 0:
-             val_hi, val_lo = div128_u64(val_hi, val_lo, pow_lo)
-        else:
-             # Handle 128/128 division case (complex) - set to 0 for now
-             val_hi, val_lo = uint64(0), uint64(0)
-
-
-    # --- Apply sign ---
-    is_negative = (sign == 0x4000)
-    if is_negative:
-        val_hi, val_lo = neg128(val_hi, val_lo)
-
-    # --- Store the final 128-bit value ---
-    _store_u128_le(val_hi, val_lo, dst_buf, dst_byte_offset)
+@cuda.jit
+def clear_validity_bits_multi(bitmaps, bitmap_rows, invalid_flags):
+    """
+    clear_validity_bits の複数列版。grid = (ceil(bitmap バイト数 / blockDim.x), n_dec):
+    列スロット slot の invalid_flags[slot] を bitmaps[bitmap_rows[slot]] へ反映する
+    """
+    i = cuda.blockIdx.x * cuda.blockDim.x + cuda.threadIdx.x
+    if i >= bitmaps.shape[1]:
+        return
+    slot = cuda.blockIdx.y
+    b_row = bitmap_rows[slot]
+    rows = invalid_flags.shape[1]
+    mask = 0
+    for b in range(8):
+        r = i * 8 + b
+        if r < rows and invalid_flags[slot, r] != 0:
+            mask |= 1 << b
+    if mask != 0:
+        bitmaps[b_row, i] = np.uint8(np.int64(bitmaps[b_row, i]) & ~mask & 0xFF)
+
+
+__all__ = [
+    "pass2_scatter_decimal128",
+    "pass2_scatter_decimal128_multi",
+    "clear_validity_bits",
+    "clear_validity_bits_multi",
+    "decode_numeric128",
+    "add128_u64",
+    "mul128_u32",
+    "divmod128_u32",
+    "neg128",
+    "mul128_pow10",
+]
@@ -12,8 +12,12 @@ dst_buf       : uint8[:]      出力バッファ (rows * stride)
 stride        : int32         出力バッファの1行あたりのバイト幅 (8 等。メモリ確保時の値)
 """
 
+import numpy as np
 from numba import cuda
 
+from ..type_map import DATE32, TS64_US
+from ..arrow_utils import PG_DATE_EPOCH_OFFSET_DAYS, PG_TS_EPOCH_OFFSET_US
+
 @cuda.jit # Remove debug=True
 def pass2_scatter_fixed(raw, field_offsets, elem_size, dst_buf, stride):
     row = cuda.grid(1)
@@ -56,3 +60,72 @@ def pass2_scatter_fixed(raw, field_offsets, elem_size, dst_buf, stride):
     # although the plan is to use correct types during Arrow assembly.
     for i in range(elem_size, stride):
         dst_buf[dst + i] = 0
+
+
+# ----------------------------------------------------------------------
+# 全固定長列を 1 回の launch で処理する融合カーネル
+# ----------------------------------------------------------------------
+
+@cuda.jit(device=True, inline=True)
+def _load_be(raw, src, elem_size):
+    """ビッグエンディアン elem_size (1/2/4/8) バイトを int64 (ビット列) として読む"""
+    if elem_size == 8:
+        return (np.int64(raw[src]) << 56) | (np.int64(raw[src + 1]) << 48) | \
+               (np.int64(raw[src + 2]) << 40) | (np.int64(raw[src + 3]) << 32) | \
+               (np.int64(raw[src + 4]) << 24) | (np.int64(raw[src + 5]) << 16) | \
+               (np.int64(raw[src + 6]) << 8) | np.int64(raw[src + 7])
+    if elem_size == 4:
+        return (np.int64(raw[src]) << 24) | (np.int64(raw[src + 1]) << 16) | \
+               (np.int64(raw[src + 2]) << 8) | np.int64(raw[src + 3])
+    if elem_size == 2:
+        return (np.int64(raw[src]) << 8) | np.int64(raw[src + 1])
+    return np.int64(raw[src])
+
+
+@cuda.jit
+def pass2_scatter_fixed_fused(raw, field_offsets, field_lengths,
+                              fixed_cols, type_ids, elem_sizes, dst_offsets, arena):
+    """
+    固定長列 (DECIMAL128 を除く) をまとめて 1 launch で scatter-copy する。
+    grid = (ceil(rows / blockDim.x), n_fixed): blockIdx.y が列スロット、スレッドが行。
+    列優先の field_offsets / field_lengths では同一 warp の読み出しが連続する。
+
+    Parameters
+    ----------
+    raw           : uint8[:]      COPY バイナリ全体
+    field_offsets : int32[:, :]   (rows, ncols) フィールド先頭オフセット
+    field_lengths : int32[:, :]   (rows, ncols) フィールド長 (-1 = NULL)
+    fixed_cols    : int32[:]      列スロット → 列インデックス
+    type_ids      : int32[:]      列ごとの Arrow 型 ID (build_gpu_meta_arrays)
+    elem_sizes    : int32[:]      列ごとのバイト幅 (1/2/4/8)
+    dst_offsets   : int64[:]      列スロット → arena 内の列先頭バイト位置
+    arena         : uint8[:]      全固定長列の出力バッファ (列ごとに rows * elem_size)
+
+    ビッグエンディアン → リトルエンディアン変換は要素サイズ別に展開し、
+    DATE32 / TS64_US は PostgreSQL → Arrow のエポック補正もここで行う。
+    NULL 行は 0 で埋める。
+    """
+    row = cuda.blockIdx.x * cuda.blockDim.x + cuda.threadIdx.x
+    rows = field_offsets.shape[0]
+    if row >= rows:
+        return
+
+    slot = cuda.blockIdx.y
+    cidx = fixed_cols[slot]
+    esize = elem_sizes[cidx]
+    dst = dst_offsets[slot] + row * esize
+
+    val = np.int64(0)
+    if field_lengths[row, cidx] != -1:
+        val = _load_be(raw, field_offsets[row, cidx], esize)
+        tid = type_ids[cidx]
+        if tid == DATE32:
+            if val >= 0x80000000:  # int32 の符号拡張
+                val -= 0x100000000
+            val += PG_DATE_EPOCH_OFFSET_DAYS
+        elif tid == TS64_US:
+            val += PG_TS_EPOCH_OFFSET_US
+
+    # リトルエンディアンで書き出し
+    for i in range(esize):
+        arena[dst + i] = np.uint8((val >> (8 * i)) & 0xFF)
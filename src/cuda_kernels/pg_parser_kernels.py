@@ -45,10 +45,11 @@ def decode_int32_be(data, pos):
         デコードされた32ビット整数値 (NULLは -1)
     """
     # バイトを取得して直接ビット演算（NumPy API使用せず）
-    b0 = (data[pos] & 0xFF)
-    b1 = (data[pos + 1] & 0xFF)
-    b2 = (data[pos + 2] & 0xFF)
-    b3 = (data[pos + 3] & 0xFF)
+    # int64 へ明示的に拡張 (シミュレータでは uint8 のままシフトすると桁あふれする)
+    b0 = np.int64(data[pos]) & 0xFF
+    b1 = np.int64(data[pos + 1]) & 0xFF
+    b2 = np.int64(data[pos + 2]) & 0xFF
+    b3 = np.int64(data[pos + 3]) & 0xFF
     
     # ビッグエンディアンからリトルエンディアンに変換し、符号付き int32 として返す
     val = (b0 << 24) | (b1 << 16) | (b2 << 8) | b3
@@ -224,8 +225,8 @@ def atomic_add_global(array, idx, val):
 @cuda.jit(device=True, inline=True)
 def read_uint16_be(data, pos):
     """ Reads a 16-bit unsigned integer in big-endian format. """
-    b0 = data[pos]
-    b1 = data[pos + 1]
+    b0 = np.int64(data[pos])
+    b1 = np.int64(data[pos + 1])
     return (b0 << 8) | b1
 
 @cuda.jit
@@ -0,0 +1,180 @@
+"""
+COPY BINARY 行先頭検出の並列カーネル
+------------------------------------
+データ本体 [header_size, raw.size) を segment_size バイトのセグメントに分割し、
+1 スレッド = 1 セグメントで以下を行う。
+
+1. guess_segment_entries_gpu
+   セグメント内で「行ヘッダ == ncols かつ行全体が範囲内に収まり、直後も行ヘッダ
+   (または終端) になる」最初の位置を投機的な行先頭 (entry) とする。
+2. walk_segments_gpu
+   entry から行を辿り、セグメント内で始まる行数 (count) と、セグメント末尾以降で
+   最初に始まる行の位置 (exit) を求める。
+3. resolve_segment_chain_gpu
+   セグメント境界を先頭から連鎖させ、entry[s] != exit[s-1] のセグメントだけを
+   exit[s-1] から辿り直す。entry[0] = header_size は常に正しいので、帰納的に
+   全セグメントが逐次走査と同じ行境界を持つ。行境界は数行で自己同期するため
+   辿り直したセグメントの exit は通常元の値に戻り、以降は比較のみで済む。
+   (誤った entry を並列に伝播させると、誤りの波が末尾まで届くまで反復が
+   終わらないため、連鎖は 1 スレッドで行う。)
+4. write_row_starts_gpu
+   count のプレフィックスサムを書き込み位置として、各セグメントが行先頭を出力する。
+
+行の判定は ``build_pg_row_starts_cpu`` と同じ規則に従う:
+終端マーカー 0xFFFF、2 バイト未満の残り、または範囲外へはみ出す行で走査終了。
+"""
+
+import numpy as np
+from numba import cuda
+
+from .pg_parser_kernels import read_uint16_be
+
+# exit に使う特別値: この位置以降に行は存在しない (終端・データ切れ)
+CHAIN_END = -1
+
+
+@cuda.jit(device=True, inline=True)
+def read_int32_be_signed(data, pos):
+    """ビッグエンディアン int32 を符号付きで読む"""
+    val = (np.int64(data[pos]) << 24) | (np.int64(data[pos + 1]) << 16) | \
+          (np.int64(data[pos + 2]) << 8) | np.int64(data[pos + 3])
+    if val >= 0x80000000:
+        val -= 0x100000000
+    return val
+
+
+@cuda.jit(device=True)
+def row_end_or_fail(raw, pos):
+    """
+    pos から始まる行の終端位置を返す。
+    行として成立しない場合 (終端マーカー・データ切れ) は CHAIN_END。
+    """
+    n = raw.size
+    if pos + 2 > n:
+        return CHAIN_END
+    nf = read_uint16_be(raw, pos)
+    if nf == 0xFFFF:
+        return CHAIN_END
+    cur = pos + 2
+    for _ in range(nf):
+        if cur + 4 > n:
+            return CHAIN_END
+        flen = read_int32_be_signed(raw, cur)
+        cur += 4
+        if flen > 0:
+            if cur + flen > n:
+                return CHAIN_END
+            cur += flen
+    return cur
+
+
+@cuda.jit(device=True)
+def is_plausible_row(raw, pos, ncols):
+    """投機用: 行ヘッダが ncols で行が完結し、次も行ヘッダ/終端/データ末尾であるか"""
+    n = raw.size
+    if pos + 2 > n or read_uint16_be(raw, pos) != ncols:
+        return False
+    nxt = row_end_or_fail(raw, pos)
+    if nxt == CHAIN_END:
+        return False
+    if nxt == n:
+        return True
+    if nxt + 2 > n:
+        return False
+    h = read_uint16_be(raw, nxt)
+    return h == ncols or h == 0xFFFF
+
+
+@cuda.jit(device=True)
+def walk_segment(raw, header_size, segment_size, s, entry):
+    """entry から行を辿り (exit, セグメント内で始まる行数) を返す"""
+    seg_end = min(header_size + (s + 1) * segment_size, raw.size)
+    pos = entry
+    cnt = 0
+    while pos != CHAIN_END and pos < seg_end:
+        nxt = row_end_or_fail(raw, pos)
+        if nxt == CHAIN_END:
+            pos = CHAIN_END
+            break
+        cnt += 1
+        pos = nxt
+    # データ末尾まで到達した場合も以降に行はない
+    if pos != CHAIN_END and pos >= raw.size:
+        pos = CHAIN_END
+    return pos, cnt
+
+
+@cuda.jit
+def guess_segment_entries_gpu(raw, header_size, segment_size, ncols, entries):
+    """各セグメントの投機的な行先頭を entries に書く (entries[0] は header_size 固定)"""
+    s = cuda.grid(1)
+    nseg = entries.size
+    if s >= nseg:
+        return
+    if s == 0:
+        entries[0] = header_size
+        return
+    seg_start = header_size + s * segment_size
+    seg_end = min(seg_start + segment_size, raw.size)
+    guess = seg_end   # 候補なし = このセグメントで始まる行はないと仮定
+    for p in range(seg_start, seg_end):
+        if is_plausible_row(raw, p, ncols):
+            guess = p
+            break
+    entries[s] = guess
+
+
+@cuda.jit
+def walk_segments_gpu(raw, header_size, segment_size, entries, exits, counts):
+    """各セグメントについて entry から行を辿り count / exit を求める"""
+    s = cuda.grid(1)
+    if s >= entries.size:
+        return
+    ex, cnt = walk_segment(raw, header_size, segment_size, s, entries[s])
+    exits[s] = ex
+    counts[s] = cnt
+
+
+@cuda.jit
+def resolve_segment_chain_gpu(raw, header_size, segment_size, entries, exits, counts, n_fixed):
+    """セグメント境界を先頭から連鎖させ、投機が外れたセグメントだけ辿り直す (1 スレッド)"""
+    if cuda.grid(1) != 0:
+        return
+    fixed = 0
+    for s in range(1, entries.size):
+        prev_exit = exits[s - 1]
+        if entries[s] != prev_exit:
+            entries[s] = prev_exit
+            ex, cnt = walk_segment(raw, header_size, segment_size, s, prev_exit)
+            exits[s] = ex
+            counts[s] = cnt
+            fixed += 1
+    n_fixed[0] = fixed
+
+
+@cuda.jit
+def write_row_starts_gpu(raw, header_size, segment_size, entries, write_offsets, row_starts_out):
+    """確定した entry から再度行を辿り、プレフィックスサム位置へ行先頭を書き込む"""
+    s = cuda.grid(1)
+    nseg = entries.size
+    if s >= nseg:
+        return
+    seg_end = min(header_size + (s + 1) * segment_size, raw.size)
+    pos = entries[s]
+    out = write_offsets[s]
+    while pos != CHAIN_END and pos < seg_end:
+        nxt = row_end_or_fail(raw, pos)
+        if nxt == CHAIN_END:
+            break
+        row_starts_out[out] = pos
+        out += 1
+        pos = nxt
+
+
+__all__ = [
+    "CHAIN_END",
+    "guess_segment_entries_gpu",
+    "walk_segments_gpu",
+    "resolve_segment_chain_gpu",
+    "write_row_starts_gpu",
+]
@@ -0,0 +1,189 @@
+"""
+GPU 行フィルタ (WHERE 述語) カーネル
+-------------------------------------
+parse (field_offsets / field_lengths) と decode (pass-1 / pass-2) の間で
+述語を行ごとに評価し、残す行の番号を詰めた選択ベクトルを作る。
+
+1. ``predicate_flags``  : 1 スレッド = 1 行で述語を評価 (flags) + ブロックごとの件数
+2. (ホスト)             : ブロック件数の排他的累積和 = ブロックの書き込み開始位置
+3. ``compact_rows``     : ブロック内走査 (共有メモリ) で行番号を順序を保って詰める
+4. ``gather_rows``      : 選択した行の field_offsets / field_lengths を詰めた行列へ集める
+
+述語は ``src/predicate.py`` がコンパイルした後置記法のプログラム。
+
+program : int64[:, 4]   1 命令 = (opcode, 列番号, a, b)
+    OP_CMP    : 列 <比較 a> consts[b]
+    OP_IN     : 列 IN consts[a : a + b]
+    OP_ISNULL : 列 IS NULL (a = 1 なら IS NOT NULL)
+    OP_AND / OP_OR : スタック上位 2 つを結合
+consts    : int64[:]    比較キー (下記)
+col_width : int32[:]    列ごとの PG バイナリ値のバイト幅 (比較できない列は 0)
+col_float : int32[:]    列ごとの浮動小数フラグ
+
+値は COPY BINARY のビッグエンディアンのまま読んで int64 の比較キーにする。
+整数・date (2000-01-01 起点の日数)・timestamp (同 µs)・bool はそのまま、float は
+IEEE ビット列を符号付き整数の大小関係に写す (PostgreSQL と同じく NaN は最大,
+-0.0 == 0.0)。NaN は符号・ペイロードによらず正の quiet NaN のキーに揃える。定数はホスト側で同じキーへ変換するので、カーネルは整数比較だけを行う。
+
+NULL との比較 / IN は偽 (SQL の UNKNOWN)。NOT を持たないので、AND / OR だけの式では
+UNKNOWN を偽とみなしても WHERE の結果は SQL と一致する。
+
+スタックは int64 のビット列 (深さ PREDICATE_MAX_DEPTH まで) で持ち、ローカル配列を
+使わないので、同じ評価関数 ``predicate_row`` を CPU (njit) と GPU (device 関数) で共用する。
+"""
+
+import numpy as np
+from numba import cuda
+
+OP_CMP, OP_IN, OP_ISNULL, OP_AND, OP_OR = 0, 1, 2, 3, 4
+CMP_EQ, CMP_NE, CMP_LT, CMP_LE, CMP_GT, CMP_GE = 0, 1, 2, 3, 4, 5
+
+PREDICATE_MAX_DEPTH = 62
+PREDICATE_THREADS = 256  # blockDim.x (共有メモリ走査のサイズと一致させる)
+
+
+def predicate_row(raw, field_offsets, field_lengths, row, program, consts, col_width, col_float):
+    """1 行分の述語を評価して 1 (残す) / 0 を返す (njit / cuda.jit(device=True) でコンパイルして使う)"""
+    st = np.int64(0)
+    for k in range(program.shape[0]):
+        op = program[k, 0]
+        if op == OP_AND or op == OP_OR:
+            b = st & 1
+            st >>= 1
+            a = st & 1
+            st >>= 1
+            r = (a & b) if op == OP_AND else (a | b)
+        else:
+            c = program[k, 1]
+            flen = field_lengths[row, c]
+            r = np.int64(0)
+            if op == OP_ISNULL:
+                if (flen == -1) != (program[k, 2] != 0):
+                    r = np.int64(1)
+            elif flen == col_width[c]:
+                # ビッグエンディアン → int64 (符号拡張)
+                width = col_width[c]
+                src = field_offsets[row, c]
+                v = np.int64(0)
+                for i in range(width):
+                    v = (v << 8) | np.int64(raw[src + i])
+                shift = 64 - 8 * width
+                if shift > 0:
+                    v = (v << shift) >> shift
+                if col_float[c] != 0:
+                    mag = v & ~(np.int64(-1) << (8 * width - 1))
+                    inf = np.int64(0x7F800000) if width == 4 else np.int64(0x7FF0000000000000)
+                    if mag > inf:
+                        # NaN: 符号・ペイロードによらず正の quiet NaN のキーに揃える (NaN 同士は等しく最大)
+                        v = inf | (np.int64(1) << (22 if width == 4 else 51))
+                    elif v < 0:
+                        # 負の float: 符号以外のビットを反転して大小を揃える (-0.0 → -1 → 0)
+                        v = v ^ ~(np.int64(-1) << (8 * width - 1))
+                        if v == -1:
+                            v = np.int64(0)
+                if op == OP_CMP:
+                    x = consts[program[k, 3]]
+                    cmp = program[k, 2]
+                    if cmp == CMP_EQ:
+                        hit = v == x
+                    elif cmp == CMP_NE:
+                        hit = v != x
+                    elif cmp == CMP_LT:
+                        hit = v < x
+                    elif cmp == CMP_LE:
+                        hit = v <= x
+                    elif cmp == CMP_GT:
+                        hit = v > x
+                    else:
+                        hit = v >= x
+                    if hit:
+                        r = np.int64(1)
+                else:
+                    start = program[k, 2]
+                    for i in range(program[k, 3]):
+                        if consts[start + i] == v:
+                            r = np.int64(1)
+                            break
+        st = (st << 1) | r
+    return st & 1
+
+
+_predicate_row_dev = cuda.jit(device=True)(predicate_row)
+
+
+@cuda.jit
+def predicate_flags(raw, field_offsets, field_lengths, program, consts, col_width, col_float,
+                    flags, block_counts):
+    """
+    1 スレッド = 1 行。grid = ceil(rows / PREDICATE_THREADS), block = PREDICATE_THREADS
+
+    Parameters
+    ----------
+    flags        : int32[:]  (out) 行ごとの評価結果 (1 = 残す)
+    block_counts : int32[:]  (out) ブロックごとの残す行数 (共有メモリで集計)
+    """
+    sh = cuda.shared.array(PREDICATE_THREADS, dtype=np.int32)
+    tid = cuda.threadIdx.x
+    row = cuda.blockIdx.x * cuda.blockDim.x + tid
+
+    f = 0
+    if row < field_lengths.shape[0]:
+        f = _predicate_row_dev(raw, field_offsets, field_lengths, row, program, consts, col_width, col_float)
+        flags[row] = f
+    sh[tid] = f
+    cuda.syncthreads()
+    stride = PREDICATE_THREADS // 2
+    while stride > 0:
+        if tid < stride:
+            sh[tid] += sh[tid + stride]
+        cuda.syncthreads()
+        stride //= 2
+    if tid == 0:
+        block_counts[cuda.blockIdx.x] = sh[0]
+
+
+@cuda.jit
+def compact_rows(flags, block_offsets, sel):
+    """
+    flags が 1 の行番号を元の順序のまま sel へ詰める。
+    ブロック内は共有メモリの包含的走査 (Hillis-Steele)、ブロック間は block_offsets
+    (ブロック件数の排他的累積和) で位置を決める。grid / block は predicate_flags と同じ
+    """
+    sh = cuda.shared.array(PREDICATE_THREADS, dtype=np.int32)
+    tid = cuda.threadIdx.x
+    row = cuda.blockIdx.x * cuda.blockDim.x + tid
+
+    f = 0
+    if row < flags.size:
+        f = flags[row]
+    sh[tid] = f
+    cuda.syncthreads()
+    offset = 1
+    while offset < PREDICATE_THREADS:
+        v = 0
+        if tid >= offset:
+            v = sh[tid - offset]
+        cuda.syncthreads()
+        sh[tid] += v
+        cuda.syncthreads()
+        offset *= 2
+    if f != 0:
+        sel[block_offsets[cuda.blockIdx.x] + sh[tid] - 1] = row
+
+
+@cuda.jit
+def gather_rows(sel, field_offsets, field_lengths, out_offsets, out_lengths):
+    """out[i, c] = in[sel[i], c]。grid は 2D (選択行, 列)"""
+    i, c = cuda.grid(2)
+    if i < sel.size and c < field_offsets.shape[1]:
+        r = sel[i]
+        out_offsets[i, c] = field_offsets[r, c]
+        out_lengths[i, c] = field_lengths[r, c]
+
+
+__all__ = [
+    "predicate_row", "predicate_flags", "compact_rows", "gather_rows",
+    "OP_CMP", "OP_IN", "OP_ISNULL", "OP_AND", "OP_OR",
+    "CMP_EQ", "CMP_NE", "CMP_LT", "CMP_LE", "CMP_GT", "CMP_GE",
+    "PREDICATE_MAX_DEPTH", "PREDICATE_THREADS",
+]
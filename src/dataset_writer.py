@@ -0,0 +1,370 @@
+"""パーティション分割した複数ファイルの Parquet データセットを書く
+
+RecordBatch の列を受け取り、指定列の値 (またはその年・月) ごとに Hive 形式の
+ディレクトリ (``<base>/lo_orderdate_year=1994/part-00003.parquet``) へ振り分けて書く。
+
+* パーティションごとにバッチを溜め、推定エンコード後サイズが target_file_bytes に
+  達したら 1 ファイル分を切り出してスレッドプールでエンコード・書き込みする
+  (pyarrow の Parquet エンコードは GIL を解放するので複数ファイルが並行に進む)。
+  推定には書き終えたファイルの「ファイルサイズ / Arrow バイト数」の実測比を使う
+* close 時に ``_common_metadata`` (スキーマ) と ``_metadata`` (全ファイルの行グループ統計)
+  を書く。読み手は ``pyarrow.dataset.parquet_dataset(".../_metadata", partitioning="hive")``
+  などで各ファイルを開かずにファイルを絞り込める
+
+複数プロセス (Ray / multiprocessing のワーカ) が同じディレクトリへ書く場合は、
+ワーカごとに file_prefix を変えて write_metadata=False で書き、全ワーカの終了後に
+``write_dataset_metadata`` でフッタを集めて ``_metadata`` を作る。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .arrow_utils import arrow_schema_for, host_batch
+from .type_map import ColumnMeta
+
+DEFAULT_TARGET_FILE_BYTES = 128 << 20
+DEFAULT_ROW_GROUP_SIZE = 1 << 20
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+PARTITION_TRANSFORMS = ("identity", "year", "month")
+
+
+def _partition_transform(name: str, pa_type: pa.DataType) -> Callable[[pa.Array], pa.Array]:
+    """
+    パーティションキーの変換関数
+
+    * identity : 値そのまま
+    * year     : date / timestamp は年、整数は YYYYMMDD 表現 (SSB の lo_orderdate など) とみなして // 10000
+    * month    : YYYYMM の整数 (date / timestamp は年 * 100 + 月、整数は // 100)
+    """
+    if name == "identity":
+        return lambda arr: arr
+    if name not in PARTITION_TRANSFORMS:
+        raise ValueError(f"unknown partition transform: {name!r} (expected one of {PARTITION_TRANSFORMS})")
+    if pa.types.is_date(pa_type) or pa.types.is_timestamp(pa_type):
+        if name == "year":
+            return pc.year
+        return lambda arr: pc.add(pc.multiply(pc.year(arr), 100), pc.month(arr))
+    if pa.types.is_integer(pa_type):
+        div = 10000 if name == "year" else 100
+        return lambda arr: pc.divide(arr, div)
+    raise TypeError(f"partition transform {name!r} is not supported for {pa_type}")
+
+
+def _partition_dir(name: str, value) -> str:
+    if value is None:
+        return f"{name}={HIVE_NULL}"
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return f"{name}={quote(str(value), safe='')}"
+
+
+@dataclass
+class DatasetFile:
+    """書き込んだ 1 ファイル (path は base_dir からの相対パス, "/" 区切り)"""
+    path: str
+    rows: int
+    bytes: int
+    partition: Optional[str] = None
+
+
+@dataclass
+class _Partition:
+    dirname: Optional[str]
+    batches: List[pa.RecordBatch] = field(default_factory=list)
+    nbytes: int = 0
+    rows: int = 0
+
+
+class ParquetDatasetWriter:
+    """
+    RecordBatch の列を Hive 形式でパーティション分割した Parquet データセットとして書く
+    (``run_pipeline`` の sink にも使える)
+
+    Parameters
+    ----------
+    base_dir : str
+        出力ディレクトリ (無ければ作る)
+    columns : list[ColumnMeta] or pyarrow.Schema, optional
+        None なら最初のバッチのスキーマを使う
+    partition_by : str, optional
+        パーティションに使う列 (None なら分割しない)
+    partition_transform : {"identity", "year", "month"} or callable
+        partition_by 列の値 → パーティションキー。callable は pyarrow.Array を受け取り同じ長さの
+        Array を返す (partition_name が必要)
+    partition_name : str, optional
+        ディレクトリ名のキー (既定: identity は列名、それ以外は ``<列名>_<transform>``)。
+        identity では列をファイルから除き、パスの値で復元する (Hive の慣習)
+    target_file_bytes : int
+        1 ファイルの目標サイズ (エンコード後の推定値, 最後のファイルは端数)
+    row_group_size : int
+        ファイル内の 1 行グループの最大行数
+    compression : str
+        Parquet の圧縮方式
+    max_workers : int
+        エンコード・書き込みを行うスレッド数 (キューに溜めるファイルはこの 2 倍まで)
+    file_prefix : str
+        ファイル名の接頭辞 (複数プロセスで同じ base_dir に書くときにワーカごとに変える)
+    write_metadata : bool
+        close 時に ``_metadata`` / ``_common_metadata`` を書く
+    **writer_options
+        その他 ``pyarrow.parquet.write_table`` への引数 (use_dictionary など)
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        columns: Union[List[ColumnMeta], pa.Schema, None] = None,
+        partition_by: Optional[str] = None,
+        partition_transform: Union[str, Callable[[pa.Array], pa.Array]] = "identity",
+        partition_name: Optional[str] = None,
+        target_file_bytes: int = DEFAULT_TARGET_FILE_BYTES,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        compression: str = "snappy",
+        max_workers: int = 4,
+        file_prefix: str = "",
+        write_metadata: bool = True,
+        **writer_options,
+    ):
+        if target_file_bytes < 1:
+            raise ValueError("target_file_bytes must be >= 1")
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        if callable(partition_transform) and partition_name is None:
+            raise ValueError("partition_name is required for a callable partition_transform")
+        self.base_dir = base_dir
+        self.partition_by = partition_by
+        self.partition_transform = partition_transform
+        if partition_name is None and partition_by is not None:
+            partition_name = partition_by if partition_transform == "identity" else \
+                f"{partition_by}_{partition_transform}"
+        self.partition_name = partition_name
+        self.target_file_bytes = target_file_bytes
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.file_prefix = file_prefix
+        self.write_metadata = write_metadata
+        self.writer_options = writer_options
+        self.files: List[DatasetFile] = []
+        self.rows_written = 0
+        self.encode_s = 0.0          # エンコード + 書き込みに使った時間 (全スレッドの合計)
+
+        self.schema: Optional[pa.Schema] = None      # 入力バッチのスキーマ
+        self.file_schema: Optional[pa.Schema] = None  # ファイルに書くスキーマ
+        self._key_fn: Optional[Callable[[pa.Array], pa.Array]] = None
+        if columns is not None:
+            self._init_schema(columns if isinstance(columns, pa.Schema) else arrow_schema_for(columns))
+
+        self._partitions: Dict[object, _Partition] = {}
+        self._metadata: List[Tuple[str, object]] = []   # (相対パス, FileMetaData)
+        self._ratio = 1.0            # ファイルサイズ / Arrow バイト数 の実測値 (最初は 1 とみなす)
+        self._arrow_bytes = 0
+        self._file_bytes = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._max_inflight = max_workers * 2
+        self._inflight: Deque[Future] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dataset-encoder")
+        self._closed = False
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _init_schema(self, schema: pa.Schema):
+        self.schema = schema
+        self.file_schema = schema
+        if self.partition_by is None:
+            return
+        idx = schema.get_field_index(self.partition_by)
+        if idx < 0:
+            raise KeyError(f"partition column {self.partition_by!r} not in schema")
+        if self.partition_transform == "identity":
+            self.file_schema = schema.remove(idx)
+        if callable(self.partition_transform):
+            self._key_fn = self.partition_transform
+        else:
+            self._key_fn = _partition_transform(self.partition_transform, schema.field(idx).type)
+
+    # ------------------------------------------------------------------
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        """RecordBatch をパーティションへ振り分けて溜め、目標サイズに達した分をエンコードへ回す"""
+        if self._closed:
+            raise ValueError("write_batch on closed ParquetDatasetWriter")
+        self._reap(block=False)
+        if batch.num_rows == 0:
+            return
+        # GPU 上のバッファを包んだバッチ (decode_chunk のゼロコピー出力) は振り分け・連結の前にホストへ
+        batch = host_batch(batch)
+        if self.schema is None:
+            self._init_schema(batch.schema)
+        elif not batch.schema.equals(self.schema):
+            batch = batch.cast(self.schema)
+
+        for key, part_batch in self._split(batch):
+            part = self._partitions.get(key)
+            if part is None:
+                dirname = None if self.partition_name is None else _partition_dir(self.partition_name, key)
+                part = self._partitions[key] = _Partition(dirname)
+            if self.file_schema is not self.schema:
+                part_batch = part_batch.drop_columns([self.partition_by])
+            part.batches.append(part_batch)
+            part.nbytes += part_batch.nbytes
+            part.rows += part_batch.num_rows
+            if part.nbytes * self._ratio >= self.target_file_bytes:
+                self._flush(part, final=False)
+
+    __call__ = write_batch
+
+    def _split(self, batch: pa.RecordBatch):
+        """(パーティションキー, そのキーの行だけのバッチ) の列"""
+        if self._key_fn is None:
+            yield None, batch
+            return
+        keys = self._key_fn(batch.column(self.partition_by))
+        uniques = pc.unique(keys)
+        if len(uniques) == 1:
+            yield uniques[0].as_py(), batch
+            return
+        for value in uniques:
+            if value.is_valid:
+                mask = pc.fill_null(pc.equal(keys, value), False)
+            else:
+                mask = pc.is_null(keys)
+            yield value.as_py(), batch.filter(mask)
+
+    def _flush(self, part: _Partition, final: bool):
+        """溜めた行から目標サイズ分ずつファイルを切り出す (final なら端数も書く)"""
+        if not part.batches:
+            return
+        table = pa.Table.from_batches(part.batches, schema=self.file_schema)
+        bytes_per_row = max(part.nbytes / max(part.rows, 1), 1e-9)
+        rows_per_file = max(int(self.target_file_bytes / (self._ratio * bytes_per_row)), 1)
+        start = 0
+        while table.num_rows - start >= rows_per_file or (final and start < table.num_rows):
+            n = min(rows_per_file, table.num_rows - start)
+            self._submit(part.dirname, table.slice(start, n))
+            start += n
+        rest = table.slice(start)
+        part.batches = rest.to_batches() if rest.num_rows else []
+        part.rows = rest.num_rows
+        part.nbytes = int(part.rows * bytes_per_row)
+
+    def _submit(self, dirname: Optional[str], table: pa.Table):
+        name = f"{self.file_prefix}part-{self._seq:05d}.parquet"
+        self._seq += 1
+        relpath = name if dirname is None else f"{dirname}/{name}"
+        while len(self._inflight) >= self._max_inflight:
+            self._inflight.popleft().result()     # 書き込みが詰まっていればホスト側で待つ
+        self._inflight.append(self._executor.submit(self._encode, relpath, dirname, table))
+
+    def _encode(self, relpath: str, dirname: Optional[str], table: pa.Table):
+        import pyarrow.parquet as pq
+
+        t0 = time.perf_counter()
+        path = os.path.join(self.base_dir, *relpath.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        collector: list = []
+        pq.write_table(table, path, row_group_size=self.row_group_size, compression=self.compression,
+                       metadata_collector=collector, **self.writer_options)
+        size = os.path.getsize(path)
+        collector[0].set_file_path(relpath)
+        with self._lock:
+            self.files.append(DatasetFile(relpath, table.num_rows, size, dirname))
+            self._metadata.append((relpath, collector[0]))
+            self.rows_written += table.num_rows
+            self._arrow_bytes += table.nbytes
+            self._file_bytes += size
+            if self._arrow_bytes:
+                self._ratio = max(self._file_bytes / self._arrow_bytes, 1e-3)
+            self.encode_s += time.perf_counter() - t0
+
+    def _reap(self, block: bool):
+        """終わったエンコードの例外を送出する (block なら全部待つ)"""
+        while self._inflight and (block or self._inflight[0].done()):
+            self._inflight.popleft().result()
+
+    # ------------------------------------------------------------------
+    def close(self) -> List[DatasetFile]:
+        """残りを書き出し、全ファイルの完了を待って ``_metadata`` / ``_common_metadata`` を書く"""
+        if self._closed:
+            return self.files
+        self._closed = True
+        try:
+            for part in self._partitions.values():
+                self._flush(part, final=True)
+            self._reap(block=True)
+        finally:
+            self._executor.shutdown(wait=True)
+        if self.write_metadata and self.file_schema is not None:
+            _write_metadata(self.base_dir, self.file_schema, [md for _, md in sorted(self._metadata,
+                                                                                      key=lambda x: x[0])])
+        self.files.sort(key=lambda f: f.path)
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 例外時は書きかけを待つだけにして _metadata は作らない
+            self._closed = True
+            self._executor.shutdown(wait=True)
+
+
+def _write_metadata(base_dir: str, schema: pa.Schema, metadata: list):
+    import pyarrow.parquet as pq
+
+    pq.write_metadata(schema, os.path.join(base_dir, "_common_metadata"))
+    if metadata:
+        pq.write_metadata(schema, os.path.join(base_dir, "_metadata"), metadata_collector=metadata)
+
+
+def write_dataset_metadata(base_dir: str) -> int:
+    """
+    base_dir 以下の Parquet ファイルのフッタだけを読み、``_metadata`` / ``_common_metadata`` を書く
+
+    複数のワーカが write_metadata=False で書いたデータセットをまとめる用。
+    "_" / "." で始まるファイル・ディレクトリは対象外。
+
+    Returns
+    -------
+    int
+        ``_metadata`` に含めたファイル数
+    """
+    import pyarrow.parquet as pq
+
+    metadata = []
+    schema = None
+    for root, dirs, files in os.walk(base_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(("_", ".")))
+        for name in sorted(files):
+            if name.startswith(("_", ".")) or not name.endswith(".parquet"):
+                continue
+            path = os.path.join(root, name)
+            md = pq.read_metadata(path)
+            md.set_file_path(os.path.relpath(path, base_dir).replace(os.sep, "/"))
+            if schema is None:
+                schema = md.schema.to_arrow_schema()
+            metadata.append(md)
+    if schema is not None:
+        _write_metadata(base_dir, schema, metadata)
+    return len(metadata)
+
+
+__all__ = [
+    "ParquetDatasetWriter",
+    "DatasetFile",
+    "write_dataset_metadata",
+    "DEFAULT_TARGET_FILE_BYTES",
+    "PARTITION_TRANSFORMS",
+]
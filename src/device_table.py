@@ -0,0 +1,237 @@
+"""GPU 常駐の出力テーブル (decode_chunk(output="device"))
+
+decode_chunk の結果を Arrow (ホスト) へ組み立てずに、GPU 上の
+values / offsets / validity バッファをそのまま列として保持する軽量コンテナ。
+
+* ``DeviceColumn`` : 1 列分のデバイスバッファ (Arrow と同じレイアウト)
+
+  - values   : 固定長は rows * 要素サイズのバイト列 (BOOL は 1 バイト/行),
+               可変長は全行の連結バイト列
+  - offsets  : 可変長のみ int32 (rows + 1)
+  - validity : NULL がある列のみ Arrow 形式のビットマップ (LSB=行0, 1=valid)
+
+  固定長列は ``__cuda_array_interface__`` で型付きの values を公開するので、
+  CuPy / Numba / cuDF などへコピーなしで渡せる。
+
+* ``DeviceTable``  : DeviceColumn の組。``to_cudf()`` で cuDF DataFrame、
+  ``to_arrow()`` で (ホストへコピーした) RecordBatch にする
+
+バッファの所有権は decode_chunk から DeviceTable へ移る (メモリプールからは切り離され、
+DeviceTable / そこから作った cuDF 列が参照している間は解放されない)。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import pyarrow as pa
+from numba import cuda
+
+
+def _values_dtype(pa_type: pa.DataType):
+    """固定長 Arrow 型 → values バッファを型付きで見るときの NumPy dtype (DECIMAL128 は None)"""
+    if pa.types.is_boolean(pa_type):
+        return np.dtype(np.bool_)       # デコーダは 1 バイト/行で書く
+    if pa.types.is_date32(pa_type):
+        return np.dtype(np.int32)
+    if pa.types.is_timestamp(pa_type):
+        return np.dtype(np.int64)
+    if pa.types.is_decimal(pa_type):
+        return None
+    return np.dtype(pa_type.to_pandas_dtype())
+
+
+def _is_varlen(pa_type: pa.DataType) -> bool:
+    return pa.types.is_string(pa_type) or pa.types.is_binary(pa_type)
+
+
+@dataclass
+class DeviceColumn:
+    """1 列分の GPU バッファ (Arrow レイアウト)"""
+    name: str
+    type: pa.DataType
+    length: int
+    data: Any                        # DeviceNDArray[uint8]
+    offsets: Any = None              # DeviceNDArray[int32] (rows + 1) 可変長のみ
+    validity: Any = None             # DeviceNDArray[uint8] (ceil(rows / 8)) NULL がある列のみ
+    null_count: int = 0
+
+    @property
+    def is_variable(self) -> bool:
+        return _is_varlen(self.type)
+
+    @property
+    def values(self):
+        """型付きの values (固定長のみ。DECIMAL128 は (rows, 2) の uint64 = 下位, 上位 64bit)"""
+        if self.is_variable:
+            raise TypeError(f"column {self.name} is variable-length; use .data and .offsets")
+        dtype = _values_dtype(self.type)
+        if dtype is None:
+            return self.data.view(np.uint64).reshape(self.length, 2)
+        return self.data.view(dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(int(b.nbytes) for b in (self.data, self.offsets, self.validity) if b is not None)
+
+    @property
+    def __cuda_array_interface__(self) -> Dict[str, Any]:
+        if self.is_variable:
+            # hasattr() での判定に応じるよう AttributeError にする
+            raise AttributeError(f"variable-length column {self.name} has no __cuda_array_interface__")
+        return self.values.__cuda_array_interface__
+
+    # ------------------------------------------------------------------
+    def to_arrow(self) -> pa.Array:
+        """ホストへコピーして pyarrow.Array にする"""
+        validity = None
+        if self.validity is not None and self.null_count:
+            validity = pa.py_buffer(self.validity.copy_to_host())
+        if self.is_variable:
+            offsets = self.offsets.copy_to_host()
+            data = self.data[: int(offsets[-1])].copy_to_host() if offsets[-1] else np.empty(0, np.uint8)
+            return pa.Array.from_buffers(
+                self.type, self.length, [validity, pa.py_buffer(offsets), pa.py_buffer(data)],
+                null_count=self.null_count,
+            )
+        host = self.data.copy_to_host()
+        if pa.types.is_boolean(self.type):
+            host = np.packbits(host.view(np.bool_), bitorder="little")
+        return pa.Array.from_buffers(self.type, self.length, [validity, pa.py_buffer(host)],
+                                     null_count=self.null_count)
+
+    @classmethod
+    def from_arrow(cls, name: str, arr: pa.Array) -> "DeviceColumn":
+        """pyarrow.Array を GPU へ転送して DeviceColumn にする (CPU デコード結果の受け渡し用)"""
+        if arr.offset:
+            arr = pa.concat_arrays([arr])    # offset 0 のバッファへ詰め直す
+        bufs = arr.buffers()
+        n = len(arr)
+        validity = None
+        if arr.null_count and bufs[0] is not None:
+            validity = cuda.to_device(np.frombuffer(bufs[0], np.uint8)[: (n + 7) // 8].copy())
+        if _is_varlen(arr.type):
+            offsets = np.frombuffer(bufs[1], np.int32)[: n + 1].copy()
+            nbytes = int(offsets[-1])
+            # 空の values も 1 バイト確保する (decode_chunk のプール確保と同じ)
+            data = np.frombuffer(bufs[2], np.uint8)[:nbytes].copy() if nbytes else np.zeros(1, np.uint8)
+            return cls(name, arr.type, n, cuda.to_device(data), cuda.to_device(offsets), validity, arr.null_count)
+        if pa.types.is_boolean(arr.type):
+            host = np.unpackbits(np.frombuffer(bufs[1], np.uint8), bitorder="little")[:n].astype(np.uint8)
+        else:
+            host = np.frombuffer(bufs[1], np.uint8)[: n * arr.type.byte_width].copy()
+        return cls(name, arr.type, n, cuda.to_device(host), None, validity, arr.null_count)
+
+    def to_cudf(self):
+        """cuDF の列 (ColumnBase) にする。バッファはコピーせず参照する (DATE32 のみ GPU 上で変換)"""
+        import cudf
+        from cudf.core.buffer import as_buffer
+        from cudf.core.column import as_column, build_column
+
+        mask = None
+        if self.validity is not None and self.null_count:
+            mask = as_buffer(_padded_bitmask(self.validity, self.length))
+        if self.is_variable:
+            # cuDF に binary 型は無いため BINARY もバイト列のまま文字列列として渡す
+            return build_column(
+                data=as_buffer(self.data), dtype=np.dtype("object"), mask=mask, size=self.length,
+                null_count=self.null_count, children=(as_column(self.offsets),),
+            )
+        if pa.types.is_decimal(self.type):
+            dtype = cudf.Decimal128Dtype(self.type.precision, self.type.scale)
+            data = self.data
+        elif pa.types.is_date32(self.type):
+            # cuDF に date 型は無いため日数 → datetime64[s] (GPU 上で 1 回変換)
+            import cupy as cp
+            data = cp.asarray(self.values).astype(cp.int64) * 86400
+            dtype = np.dtype("datetime64[s]")
+        elif pa.types.is_timestamp(self.type):
+            data = self.data
+            dtype = np.dtype(f"datetime64[{self.type.unit}]")
+        else:
+            data = self.data
+            dtype = _values_dtype(self.type)
+        return build_column(data=as_buffer(data), dtype=dtype, mask=mask, size=self.length,
+                            null_count=self.null_count)
+
+
+def _padded_bitmask(validity, rows: int):
+    """cuDF はビットマスクを 64 バイト単位で確保する前提なので、足りなければ GPU 上で詰め直す"""
+    need = (rows + 511) // 512 * 64
+    if validity.size >= need:
+        return validity
+    padded = cuda.device_array(need, dtype=np.uint8)
+    padded[validity.size:] = 0xFF
+    padded[: validity.size].copy_to_device(validity)
+    return padded
+
+
+class DeviceTable:
+    """GPU 常駐の列の組 (1 チャンク分の decode_chunk 結果)"""
+
+    def __init__(self, columns: List[DeviceColumn]):
+        lengths = {c.length for c in columns}
+        if len(lengths) > 1:
+            raise ValueError(f"columns have different lengths: {sorted(lengths)}")
+        self.columns = list(columns)
+        self.num_rows = lengths.pop() if lengths else 0
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    @property
+    def num_columns(self) -> int:
+        return len(self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self.columns)
+
+    def column(self, key) -> DeviceColumn:
+        if isinstance(key, int):
+            return self.columns[key]
+        for c in self.columns:
+            if c.name == key:
+                return c
+        raise KeyError(key)
+
+    __getitem__ = column
+
+    def __iter__(self) -> Iterator[DeviceColumn]:
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    @property
+    def schema(self) -> pa.Schema:
+        return pa.schema([pa.field(c.name, c.type) for c in self.columns])
+
+    def to_arrow(self) -> pa.RecordBatch:
+        """ホストへコピーして RecordBatch にする (検証・CPU 側への受け渡し用)"""
+        return pa.RecordBatch.from_arrays([c.to_arrow() for c in self.columns], schema=self.schema)
+
+    @classmethod
+    def from_arrow(cls, batch: pa.RecordBatch) -> "DeviceTable":
+        """RecordBatch を GPU へ転送して DeviceTable にする"""
+        return cls([DeviceColumn.from_arrow(name, arr) for name, arr in zip(batch.schema.names, batch.columns)])
+
+    def to_cudf(self):
+        """cudf.DataFrame にする (ホストを経由しない)"""
+        import cudf
+        return cudf.DataFrame({c.name: cudf.Series(c.to_cudf()) for c in self.columns})
+
+
+def concat_to_cudf(tables: List[DeviceTable]):
+    """チャンクごとの DeviceTable を 1 つの cudf.DataFrame に連結する (連結は GPU 上)"""
+    import cudf
+    frames = [t.to_cudf() for t in tables if t.num_rows]
+    if not frames:
+        return cudf.DataFrame()
+    return frames[0] if len(frames) == 1 else cudf.concat(frames, ignore_index=True)
+
+
+__all__ = ["DeviceColumn", "DeviceTable", "concat_to_cudf"]
@@ -0,0 +1,212 @@
+"""保存済み COPY BINARY ファイルからの読み込み (DB なし)
+
+``get_binary_data`` が書き出す ``output_debug.bin`` や ``COPY ... TO 'file' (FORMAT BINARY)``
+の出力など、ディスク上の COPY BINARY ファイル (単一ファイル、またはそれを並べた
+ディレクトリ) をメモリマップし、行境界揃えの ``CopyChunk`` として返すソース。
+
+* ファイルは ``np.memmap`` で開き、チャンクはそのスライス (ビュー) なので
+  Python の bytes へ読み込まない (ページキャッシュから GPU 転送用バッファへ 1 回コピーするだけ)
+* 各ファイルは独立した COPY ストリーム (ヘッダ + 行 + 終端) として扱い、
+  ファイルの先頭チャンクだけが ``header_size`` を持つ。``CopyChunk.partition`` はファイル番号
+* ``run_pipeline`` / ``decode_copy_stream`` の入力にそのまま使える。``FileSource.run`` は
+  PostgreSQL への接続なしで通常の parse / decode パイプラインを回す
+  (オフラインでの再処理や、受信を含まない再現可能なベンチマーク用)
+
+ファイルに列の型情報は無いので、ColumnMeta は引数で渡すか、``save_column_meta`` で
+書いたサイドカー (``<file>.columns.json`` / ディレクトリの ``columns.json``) から読む。
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+from dataclasses import asdict
+from typing import Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pyarrow as pa
+
+from .cpu_parse_utils import detect_pg_header_size, scan_row_boundaries
+from .pipeline import PipelineStats, run_pipeline
+from .psql_copy_stream import CopyChunk, DEFAULT_CHUNK_BYTES, MIN_CHUNK_BYTES
+from .type_map import ColumnMeta
+
+COLUMNS_SIDECAR = "columns.json"
+
+
+def save_column_meta(path: str, columns: List[ColumnMeta]) -> str:
+    """
+    ColumnMeta をサイドカー JSON に保存する
+
+    path が COPY ファイルなら ``<path>.columns.json``、ディレクトリなら
+    ``<path>/columns.json`` に書き、書いたパスを返す
+    """
+    out = os.path.join(path, COLUMNS_SIDECAR) if os.path.isdir(path) else f"{path}.{COLUMNS_SIDECAR}"
+    with open(out, "w") as f:
+        json.dump([asdict(c) for c in columns], f, indent=1)
+    return out
+
+
+def load_column_meta(path: str) -> List[ColumnMeta]:
+    """``save_column_meta`` で書いた JSON (またはその対象の COPY ファイル / ディレクトリ) を読む"""
+    if not path.endswith(".json"):
+        path = os.path.join(path, COLUMNS_SIDECAR) if os.path.isdir(path) else f"{path}.{COLUMNS_SIDECAR}"
+    with open(path) as f:
+        items = json.load(f)
+    # JSON では (precision, scale) などのタプルがリストになるので戻す (varchar(n) の長さなど int はそのまま)
+    return [ColumnMeta(**{**item, "arrow_param": _param(item["arrow_param"])}) for item in items]
+
+
+def _param(p):
+    return tuple(p) if isinstance(p, list) else p
+
+
+def _expand_paths(paths: Union[str, Sequence[str]], pattern: str) -> List[str]:
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files: List[str] = []
+    for p in map(os.fspath, paths):
+        if os.path.isdir(p):
+            files.extend(sorted(glob.glob(os.path.join(p, pattern))))
+        elif os.path.exists(p):
+            files.append(p)
+        else:
+            raise FileNotFoundError(p)
+    return files
+
+
+class FileSource:
+    """
+    COPY BINARY ファイル群をメモリマップして行境界揃えの CopyChunk を返すソース
+
+    Parameters
+    ----------
+    paths : str or list of str
+        COPY BINARY ファイル、またはそれを含むディレクトリ (pattern に合うファイルを名前順に読む)
+    columns : list of ColumnMeta, optional
+        ファイルの列。省略時は最初のパスのサイドカー JSON (``load_column_meta``) があれば使う
+    chunk_bytes : int
+        1 チャンクの目標バイト数 (1 行がこれを超える場合のみ拡張される)
+    pattern : str
+        ディレクトリから読むファイル名のパターン
+    """
+
+    def __init__(
+        self,
+        paths: Union[str, Sequence[str]],
+        columns: Optional[List[ColumnMeta]] = None,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        pattern: str = "*.bin",
+    ):
+        if chunk_bytes < MIN_CHUNK_BYTES:
+            raise ValueError(f"chunk_bytes must be >= {MIN_CHUNK_BYTES}")
+        self.files = _expand_paths(paths, pattern)
+        if not self.files:
+            raise FileNotFoundError(f"no COPY files matching {pattern!r} in {paths!r}")
+        if columns is None:
+            first = paths if isinstance(paths, (str, os.PathLike)) else paths[0]
+            try:
+                columns = load_column_meta(os.fspath(first))
+            except FileNotFoundError:
+                columns = None
+        self.columns = columns
+        self.chunk_bytes = chunk_bytes
+
+    @property
+    def nbytes(self) -> int:
+        """全ファイルの合計バイト数"""
+        return sum(os.path.getsize(f) for f in self.files)
+
+    def __repr__(self):
+        return f"FileSource({len(self.files)} files, {self.nbytes} bytes)"
+
+    def _map(self, path: str) -> Optional[np.ndarray]:
+        if os.path.getsize(path) == 0:
+            return None
+        # memmap のビューを ndarray として返す (mmap は参照が残る間有効)
+        return np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+
+    def ncols(self) -> Optional[int]:
+        """先頭行のフィールド数 (行が無ければ None)。columns との整合確認用"""
+        for path in self.files:
+            data = self._map(path)
+            if data is None:
+                continue
+            pos = detect_pg_header_size(data[:128])
+            if pos + 2 > data.size:
+                continue
+            nf = (int(data[pos]) << 8) | int(data[pos + 1])
+            if nf != 0xFFFF:
+                return nf
+        return None
+
+    def __iter__(self) -> Iterator[CopyChunk]:
+        index = 0
+        for file_index, path in enumerate(self.files):
+            for chunk in self._iter_file(path, file_index, index):
+                index += 1
+                yield chunk
+
+    def _iter_file(self, path: str, file_index: int, index: int) -> Iterator[CopyChunk]:
+        data = self._map(path)
+        if data is None:
+            return
+        size = int(data.size)
+        start = 0
+        pos = detect_pg_header_size(data[:128])
+        window = self.chunk_bytes
+        while pos < size:
+            end = min(start + window, size)
+            row_end, rows, eof = scan_row_boundaries(data, pos, end)
+            row_end, rows = int(row_end), int(rows)
+            if rows == 0 and not eof:
+                if end == size:
+                    raise ValueError(f"{path}: file ends inside a row ({size - pos} trailing bytes at offset {pos})")
+                # 1 行が window より大きい → 広げて走査し直す
+                window *= 2
+                continue
+            if rows > 0:
+                yield CopyChunk(
+                    data=data[start:row_end],
+                    header_size=pos - start,
+                    rows=rows,
+                    index=index,
+                    stream_offset=start,
+                    partition=file_index,
+                )
+                index += 1
+            if eof:
+                return
+            start = pos = row_end
+            window = self.chunk_bytes
+
+    # ------------------------------------------------------------------
+    def resolve_columns(self, columns: Optional[List[ColumnMeta]] = None) -> List[ColumnMeta]:
+        """使う ColumnMeta (引数 > サイドカー)。無い場合や先頭行のフィールド数と合わない場合は ValueError"""
+        columns = columns if columns is not None else self.columns
+        if columns is None:
+            raise ValueError("column metadata is required: pass columns= or write a sidecar with save_column_meta")
+        ncols = self.ncols()
+        if ncols is not None and ncols != len(columns):
+            raise ValueError(f"ncols mismatch: file rows have {ncols} fields, columns has {len(columns)}")
+        return columns
+
+    def run(self, sink, columns: Optional[List[ColumnMeta]] = None, **options) -> PipelineStats:
+        """
+        ファイルを ``run_pipeline`` で変換して sink へ書き出す
+
+        options は run_pipeline へそのまま渡す (backend / projection / predicate / output など)
+        """
+        columns = self.resolve_columns(columns)
+        options.setdefault("chunk_bytes", self.chunk_bytes)
+        return run_pipeline(self, columns, sink, **options)
+
+    def read_table(self, columns: Optional[List[ColumnMeta]] = None, **options) -> Optional[pa.Table]:
+        """全ファイルを変換して 1 つの pa.Table にする (行が無ければ None)"""
+        batches: List[pa.RecordBatch] = []
+        self.run(batches.append, columns, **options)
+        return pa.Table.from_batches(batches) if batches else None
+
+
+__all__ = ["FileSource", "save_column_meta", "load_column_meta", "COLUMNS_SIDECAR"]
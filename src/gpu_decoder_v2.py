@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 import warnings
 import numpy as np
@@ -11,25 +11,44 @@ import pyarrow as pa
 import pyarrow.compute as pc
 try:
     import pyarrow.cuda as pa_cuda
-    print("[gpu_decoder_v2] pyarrow.cuda imported successfully.")
     PYARROW_CUDA_AVAILABLE = True
 except ImportError:
     pa_cuda = None
-    print("[gpu_decoder_v2] pyarrow.cuda not available.")
     PYARROW_CUDA_AVAILABLE = False
 
 
 from numba import cuda
 
 from .type_map import *
+from .arrow_utils import (
+    arrow_elem_size, arrow_schema_for, arrow_type_for, build_gpu_meta_arrays, projection_indices,
+)
 from .gpu_memory_manager_v2 import GPUMemoryManagerV2
-
-from .cuda_kernels.arrow_gpu_pass1 import pass1_len_null # Use Pass 1 GPU Kernel
-from .cuda_kernels.arrow_gpu_pass2 import pass2_scatter_varlen
-from .cuda_kernels.arrow_gpu_pass2_fixed import pass2_scatter_fixed
-from .cuda_kernels.arrow_gpu_pass2_decimal128 import pass2_scatter_decimal128 # Import the new kernel
+from .device_table import DeviceColumn, DeviceTable
+from .predicate import compile_predicate, filter_rows_gpu
+
+from .cuda_kernels.arrow_gpu_pass1 import pass1_validity_bitmap, PASS1_BITMAP_THREADS
+from .cuda_kernels.arrow_gpu_pass2 import pass2_scatter_varlen, pass2_scatter_varlen_group
+from .cuda_kernels.arrow_gpu_pass2_fixed import pass2_scatter_fixed_fused
+from .cuda_kernels.arrow_gpu_pass2_decimal128 import (
+    pass2_scatter_decimal128, pass2_scatter_decimal128_multi, clear_validity_bits, clear_validity_bits_multi,
+)
 from .cuda_kernels.numeric_utils import int64_to_decimal_ascii  # noqa: F401  (import for Numba registration)
 
+_pa_cuda_context = None
+
+
+def _as_cuda_buffer(arr, lease):
+    """
+    デバイス配列を pyarrow.cuda のバッファとしてゼロコピーで包む。
+    バッファは lease を参照し続けるので、Arrow 側が破棄されるまでプールへは戻らない
+    """
+    global _pa_cuda_context
+    if _pa_cuda_context is None:
+        _pa_cuda_context = pa_cuda.Context()
+    return _pa_cuda_context.buffer_from_object(lease.wrap(arr))
+
+
 def build_validity_bitmap(valid_bool: np.ndarray) -> pa.Buffer:
     """Arrow validity bitmap (LSB=行0, 1=valid)"""
     if isinstance(valid_bool, cp.ndarray):
@@ -56,90 +75,347 @@ def _build_var_indices(columns: List[ColumnMeta]) -> np.ndarray:
     return idxs
 
 
+# ----------------------------------------------------------------------
+def run_pass1_bitmaps(field_lengths_dev, var_indices_dev, n_var: int, src_cols=None):
+    """
+    pass-1: 可変長列の長さと列ごとの validity ビットマップを GPU 上で生成
+
+    Parameters
+    ----------
+    src_cols : sequence of int, optional
+        処理する列 (field_lengths_dev の列番号, 出力順)。None なら全列。
+        var_indices_dev はこの出力列に対応する
+
+    Returns
+    -------
+    d_var_lens : DeviceNDArray[int32] (n_var, rows)
+    d_bitmaps : DeviceNDArray[uint8] (n_out, ceil(rows / 8))
+        Arrow validity ビットマップ (列ごとに連続)
+    null_counts : np.ndarray[int32] (n_out,)
+        列ごとの NULL 数 (ホストへ転送されるのはこの配列のみ)
+    """
+    rows, ncols = field_lengths_dev.shape
+    if src_cols is None:
+        src_cols = np.arange(ncols, dtype=np.int32)
+    src_cols = np.asarray(src_cols, dtype=np.int32)
+    n_out = len(src_cols)
+    bitmap_bytes = (rows + 7) // 8
+    d_var_lens = cuda.device_array((n_var, rows), dtype=np.int32)
+    d_bitmaps = cuda.device_array((n_out, bitmap_bytes), dtype=np.uint8)
+    d_null_counts = cuda.to_device(np.zeros(n_out, dtype=np.int32))
+    if n_out == 0:
+        return d_var_lens, d_bitmaps, d_null_counts.copy_to_host()
+
+    blocks_x = max(1, (bitmap_bytes + PASS1_BITMAP_THREADS - 1) // PASS1_BITMAP_THREADS)
+    pass1_validity_bitmap[(blocks_x, n_out), PASS1_BITMAP_THREADS](
+        field_lengths_dev, cuda.to_device(src_cols), var_indices_dev, d_var_lens, d_bitmaps, d_null_counts
+    )
+    return d_var_lens, d_bitmaps, d_null_counts.copy_to_host()
+
+
+# ----------------------------------------------------------------------
+# 可変長 pass-2: 平均長 (pass1 の合計バイト数 / 行数) → 1 行を担当するスレッド数
+# 短い文字列は 1 スレッド/行、長いものほど多くの lane で協調コピーする
+VARLEN_GROUP_THRESHOLDS = ((16, 1), (64, 8), (256, 16))
+VARLEN_GROUP_MAX = 32
+
+
+def choose_varlen_group(avg_len: float) -> int:
+    """平均フィールド長から 1 行あたりのスレッド数 (1 / 8 / 16 / 32) を選ぶ"""
+    for limit, group in VARLEN_GROUP_THRESHOLDS:
+        if avg_len < limit:
+            return group
+    return VARLEN_GROUP_MAX
+
+
+def _device_ptr(arr) -> int:
+    iface = getattr(arr, "__cuda_array_interface__", None) or arr.__array_interface__
+    return iface["data"][0]
+
+
+def run_pass2_varlen(raw_dev, field_off, field_len, d_offsets, d_values,
+                     total_bytes: int, threads: int = 256, group: int | None = None) -> int:
+    """
+    pass-2 (可変長) を 1 列分 launch する。group=None なら平均長から自動選択。
+    word 単位コピーには raw / values の先頭が 4 バイト境界である必要があるため、
+    揃っていなければ 1 スレッド/行にフォールバックする。
+
+    Returns
+    -------
+    int : 実際に使った 1 行あたりのスレッド数
+    """
+    rows = field_off.size
+    if group is None:
+        group = choose_varlen_group(total_bytes / rows if rows else 0.0)
+    if group > 1 and (_device_ptr(raw_dev) % 4 or _device_ptr(d_values) % 4):
+        group = 1
+
+    if group == 1:
+        blocks = (rows + threads - 1) // threads
+        pass2_scatter_varlen[blocks, threads](raw_dev, field_off, field_len, d_offsets, d_values)
+    else:
+        raw_words = raw_dev[: raw_dev.size // 4 * 4].view(np.uint32)
+        values_words = d_values[: d_values.size // 4 * 4].view(np.uint32)
+        blocks = (rows * group + threads - 1) // threads
+        pass2_scatter_varlen_group[blocks, threads](
+            raw_dev, raw_words, field_off, field_len, d_offsets, d_values, values_words, group
+        )
+    return group
+
+
+# ----------------------------------------------------------------------
+def run_pass2_decimal128(raw_dev, field_off, field_len, pa_type, d_vals, d_bitmap, threads: int = 256):
+    """
+    pass-2 (DECIMAL128) を 1 列分 launch する。d_vals (uint8, rows*16) へ
+    pa_type.scale 単位の値を書き、NULL にした行は d_bitmap のビットを落とす。
+
+    Returns
+    -------
+    (cleared, overflow) : 新たに NULL にした行数と、そのうち桁あふれの数
+    """
+    rows = field_off.size
+    blocks = (rows + threads - 1) // threads
+    d_invalid = cuda.device_array(rows, dtype=np.uint8)
+    d_counters = cuda.to_device(np.zeros(2, dtype=np.int32))
+    pass2_scatter_decimal128[blocks, threads](
+        raw_dev, field_off, field_len, pa_type.scale, pa_type.precision,
+        d_vals.view(np.uint64), d_invalid, d_counters,
+    )
+    cleared, overflow = (int(v) for v in d_counters.copy_to_host())
+    if cleared:
+        nbytes = d_bitmap.size
+        clear_validity_bits[(nbytes + threads - 1) // threads, threads](d_bitmap, d_invalid)
+    return cleared, overflow
+
+
+# ----------------------------------------------------------------------
+ARENA_ALIGN = 64  # Arrow 推奨のバッファアライメント
+
+
+def _arena_layout(rows: int, elem_sizes) -> tuple:
+    """列スロットごとの arena 内先頭バイト位置 (ARENA_ALIGN 境界) と arena の合計バイト数"""
+    dst_offsets = np.empty(len(elem_sizes), dtype=np.int64)
+    total = 0
+    for slot, esize in enumerate(elem_sizes):
+        dst_offsets[slot] = total
+        nbytes = rows * int(esize)
+        total += (nbytes + ARENA_ALIGN - 1) // ARENA_ALIGN * ARENA_ALIGN
+    return dst_offsets, total
+
+
+def _device_bytes(nbytes: int):
+    return cuda.device_array(nbytes, dtype=np.uint8)
+
+
+def run_pass2_decimal128_multi(raw_dev, field_offsets_dev, field_lengths_dev, columns: List[ColumnMeta],
+                               dec_cidx: List[int], d_bitmaps, bitmap_rows: List[int], threads: int = 256,
+                               alloc=None):
+    """
+    pass-2 (DECIMAL128): 全 DECIMAL128 列を 1 launch で 1 つの arena へ書き出す。
+    NULL にした行の validity ビットは全列分をまとめてもう 1 launch で落とす。
+
+    Parameters
+    ----------
+    dec_cidx : list of int
+        DECIMAL128 列のインデックス (field 行列上の列番号)
+    d_bitmaps : DeviceNDArray[uint8] (n_out, ceil(rows / 8))
+        pass-1 の validity ビットマップ
+    bitmap_rows : list of int
+        dec_cidx の各列に対応する d_bitmaps の行 (出力列番号)
+    alloc : callable, optional
+        nbytes → uint8 デバイス配列。arena の確保に使う (省略時は cuda.device_array)。
+        decode_chunk は ``GPUMemoryManagerV2.lease_array`` を渡してプールから借りる
+
+    Returns
+    -------
+    arena : DeviceNDArray[uint8]
+        全列分の出力 (列ごとに 64 バイト境界から rows * 16 バイト)
+    views : dict[int, DeviceNDArray[uint8]]
+        列インデックス → arena 内のその列のスライス
+    cleared, overflow : np.ndarray[int32] (n_dec,)
+        列ごとの新たに NULL にした行数と、そのうち桁あふれの数
+    """
+    rows = field_lengths_dev.shape[0]
+    n_dec = len(dec_cidx)
+    dst_offsets, total = _arena_layout(rows, [16] * n_dec)
+    arena = (alloc or _device_bytes)(max(total, 1))
+    views = {cidx: arena[dst_offsets[slot]:dst_offsets[slot] + rows * 16] for slot, cidx in enumerate(dec_cidx)}
+    if n_dec == 0:
+        return arena, views, np.zeros(0, np.int32), np.zeros(0, np.int32)
+
+    pa_types = [arrow_type_for(columns[cidx]) for cidx in dec_cidx]
+    d_invalid = cuda.device_array((n_dec, rows), dtype=np.uint8)
+    d_counters = cuda.to_device(np.zeros((n_dec, 2), dtype=np.int32))
+    blocks = (rows + threads - 1) // threads
+    pass2_scatter_decimal128_multi[(blocks, n_dec), threads](
+        raw_dev, field_offsets_dev, field_lengths_dev,
+        cuda.to_device(np.asarray(dec_cidx, dtype=np.int32)),
+        cuda.to_device(np.array([t.scale for t in pa_types], dtype=np.int32)),
+        cuda.to_device(np.array([t.precision for t in pa_types], dtype=np.int32)),
+        cuda.to_device(dst_offsets // 8), arena[: total // 8 * 8].view(np.uint64), d_invalid, d_counters,
+    )
+    counters = d_counters.copy_to_host()
+    if counters[:, 0].any():
+        nbytes = d_bitmaps.shape[1]
+        clear_validity_bits_multi[((nbytes + threads - 1) // threads, n_dec), threads](
+            d_bitmaps, cuda.to_device(np.asarray(bitmap_rows, dtype=np.int32)), d_invalid,
+        )
+    return arena, views, counters[:, 0], counters[:, 1]
+
+
+def run_pass2_fixed_fused(raw_dev, field_offsets_dev, field_lengths_dev,
+                          columns: List[ColumnMeta], fixed_cidx: List[int], threads: int = 256, alloc=None):
+    """
+    pass-2 (固定長): DECIMAL128 以外の固定長列を 1 launch で 1 つの arena へ書き出す。
+    arena は alloc (nbytes → uint8 デバイス配列, 省略時は cuda.device_array) で確保する
+
+    Returns
+    -------
+    arena : DeviceNDArray[uint8]
+        全列分の出力 (列ごとに 64 バイト境界から rows * elem_size バイト)
+    views : dict[int, DeviceNDArray[uint8]]
+        列インデックス → arena 内のその列のスライス
+    """
+    rows = field_lengths_dev.shape[0]
+    type_ids, elem_sizes, _, _ = build_gpu_meta_arrays(columns)
+
+    dst_offsets, total = _arena_layout(rows, [elem_sizes[cidx] for cidx in fixed_cidx])
+    arena = (alloc or _device_bytes)(max(total, 1))
+    if fixed_cidx:
+        blocks = (rows + threads - 1) // threads
+        pass2_scatter_fixed_fused[(blocks, len(fixed_cidx)), threads](
+            raw_dev, field_offsets_dev, field_lengths_dev,
+            cuda.to_device(np.asarray(fixed_cidx, dtype=np.int32)),
+            cuda.to_device(type_ids), cuda.to_device(elem_sizes),
+            cuda.to_device(dst_offsets), arena,
+        )
+    views = {
+        cidx: arena[dst_offsets[slot]:dst_offsets[slot] + rows * int(elem_sizes[cidx])]
+        for slot, cidx in enumerate(fixed_cidx)
+    }
+    return arena, views
+
+
 # ----------------------------------------------------------------------
 def decode_chunk(
     raw_dev: cuda.cudadrv.devicearray.DeviceNDArray,  # uint8[:]
     field_offsets_dev,  # int32[:, :]
     field_lengths_dev,  # int32[:, :]
     columns: List[ColumnMeta],
-) -> pa.RecordBatch:
+    backend: str = "gpu",
+    output: str = "arrow",
+    projection: Optional[Sequence[Union[int, str]]] = None,
+    predicate=None,
+    verbose: bool = False,
+) -> pa.RecordBatch | DeviceTable:
     """
     GPU メモリ上の COPY バイナリ解析結果を 2‑pass で Arrow RecordBatch へ変換
+
+    backend="cpu" の場合は cpu_decoder.decode_chunk_cpu (NumPy/Numba) に委譲する。
+    入力がデバイス配列ならホストへコピーしてから処理する。
+
+    output="device" の場合は Arrow を組み立てず、GPU 上の values / offsets / validity
+    バッファをそのまま持つ DeviceTable を返す (バッファの所有権ごと渡し、コピーしない)。
+
+    projection (列名または列番号のリスト) を指定すると、その列だけを (その順で) 出力する。
+    columns / field 行列は COPY ストリームの全列のままで、射影外の列は pass-1 / pass-2 の
+    対象にも出力バッファの確保対象にもならない (処理量とデバイスメモリは射影した列数に比例)。
+
+    predicate (``predicate.col`` から作った述語) を指定すると、parse 結果の上で行ごとに評価し、
+    残す行の番号を詰めた選択ベクトルで field 行列を詰め直してから pass-1 / pass-2 を行う
+    (落とした行はデコードもバッファ確保もされない)。全行が落ちた場合は 0 行の結果を返す。
+
+    verbose=True で各パスの開始・終了を表示する (既定では何も表示しない)。
     """
+    if output not in ("arrow", "device"):
+        raise ValueError(f"unknown output: {output!r} (expected 'arrow' or 'device')")
+    if backend == "cpu":
+        from .cpu_decoder import decode_chunk_cpu
+        batch = decode_chunk_cpu(raw_dev, field_offsets_dev, field_lengths_dev, columns, projection, predicate)
+        return DeviceTable.from_arrow(batch) if output == "device" else batch
+    if backend != "gpu":
+        raise ValueError(f"unknown backend: {backend!r} (expected 'gpu' or 'cpu')")
+
     rows, ncols = field_lengths_dev.shape
     if rows == 0:
         raise ValueError("rows == 0")
-
-    # ----------------------------------
-    # 1. GPU バッファ確保 (Arrow出力用) - 初期確保
-    # ----------------------------------
-    gmm = GPUMemoryManagerV2()
-    # bufs now contains offset buffers for varlen columns as well
-    # varlen: (d_values, d_nulls, d_offsets, max_len)
-    # fixed: (d_values, d_nulls, stride)
-    bufs: Dict[str, Any] = gmm.initialize_device_buffers(columns, rows)
+    if ncols != len(columns):
+        raise ValueError(f"ncols mismatch: field matrix has {ncols}, columns has {len(columns)}")
+
+    # 出力する列 (src_cidx[j] = 出力列 j の field 行列上の列番号)
+    src_cidx = projection_indices(columns, projection)
+    out_columns = [columns[cidx] for cidx in src_cidx]
+    n_out = len(out_columns)
+
+    # 行フィルタ: 選択ベクトルで field 行列を詰め直し、以降は残った行だけを処理する
+    if predicate is not None:
+        predicate = compile_predicate(predicate, columns)
+        field_offsets_dev, field_lengths_dev = filter_rows_gpu(
+            raw_dev, field_offsets_dev, field_lengths_dev, predicate)
+        rows = field_lengths_dev.shape[0]
+        if rows == 0:
+            empty = pa.RecordBatch.from_pylist([], schema=arrow_schema_for(out_columns))
+            return DeviceTable.from_arrow(empty) if output == "device" else empty
 
     # varlen_meta の準備 (Pass 2 で使用) - NUMERIC(DECIMAL128)は固定長なので除外
-    varlen_meta = []  # (col_idx, var_idx, name) # var_idx is the index within varlen columns
-    fixedlen_meta = [] # (col_idx, name)
-    for cidx, col in enumerate(columns):
+    # 以下 cidx は field 行列上の列番号、j は出力列番号 (ビットマップ / NULL 数の添字)
+    varlen_meta = []  # (col_idx, var_idx, name, out_idx) # var_idx is the index within varlen columns
+    fixedlen_meta = [] # (col_idx, name, out_idx)
+    for j, cidx in enumerate(src_cidx):
+        col = columns[cidx]
         # Check arrow_id for variable length (UTF8, BINARY)
         if col.arrow_id == UTF8 or col.arrow_id == BINARY:
-             varlen_meta.append((cidx, len(varlen_meta), col.name))
+             varlen_meta.append((cidx, len(varlen_meta), col.name, j))
         else: # Fixed length including DECIMAL128
-             fixedlen_meta.append((cidx, col.name))
+             fixedlen_meta.append((cidx, col.name, j))
+    # DECIMAL128 以外の固定長列は融合カーネルで arena へまとめて書く
+    fused_cidx = [
+        cidx for cidx, _, _ in fixedlen_meta
+        if columns[cidx].arrow_id != DECIMAL128 and arrow_elem_size(columns[cidx].arrow_id) > 0
+    ]
+    # DECIMAL128 列も全列まとめて 1 launch (列ごとの scale / precision は配列で渡す)
+    dec_meta = [(cidx, j) for cidx, _, j in fixedlen_meta if columns[cidx].arrow_id == DECIMAL128]
+    arena_cidx = set(fused_cidx) | {cidx for cidx, _ in dec_meta}
+
+    # ----------------------------------
+    # 1. GPU バッファ確保 (Arrow出力用) - 初期確保 (固定長列と DECIMAL128 列は pass-2 で arena をプールから借りる)
+    # ----------------------------------
+    gmm = GPUMemoryManagerV2(verbose=verbose)
+    # bufs now contains offset buffers for varlen columns as well
+    # varlen: (d_values, d_offsets, max_len)
+    # fixed: (d_values, stride)
+    bufs: Dict[str, Any] = gmm.initialize_device_buffers(
+        [columns[cidx] for cidx in src_cidx if cidx not in arena_cidx], rows
+    )
 
 
     # ----------------------------------
     # 2. pass‑1 len/null (GPU Kernel)
     # ----------------------------------
-    print("\n--- Running Pass 1 (len/null collection) on GPU ---")
-    var_indices_host = _build_var_indices(columns) # Still need this mapping
+    if verbose:
+        print("\n--- Running Pass 1 (len/null collection) on GPU ---")
+    var_indices_host = _build_var_indices(out_columns) # Still need this mapping
     var_indices_dev = cuda.to_device(var_indices_host)
     n_var = len(varlen_meta)
 
-    # Allocate output arrays on GPU
-    # Note: pass1_len_null expects d_nulls shape (rows, ncols)
-    # and d_var_lens shape (n_var, rows)
-    d_nulls_all = cuda.device_array((rows, ncols), dtype=np.uint8)
-    d_var_lens = cuda.device_array((n_var, rows), dtype=np.int32)
-
-    # Calculate grid/block dimensions for Pass 1 kernel
-    threads_pass1 = 256 # Or use a configurable value
-    blocks_pass1 = (rows + threads_pass1 - 1) // threads_pass1
-
-    # Launch Pass 1 kernel
-    pass1_len_null[blocks_pass1, threads_pass1](
-        field_lengths_dev, # Input: lengths calculated by Pass 0
-        var_indices_dev,   # Input: mapping from col index to varlen index
-        d_var_lens,        # Output: lengths for varlen columns
-        d_nulls_all        # Output: null bitmap (Arrow format: 0=NULL, 1=Valid)
-    )
-    cuda.synchronize()
-    print("--- Finished Pass 1 (GPU) ---")
-
-    # --- DEBUG: Check Pass 1 Output (copy from GPU) ---
-    print("\n--- After Pass 1 (GPU) ---")
-    host_nulls_all = d_nulls_all.copy_to_host() # Copy result for printing
-    print(f"d_nulls_all (first 3 rows, 5 cols):\n{host_nulls_all[:min(3, rows), :min(5, ncols)]}")
-    if n_var > 0:
-        host_var_lens = d_var_lens.copy_to_host() # Copy result for printing
-        # d_var_lens is (n_var, rows), print first 3 columns (rows) for first 5 var columns
-        print(f"d_var_lens (first 5 var cols, 3 rows):\n{host_var_lens[:min(5, n_var), :min(3, rows)]}")
-    # --- END DEBUG ---
+    # validity はビットパック済みで GPU に残し、ホストへは NULL 数 (出力列数個) のみ転送
+    d_var_lens, d_bitmaps, null_counts = run_pass1_bitmaps(field_lengths_dev, var_indices_dev, n_var, src_cidx)
+    if verbose:
+        print("--- Finished Pass 1 (GPU) ---")
 
     # ----------------------------------
     # 3. prefix‑sum offsets (GPU - CuPy) & データバッファ再確保
     # ----------------------------------
-    print("--- Running Prefix Sum (GPU - CuPy) & Reallocating Varlen Buffers ---")
+    if verbose:
+        print("--- Running Prefix Sum (GPU - CuPy) & Allocating Varlen Buffers ---")
     total_bytes_list = [] # Store total bytes for each varlen column
     values_dev_reallocated = [] # Store reallocated data buffers
 
     # Get the initially allocated offset buffers from gmm
-    # Assuming varlen tuple is (d_values, d_nulls, d_offsets, max_len)
-    initial_offset_buffers = [bufs[name][2] for _, _, name in varlen_meta]
+    # Assuming varlen tuple is (d_values, d_offsets, max_len)
+    initial_offset_buffers = [bufs[name][1] for _, _, name, _ in varlen_meta]
 
-    for v_idx, (cidx, _, name) in enumerate(varlen_meta):
+    for v_idx, (cidx, _, name, _) in enumerate(varlen_meta):
         # Calculate prefix sum using the lengths from Pass 1
         cp_len = cp.asarray(d_var_lens[v_idx]) # Lengths for this varlen column
         # Calculate offsets (including the initial 0)
@@ -153,30 +429,28 @@ def decode_chunk(
         d_offset_col[0] = 0
         d_offset_col[1:] = cp_off # Write cumsum result
 
-        # Reallocate the data buffer using the calculated total_bytes
-        new_data_buf = gmm.replace_varlen_data_buffer(name, total_bytes)
+        # values バッファはここで初めて実サイズで確保する (プール経由)
+        new_data_buf = gmm.allocate_varlen_data_buffer(name, total_bytes)
         values_dev_reallocated.append(new_data_buf)
 
-        # Debug print
-        print(f"VarCol '{name}' (v_idx={v_idx}): Total Bytes={total_bytes}, Reallocated Buffer: {new_data_buf.device_ctypes_pointer.value if new_data_buf else 'None'}")
-        # print(f"  Offsets (first 5): {d_offset_col[:min(6, rows+1)].copy_to_host()}") # Debug: check offsets
-
-    print("--- Finished Prefix Sum & Reallocation ---")
+    if verbose:
+        print("--- Finished Prefix Sum & Allocation ---")
 
 
     # ----------------------------------
     # 4. pass-2 scatter-copy per var-col (GPU Kernel)
     # ----------------------------------
-    print("--- Running Pass 2 VarLen (GPU Kernel) ---")
+    if verbose:
+        print("--- Running Pass 2 VarLen (GPU Kernel) ---")
     threads = 256
     blocks = (rows + threads - 1) // threads
 
-    for v_idx, (cidx, _, name) in enumerate(varlen_meta):
+    for v_idx, (cidx, _, name, _) in enumerate(varlen_meta):
         col_meta = columns[cidx]
         # Only run for actual variable length types
         if col_meta.arrow_id == UTF8 or col_meta.arrow_id == BINARY:
             # Get the offset buffer (already filled by prefix sum)
-            d_offset_v = bufs[name][2] # Get from the updated bufs dict
+            d_offset_v = bufs[name][1] # Get from the updated bufs dict
             # Get the reallocated data buffer
             d_values_v = bufs[name][0] # Get from the updated bufs dict
 
@@ -184,156 +458,113 @@ def decode_chunk(
             field_off_v = field_offsets_dev[:, cidx]
             field_len_v = field_lengths_dev[:, cidx]
 
-            # Call the simplified kernel
-            pass2_scatter_varlen[blocks, threads](
-                raw_dev,
-                field_off_v,
-                field_len_v,
-                d_offset_v,    # Pass the offset buffer for this column
-                d_values_v     # Pass the reallocated data buffer
+            # 平均長に応じて 1 スレッド/行 か warp 協調コピーを選ぶ
+            run_pass2_varlen(
+                raw_dev, field_off_v, field_len_v, d_offset_v, d_values_v,
+                total_bytes_list[v_idx], threads,
             )
         else:
             # This case should not happen if varlen_meta is built correctly
              warnings.warn(f"Column {name} in varlen_meta but is not UTF8/BINARY (arrow_id={col_meta.arrow_id}). Skipping varlen pass.")
 
     cuda.synchronize()
-    print("--- Finished Pass 2 VarLen ---")
+    if verbose:
+        print("--- Finished Pass 2 VarLen ---")
 
 
     # ----------------------------------
     # 4.5 pass-2 scatter-copy for fixed-length cols (GPU Kernel)
     # ----------------------------------
-    print("--- Running Pass 2 FixedLen (GPU Kernel) ---")
-    # Iterate through fixedlen_meta instead of all columns
-    for cidx, name in fixedlen_meta:
-        col = columns[cidx] # Get the full ColumnMeta
-        # fixed-length: includes INTs, FLOATs, BOOL, DATE, TS, and now DECIMAL128
-        d_vals, d_nulls_col, stride = bufs[name]
-
-        # Check for DECIMAL128 and call the specific kernel
-        if col.arrow_id == DECIMAL128:
-            print(f"Running Pass 2 kernel for DECIMAL128 column {name}")
-            pass2_scatter_decimal128[blocks, threads](
-                raw_dev,
-                field_offsets_dev[:, cidx], # Offsets for this column
-                field_lengths_dev[:, cidx], # Lengths (needed for signature, maybe useful for validation inside kernel)
-                d_vals,                     # Output buffer for this column
-                stride                      # Should be 16 for Decimal128
-            )
-        else:
-            # Call the existing generic fixed-length kernel for other types
-            pass2_scatter_fixed[blocks, threads](
-                raw_dev,
-                field_offsets_dev[:, cidx],
-                col.elem_size,
-                d_vals,
-                stride
-            )
+    if verbose:
+        print("--- Running Pass 2 FixedLen (GPU Kernel) ---")
+    # INT / FLOAT / BOOL / DATE / TS: 1 launch (エンディアン変換とエポック補正を含む)
+    _, fused_views = run_pass2_fixed_fused(
+        raw_dev, field_offsets_dev, field_lengths_dev, columns, fused_cidx, threads, alloc=gmm.lease_array,
+    )
+    for cidx, d_vals in fused_views.items():
+        col = columns[cidx]
+        bufs[col.name] = (d_vals, col.elem_size)
+
+    # DECIMAL128: 全列を 1 launch (列の scale へ丸め、NaN/Inf/桁あふれは NULL)
+    _, dec_views, cleared, overflow = run_pass2_decimal128_multi(
+        raw_dev, field_offsets_dev, field_lengths_dev, columns,
+        [cidx for cidx, _ in dec_meta], d_bitmaps, [j for _, j in dec_meta], threads, alloc=gmm.lease_array,
+    )
+    for slot, (cidx, j) in enumerate(dec_meta):
+        name = columns[cidx].name
+        bufs[name] = (dec_views[cidx], 16)
+        null_counts[j] += cleared[slot]
+        if overflow[slot]:
+            warnings.warn(f"{overflow[slot]} values of DECIMAL column {name} overflowed and were set to NULL.")
     cuda.synchronize()
-    print("--- Finished Pass 2 FixedLen ---")
-
-    # --- DEBUG: Check fixed-length buffer content after kernel ---
-    try:
-        target_col_name = "lo_linenumber" # Example: Check this column
-        if target_col_name in bufs:
-            d_vals_check, _, stride_check = bufs[target_col_name]
-            print(f"\n--- DEBUG: Content of '{target_col_name}' buffer after pass2_fixed (first {min(rows, 5)} rows) ---")
-            # Copy the relevant part of the buffer to host
-            bytes_to_copy = min(rows, 5) * stride_check
-            host_vals_check = d_vals_check[:bytes_to_copy].copy_to_host()
-            # Print raw bytes and interpreted values (assuming int32 for lo_linenumber)
-            for r in range(min(rows, 5)):
-                offset = r * stride_check
-                raw_bytes = host_vals_check[offset : offset + stride_check]
-                # Interpret as little-endian int32 (adjust type if needed)
-                try:
-                    # Read only the first 4 bytes as int32 (elem_size for lo_linenumber is 4)
-                    interpreted_val = np.frombuffer(raw_bytes[:4], dtype=np.int32)[0]
-                except IndexError:
-                    interpreted_val = "Error reading bytes"
-                hex_str = " ".join(f"{b:02x}" for b in raw_bytes)
-                print(f"Row {r}: Bytes=[{hex_str}] Interpreted(int32)={interpreted_val}")
-        else:
-            print(f"\n--- DEBUG: Column '{target_col_name}' not found in bufs for checking ---")
-    except Exception as e:
-        print(f"\n--- DEBUG: Error during buffer check: {e} ---")
-    # --- END DEBUG ---
+    if verbose:
+        print("--- Finished Pass 2 FixedLen ---")
 
 
+    # ----------------------------------
+    # 5a. GPU 常駐出力: バッファをそのまま DeviceTable へ渡す
+    # ----------------------------------
+    if output == "device":
+        varlen_pos = {j: v for _, v, _, j in varlen_meta}
+        device_columns = []
+        for j, col in enumerate(out_columns):
+            null_count = int(null_counts[j])
+            entry = bufs[col.name]
+            if j in varlen_pos:
+                data = entry[0][: max(total_bytes_list[varlen_pos[j]], 1)]
+                offsets = entry[1]
+            else:
+                data, offsets = entry[0], None
+            device_columns.append(DeviceColumn(
+                col.name, arrow_type_for(col), rows, data, offsets,
+                d_bitmaps[j] if null_count else None, null_count,
+            ))
+        # バッファは DeviceTable が所有するのでプールから切り離す
+        gmm.detach()
+        return DeviceTable(device_columns)
+
     # ----------------------------------
     # 5. Arrow RecordBatch 組立 (Zero-Copy where possible)
     # ----------------------------------
-    print("--- Assembling Arrow RecordBatch (Zero-Copy Attempt) ---")
+    if verbose:
+        print("--- Assembling Arrow RecordBatch (Zero-Copy Attempt) ---")
     arrays = []
-    # Get the full null bitmap from GPU once
-    # host_nulls_all was already copied for debugging, reuse it.
-    # If not debugging, copy here: host_nulls_all = d_nulls_all.copy_to_host()
+    # ゼロコピーで包むバッファはリースに移し、RecordBatch が破棄された時点でプールへ返却する
+    lease = gmm.lease() if PYARROW_CUDA_AVAILABLE else None
 
-    for cidx, col in enumerate(columns):
-        print(f"Assembling column: {col.name} (Arrow ID: {col.arrow_id}, IsVar: {col.is_variable})")
+    for j, col in enumerate(out_columns):
         # --- 1. Get Validity Buffer ---
-        # Get the boolean mask (True=valid) for this column from the host copy
-        boolean_mask_np = (host_nulls_all[:, cidx] == 1)
-        null_count = rows - np.count_nonzero(boolean_mask_np)
-        # Build the Arrow validity bitmap buffer (on host for now)
-        # build_validity_bitmap handles contiguous array conversion
-        try:
-            validity_buffer = build_validity_bitmap(boolean_mask_np)
-        except Exception as e_vb:
-            print(f"Error building validity bitmap for {col.name}: {e_vb}")
-            arrays.append(pa.nulls(rows)) # Fallback
-            continue
+        # NULL が無い列はビットマップ不要。ある列は GPU 上のビットマップをそのまま包む
+        null_count = int(null_counts[j])
+        if null_count == 0:
+            validity_buffer = None
+        elif PYARROW_CUDA_AVAILABLE:
+            validity_buffer = _as_cuda_buffer(d_bitmaps[j], lease)
+        else:
+            # ceil(rows / 8) バイトのみのコピー
+            validity_buffer = pa.py_buffer(d_bitmaps[j].copy_to_host())
 
         # --- 2. Determine Arrow Type ---
-        pa_type = None
-        if col.arrow_id == DECIMAL128:
-            # Precision/scale should be in col.arrow_param from meta_fetch
-            precision, scale = col.arrow_param or (38, 0)
-            if not (1 <= precision <= 38):
-                 warnings.warn(f"Invalid precision {precision} for DECIMAL column {col.name}. Using (38, 0).")
-                 precision, scale = 38, 0
-            pa_type = pa.decimal128(precision, scale)
-        elif col.arrow_id == UTF8: pa_type = pa.string()
-        elif col.arrow_id == BINARY: pa_type = pa.binary()
-        elif col.arrow_id == INT16: pa_type = pa.int16()
-        elif col.arrow_id == INT32: pa_type = pa.int32()
-        elif col.arrow_id == INT64: pa_type = pa.int64()
-        elif col.arrow_id == FLOAT32: pa_type = pa.float32()
-        elif col.arrow_id == FLOAT64: pa_type = pa.float64()
-        elif col.arrow_id == BOOL: pa_type = pa.bool_() # Assuming stored as 1 byte in GPU buffer
-        elif col.arrow_id == DATE32: pa_type = pa.date32()
-        elif col.arrow_id == TS64_US:
-            # Handle timezone explicitly using arrow_param if available
-            tz_info = col.arrow_param # Expects None or a timezone string
-            if tz_info is not None and not isinstance(tz_info, str):
-                 warnings.warn(f"Invalid timezone info in arrow_param for {col.name}: {tz_info}. Ignoring.")
-                 tz_info = None
-            # NOTE: meta_fetch.py currently does not populate arrow_param with timezone.
-            # This code assumes it might in the future.
-            print(f"Timestamp column {col.name}: using timezone '{tz_info}' from arrow_param.")
-            pa_type = pa.timestamp('us', tz=tz_info)
-        else: # Includes UNKNOWN
-            warnings.warn(f"Unhandled arrow_id {col.arrow_id} for column {col.name}. Falling back to binary.")
-            pa_type = pa.binary() # Fallback to binary
+        pa_type = arrow_type_for(col)
 
         # --- 3. Get Data/Offset Buffers (GPU Pointers) ---
         arr = None
         try:
             if col.is_variable:
                 # Get buffers from the potentially updated bufs dict
-                # Tuple: (d_values, d_nulls, d_offsets, max_len)
-                if col.name not in bufs or len(bufs[col.name]) != 4:
+                # Tuple: (d_values, d_offsets, max_len)
+                if col.name not in bufs or len(bufs[col.name]) != 3:
                      raise ValueError(f"Variable length buffer tuple not found or invalid for {col.name}")
                 d_values_col = bufs[col.name][0] # Reallocated data buffer
-                d_offsets_col = bufs[col.name][2] # Offset buffer
+                d_offsets_col = bufs[col.name][1] # Offset buffer
 
                 if d_values_col is None or d_offsets_col is None:
                      raise ValueError(f"Missing data or offset buffer for varlen column {col.name}")
 
                 # Wrap GPU buffers for PyArrow
                 if PYARROW_CUDA_AVAILABLE:
-                    pa_offset_buf = pa_cuda.as_cuda_buffer(d_offsets_col)
-                    pa_data_buf = pa_cuda.as_cuda_buffer(d_values_col)
+                    pa_offset_buf = _as_cuda_buffer(d_offsets_col, lease)
+                    pa_data_buf = _as_cuda_buffer(d_values_col, lease)
                 else:
                     # Fallback: Copy to host if pyarrow.cuda is not available
                     warnings.warn("pyarrow.cuda not available. Copying varlen data/offsets to host for Arrow assembly.")
@@ -351,11 +582,11 @@ def decode_chunk(
 
             else: # Fixed-width
                 # Get buffer from bufs dict
-                # Tuple: (d_values, d_nulls, stride)
-                if col.name not in bufs or len(bufs[col.name]) != 3:
+                # Tuple: (d_values, stride)
+                if col.name not in bufs or len(bufs[col.name]) != 2:
                      raise ValueError(f"Fixed length buffer tuple not found or invalid for {col.name}")
                 d_values_col = bufs[col.name][0]
-                stride = bufs[col.name][2]
+                stride = bufs[col.name][1]
                 expected_item_size = pa_type.byte_width if hasattr(pa_type, 'byte_width') else stride # Use stride if byte_width not available (e.g., bool)
 
                 if d_values_col is None:
@@ -366,7 +597,7 @@ def decode_chunk(
 
                 # Wrap GPU buffer or copy if needed
                 if PYARROW_CUDA_AVAILABLE and is_contiguous:
-                    pa_data_buf = pa_cuda.as_cuda_buffer(d_values_col)
+                    pa_data_buf = _as_cuda_buffer(d_values_col, lease)
                 else:
                     if not is_contiguous:
                         warnings.warn(f"Copying fixed-length column {col.name} to host due to stride ({stride} != {expected_item_size}).")
@@ -426,20 +657,27 @@ def decode_chunk(
                      # Fallback to host copy for unsupported types
                      host_vals_np = d_values_col.copy_to_host()
                      np_dtype = pa_type.to_pandas_dtype()
-                     arr = pa.array(host_vals_np.view(np_dtype), type=pa_type, mask=~boolean_mask_np)
+                     host_bits = d_bitmaps[j].copy_to_host()
+                     null_mask = np.unpackbits(host_bits, bitorder='little')[:rows] == 0
+                     arr = pa.array(host_vals_np.view(np_dtype), type=pa_type, mask=null_mask)
 
 
         except Exception as e_assembly:
-            print(f"Error assembling Arrow array for column {col.name} (type {pa_type}): {e_assembly}")
+            warnings.warn(f"Error assembling Arrow array for column {col.name} (type {pa_type}): {e_assembly}")
             arr = pa.nulls(rows, type=pa_type if pa_type else pa.null()) # Fallback
 
         if arr is None: # Should not happen with fallbacks, but as a safeguard
-            print(f"Array creation failed unexpectedly for {col.name}. Creating null array.")
+            warnings.warn(f"Array creation failed unexpectedly for {col.name}. Creating null array.")
             arr = pa.nulls(rows, type=pa_type if pa_type else pa.null())
 
         arrays.append(arr)
 
-    batch = pa.RecordBatch.from_arrays(arrays, [c.name for c in columns])
-    print("--- Finished Arrow Assembly ---")
+    batch = pa.RecordBatch.from_arrays(arrays, [c.name for c in out_columns])
+    # ホストへコピーした場合はバッファをすぐにプールへ返却して次のバッチで再利用する。
+    # ゼロコピーの場合は RecordBatch のバッファが参照するリースが、破棄時に返却する
+    if lease is None:
+        gmm.release()
+    if verbose:
+        print("--- Finished Arrow Assembly ---")
     return batch
 __all__ = ["decode_chunk"]
@@ -19,6 +19,7 @@ from .arrow_utils import (
     arrow_elem_size,
     build_gpu_meta_arrays,
 )
+from .gpu_memory_pool import DeviceBufferPool, PoolLease, get_default_pool, size_class
 
 
 # ----------------------------------------------------------------------
@@ -27,18 +28,46 @@ from .arrow_utils import (
 class GPUMemoryManagerV2:
     """
     Arrow ColumnMeta をもとに GPU バッファを確保する軽量クラス
+
+    可変長列は 2 段階で確保する:
+
+    1. ``initialize_device_buffers``: offsets のみ確保 (values は空配列)
+    2. ``allocate_varlen_data_buffer``: pass-1 の prefix-sum で合計バイト数が
+       判明してから values を確保 (サイズクラス別プールから再利用)
+
+    validity は pass-1 のビットマップ (``gpu_decoder_v2.run_pass1_bitmaps``) を使うので、
+    列ごとの NULL フラグ配列は確保しない。
+
+    すべてのバッファ (values / offsets) はサイズクラス別プールから借りる。
+    バッチの結果を使い終えたら ``release()`` でプールへ返却し、Arrow へゼロコピーで
+    渡した場合は ``lease()`` で得た ``PoolLease`` を Arrow のバッファに持たせて、
+    RecordBatch が破棄された時点で返却する (``detach()`` は所有権を手放すだけで
+    プールへは戻らない)。次の ``initialize_device_buffers`` は
+    返却されていない前回分を自動で ``release()`` する。
+
+    ``device_bytes`` / ``peak_device_bytes`` はこのマネージャ経由の確保量
+    (サイズクラス換算)。
     """
 
-    def __init__(self):
+    def __init__(self, pool: DeviceBufferPool | None = None, verbose: bool = True):
+        self.pool = pool if pool is not None else get_default_pool()
+        self._pooled = {}          # 列名 → プールから借りた values バッファ
+        self._leases = []          # プールから借りたその他のバッファ (offsets / 固定長 values)
+        self._allocated_buffers = {}
+        self.device_bytes = 0
+        self.peak_device_bytes = 0
         try:
             # 既存コンテキストがあれば流用
             try:
                 cuda.current_context()
-                print("[GPUMemoryManagerV2] existing CUDA context")
+                if verbose:
+                    print("[GPUMemoryManagerV2] existing CUDA context")
             except cuda.cudadrv.error.CudaSupportError:
                 cuda.select_device(0)
-                print("[GPUMemoryManagerV2] new CUDA context created")
-            self.print_gpu_memory_info()
+                if verbose:
+                    print("[GPUMemoryManagerV2] new CUDA context created")
+            if verbose:
+                self.print_gpu_memory_info()
         except Exception as e:
             raise RuntimeError(f"CUDA init failed: {e}") from e
 
@@ -57,7 +86,9 @@ class GPUMemoryManagerV2:
         -------
         dict
           {
-            '<colname>': device_array / (offsets, values, nulls) tuple for varlen,
+            '<colname>': (values, stride) for fixed /
+                         (values, offsets, max_len) for varlen
+                         (varlen の values は allocate_varlen_data_buffer まで空配列),
             'type_ids': np.ndarray[int32],
             'elem_sizes': np.ndarray[int32],
             'param1': np.ndarray[int32],
@@ -66,29 +97,29 @@ class GPUMemoryManagerV2:
         """
         type_ids, elem_sizes, param1, param2 = build_gpu_meta_arrays(columns)
 
+        # 前回分のバッファは辞書ごと差し替わるので、プール分を返却して計上をリセット
+        self.release()
+        self.device_bytes = 0
         buffers: Dict[str, Any] = {}
 
         # 固定長 & 可変長の確保
         for meta in columns:
             aid = meta.arrow_id
             if aid in (UTF8, BINARY):
-                # 可変長列: 現時点では単純に rows * max_len の連続バッファ
-                # 長さは param1 if set else 256
+                # 可変長列: values は合計長が分かるまで確保しない (空配列を置いておく)
+                # max_len は参考値として保持 (param1 if set else 256)
                 max_len = meta.arrow_param or 256
-                total_bytes = rows * max_len
 
                 try:
-                    # Initial allocation with max_len (will be replaced later)
-                    d_values = cuda.device_array(total_bytes, dtype=np.uint8)
-                    d_nulls = cuda.device_array(rows, dtype=np.uint8)
+                    d_values = cuda.device_array(0, dtype=np.uint8)
                     # Allocate offset buffer (rows + 1 for Arrow standard)
-                    d_offsets = cuda.device_array(rows + 1, dtype=np.int32)
+                    d_offsets = self._device_array(rows + 1, np.int32)
                 except CudaAPIError as e:
                     self._cleanup_partial(buffers)
                     raise RuntimeError(f"GPU alloc failed (varlen {meta.name}): {e}") from e
 
-                # Store all three buffers + initial max_len
-                buffers[meta.name] = (d_values, d_nulls, d_offsets, max_len)
+                # Store both buffers + initial max_len
+                buffers[meta.name] = (d_values, d_offsets, max_len)
 
             else:
                 esize = arrow_elem_size(aid)
@@ -107,16 +138,15 @@ class GPUMemoryManagerV2:
                     alloc_size = esize
                     total_bytes = rows * esize
                 try:
-                    d_values = cuda.device_array(total_bytes, dtype=np.uint8)
-                    d_nulls = cuda.device_array(rows, dtype=np.uint8)
+                    d_values = self._device_array(total_bytes, np.uint8)
                 except CudaAPIError as e:
                     self._cleanup_partial(buffers)
                     raise RuntimeError(f"GPU alloc failed (fixed {meta.name}): {e}") from e
 
-                # 可変長列と同じく3要素タプル（stride=実際の確保サイズ）として統一
+                # stride=実際の確保サイズ
                 # このstrideはpass2_scatter_fixed中での行アドレス計算に使用される
-                # For fixed-length, store (values, nulls, stride)
-                buffers[meta.name] = (d_values, d_nulls, alloc_size)
+                # For fixed-length, store (values, stride)
+                buffers[meta.name] = (d_values, alloc_size)
 
         # メタ配列はホスト側 numpy で保持 (caller が必要に応じて GPU 転送)
         buffers["type_ids"] = type_ids
@@ -129,16 +159,74 @@ class GPUMemoryManagerV2:
 
         return buffers
 
+    def allocate_varlen_data_buffer(self, column_name: str, total_bytes: int):
+        """
+        可変長列の values バッファを実サイズ (pass-1 の合計バイト数) で確保し、
+        内部のバッファ辞書を更新する。確保はプール経由で、既に確保済みなら返却してから借り直す。
+        """
+        if column_name not in self._allocated_buffers:
+            raise ValueError(f"Column '{column_name}' not found in allocated buffers.")
+        current_tuple = self._allocated_buffers[column_name]
+        if len(current_tuple) != 3: # Should be (d_values, d_offsets, max_len)
+            raise TypeError(f"Buffer entry for '{column_name}' is not a variable-length tuple.")
+
+        old = self._pooled.pop(column_name, None)
+        if old is not None:
+            self._release_to_pool(old)
+        new_data_buffer = self.pool.acquire(max(1, total_bytes))
+        self._pooled[column_name] = new_data_buffer
+        self._account(size_class(new_data_buffer.size))
+
+        self._allocated_buffers[column_name] = (new_data_buffer, current_tuple[1], current_tuple[2])
+        return new_data_buffer
+
+    def lease_array(self, nbytes: int):
+        """
+        uint8 デバイス配列をプールから借りる (固定長列の arena など)。
+        返却 / 切り離しは他のバッファと同じく ``release`` / ``detach`` でまとめて行う
+        """
+        return self._device_array(nbytes, np.uint8)
+
+    def release(self):
+        """プールから借りたバッファをすべて返却する (バッチの結果をホストへコピー済みの場合など)"""
+        for buf in list(self._pooled.values()) + self._leases:
+            self._release_to_pool(buf)
+        self._pooled.clear()
+        self._leases.clear()
+
+    def lease(self) -> PoolLease:
+        """
+        プールから借りたバッファの所有権を PoolLease へ移す (Arrow へゼロコピーで渡す場合)。
+        リースが破棄される (``PoolLease.wrap`` で包んだバッファを参照するものが無くなる) と
+        バッファはプールへ返却される
+        """
+        bufs = list(self._pooled.values()) + self._leases
+        for buf in bufs:
+            self.device_bytes -= size_class(buf.size)
+        self._pooled.clear()
+        self._leases.clear()
+        return PoolLease(self.pool, bufs)
+
+    def detach(self):
+        """プールから借りたバッファの所有権を手放す (寿命をプールで管理できない DeviceTable へ渡した場合)"""
+        for buf in list(self._pooled.values()) + self._leases:
+            self.device_bytes -= size_class(buf.size)
+            self.pool.detach(buf)
+        self._pooled.clear()
+        self._leases.clear()
+
     def replace_varlen_data_buffer(self, column_name: str, new_size: int):
         """
         指定された可変長列のデータバッファを指定サイズで再確保し、
         内部のバッファ辞書を更新する。
+
+        .. note:: プールを使わず毎回確保する旧 API。``allocate_varlen_data_buffer`` を使うこと。
         """
         if column_name not in self._allocated_buffers:
             raise ValueError(f"Column '{column_name}' not found in allocated buffers.")
 
         current_tuple = self._allocated_buffers[column_name]
-        if len(current_tuple) != 4: # Should be (d_values, d_nulls, d_offsets, max_len)
+        if len(current_tuple) != 3: # Should be (d_values, d_offsets, max_len)
              raise TypeError(f"Buffer entry for '{column_name}' is not a variable-length tuple.")
 
         # old_data_buffer = current_tuple[0] # No need to explicitly free with Numba's context management?
@@ -152,7 +240,7 @@ class GPUMemoryManagerV2:
             raise RuntimeError(f"GPU re-allocation failed for varlen data buffer '{column_name}': {e}") from e
 
         # Update the buffer dictionary with the new data buffer
-        self._allocated_buffers[column_name] = (new_data_buffer, current_tuple[1], current_tuple[2], current_tuple[3])
+        self._allocated_buffers[column_name] = (new_data_buffer, current_tuple[1], current_tuple[2])
         print(f"[GPUMemoryManagerV2] Reallocation successful for '{column_name}'.")
         # Return the new buffer for convenience, although the internal dict is updated
         return new_data_buffer
@@ -161,6 +249,21 @@ class GPUMemoryManagerV2:
     # ------------------------
     # helpers
     # ------------------------
+    def _account(self, nbytes: int):
+        self.device_bytes += int(nbytes)
+        self.peak_device_bytes = max(self.peak_device_bytes, self.device_bytes)
+
+    def _device_array(self, n: int, dtype):
+        itemsize = np.dtype(dtype).itemsize
+        raw = self.pool.acquire(n * itemsize)
+        self._leases.append(raw)
+        self._account(size_class(raw.size))
+        return raw if itemsize == 1 else raw.view(dtype)
+
+    def _release_to_pool(self, buf):
+        self.device_bytes -= size_class(buf.size)
+        self.pool.release(buf)
+
     @staticmethod
     def _dtype_for_size(esize: int):
         if esize == 1:
@@ -0,0 +1,336 @@
+"""GPU デバイスメモリのサイズクラス別プール
+
+可変長列の values バッファのように「バッチごとにサイズが少しずつ違う」確保を
+サイズクラスに丸めて再利用し、バッチを繰り返しても cudaMalloc / cudaFree を
+毎回発生させないためのプール。
+
+サイズクラス
+-------------
+* MIN_CLASS_BYTES 以下は MIN_CLASS_BYTES
+* それ以上は 2 の冪 p ごとに p/8 刻み (丸めによる無駄は最大 12.5%)
+
+キャッシュの上限 (high-water mark)
+----------------------------------
+返却で ``bytes_cached`` が ``max_cached_bytes`` を超えたら、大きいサイズクラスから
+ブロックを解放して上限以下に戻す。既定値は環境変数 ``GPUPASER_POOL_MAX_CACHED_MB``
+(未設定なら 1024MB, 0 以下で無制限)。
+
+CuPy との共有 (Numba EMM プラグイン)
+------------------------------------
+``CupyNumbaMemoryManager`` は Numba の External Memory Management プラグインで、
+Numba のデバイス確保 (``cuda.device_array`` など、このプールのブロックを含む) を
+CuPy のメモリプールから行う。CuPy と Numba が同じプールを共有するので、
+片方が解放した領域をもう片方が cudaMalloc なしで再利用できる。
+登録はプロセス全体の Numba アロケータを差し替えるため opt-in で、import だけでは
+登録しない。``use_cupy_pool_for_numba()`` を最初の GPU 確保より前に明示的に呼ぶ
+(``PgGpuProcessor(share_cupy_pool=True)`` / CLI の ``--share-cupy-pool``、
+または環境変数 ``GPUPASER_CUPY_POOL=1`` で PgGpuProcessor の既定が有効になる)。
+"""
+
+from __future__ import annotations
+
+import ctypes
+import os
+import threading
+import weakref
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numba import cuda
+from numba.cuda.cudadrv.driver import CudaAPIError
+
+try:
+    import cupy as cp
+    CUPY_AVAILABLE = True
+except ImportError:
+    cp = None
+    CUPY_AVAILABLE = False
+
+try:
+    from numba.cuda import GetIpcHandleMixin, HostOnlyCUDAMemoryManager, MemoryInfo, MemoryPointer
+    NUMBA_EMM_AVAILABLE = True
+except ImportError:   # CUDA シミュレータには EMM が無い
+    NUMBA_EMM_AVAILABLE = False
+
+MIN_CLASS_BYTES = 512
+CLASS_STEPS = 8
+DEFAULT_MAX_CACHED_BYTES = int(os.environ.get("GPUPASER_POOL_MAX_CACHED_MB", "1024")) * 1024 ** 2
+SHARE_CUPY_POOL = os.environ.get("GPUPASER_CUPY_POOL", "0") == "1"
+
+
+def size_class(nbytes: int) -> int:
+    """nbytes 以上の最小のサイズクラス (バイト数) を返す"""
+    if nbytes <= MIN_CLASS_BYTES:
+        return MIN_CLASS_BYTES
+    p = 1 << ((int(nbytes) - 1).bit_length() - 1)   # nbytes 未満の最大の 2 の冪
+    step = max(p // CLASS_STEPS, 1)
+    return (nbytes + step - 1) // step * step
+
+
+class DeviceBufferPool:
+    """
+    uint8 DeviceNDArray をサイズクラス単位で貸し出し、返却分を再利用するプール
+
+    Attributes
+    ----------
+    bytes_in_use : int
+        貸し出し中ブロックの合計 (サイズクラス換算)
+    bytes_cached : int
+        返却済みで再利用待ちのブロックの合計
+    peak_bytes : int
+        bytes_in_use + bytes_cached の最大値
+    hits, misses : int
+        再利用できた / 新規確保した回数
+    trimmed_bytes : int
+        上限超過 / ``trim`` で解放したブロックの累計
+
+    Parameters
+    ----------
+    max_cached_bytes : int, optional
+        再利用待ちブロックの上限。None なら DEFAULT_MAX_CACHED_BYTES、0 以下なら無制限
+    """
+
+    def __init__(self, max_cached_bytes: int | None = None):
+        self._free: Dict[int, List] = {}
+        self._lent: Dict[int, Tuple[object, object, int]] = {}  # id(view) → (view, block, cls)
+        self._lock = threading.RLock()   # PoolLease の返却は GC (任意のスレッド・任意の時点) から呼ばれる
+        self.max_cached_bytes = DEFAULT_MAX_CACHED_BYTES if max_cached_bytes is None else int(max_cached_bytes)
+        self.bytes_in_use = 0
+        self.bytes_cached = 0
+        self.peak_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.trimmed_bytes = 0
+
+    # ------------------------
+    # public
+    # ------------------------
+    def acquire(self, nbytes: int):
+        """
+        nbytes バイトの uint8 デバイス配列を返す (サイズクラスのブロックの先頭スライス)。
+        使い終わったら ``release`` で返却する。
+        """
+        cls = size_class(max(int(nbytes), 1))
+        with self._lock:
+            free = self._free.get(cls)
+            if free:
+                block = free.pop()
+                self.bytes_cached -= cls
+                self.hits += 1
+            else:
+                block = None
+                self.misses += 1
+        if block is None:
+            block = self._alloc(cls)
+
+        view = block[:nbytes]
+        with self._lock:
+            self.bytes_in_use += cls
+            self.peak_bytes = max(self.peak_bytes, self.bytes_in_use + self.bytes_cached)
+            self._lent[id(view)] = (view, block, cls)
+        return view
+
+    def release(self, view) -> None:
+        """acquire で得た配列を返却する (以後その配列に触れてはならない)"""
+        with self._lock:
+            _, block, cls = self._lent.pop(id(view))
+            self.bytes_in_use -= cls
+            self.bytes_cached += cls
+            self._free.setdefault(cls, []).append(block)
+            if 0 < self.max_cached_bytes < self.bytes_cached:
+                self._trim_locked(self.max_cached_bytes)
+
+    def detach(self, view) -> None:
+        """
+        acquire で得た配列の所有権を呼び出し側へ移す (プールには戻さない)。
+        Arrow へゼロコピーで渡したバッファなど、寿命をプールが管理できない場合に使う。
+        """
+        with self._lock:
+            _, _, cls = self._lent.pop(id(view))
+            self.bytes_in_use -= cls
+
+    def trim(self, target_bytes: int = 0) -> int:
+        """再利用待ちブロックを大きいサイズクラスから解放し bytes_cached <= target_bytes にする。解放量を返す"""
+        with self._lock:
+            return self._trim_locked(target_bytes)
+
+    def clear(self) -> None:
+        """再利用待ちのブロックをすべて解放する"""
+        self.trim(0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "bytes_in_use": self.bytes_in_use,
+            "bytes_cached": self.bytes_cached,
+            "peak_bytes": self.peak_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "trimmed_bytes": self.trimmed_bytes,
+        }
+
+    # ------------------------
+    # helpers
+    # ------------------------
+    def _trim_locked(self, target_bytes: int) -> int:
+        freed = 0
+        for cls in sorted(self._free, reverse=True):
+            blocks = self._free[cls]
+            while blocks and self.bytes_cached > target_bytes:
+                blocks.pop()    # 参照が切れると Numba (または EMM プラグイン) が解放する
+                self.bytes_cached -= cls
+                freed += cls
+            if not blocks:
+                del self._free[cls]
+            if self.bytes_cached <= target_bytes:
+                break
+        self.trimmed_bytes += freed
+        return freed
+
+    def _alloc(self, nbytes: int):
+        try:
+            return cuda.device_array(nbytes, dtype=np.uint8)
+        except CudaAPIError:
+            # キャッシュを手放してから 1 度だけ再試行
+            self.clear()
+            try:
+                return cuda.device_array(nbytes, dtype=np.uint8)
+            except CudaAPIError as e:
+                raise RuntimeError(f"GPU alloc failed ({nbytes} bytes) even after releasing the pool cache: {e}") from e
+
+
+class PoolLease:
+    """
+    プールから借りたバッファ群を、利用側の寿命が尽きたときにまとめて返却するリース
+
+    ``wrap(arr)`` はこのリースへの参照を持ち、arr と同じ ``__cuda_array_interface__`` を
+    公開するオブジェクトを返す。pyarrow.cuda の ``Context.buffer_from_object`` はそれを
+    base として保持するので、ゼロコピーで組み立てた RecordBatch が破棄されると
+    リースも破棄され、バッファはプールへ戻る (``release()`` で明示的にも返却できる)。
+    """
+
+    def __init__(self, pool: DeviceBufferPool, views):
+        views = list(views)
+        self.nbytes = sum(size_class(v.size) for v in views)
+        self._finalizer = weakref.finalize(self, _release_views, pool, views)
+
+    def wrap(self, arr) -> "_LeasedArray":
+        return _LeasedArray(arr, self)
+
+    def release(self) -> None:
+        self._finalizer()
+
+    @property
+    def alive(self) -> bool:
+        """まだプールへ返却されていなければ True"""
+        return self._finalizer.alive
+
+
+def _release_views(pool: DeviceBufferPool, views) -> None:
+    for v in views:
+        pool.release(v)
+
+
+class _LeasedArray:
+    """PoolLease を参照し続けるデバイス配列のラッパ (CUDA Array Interface のみ公開)"""
+
+    __slots__ = ("_arr", "_lease")
+
+    def __init__(self, arr, lease: PoolLease):
+        self._arr = arr
+        self._lease = lease
+
+    @property
+    def __cuda_array_interface__(self):
+        return self._arr.__cuda_array_interface__
+
+
+_default_pool: DeviceBufferPool | None = None
+
+
+def get_default_pool() -> DeviceBufferPool:
+    """プロセス共通のプール (バッチをまたいで再利用するため decode_chunk が使う)"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = DeviceBufferPool()
+    return _default_pool
+
+
+# ----------------------------------------------------------------------
+#  Numba EMM プラグイン (CuPy のメモリプールを Numba と共有)
+# ----------------------------------------------------------------------
+if NUMBA_EMM_AVAILABLE and CUPY_AVAILABLE:
+
+    class CupyNumbaMemoryManager(GetIpcHandleMixin, HostOnlyCUDAMemoryManager):
+        """Numba のデバイス確保を ``cupy.get_default_memory_pool()`` から行う EMM プラグイン"""
+
+        def initialize(self):
+            super().initialize()
+            self._mp = cp.get_default_memory_pool()
+            self._allocations = {}   # ptr → cupy MemoryPointer (Numba 側が生きている間保持)
+
+        def memalloc(self, size):
+            cp_mp = self._mp.malloc(size)
+            ptr = int(cp_mp.ptr)
+            self._allocations[ptr] = cp_mp
+            allocations = self._allocations
+
+            def finalizer():
+                # cupy MemoryPointer を手放すとブロックは CuPy のプールへ戻る
+                allocations.pop(ptr, None)
+
+            return MemoryPointer(cuda.current_context(), ctypes.c_void_p(ptr), size, finalizer=finalizer)
+
+        def get_memory_info(self):
+            free_b, total_b = cp.cuda.runtime.memGetInfo()
+            # CuPy プールにキャッシュされた領域も Numba からは空きとして見せる
+            return MemoryInfo(free=free_b + self._mp.free_bytes(), total=total_b)
+
+        def reset(self):
+            super().reset()
+            self._mp.free_all_blocks()
+
+        @property
+        def interface_version(self):
+            return 1
+
+    # NUMBA_CUDA_MEMORY_MANAGER=src.gpu_memory_pool でも読み込める
+    _numba_memory_manager = CupyNumbaMemoryManager
+
+
+def use_cupy_pool_for_numba() -> None:
+    """
+    Numba の EMM プラグインとして CupyNumbaMemoryManager を登録する。
+    CUDA コンテキストが作られる前 (最初の GPU 確保より前) に呼ぶこと。
+
+    Raises
+    ------
+    RuntimeError
+        CuPy / 実 GPU がない場合、または Numba が既に CUDA コンテキストを作っていて
+        登録が反映されない場合 (既存コンテキストは元のアロケータを使い続けるため)
+    """
+    if not (NUMBA_EMM_AVAILABLE and CUPY_AVAILABLE):
+        raise RuntimeError("Numba EMM plugin requires CuPy and a real CUDA device (not the simulator)")
+    cuda.set_memory_manager(CupyNumbaMemoryManager)
+    if not cupy_pool_enabled():
+        raise RuntimeError("a CUDA context already exists; call use_cupy_pool_for_numba() "
+                           "before the first GPU allocation")
+
+
+def cupy_pool_enabled() -> bool:
+    """現在の CUDA コンテキストのデバイス確保が CuPy のプールから行われていれば True"""
+    if not (NUMBA_EMM_AVAILABLE and CUPY_AVAILABLE):
+        return False
+    return isinstance(getattr(cuda.current_context(), "memory_manager", None), CupyNumbaMemoryManager)
+
+
+__all__ = [
+    "DeviceBufferPool",
+    "PoolLease",
+    "get_default_pool",
+    "size_class",
+    "use_cupy_pool_for_numba",
+    "cupy_pool_enabled",
+    "CUPY_AVAILABLE",
+    "NUMBA_EMM_AVAILABLE",
+    "SHARE_CUPY_POOL",
+]
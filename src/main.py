@@ -1,468 +1,277 @@
 """PostgreSQL-GPU処理パイプライン メインモジュール"""
 
+import os
 import time
 import numpy as np
-from typing import Dict, List, Optional, Any
-
-from .pg_connector import connect_to_postgres, check_table_exists, get_table_info, get_table_row_count, get_binary_data, get_query_column_info
-from .gpu_memory_manager_v2 import GPUMemoryManagerV2
-from .gpu_parse_wrapper import parse_binary_chunk_gpu, detect_pg_header_size
-from test.test_single_row_pg_parser import calculate_row_starts_cpu
-from .gpu_decoder_v2 import GPUDecoderV2 as GPUDecoder
-from .output_handler import OutputHandler
+import pyarrow as pa
+from typing import Dict, List, Optional, Any, Sequence, Union
+
+from .pg_connector import connect_to_postgres, get_query_column_meta, iter_binary_data, estimate_query_rows, estimate_table_rows, project_query, select_list
+from .pg_partition import ChunkSpec, ParallelCopyReader, plan_chunks
+from .pg_pool import build_dsn, get_metadata_cache, get_pool
+from .output_handler import OutputHandler, open_sink
 from .meta_fetch import ColumnMeta
+from .arrow_utils import projection_indices
+from .chunk_planner import StreamPlanner
+from .psql_copy_stream import iter_copy_chunks
+from .pipeline import run_pipeline
+from .predicate import Expr
+from .device_table import DeviceTable, concat_to_cudf
+from .file_source import FileSource
+from .gpu_memory_pool import SHARE_CUPY_POOL, use_cupy_pool_for_numba
 
 class PgGpuProcessor:
     """PostgreSQLデータGPU処理の統合クラス"""
 
     # Update __init__ to use V2 classes if that's the current standard
-    def __init__(self, dbname='postgres', user='postgres', password='postgres', host='localhost', parquet_output=None, block_size=None, thread_count=None):
-        """初期化"""
+    def __init__(self, dbname='postgres', user='postgres', password='postgres', host='localhost', parquet_output=None, block_size=None, thread_count=None,
+                 share_cupy_pool=SHARE_CUPY_POOL):
+        """初期化
+
+        share_cupy_pool が True なら、GPU 確保より前に Numba のデバイス確保を
+        CuPy のメモリプールへ向ける (既定は環境変数 GPUPASER_CUPY_POOL=1 で有効)
+        """
+        if share_cupy_pool:
+            use_cupy_pool_for_numba()
         dsn = os.environ.get("GPUPASER_PG_DSN")
         if dsn:
              print("Using DSN from GPUPASER_PG_DSN environment variable.")
-             self.conn = connect_to_postgres(dbname, user, password, host)
+             self.dsn = dsn
         else:
-             self.conn = connect_to_postgres(dbname, user, password, host)
+             self.dsn = build_dsn(dbname, user, password, host)
+        # 接続はプロセス単位のプールから借りる (同じワーカで作り直しても再接続しない)。
+        # 並列 COPY (ParallelCopyReader) も同じ DSN のプールからパーティションごとに借りる
+        self.pool = get_pool(self.dsn)
+        self.conn = self.pool.getconn()
 
-        self.memory_manager = GPUMemoryManagerV2()
-        self.gpu_decoder = GPUDecoder()
         self.output_handler = OutputHandler(parquet_output)
         self.parquet_output = parquet_output
         self.block_size = block_size
         self.thread_count = thread_count
         
-    def process_table_chunk(self, table_name: str, chunk_size: int, offset: int = 0, output_file: Optional[str] = None):
-        """テーブルの特定チャンク範囲のみを処理
-        
+    def process_table_chunk(self, table_name: str, spec: ChunkSpec, output_file: Optional[str] = None,
+                            sink=None, columns: Optional[Sequence[Union[str, int]]] = None):
+        """テーブルの 1 チャンク (ChunkSpec) のみを処理
+
+        LIMIT/OFFSET ではなく ctid 範囲・キー範囲・ハッシュ分割の WHERE 条件で取り出すため、
+        チャンクの走査コストはオフセットに依存せず、同じ plan_chunks で作ったチャンク同士は
+        重複も欠落もない。
+
         Args:
             table_name: 処理するテーブル名
-            chunk_size: 処理する行数
-            offset: 開始行オフセット
-            output_file: Parquet出力ファイルパス（Noneの場合は出力なし）
-            
+            spec: 処理範囲 (``plan_table_chunks`` / ``pg_partition.plan_chunks`` で作る)
+            output_file: Parquet出力ファイルパス（Noneの場合は結果を pa.Table で返す）
+            sink: RecordBatch の書き出し先 (``ParquetDatasetWriter`` など)。
+                指定時は output_file より優先し、close は呼び出し側で行う
+            columns: 取得する列 (列名または列番号, None なら全列)。COPY の SELECT リストを絞る
+
         Returns:
-            処理結果
+            処理結果 (``_process_data_in_chunks`` を参照)
         """
-        # テーブルの存在確認
-        if not check_table_exists(self.conn, table_name):
-            raise ValueError(f"Table {table_name} does not exist")
-        
-        # テーブル情報の取得
-        columns = get_table_info(self.conn, table_name)
-        if not columns:
-            raise ValueError(f"No columns found in table {table_name}")
-        
-        # LIMIT/OFFSETで指定された範囲のデータのみを取得
-        print(f"チャンク処理: {table_name}テーブルの{offset+1}～{offset+chunk_size}行目を処理")
-        
-        # バイナリデータの取得
+        # テーブルの存在確認と列情報 (プロセス単位のキャッシュ, 2 チャンク目以降は往復なし)
+        col_meta = self._table_columns(table_name, columns)
+
+        print(f"チャンク処理: {table_name}テーブルのチャンク {spec.index} ({spec.where_clause()}) を処理")
         start_time = time.time()
-        buffer_data, buffer = get_binary_data(
-            self.conn, 
-            table_name, 
-            limit=chunk_size, 
-            offset=offset
-        )
-        
-        # 出力ハンドラの設定（チャンク専用のParquet出力）
-        chunk_output_handler = OutputHandler(output_file)
-        
-        # チャンク処理用の変数初期化
-        num_columns = len(columns)
-        processed_rows = 0
-        
-        # GPUバッファの初期化
-        buffers = self.memory_manager.initialize_device_buffers(columns, chunk_size)
-        
-        try:
-            # バイナリデータの解析
-            chunk_array, field_offsets, field_lengths, rows_in_chunk = self.parser.parse_chunk(
-                buffer_data, 
-                max_chunk_size=1024*1024,
-                num_columns=num_columns,
-                start_row=0,  # バッファ内の開始行（すでにオフセット済み）
-                max_rows=chunk_size
-            )
-            
-            if rows_in_chunk == 0:
-                print("処理する行がありません")
-                return None
-                
-            print(f"処理中: {rows_in_chunk}行")
-            
-            # GPUで解析
-            d_col_types = None
-            d_col_lengths = None
-            
-            try:
-                print(f"GPUデコード開始: チャンク（{rows_in_chunk}行）")
-                
-                # チャンク間でのGCを促進
-                import gc
-                gc.collect()
-                from numba import cuda
-                cuda.synchronize()
-                
-                # デバイスに転送
-                d_col_types = self.memory_manager.transfer_to_device(buffers["col_types"], np.int32)
-                d_col_lengths = self.memory_manager.transfer_to_device(buffers["col_lengths"], np.int32)
-                
-                # デコード処理
-                chunk_results = self.gpu_decoder.decode_chunk(
-                    buffers, 
-                    chunk_array, 
-                    field_offsets, 
-                    field_lengths, 
-                    rows_in_chunk, 
-                    columns
-                )
-                
-                print(f"GPUデコード完了")
-                
-                # 結果の処理
-                chunk_output_handler.process_chunk_result(chunk_results)
-                final_results = chunk_output_handler.print_summary()
-                
-                # 処理済み行数の更新
-                processed_rows = rows_in_chunk
-                
-            except Exception as e:
-                print(f"チャンク処理中にエラー発生: {e}")
-                raise
-                
-            finally:
-                # GPUリソースのクリーンアップ
-                cleanup_dict = {
-                    "d_col_types": d_col_types, 
-                    "d_col_lengths": d_col_lengths
-                }
-                self.memory_manager.cleanup_buffers(cleanup_dict)
-                self.memory_manager.cleanup_buffers(buffers)
-                
-                # 明示的にGPU同期を取り、全リソースが解放されたことを確認
-                from numba import cuda
-                cuda.synchronize()
-                
-                # ガベージコレクションを促進
-                import gc
-                gc.collect()
-        
-            print(f"チャンク処理完了: {processed_rows}行")
-            print(f"処理時間: {time.time() - start_time:.3f}秒")
-            
-            return final_results
-            
-        except Exception as e:
-            print(f"チャンク処理でエラー: {e}")
-            raise
-    
-    def _process_data_in_chunks(self, buffer_data, columns, total_rows, output_file=None):
-        """データをチャンクに分けて処理する共通ロジック
-        
-        Args:
-            buffer_data: PostgreSQLから取得したバイナリデータ
-            columns: カラム情報のリスト
-            total_rows: 処理する合計行数
-            output_file: Parquet出力ファイルパス
-            
-        Returns:
-            処理結果の辞書
-        """
-        # 最適なチャンクサイズを計算
-        num_columns = len(columns)
-        optimal_chunk_size = self.memory_manager.calculate_optimal_chunk_size(columns, total_rows)
-        
-        # チャンク設定の初期化
-        chunk_config = ChunkConfig(total_rows, optimal_chunk_size)
-        print(f"GPUメモリに基づく最適チャンクサイズ: {chunk_config.rows_per_chunk}行")
-        
-        # 出力ハンドラの設定
-        output_handler = OutputHandler(output_file)
-        
-        # 複数チャンク処理のための変数初期化
-        all_results = {}  # 全チャンクの結果を集約する辞書
-        processed_rows = 0
-        chunk_count = 0
-        
-        # 全行を複数チャンクに分けて処理
-        while processed_rows < total_rows:
-            # 現在のチャンクサイズを計算
-            current_chunk_size = min(chunk_config.rows_per_chunk, total_rows - processed_rows)
-            chunk_count += 1
-            
-            print(f"\n== チャンク {chunk_count}: {processed_rows+1}～{processed_rows+current_chunk_size}行目を処理 (全{total_rows}行中) ==")
-            
-            buffers = self.memory_manager.initialize_device_buffers(columns, current_chunk_size)
-            from numba import cuda
-            import cupy as cp
+        select = select_list(None if columns is None else [c.name for c in col_meta])
+        planner = StreamPlanner(col_meta)
+        chunks = iter_binary_data(self.conn, table_name, query=spec.query(table_name, select),
+                                  chunk_bytes=planner.chunk_bytes)
+        result = self._process_data_in_chunks(None, col_meta, None, output_file, chunks=chunks, sink=sink,
+                                              planner=planner)
+        print(f"処理時間: {time.time() - start_time:.3f}秒")
+        return result
+
+    def _table_columns(self, table_name: str,
+                       columns: Optional[Sequence[Union[str, int]]] = None) -> List[ColumnMeta]:
+        """テーブルの ColumnMeta (columns 指定時はその列だけを指定順に)。テーブルが無ければ ValueError"""
+        col_meta = get_metadata_cache().table_columns(self.conn, self.dsn, table_name)
+        if not col_meta:
+            raise ValueError(f"No columns found in table {table_name}")
+        if columns is None:
+            return col_meta
+        return [col_meta[i] for i in projection_indices(col_meta, columns)]
 
-            # TODO: GPU parsing integration needed
-            raise NotImplementedError("GPU parsing logic needs to be integrated in _process_data_in_chunks.")
-            
-            rows_in_chunk = current_chunk_size
-            chunk_array = None
-            field_offsets = None
-            field_lengths = None
+    def plan_table_chunks(self, table_name: str, parts: int, method: str = "ctid",
+                          key: Optional[str] = None) -> List[ChunkSpec]:
+        """テーブルを parts 個の互いに素なチャンクに分ける (method: "ctid" / "key" / "hash")"""
+        return plan_chunks(self.conn, table_name, parts, method, key)
 
-            # Check if rows exist *before* the try block
-            if rows_in_chunk == 0:
-                print("これ以上処理する行がありません")
-                break
+    def _process_data_in_chunks(self, buffer_data, columns, total_rows, output_file=None, chunks=None,
+                                output="arrow", sink=None, projection=None, predicate=None, planner=None):
+        """データをチャンクに分けてパイプライン処理する共通ロジック
 
-            print(f"処理中: {rows_in_chunk}行")
+        COPY 受信 (reader スレッド) / GPU 変換 / 書き出し (writer スレッド) を
+        ``run_pipeline`` で重ねて実行する。
 
-            # Initialize d_col_types and d_col_lengths before try block
-            d_col_types = None
-            d_col_lengths = None
-            try:
-                # GPUデコード処理
-                d_col_types = self.memory_manager.transfer_to_device(buffers["col_types"], np.int32)
-                d_col_lengths = self.memory_manager.transfer_to_device(buffers["col_lengths"], np.int32)
-
-                chunk_results = self.gpu_decoder.decode_chunk(
-                    buffers,
-                    chunk_array,
-                    field_offsets,
-                    field_lengths,
-                    rows_in_chunk,
-                    columns
-                )
-                
-                # Parquet出力処理
-                if output_file:
-                    output_handler.process_chunk_result(chunk_results)
-                
-                # 結果の集約
-                if not all_results:
-                    # 初回は結果をそのまま使用
-                    all_results = chunk_results
-                else:
-                    # 2回目以降は結果を連結
-                    for col_name, data in chunk_results.items():
-                        if isinstance(data, np.ndarray):
-                            all_results[col_name] = np.concatenate([all_results[col_name], data])
-                        elif isinstance(data, list):
-                            all_results[col_name].extend(data)
-                
-                # 処理済み行数を更新
-                processed_rows += rows_in_chunk
-                
-            except Exception as e:
-                print(f"チャンク {chunk_count} の処理中にエラー: {e}")
-                import traceback
-                traceback.print_exc()
-            finally:
-                # GPUリソースのクリーンアップ
-                cleanup_dict = {
-                    "d_col_types": d_col_types,
-                    "d_col_lengths": d_col_lengths,
-                }
-                self.memory_manager.cleanup_buffers(cleanup_dict)
-                self.memory_manager.cleanup_buffers(buffers)
-        
-        # 出力ハンドラのサマリー表示
-        if output_file:
-            output_handler.print_summary()
-        
-        return all_results
+        Args:
+            buffer_data: PostgreSQLから取得したバイナリデータ (chunks 指定時は None 可)
+            columns: カラム情報のリスト
+            total_rows: 処理する合計行数 (チャンク計画の上限, 不明なら None)。
+                chunks 指定時は推定値として扱い、実際の行数はパイプラインが数える
+            output_file: 出力ファイルパス (None の場合は結果を pa.Table で返す)。
+                拡張子 .arrow / .feather / .arrows なら Arrow IPC、それ以外は Parquet (``open_sink``)
+            chunks: 行境界揃えの CopyChunk の iterable (``iter_binary_data`` など)
+            output: "device" ならチャンクごとの GPU 常駐 DeviceTable のリストを返す
+                (output_file は使わない)
+            sink: 指定時はバッチをこの書き出し先へ渡して PipelineStats を返す (close しない)
+            projection: 出力する列 (None なら columns の全列)。述語だけが参照する列を除くのに使う
+            predicate: 残す行の条件 (``predicate.col`` から作る)。GPU 上で parse と decode の間に評価する
+            planner: chunks のチャンクサイズを決めている StreamPlanner (``chunk_bytes`` を
+                chunks の生成元へ渡したもの)。None なら新しく作る
 
-    def process_table(self, table_name: str, limit: Optional[int] = None):
-        """テーブル全体を処理（複数チャンク対応）"""
-        # テーブルの存在確認
-        if not check_table_exists(self.conn, table_name):
-            raise ValueError(f"Table {table_name} does not exist")
+        Returns:
+            output_file / sink 指定時は PipelineStats, output="device" は list[DeviceTable],
+            それ以外は全チャンクを連結した pa.Table
+        """
+        # チャンクサイズは先頭チャンクの行あたりバイト数と空き GPU メモリから決め、
+        # 以降のチャンクの実績で見積りを更新する (再計画したサイズは次のチャンクから使われる)
+        if planner is None:
+            # 行数が確定しているのはホスト上のバッファを渡された場合だけ
+            planner = StreamPlanner(columns, max_rows=total_rows if chunks is None else None,
+                                    filtered=predicate is not None)
+        if chunks is None:
+            chunks = iter_copy_chunks([buffer_data], planner.chunk_bytes)
+        chunks = planner.track(chunks)
+
+        batches = []
+        writer = None
+        external_sink = sink is not None
+        if external_sink:
+            output_file = None
+        elif output_file and output == "arrow":
+            # run_pipeline の writer スレッドから呼ばれるので sink 自身のスレッドは使わない
+            out_columns = [columns[i] for i in projection_indices(columns, projection)]
+            writer = open_sink(output_file, out_columns, background=False)
+            sink = writer
+        else:
+            sink = batches.append
 
-        # テーブル情報と行数の取得
-        columns = get_table_info(self.conn, table_name)
-        if not columns:
-            raise ValueError(f"No columns found in table {table_name}")
+        try:
+            stats = run_pipeline(chunks, columns, sink, chunk_bytes=planner.chunk_bytes(), output=output,
+                                 projection=projection, predicate=predicate)
+        finally:
+            if writer is not None:
+                writer.close()
+        print(stats.report())
+        if total_rows is not None and stats.rows != total_rows:
+            print(f"推定行数 {total_rows} → 実際 {stats.rows} 行")
+
+        if output == "device" and not external_sink:
+            return batches
+        if output_file or external_sink:
+            if output_file:
+                print(f"出力ファイルが保存されました: {output_file} ({stats.rows} 行)")
+            return stats
+        if not batches:
+            return None
+        return pa.Table.from_batches(batches)
 
-        total_rows = min(get_table_row_count(self.conn, table_name), limit if limit else float('inf'))
+    def process_table(self, table_name: str, limit: Optional[int] = None, partitions: Optional[int] = None,
+                      ordered: bool = False, output: str = "arrow",
+                      columns: Optional[Sequence[Union[str, int]]] = None, predicate: Optional[Expr] = None):
+        """テーブル全体を処理（複数チャンク対応）
 
-        # バイナリデータの取得
-        start_time = time.time()
-        buffer_data, buffer = get_binary_data(self.conn, table_name, limit)
+        Args:
+            table_name: 処理するテーブル名
+            limit: 取得する最大行数
+            partitions: 2 以上なら ctid 範囲で分割し、その本数の接続で並列に COPY する
+                (limit 指定時は単一接続)
+            ordered: 並列 COPY の結果をブロック順 (パーティション順) に処理する
+            output: "device" なら GPU 常駐の DeviceTable のリストを返す (to_device_table を参照)
+            columns: 取得する列 (列名または列番号, None なら全列)。COPY の SELECT リストを
+                書き換えるので、射影外の列は転送も parse / decode もされない
+            predicate: 残す行の条件 (``predicate.col`` から列名で作る)。サーバへは送らず、
+                GPU 上で parse と decode の間に評価する (プライマリに重い WHERE を実行させない)。
+                columns に無い列を参照する場合はその列も取得し、出力からは除く
+        """
+        # テーブルの存在確認と列情報 (RowDescription から ColumnMeta を作り、プロセス内でキャッシュ)
+        col_meta = self._table_columns(table_name, columns)
+        projection = None
+        if predicate is not None and columns is not None:
+            out_names = [c.name for c in col_meta]
+            extra = [c for c in self._table_columns(table_name, predicate.columns()) if c.name not in out_names]
+            if extra:
+                col_meta = col_meta + extra
+                projection = out_names
+        names = None if columns is None else [c.name for c in col_meta]
+
+        # 行数は統計情報からの推定値のみ (COUNT(*) の全件走査を避ける)。
+        # 実際の行数はストリーミング受信しながらパイプラインで数える
+        total_rows = estimate_table_rows(self.conn, table_name)
+        if limit is not None:
+            total_rows = limit if total_rows is None else min(total_rows, limit)
+        print(f"{table_name}: 推定{total_rows}行")
+
+        # バイナリデータをストリーミング受信しながら処理 (結果全体をホストに溜めない)
+        planner = StreamPlanner(col_meta, filtered=predicate is not None)
+        if partitions and partitions > 1 and limit is None:
+            chunks = ParallelCopyReader(self.dsn, table_name, partitions, chunk_bytes=planner.chunk_bytes,
+                                        ordered=ordered, columns=select_list(names))
+        else:
+            chunks = iter_binary_data(self.conn, table_name, limit, columns=names,
+                                      chunk_bytes=planner.chunk_bytes)
+        return self._process_data_in_chunks(None, col_meta, total_rows, self.parquet_output, chunks=chunks,
+                                            output=output, projection=projection, predicate=predicate,
+                                            planner=planner)
 
-        # 共通のチャンク処理ロジックを呼び出し
-        return self._process_data_in_chunks(buffer_data, columns, total_rows, self.parquet_output)
+    def to_device_table(self, table_name: str, limit: Optional[int] = None, partitions: Optional[int] = None,
+                        ordered: bool = False, columns: Optional[Sequence[Union[str, int]]] = None,
+                        predicate: Optional[Expr] = None) -> List[DeviceTable]:
+        """テーブルを GPU 上の列として読み込む (ホストへの往復なし)
+
+        Returns:
+            チャンクごとの DeviceTable のリスト。cuDF へは ``concat_to_cudf`` で連結する
+        """
+        return self.process_table(table_name, limit, partitions, ordered, output="device", columns=columns,
+                                  predicate=predicate)
             
     def process_query(self, query: str):
-        """SQLクエリを実行し結果を処理する
-        
+        """SQLクエリを実行し結果を処理する (GPU 変換は ``process_custom_query`` と同じ)
+
         Args:
             query: 実行するSQLクエリ
-            
+
         Returns:
-            pandas.DataFrame: 処理結果のデータフレーム
+            pandas.DataFrame: 処理結果のデータフレーム (結果が空またはエラーの場合は None)
         """
-        # テーブル情報と行数の取得
-        buffer_data, buffer = get_binary_data(
-            self.conn,
-            table_name="", 
-            query=query
-        )
-        
-        # バッファが空の場合
-        if len(buffer_data) == 0:
-            print("クエリ結果が空です")
-            return None
-        
-        # カラム情報を最初の行から推定（簡易版）
-        import pandas as pd
-        
-        try:
-            parser = BinaryDataParser(use_gpu=False)
-            chunk_array, field_offsets, field_lengths, rows_in_chunk = parser.parse_chunk(
-                buffer_data, max_chunk_size=len(buffer_data), max_rows=10000
-            )
-            
-            if rows_in_chunk == 0:
-                print("有効な行がありません")
-                return None
-                
-            field_count = 0
-            for i in range(min(100, len(field_lengths))):
-                if field_lengths[i] != 0:
-                    field_count += 1
-                else:
-                    break
-                        
-            num_cols = field_count if rows_in_chunk > 0 else 0
-            
-            if num_cols == 0:
-                print("列情報を取得できませんでした")
-                return None
-                
-            columns = get_query_column_info(self.conn, query)
-            
-            if not columns:
-                print("PostgreSQLメタデータからカラム情報を取得できませんでした。デフォルト設定を使用します。")
-                columns = []
-                for i in range(num_cols):
-                    columns.append(ColumnMeta(f"col_{i}", 0, -1, UNKNOWN, 0, 1, -1))
+        table = self.process_custom_query(query)
+        return None if table is None else table.to_pandas()
 
-            # GPUバッファの初期化
-            buffers = self.memory_manager.initialize_device_buffers(columns, rows_in_chunk)
-            
-            # GPUでデコード
-            try:
-                chunk_results = self.gpu_decoder.decode_chunk(
-                    buffers,
-                    chunk_array,
-                    field_offsets,
-                    field_lengths,
-                    rows_in_chunk,
-                    columns
-                )
-                
-                # 結果をDataFrameに変換
-                df = pd.DataFrame(chunk_results)
-                # カラム名をインデックス順に設定
-                df.columns = [f"col_{i}" for i in range(len(df.columns))]
-                
-                return df
-                
-            except Exception as e:
-                print(f"GPUデコード中にエラー: {e}")
-                return None
-                
-        except Exception as e:
-            print(f"クエリ処理中にエラー: {e}")
-            return None
-            
-    def process_custom_query(self, query: str, output_file: Optional[str] = None):
+    def process_custom_query(self, query: str, output_file: Optional[str] = None,
+                             columns: Optional[Sequence[str]] = None):
         """カスタムSQLクエリを実行し、結果をGPUで処理してParquetファイルに出力する
 
         Args:
             query: 実行するSQLクエリ
             output_file: Parquet出力ファイルパス（Noneの場合は出力なし）
+            columns: 取得する列名 (None なら全列)。クエリを外側の SELECT で包んで列を絞る
 
         Returns:
             処理結果（dictまたはDataFrame）
         """
+        query = project_query(query, columns)
         print(f"カスタムSQLクエリの実行: {query}")
         start_time = time.time()
 
-        # テーブル情報と行数の取得
-        buffer_data, buffer = get_binary_data(
-            self.conn,
-            table_name="",
-            query=query
-        )
-
-        # バッファが空の場合
-        if len(buffer_data) == 0:
-            print("クエリ結果が空です")
-            return None
-
-        # まずCPUで簡易パースして列数とタイプを推定（少数行のみ）
         try:
-            parser = BinaryDataParser(use_gpu=False)
-            chunk_array, field_offsets, field_lengths, rows_in_sample = parser.parse_chunk(
-                buffer_data,
-                max_chunk_size=len(buffer_data),
-                max_rows=100  # メタデータ推定用に少数行のみ処理（10000→100に変更）
-            )
-
-            if rows_in_sample == 0:
-                print("有効な行がありません")
-                return None
-
-            # 最初の行から列数を推定
-            if rows_in_sample > 0:
-                # フィールド数をカウント
-                field_count = 0
-                for i in range(min(100, len(field_lengths))):
-                    if field_lengths[i] != 0:
-                        field_count += 1
-                    else:
-                        break
-
-                # 先頭行のフィールド数から推定
-                num_cols = field_count
-            else:
-                num_cols = 0
-
-            if num_cols == 0:
-                print("列情報を取得できませんでした")
-                return None
-
-            # PostgreSQLメタデータAPIを使用して正確なカラム型情報を取得
-            columns = get_query_column_info(self.conn, query)
-
-            # カラム情報が取得できない場合はフォールバック
+            # カラム型情報は RowDescription (LIMIT 0) から取得し、行数は EXPLAIN の推定値を使う。
+            # COUNT(*) で数えるとクエリを 2 回実行することになるため、実際の行数は
+            # ストリーミング受信しながらパイプラインで数える (クエリの実行は COPY の 1 回のみ)
+            columns = get_query_column_meta(self.conn, query)
             if not columns:
-                print("PostgreSQLメタデータからカラム情報を取得できませんでした。デフォルト設定を使用します。")
-                # デフォルトのカラム情報を作成（すべて文字列型と仮定）
-                columns = []
-                for i in range(num_cols):
-                     # Use ColumnMeta here
-                    columns.append(ColumnMeta(f"col_{i}", 0, -1, UNKNOWN, 0, 1, -1)) # Provide default values for ColumnMeta fields
-                    # Example: ColumnMeta(name, pg_oid, typmod, arrow_id, elem_size, is_variable, var_index)
-                    # Adjust default values as needed based on ColumnMeta definition
-
-            # --- 以下が変更部分 ---
-            # 全行数を取得または推定
-            # SQLからの正確な行数が取得できない場合は、バッファサイズから概算
-            try:
-                # ROW_NUMBERを使った行数取得クエリ
-                count_query = f"SELECT COUNT(*) FROM ({query}) AS subquery"
-                count_cursor = self.conn.cursor()
-                count_cursor.execute(count_query)
-                total_rows = count_cursor.fetchone()[0]
-                count_cursor.close()
-            except Exception as e:
-                print(f"行数の正確な取得に失敗: {e}")
-                # バッファサイズとサンプルから行数を概算
-                avg_row_size = len(buffer_data) / rows_in_sample if rows_in_sample > 0 else 1000
-                total_rows = int(len(buffer_data) / avg_row_size) + 1
-                print(f"概算行数: {total_rows}行")
+                print("PostgreSQLメタデータからカラム情報を取得できませんでした")
+                return None
 
-            print(f"クエリ結果: 推定{total_rows}行")
+            estimated_rows = estimate_query_rows(self.conn, query)
+            print(f"クエリ結果: 推定{estimated_rows}行")
 
-            # 共通のチャンク処理ロジックを呼び出し
-            return self._process_data_in_chunks(buffer_data, columns, total_rows, output_file)
+            planner = StreamPlanner(columns)
+            chunks = iter_binary_data(self.conn, "", query=query, chunk_bytes=planner.chunk_bytes)
+            result = self._process_data_in_chunks(None, columns, estimated_rows, output_file, chunks=chunks,
+                                                  planner=planner)
+            print(f"処理時間: {time.time() - start_time:.3f}秒")
+            return result
 
         except Exception as e:
             print(f"クエリ処理中にエラー: {e}")
@@ -473,13 +282,27 @@ class PgGpuProcessor:
     def close(self):
         """リソースの解放"""
         if hasattr(self, 'conn') and self.conn:
-            self.conn.close()
+            # プールへ返却 (トランザクションは閉じられ、次の PgGpuProcessor が再利用する)
+            self.pool.putconn(self.conn)
+            self.conn = None
+
+def load_table_optimized(table_name: str, limit: Optional[int] = None, parquet_output: Optional[str] = None,
+                         output: str = "arrow", columns: Optional[Sequence[Union[str, int]]] = None):
+    """最適化されたGPU実装でテーブルを読み込む（コンビニエンス関数）
+
+    output="cudf" では Parquet を経由せず、GPU 上の列から直接 cudf.DataFrame を作って返す。
+    columns を指定するとその列だけを取得する。
+    """
+    if output == "cudf":
+        processor = PgGpuProcessor()
+        try:
+            return concat_to_cudf(processor.to_device_table(table_name, limit, columns=columns))
+        finally:
+            processor.close()
 
-def load_table_optimized(table_name: str, limit: Optional[int] = None, parquet_output: Optional[str] = None):
-    """最適化されたGPU実装でテーブルを読み込む（コンビニエンス関数）"""
     processor = PgGpuProcessor(parquet_output=parquet_output)
     try:
-        results = processor.process_table(table_name, limit)
+        results = processor.process_table(table_name, limit, columns=columns)
         
         # Parquet出力が指定されている場合の検証
         if parquet_output:
@@ -501,8 +324,36 @@ def load_table_optimized(table_name: str, limit: Optional[int] = None, parquet_o
     finally:
         processor.close()
 
-# Import os for environment variable access
-import os
+
+def process_copy_files(paths, output_file: Optional[str] = None,
+                       columns: Optional[Sequence[Union[str, int]]] = None,
+                       column_meta: Optional[List[ColumnMeta]] = None,
+                       predicate: Optional[Expr] = None, backend: str = "gpu"):
+    """保存済みの COPY BINARY ファイル (.bin, またはそれを含むディレクトリ) を DB に接続せずに処理
+
+    Args:
+        paths: ファイル / ディレクトリ (またはそのリスト)。メモリマップして行境界で切る
+        output_file: 出力ファイルパス (None の場合は結果を pa.Table で返す)
+        columns: 出力する列 (列名または列番号, None なら全列)
+        column_meta: ファイルの列情報。省略時はサイドカー (``file_source.save_column_meta``) から読む
+        predicate: 残す行の条件 (``predicate.col`` から作る)
+        backend: "gpu" / "cpu"
+
+    Returns:
+        output_file 指定時は PipelineStats, それ以外は pa.Table (行が無ければ None)
+    """
+    source = FileSource(paths, column_meta)
+    print(f"COPY ファイル: {len(source.files)} 個, {source.nbytes} bytes")
+    if not output_file:
+        return source.read_table(backend=backend, projection=columns, predicate=predicate)
+    meta = source.resolve_columns()
+    out_columns = [meta[i] for i in projection_indices(meta, columns)]
+    with open_sink(output_file, out_columns, background=False) as sink:
+        stats = source.run(sink, backend=backend, projection=columns, predicate=predicate)
+    print(stats.report())
+    print(f"出力ファイルが保存されました: {output_file} ({stats.rows} 行)")
+    return stats
+
 
 if __name__ == "__main__":
     import argparse
@@ -519,14 +370,28 @@ if __name__ == "__main__":
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--table', help='Table name to process')
     group.add_argument('--sql', help='SQL query to process')
+    group.add_argument('--file', nargs='+',
+                       help='Saved COPY BINARY file(s) or directories of *.bin files (no database needed)')
     parser.add_argument('--limit', type=int, default=None, help='Limit number of rows (used with --table)')
-    parser.add_argument('--parquet', help='Output path for Parquet file')
+    parser.add_argument('--parquet',
+                        help='Output path (.parquet, or .arrow/.feather/.arrows for Arrow IPC file/stream)')
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='Number of parallel COPY connections split by ctid range (used with --table)')
+    parser.add_argument('--ordered', action='store_true', help='Keep block order when using --partitions')
+    parser.add_argument('--columns', default=None,
+                        help='Comma-separated list of columns to fetch (default: all columns)')
+    parser.add_argument('--share-cupy-pool', action='store_true',
+                        help='Serve Numba device allocations from the CuPy memory pool')
     # Add arguments for DB connection if not using environment variable exclusively
     # parser.add_argument('--dbname', default='postgres')
     # parser.add_argument('--user', default='postgres')
     # parser.add_argument('--password', default='postgres')
     # parser.add_argument('--host', default='localhost')
     args = parser.parse_args()
+    columns = [c.strip() for c in args.columns.split(',')] if args.columns else None
+    if args.share_cupy_pool:
+        # 最初の GPU 確保より前に登録する (--file でも有効にするためプロセッサ生成前に呼ぶ)
+        use_cupy_pool_for_numba()
 
     start_time = time.time()
     processor = None
@@ -535,29 +400,35 @@ if __name__ == "__main__":
         # Instantiate PgGpuProcessor, passing parquet path
         # DB connection details could be passed here if args are added,
         # otherwise it uses defaults or environment variables (as implemented in __init__)
-        processor = PgGpuProcessor(
-            # dbname=args.dbname, user=args.user, password=args.password, host=args.host, # If args added
-            parquet_output=args.parquet
-        )
+        if not args.file:
+            processor = PgGpuProcessor(
+                # dbname=args.dbname, user=args.user, password=args.password, host=args.host, # If args added
+                parquet_output=args.parquet
+            )
 
-        if args.sql:
+        if args.file:
+            # 保存済み COPY ファイルを DB なしで処理 (列情報はサイドカー JSON から読む)
+            print(f"=== COPYファイル処理 ===")
+            results = process_copy_files(args.file, args.parquet, columns)
+        elif args.sql:
             # Process custom SQL query
             print(f"=== SQLクエリ処理 ===")
             print(f"SQL: {args.sql}")
             print("\n[最適化GPU実装]")
             # Call process_custom_query directly
-            results = processor.process_custom_query(args.sql, args.parquet) # Pass parquet path again if needed by method
+            results = processor.process_custom_query(args.sql, args.parquet, columns) # Pass parquet path again if needed by method
         elif args.table:
             # Process table (using the processor instance directly is cleaner)
             print(f"=== {args.table}テーブル処理 ===")
             print("\n[最適化GPU実装]")
             # Call process_table directly on the created processor instance
-            results = processor.process_table(args.table, args.limit)
+            results = processor.process_table(args.table, args.limit, args.partitions, args.ordered,
+                                              columns=columns)
             # Note: load_table_optimized creates its own processor, which is redundant here.
             # results = load_table_optimized(args.table, args.limit, args.parquet) # Keep if preferred
         else:
             # Should not be reached due to mutually_exclusive_group
-            print("Error: --table または --sql のいずれかを指定してください。")
+            print("Error: --table / --sql / --file のいずれかを指定してください。")
             exit(1)
 
         gpu_time = time.time() - start_time
@@ -1,7 +1,27 @@
-"""デコード結果の処理と出力を管理"""
+"""デコード結果の処理と出力を管理
 
+* ``ArrowParquetSink`` : decode_chunk の RecordBatch をそのまま Parquet に書く (推奨)
+* ``ArrowIPCSink``     : 同じく Arrow IPC (ファイル / ストリーム, LZ4・ZSTD 圧縮可) に書く
+* ``ArrowIPCSource``   : IPC ファイルを RecordBatch として読み直す (メモリマップ)
+* ``open_sink``        : 出力パスの拡張子で上記の sink を選ぶ
+* ``OutputHandler`` / ``ParquetWriter`` : 列名→配列の dict を受け取る旧来の出力
+"""
+
+import os
+import queue
+import threading
+import time
 import numpy as np
-from typing import Dict, List, Any
+import pyarrow as pa
+from typing import Dict, Iterator, List, Any, Optional, Union
+
+from .arrow_utils import arrow_schema_for, host_batch
+from .type_map import ColumnMeta
+
+DEFAULT_ROW_GROUP_SIZE = 1 << 20     # 行
+DEFAULT_WRITE_QUEUE_DEPTH = 4
+IPC_FORMATS = ("file", "stream")
+_CLOSE = object()
 
 class ResultAggregator:
     """結果データの集約を管理"""
@@ -82,8 +102,350 @@ class OutputHandler:
         
         return results
 
+class _BatchSink:
+    """
+    RecordBatch sink の共通部分 (スキーマ合わせ / background 書き込み / 例外の受け渡し)
+
+    サブクラスは ``_append(batch)`` (スキーマ合わせ済みのバッチを書く) と
+    ``_finish()`` (close 時の残りの書き出し), ``_close_writer()`` を実装する。
+
+    * background=True では有界キューを介して専用スレッドで書き込み、
+      write_batch はキューが満杯のときだけ待つ。書き込み側の例外は次の
+      write_batch / close で送出する
+    * GPU 上のバッファを包んだバッチ (decode_chunk のゼロコピー出力) は write_batch で
+      ホストへコピーしてから積む。キューや行グループ待ちのバッチがデバイスメモリ
+      (プールのリース) を持ち続けないようにするため
+    """
+
+    _thread_name = "batch-sink"
+
+    def __init__(self, output_path: str, columns: Union[List[ColumnMeta], "pa.Schema"],
+                 background: bool, queue_depth: int):
+        self.output_path = output_path
+        self.schema = columns if isinstance(columns, pa.Schema) else arrow_schema_for(columns)
+        self.rows_written = 0
+        self.write_s = 0.0          # 書き込み (エンコード + I/O) に使った時間
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._background = background
+        self._queue_depth = queue_depth
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _start(self):
+        """writer を開いた後にサブクラスの __init__ から呼ぶ"""
+        if self._background:
+            self._queue = queue.Queue(maxsize=self._queue_depth)
+            self._thread = threading.Thread(target=self._run, name=self._thread_name, daemon=True)
+            self._thread.start()
+
+    # ------------------------------------------------------------------
+    def write_batch(self, batch: "pa.RecordBatch") -> None:
+        """RecordBatch を 1 個書き出す (background 時はキューへ積むだけ)"""
+        if self._closed:
+            raise ValueError(f"write_batch on closed {type(self).__name__}")
+        self._raise_error()
+        if batch.num_rows == 0:
+            return
+        batch = host_batch(batch)
+        if self._queue is None:
+            self._write(batch)
+            return
+        while True:
+            try:
+                self._queue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                self._raise_error()   # writer が止まっていればキュー待ちを抜ける
+
+    __call__ = write_batch
+
+    def close(self) -> None:
+        """残りのバッチを書き出してファイルを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._thread is not None:
+                self._queue.put(_CLOSE)
+                self._thread.join()
+            elif self._error is None:
+                self._finish()
+        finally:
+            self._close_writer()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------------------------------------------------------
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                if self._error is None:
+                    try:
+                        self._finish()
+                    except BaseException as e:   # noqa: BLE001
+                        self._error = e
+                return
+            if self._error is not None:
+                continue    # 失敗後は呼び出し側を止めないよう読み捨てる
+            try:
+                self._write(item)
+            except BaseException as e:   # noqa: BLE001
+                self._error = e
+
+    def _write(self, batch: "pa.RecordBatch"):
+        if not batch.schema.equals(self.schema):
+            batch = batch.cast(self.schema)
+        self._append(batch)
+
+    def _append(self, batch: "pa.RecordBatch"):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def _close_writer(self):
+        raise NotImplementedError
+
+
+class ArrowParquetSink(_BatchSink):
+    """
+    RecordBatch を Parquet ファイルへ書き出す sink (``run_pipeline`` の sink にも使える)
+
+    スキーマは ColumnMeta から決め (``arrow_schema_for``)、デコード結果の型をそのまま書く。
+    列名からの型推測や要素ごとの変換はしない。
+
+    * 受け取ったバッチは row_group_size 行ずつ (最後のみ端数) の行グループにまとめて書く
+    * background=True では有界キューを介して専用スレッドで書き込み、
+      write_batch はキューが満杯のときだけ待つ。書き込み側の例外は次の
+      write_batch / close で送出する
+
+    Parameters
+    ----------
+    output_path : str
+    columns : list[ColumnMeta] or pyarrow.Schema
+    row_group_size : int
+        1 行グループの行数
+    compression : str or dict
+        ``pyarrow.parquet.ParquetWriter`` の compression ("snappy", "zstd", "none", 列名→codec)
+    use_dictionary : bool or list[str]
+        辞書エンコーディングする列 (True で全列)
+    background : bool
+        専用の writer スレッドで書き込む
+    queue_depth : int
+        background 時のキュー長 (ホストに溜めるバッチ数の上限)
+    **writer_options
+        その他 ``pyarrow.parquet.ParquetWriter`` への引数 (compression_level など)
+    """
+
+    _thread_name = "parquet-writer"
+
+    def __init__(
+        self,
+        output_path: str,
+        columns: Union[List[ColumnMeta], "pa.Schema"],
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        compression: Union[str, Dict[str, str]] = "snappy",
+        use_dictionary: Union[bool, List[str]] = True,
+        background: bool = True,
+        queue_depth: int = DEFAULT_WRITE_QUEUE_DEPTH,
+        **writer_options,
+    ):
+        import pyarrow.parquet as pq
+
+        if row_group_size < 1:
+            raise ValueError("row_group_size must be >= 1")
+        super().__init__(output_path, columns, background, queue_depth)
+        self.row_group_size = row_group_size
+        self.row_groups = 0
+        self._pending: List[pa.RecordBatch] = []
+        self._pending_rows = 0
+        self._writer = pq.ParquetWriter(
+            output_path, self.schema, compression=compression,
+            use_dictionary=use_dictionary, **writer_options,
+        )
+        self._start()
+
+    def _append(self, batch: "pa.RecordBatch"):
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush(final=False)
+
+    def _finish(self):
+        self._flush(final=True)
+
+    def _close_writer(self):
+        self._writer.close()
+
+    def _flush(self, final: bool):
+        """溜めたバッチから row_group_size 行の行グループを書く (final なら端数も書く)"""
+        if not self._pending:
+            return
+        t0 = time.perf_counter()
+        table = pa.Table.from_batches(self._pending, schema=self.schema)
+        full = (table.num_rows // self.row_group_size) * self.row_group_size
+        n = table.num_rows if final else full
+        if n > 0:
+            self._writer.write_table(table.slice(0, n), row_group_size=self.row_group_size)
+            self.rows_written += n
+            self.row_groups += -(-n // self.row_group_size)
+        rest = table.slice(n)
+        self._pending = rest.to_batches() if rest.num_rows else []
+        self._pending_rows = rest.num_rows
+        self.write_s += time.perf_counter() - t0
+
+
+class ArrowIPCSink(_BatchSink):
+    """
+    RecordBatch を Arrow IPC (Feather v2) へ書き出す sink
+
+    Parquet と違いエンコードが無く、バッファをそのままファイルへ書く。DuckDB / Polars /
+    Spark (Arrow) など Arrow を直接読む後段向け。バッチは受け取った単位で 1 メッセージずつ書く。
+
+    * format="file"   : ランダムアクセス可能な IPC ファイル (= Feather v2, 拡張子 .arrow / .feather)。
+      ``ArrowIPCSource`` / ``pyarrow.memory_map`` で非圧縮ならコピーなしに読める
+    * format="stream" : IPC ストリーム (.arrows)。フッタが無いので書き込み途中でも先頭から読める
+
+    Parameters
+    ----------
+    output_path : str
+    columns : list[ColumnMeta] or pyarrow.Schema
+    format : {"file", "stream"}
+    compression : {None, "lz4", "zstd"}
+        バッファ単位の圧縮 (圧縮するとメモリマップで読んでも展開のコピーが入る)
+    background : bool
+        専用の writer スレッドで書き込む
+    queue_depth : int
+        background 時のキュー長
+    """
+
+    _thread_name = "ipc-writer"
+
+    def __init__(
+        self,
+        output_path: str,
+        columns: Union[List[ColumnMeta], "pa.Schema"],
+        format: str = "file",
+        compression: Optional[str] = None,
+        background: bool = True,
+        queue_depth: int = DEFAULT_WRITE_QUEUE_DEPTH,
+    ):
+        if format not in IPC_FORMATS:
+            raise ValueError(f"unknown IPC format: {format!r} (expected 'file' or 'stream')")
+        if compression not in (None, "lz4", "zstd"):
+            raise ValueError(f"unsupported IPC compression: {compression!r} (expected None, 'lz4' or 'zstd')")
+        super().__init__(output_path, columns, background, queue_depth)
+        self.format = format
+        self.compression = compression
+        self.batches_written = 0
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        self._sink = pa.OSFile(output_path, "wb")
+        try:
+            if format == "file":
+                self._writer = pa.ipc.new_file(self._sink, self.schema, options=options)
+            else:
+                self._writer = pa.ipc.new_stream(self._sink, self.schema, options=options)
+        except BaseException:
+            self._sink.close()
+            raise
+        self._start()
+
+    def _append(self, batch: "pa.RecordBatch"):
+        t0 = time.perf_counter()
+        self._writer.write_batch(batch)
+        self.rows_written += batch.num_rows
+        self.batches_written += 1
+        self.write_s += time.perf_counter() - t0
+
+    def _close_writer(self):
+        try:
+            self._writer.close()
+        finally:
+            self._sink.close()
+
+
+class ArrowIPCSource:
+    """
+    ``ArrowIPCSink`` で書いた IPC ファイル / ストリームを RecordBatch として読み直す
+
+    ベンチマークで PostgreSQL を経由せずに同じバッチ列を sink へ流すためのもの
+    (``pipeline.replay_batches`` に渡す)。memory_map=True では ``pyarrow.memory_map``
+    で開くので、非圧縮のファイルはバッチのバッファがマップした領域を直接指す (コピーなし)。
+    形式 (file / stream) は中身から判定する。
+
+    Parameters
+    ----------
+    path : str
+    memory_map : bool
+        False ならファイルを通常の読み込みで開く
+    """
+
+    def __init__(self, path: str, memory_map: bool = True):
+        self.path = path
+        self._source = pa.memory_map(path, "r") if memory_map else pa.OSFile(path, "rb")
+        try:
+            self._reader = pa.ipc.open_file(self._source)
+            self.format = "file"
+        except pa.ArrowInvalid:
+            self._source.seek(0)
+            self._reader = pa.ipc.open_stream(self._source)
+            self.format = "stream"
+        self.schema: pa.Schema = self._reader.schema
+
+    @property
+    def num_batches(self) -> Optional[int]:
+        """バッチ数 (stream 形式は読むまで分からないので None)"""
+        return self._reader.num_record_batches if self.format == "file" else None
+
+    def __iter__(self) -> Iterator["pa.RecordBatch"]:
+        if self.format == "file":
+            for i in range(self._reader.num_record_batches):
+                yield self._reader.get_batch(i)
+        else:
+            yield from self._reader
+
+    def read_all(self) -> "pa.Table":
+        return self._reader.read_all()
+
+    def close(self) -> None:
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_sink(output_path: str, columns: Union[List[ColumnMeta], "pa.Schema"], **options) -> _BatchSink:
+    """
+    拡張子から sink を選んで開く
+
+    ``.arrow`` / ``.feather`` / ``.ipc`` → ArrowIPCSink(format="file"),
+    ``.arrows`` → ArrowIPCSink(format="stream"), それ以外 → ArrowParquetSink。
+    options はそれぞれのコンストラクタへ渡す。
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext == ".arrows":
+        return ArrowIPCSink(output_path, columns, format="stream", **options)
+    if ext in (".arrow", ".feather", ".ipc"):
+        return ArrowIPCSink(output_path, columns, format="file", **options)
+    return ArrowParquetSink(output_path, columns, **options)
+
+
 class ParquetWriter:
-    """Parquet形式での出力を管理するクラス"""
+    """Parquet形式での出力を管理するクラス (dict 入力用。RecordBatch は ArrowParquetSink を使う)"""
     
     def __init__(self, output_path: str):
         """初期化"""
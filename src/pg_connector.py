@@ -5,12 +5,13 @@ PostgreSQLへの接続とデータ取得モジュール
 import psycopg # Use only psycopg (v3)
 import io
 import os
-from typing import List, Optional, Tuple
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
 
 # from .utils import ColumnInfo # Removed incorrect import
 from .meta_fetch import fetch_column_meta, ColumnMeta # Import ColumnMeta from meta_fetch
+from .psql_copy_stream import CopyChunk, DEFAULT_CHUNK_BYTES, iter_copy_chunks, copy_binary_to_gpu_chunks
+from .pg_pool import build_dsn, get_pool
 # from .type_map import ColumnMeta # Removed import from type_map
-# from .psql_copy_stream import copy_binary_to_gpu_chunks # Commented out non-existent module import
 
 class PostgresConnector:
     """PostgreSQLとの接続を管理するクラス"""
@@ -21,15 +22,14 @@ class PostgresConnector:
         self.user = user
         self.password = password
         self.host = host
+        self.dsn = build_dsn(dbname, user, password, host)
         self.conn = None
         self.connect()
         
     def connect(self):
-        """PostgreSQL接続を確立"""
+        """PostgreSQL接続を確立 (プロセス単位のプールから借りる)"""
         try:
-            # Construct DSN string for psycopg (v3)
-            dsn = f"dbname='{self.dbname}' user='{self.user}' password='{self.password}' host='{self.host}'"
-            self.conn = psycopg.connect(dsn)
+            self.conn = get_pool(self.dsn).getconn()
             return True
         except Exception as e:
             print(f"PostgreSQL接続エラー: {e}")
@@ -47,15 +47,29 @@ class PostgresConnector:
     def get_table_row_count(self, table_name):
         """テーブルの行数を取得"""
         return get_table_row_count(self.conn, table_name)
+
+    def estimate_table_rows(self, table_name):
+        """テーブルの推定行数 (統計情報から, テーブルは走査しない)"""
+        return estimate_table_rows(self.conn, table_name)
+
+    def estimate_query_rows(self, query):
+        """クエリ結果の推定行数 (EXPLAIN から, クエリは実行しない)"""
+        return estimate_query_rows(self.conn, query)
         
     def get_binary_data(self, table_name, limit=None, offset=None, query=None):
         """テーブルのバイナリデータを取得"""
         return get_binary_data(self.conn, table_name, limit, offset, query)
+
+    def iter_binary_data(self, table_name, limit=None, offset=None, query=None, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                         columns=None):
+        """テーブルのバイナリデータを行境界揃えのチャンクとして順次取得"""
+        return iter_binary_data(self.conn, table_name, limit, offset, query, chunk_bytes, columns)
         
     def close(self):
-        """接続を閉じる"""
+        """接続をプールへ返却する"""
         if self.conn:
-            self.conn.close()
+            get_pool(self.dsn).putconn(self.conn)
+            self.conn = None
 
     def copy_to_gpu(self,
         query: str,
@@ -72,16 +86,17 @@ class PostgresConnector:
             (gpu_dev_array, nbytes) を受け取るコールバック
         chunk_bytes : int
             1チャンクのバイト数
+
+        Returns
+        -------
+        dict
+            転送統計 (chunks / bytes / rows / pinned)
         """
-        # DSN文字列を再構築
-        dsn = f"dbname={self.dbname} user={self.user} password={self.password} host={self.host}"
-        copy_binary_to_gpu_chunks(dsn, query, chunk_bytes, process_chunk)
+        return copy_binary_to_gpu_chunks(self.dsn, query, chunk_bytes, process_chunk)
 
 def connect_to_postgres(dbname='postgres', user='postgres', password='postgres', host='localhost'):
-    """PostgreSQLへの接続を確立する"""
-    dsn = f"dbname='{dbname}' user='{user}' password='{password}' host='{host}'"
-    conn = psycopg.connect(dsn)
-    return conn
+    """PostgreSQLへの接続を確立する (呼び出し側が close する単独の接続。繰り返し使う場合は pg_pool.get_pool)"""
+    return psycopg.connect(build_dsn(dbname, user, password, host))
 
 def check_table_exists(conn, table_name: str) -> bool:
     """テーブルの存在確認"""
@@ -121,7 +136,11 @@ def get_table_info(conn, table_name: str) -> List[ColumnMeta]: # Changed ColumnI
     return columns
 
 def get_table_row_count(conn, table_name: str) -> int:
-    """テーブルの行数取得"""
+    """テーブルの行数取得
+
+    ``COUNT(*)`` でテーブル全体を走査するため、大きなテーブルでは COPY と同じだけ時間がかかる。
+    チャンク計画などの目安には estimate_table_rows を使う。
+    """
     cur = conn.cursor()
     cur.execute(f"SELECT COUNT(*) FROM {table_name}")
     row_count = cur.fetchone()[0]
@@ -129,6 +148,44 @@ def get_table_row_count(conn, table_name: str) -> int:
     print(f"Table {table_name} has {row_count} rows")  # デバッグ出力
     return row_count
 
+def estimate_table_rows(conn, table_name: str) -> Optional[int]:
+    """統計情報 (pg_class.reltuples / relpages) からテーブルの行数を推定する
+
+    プランナと同じく、最後の ANALYZE 時点の行密度 reltuples / relpages に現在のページ数を掛ける。
+    一度も ANALYZE / VACUUM されていない (reltuples < 0) 場合や、テーブルが無い場合は None。
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT reltuples::float8, relpages::int8,
+                   pg_relation_size(oid) / current_setting('block_size')::int8
+            FROM pg_class WHERE oid = to_regclass(%s)
+        """, (table_name,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if row is None:
+        return None
+    reltuples, relpages, curpages = row
+    if reltuples < 0:
+        return None
+    if relpages > 0:
+        return int(round(reltuples / relpages * curpages))
+    return int(reltuples)
+
+def estimate_query_rows(conn, query: str) -> Optional[int]:
+    """``EXPLAIN (FORMAT JSON)`` のプラン最上位ノードの推定行数 (クエリは実行しない)"""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = cur.fetchone()[0]
+    finally:
+        cur.close()
+    if isinstance(plan, str):
+        import json
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
 def get_query_column_info(conn, query: str) -> List[ColumnMeta]: # Changed ColumnInfo to ColumnMeta
     """SQLクエリの結果セットのカラム情報を取得
 
@@ -208,14 +265,7 @@ def get_binary_data(conn, table_name: str, limit: Optional[int] = None, offset:
     # バイナリデータを一時的にメモリに保存
     buffer = io.BytesIO()
     
-    if query is not None:
-        # カスタムクエリが指定された場合はそれを使用
-        sql_query = query
-    else:
-        # LIMITとOFFSETの設定
-        limit_clause = f"LIMIT {limit}" if limit is not None else ""
-        offset_clause = f"OFFSET {offset}" if offset is not None else ""
-        sql_query = f"SELECT * FROM {table_name} {limit_clause} {offset_clause}"
+    sql_query = _build_select_query(table_name, limit, offset, query)
     
     print(f"実行クエリ: {sql_query}")
     # Use cursor.copy() for psycopg (v3)
@@ -247,6 +297,71 @@ def get_binary_data(conn, table_name: str, limit: Optional[int] = None, offset:
     return buffer_data, buffer
 
 
+def iter_binary_data(conn, table_name: str, limit: Optional[int] = None, offset: Optional[int] = None,
+                     query: Optional[str] = None,
+                     chunk_bytes: Union[int, Callable[[], int]] = DEFAULT_CHUNK_BYTES,
+                     columns: Optional[Sequence[str]] = None) -> Iterator[CopyChunk]:
+    """テーブルのバイナリデータをストリーミングで取得
+
+    get_binary_data と異なり結果全体をメモリに保持せず、``cursor.copy()`` から
+    受信したデータを chunk_bytes 単位の行境界揃えバッファとして順次返す。
+
+    Args:
+        conn: PostgreSQL接続
+        table_name: テーブル名
+        limit: 取得する最大行数
+        offset: 取得開始位置（行オフセット）
+        query: カスタムSQLクエリ（指定された場合は他のパラメータより優先）
+        chunk_bytes: 1チャンクのバイト数 (``StreamPlanner.chunk_bytes`` のような callable も可, ``iter_copy_chunks`` を参照)
+        columns: 取得する列名 (None なら全列)。COPY するクエリの SELECT リストを書き換えるので、
+            射影外の列はサーバから送られない
+
+    Yields:
+        CopyChunk: 行境界で終わるバイナリデータ (先頭チャンクのみヘッダ付き)
+    """
+    sql_query = _build_select_query(table_name, limit, offset, query, columns)
+    print(f"実行クエリ (streaming): {sql_query}")
+    cur = conn.cursor()
+    try:
+        with cur.copy(f"COPY ({sql_query}) TO STDOUT (FORMAT BINARY)") as copy:
+            yield from iter_copy_chunks(copy, chunk_bytes)
+    finally:
+        cur.close()
+
+
+def quote_ident(name: str) -> str:
+    """SQL 識別子として引用する (大文字・記号を含む列名もそのまま指定できる)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def select_list(columns: Optional[Sequence[str]] = None) -> str:
+    """列名のリスト → SELECT リスト (None は "*")"""
+    if columns is None:
+        return "*"
+    if not columns:
+        raise ValueError("columns must not be empty")
+    return ", ".join(quote_ident(c) for c in columns)
+
+
+def project_query(query: str, columns: Optional[Sequence[str]]) -> str:
+    """任意の SELECT 文を columns だけを返すクエリに書き換える (columns=None ならそのまま)"""
+    if columns is None:
+        return query
+    return f"SELECT {select_list(columns)} FROM ({query.strip().rstrip(';')}) AS _q"
+
+
+def _build_select_query(table_name: str, limit: Optional[int], offset: Optional[int], query: Optional[str],
+                        columns: Optional[Sequence[str]] = None) -> str:
+    """COPY 対象の SELECT 文を組み立てる"""
+    if query is not None:
+        # カスタムクエリが指定された場合はそれを使用 (射影時は外側の SELECT で列を絞る)
+        return project_query(query, columns)
+    # LIMITとOFFSETの設定
+    limit_clause = f"LIMIT {limit}" if limit is not None else ""
+    offset_clause = f"OFFSET {offset}" if offset is not None else ""
+    return f"SELECT {select_list(columns)} FROM {table_name} {limit_clause} {offset_clause}"
+
+
 # ----------------------------------------------------------------------
 # Arrow ColumnMeta ベースでカラムメタデータを取得する新関数
 # ----------------------------------------------------------------------
@@ -0,0 +1,425 @@
+"""
+ctid (ブロック) 範囲によるサーバ側並列 COPY
+------------------------------------------
+1 本の ``COPY (SELECT * FROM t) TO STDOUT`` は 1 バックエンドのシリアライズ速度で
+頭打ちになるため、テーブルをヒープのブロック範囲に分割し、N 本の接続で
+
+    COPY (SELECT * FROM t WHERE ctid >= '(a,0)'::tid AND ctid < '(b,0)'::tid) TO STDOUT (FORMAT BINARY)
+
+を同時に実行する (PostgreSQL 14 以降は TID Range Scan で該当ブロックだけを読む)。
+
+* ブロック数は ``pg_relation_size(t) / block_size`` で求める。
+  最後の範囲は上限なしにして、計測後に追加されたブロックも取りこぼさない
+* ``consistent=True`` (既定) では調整用接続で ``pg_export_snapshot()`` したスナップショットを
+  全接続で ``SET TRANSACTION SNAPSHOT`` し、パーティション間で同じ時点のデータを読む
+* 各パーティションのストリームは ``iter_copy_chunks`` で行境界揃えの CopyChunk にし、
+  ``CopyChunk.partition`` にパーティション番号を入れて 1 本の iterator に合流する。
+  ``ordered=True`` ではパーティション順 (= ブロック順) に、False では到着順に返す
+
+返す CopyChunk は各パーティションの先頭チャンクが COPY ヘッダを含む
+(``header_size`` が 0 以外)。``run_pipeline`` へそのまま渡せる。
+各接続は ``pg_pool.get_pool(dsn)`` から借りて返却するので、同じプロセスで
+読み直すときは接続確立を繰り返さない。
+
+チャンク指定 (ChunkSpec)
+------------------------
+LIMIT/OFFSET による分割はオフセットに比例して走査コストが増え、順序も不定なため
+使わない。テーブルの分割は以下の ChunkSpec で表し、プロセッサ・Ray・multiprocessing の
+各ドライバが共通に使う。同じ plan_* で作ったチャンク群は互いに素で全行を覆う。
+
+* ``CtidRange``     : ヒープブロック範囲。TID Range Scan で O(チャンク)
+* ``KeyRangeChunk`` : 整数キーの範囲 ``lo <= k < hi``。k に索引があれば O(チャンク)
+* ``HashChunk``     : ``(hashtext(k::text) & 2147483647) % N = i``。
+                      キーに偏りがあっても均等だが、各チャンクがテーブル全体を走査する
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+from .pg_pool import get_pool
+from .psql_copy_stream import CopyChunk, DEFAULT_CHUNK_BYTES, iter_copy_chunks
+
+DEFAULT_QUEUE_DEPTH = 2     # パーティションごとに先読みするチャンク数
+_DONE = object()
+
+
+class ChunkSpec:
+    """テーブルの 1 チャンクを表す WHERE 条件 (サブクラスが where_clause を実装する)"""
+    index: int
+
+    def where_clause(self) -> str:
+        raise NotImplementedError
+
+    def query(self, table_name: str, columns: str = "*") -> str:
+        """このチャンクを取り出す SELECT 文"""
+        return f"SELECT {columns} FROM {table_name} WHERE {self.where_clause()}"
+
+
+@dataclass(frozen=True)
+class CtidRange(ChunkSpec):
+    """ヒープブロック [start_block, end_block) の範囲 (end_block=None は上限なし)"""
+    index: int
+    start_block: int
+    end_block: Optional[int]
+
+    def where_clause(self) -> str:
+        conds = []
+        if self.start_block > 0:
+            conds.append(f"ctid >= '({self.start_block},0)'::tid")
+        if self.end_block is not None:
+            conds.append(f"ctid < '({self.end_block},0)'::tid")
+        return " AND ".join(conds) if conds else "TRUE"
+
+
+@dataclass(frozen=True)
+class KeyRangeChunk(ChunkSpec):
+    """
+    キー範囲 [lo, hi) (lo=None / hi=None は下限 / 上限なし)。
+    include_nulls=True のチャンク (先頭) はキーが NULL の行も含む。
+    """
+    index: int
+    key: str
+    lo: Optional[int]
+    hi: Optional[int]
+    include_nulls: bool = False
+
+    def where_clause(self) -> str:
+        conds = []
+        if self.lo is not None:
+            conds.append(f"{self.key} >= {int(self.lo)}")
+        if self.hi is not None:
+            conds.append(f"{self.key} < {int(self.hi)}")
+        cond = " AND ".join(conds) if conds else f"{self.key} IS NOT NULL"
+        if self.include_nulls:
+            cond = f"({cond} OR {self.key} IS NULL)"
+        return cond
+
+
+@dataclass(frozen=True)
+class HashChunk(ChunkSpec):
+    """キーのハッシュ値による N 分割の i 番目 (先頭はキーが NULL の行も含む)"""
+    index: int
+    key: str
+    modulus: int
+
+    def where_clause(self) -> str:
+        # abs(hashtext(..)) は INT_MIN で桁あふれするため符号ビットを落として剰余を取る
+        cond = f"(hashtext({self.key}::text) & 2147483647) % {self.modulus} = {self.index}"
+        if self.index == 0:
+            cond = f"({cond} OR {self.key} IS NULL)"
+        return cond
+
+
+def split_ctid_ranges(nblocks: int, parts: int) -> List[CtidRange]:
+    """
+    0..nblocks のブロックを parts 個のほぼ等しい範囲に分ける。
+    パーティション数はブロック数を超えない (最低 1)。最後の範囲は上限なし。
+    """
+    if parts < 1:
+        raise ValueError("parts must be >= 1")
+    parts = max(1, min(parts, nblocks))
+    bounds = [nblocks * i // parts for i in range(parts + 1)]
+    return [
+        CtidRange(i, bounds[i], None if i == parts - 1 else bounds[i + 1])
+        for i in range(parts)
+    ]
+
+
+def table_block_count(conn, table_name: str) -> int:
+    """テーブルのヒープのブロック数 (pg_relation_size / block_size)"""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::int",
+            (table_name,),
+        )
+        return int(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+
+def split_key_range(lo: int, hi: int, parts: int, key: str) -> List[KeyRangeChunk]:
+    """
+    整数キーの [lo, hi] (両端を含む) を parts 個の範囲に分ける。
+    先頭は下限なし + NULL 込み、最後は上限なしにして範囲外の値も取りこぼさない。
+    """
+    if parts < 1:
+        raise ValueError("parts must be >= 1")
+    span = hi - lo + 1
+    parts = max(1, min(parts, span))
+    bounds = [lo + span * i // parts for i in range(parts + 1)]
+    return [
+        KeyRangeChunk(
+            i, key,
+            None if i == 0 else bounds[i],
+            None if i == parts - 1 else bounds[i + 1],
+            include_nulls=(i == 0),
+        )
+        for i in range(parts)
+    ]
+
+
+def plan_ctid_chunks(conn, table_name: str, parts: int) -> List[CtidRange]:
+    """テーブルのブロック数から ctid 範囲のチャンクを作る"""
+    return split_ctid_ranges(table_block_count(conn, table_name), parts)
+
+
+def plan_key_range_chunks(conn, table_name: str, key: str, parts: int) -> List[KeyRangeChunk]:
+    """
+    整数キー (主キーなど) の min / max を等分したチャンクを作る。
+    min / max は索引があれば O(log n)。値の分布に偏りがあるとチャンクの行数も偏る。
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT min({key}), max({key}) FROM {table_name}")
+        lo, hi = cur.fetchone()
+    finally:
+        cur.close()
+    if lo is None:
+        return [KeyRangeChunk(0, key, None, None, include_nulls=True)]
+    return split_key_range(int(lo), int(hi), parts, key)
+
+
+def plan_hash_chunks(key: str, parts: int) -> List[HashChunk]:
+    """キーのハッシュ値で parts 分割したチャンクを作る"""
+    if parts < 1:
+        raise ValueError("parts must be >= 1")
+    return [HashChunk(i, key, parts) for i in range(parts)]
+
+
+def plan_chunks(conn, table_name: str, parts: int, method: str = "ctid", key: Optional[str] = None) -> List[ChunkSpec]:
+    """
+    method ("ctid" / "key" / "hash") に応じたチャンク群を作る。
+    "key" / "hash" は key (列名) が必要。
+    """
+    if method == "ctid":
+        return plan_ctid_chunks(conn, table_name, parts)
+    if method not in ("key", "hash"):
+        raise ValueError(f"unknown chunk method: {method!r} (expected 'ctid', 'key' or 'hash')")
+    if not key:
+        raise ValueError(f"chunk method {method!r} requires a key column")
+    if method == "key":
+        return plan_key_range_chunks(conn, table_name, key, parts)
+    return plan_hash_chunks(key, parts)
+
+
+def partition_query(table_name: str, spec: ChunkSpec, columns: str = "*") -> str:
+    """パーティション 1 個分の SELECT 文"""
+    return spec.query(table_name, columns)
+
+
+# ----------------------------------------------------------------------
+# ストリームの合流
+# ----------------------------------------------------------------------
+class _PartitionError:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _pump(part: int, stream: Iterable[CopyChunk], q: queue.Queue, stop: threading.Event):
+    it = iter(stream)
+    try:
+        for chunk in it:
+            chunk.partition = part
+            if not _put(q, chunk, stop):
+                return
+    except BaseException as e:   # noqa: BLE001  (合流側で再送出する)
+        _put(q, _PartitionError(e), stop)
+        return
+    finally:
+        # 途中で止めた場合も COPY の後始末と接続の返却 (putconn) をこのスレッドで行う
+        # (GC に任せると別スレッド・任意の時点で generator の finally が走る)
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+    _put(q, (_DONE, part), stop)
+
+
+def merge_partition_streams(
+    streams: List[Iterable[CopyChunk]],
+    ordered: bool = False,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+) -> Iterator[CopyChunk]:
+    """
+    パーティションごとの CopyChunk ストリームをスレッドで並行に読み、1 本に合流する。
+
+    Parameters
+    ----------
+    streams : list of iterable of CopyChunk
+        パーティション順に並べたストリーム (各スレッド内で iterate される)
+    ordered : bool
+        True ならパーティション 0 の全チャンク → 1 → ... の順に返す
+        (後続パーティションは queue_depth 個まで先読みして待つ)。
+        False なら到着順 (パーティション内の順序は保たれる)
+    queue_depth : int
+        パーティションあたりの先読みチャンク数
+    """
+    stop = threading.Event()
+    if ordered:
+        queues = [queue.Queue(maxsize=queue_depth) for _ in streams]
+    else:
+        shared = queue.Queue(maxsize=queue_depth * max(len(streams), 1))
+        queues = [shared] * len(streams)
+    threads = [
+        threading.Thread(target=_pump, args=(i, s, queues[i], stop), name=f"copy-part-{i}", daemon=True)
+        for i, s in enumerate(streams)
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        if ordered:
+            for q in queues:
+                while True:
+                    item = q.get()
+                    if isinstance(item, tuple) and item[0] is _DONE:
+                        break
+                    if isinstance(item, _PartitionError):
+                        raise item.exc
+                    yield item
+        else:
+            remaining = len(streams)
+            while remaining:
+                item = shared.get()
+                if isinstance(item, tuple) and item[0] is _DONE:
+                    remaining -= 1
+                    continue
+                if isinstance(item, _PartitionError):
+                    raise item.exc
+                yield item
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+# ----------------------------------------------------------------------
+# 並列 COPY リーダ
+# ----------------------------------------------------------------------
+@contextmanager
+def _repeatable_read(conn):
+    """プールの接続を REPEATABLE READ で使い、返却前に既定の分離レベルへ戻す"""
+    import psycopg
+
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    try:
+        yield conn
+    finally:
+        if not conn.closed and conn.info.transaction_status != psycopg.pq.TransactionStatus.ACTIVE:
+            conn.rollback()
+            conn.isolation_level = None
+
+
+def _copy_partition(dsn: str, query: str, chunk_bytes: Union[int, Callable[[], int]], snapshot: Optional[str]) -> Iterator[CopyChunk]:
+    from psycopg import sql
+
+    with get_pool(dsn).connection() as conn:
+        with _repeatable_read(conn) if snapshot is not None else nullcontext(conn):
+            if snapshot is not None:
+                conn.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot)))
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY ({query}) TO STDOUT (FORMAT BINARY)") as copy:
+                    yield from iter_copy_chunks(copy, chunk_bytes)
+
+
+class ParallelCopyReader:
+    """
+    テーブルを ctid 範囲で分割し、partitions 本の接続で並列に COPY BINARY するリーダ
+
+    iterate すると行境界揃えの CopyChunk を返す (``run_pipeline`` / ``decode_copy_stream``
+    の入力にできる)。
+
+    Parameters
+    ----------
+    dsn : str
+        psycopg.connect に渡す接続文字列 (パーティションごとに接続する)
+    table_name : str
+    partitions : int
+        並列接続数 (ブロック数が少ない場合は減らす)
+    chunk_bytes : int or callable
+        各パーティションの CopyChunk の目標バイト数 (callable は ``iter_copy_chunks`` を参照)
+    ordered : bool
+        True ならブロック順 (パーティション順) に返す
+    consistent : bool
+        True なら全接続で同じスナップショットを使う
+    columns : str
+        SELECT する列リスト (既定 "*")
+    specs : list[ChunkSpec], optional
+        パーティションの分け方。省略時はブロック数から ctid 範囲を作る
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        table_name: str,
+        partitions: int = 4,
+        chunk_bytes: Union[int, Callable[[], int]] = DEFAULT_CHUNK_BYTES,
+        ordered: bool = False,
+        consistent: bool = True,
+        columns: str = "*",
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        specs: Optional[List[ChunkSpec]] = None,
+    ):
+        self.dsn = dsn
+        self.table_name = table_name
+        self.partitions = partitions
+        self.chunk_bytes = chunk_bytes
+        self.ordered = ordered
+        self.consistent = consistent
+        self.columns = columns
+        self.queue_depth = queue_depth
+        self.specs = specs
+        self.ranges: List[ChunkSpec] = list(specs) if specs is not None else []
+
+    def queries(self, nblocks: Optional[int] = None) -> List[str]:
+        if self.specs is None:
+            self.ranges = split_ctid_ranges(nblocks, self.partitions)
+        return [partition_query(self.table_name, r, self.columns) for r in self.ranges]
+
+    def __iter__(self) -> Iterator[CopyChunk]:
+        with get_pool(self.dsn).connection() as coord, \
+                _repeatable_read(coord) if self.consistent else nullcontext(coord):
+            snapshot = None
+            if self.consistent:
+                # スナップショットは調整用トランザクションが開いている間だけ有効
+                snapshot = coord.execute("SELECT pg_export_snapshot()").fetchone()[0]
+            nblocks = table_block_count(coord, self.table_name) if self.specs is None else None
+            streams = [
+                _copy_partition(self.dsn, q, self.chunk_bytes, snapshot)
+                for q in self.queries(nblocks)
+            ]
+            print(f"[ParallelCopyReader] {self.table_name}: {len(streams)} partitions")
+            yield from merge_partition_streams(streams, self.ordered, self.queue_depth)
+
+
+__all__ = [
+    "ChunkSpec",
+    "CtidRange",
+    "KeyRangeChunk",
+    "HashChunk",
+    "ParallelCopyReader",
+    "merge_partition_streams",
+    "partition_query",
+    "plan_chunks",
+    "plan_ctid_chunks",
+    "plan_hash_chunks",
+    "plan_key_range_chunks",
+    "split_ctid_ranges",
+    "split_key_range",
+    "table_block_count",
+]
@@ -0,0 +1,311 @@
+"""PostgreSQL 接続プールとメタデータキャッシュ (プロセス単位)
+
+チャンクごとに ``psycopg.connect`` → テーブル存在確認 → 列情報取得 を繰り返すと、
+1 チャンクの準備に接続確立 (TCP + 認証) と数回の往復がかかる。ここでは
+
+* ``ConnectionPool`` : DSN ごとのアイドル接続を使い回す (psycopg_pool 相当の最小実装)
+* ``MetadataCache``  : ``(dsn, query)`` をキーに ColumnMeta のリストを保持する
+
+をプロセスに 1 つずつ持ち、同じワーカで 2 チャンク目以降の準備の往復を 0 にする。
+
+キャッシュの無効化
+------------------
+エントリは対象テーブルの ``pg_class`` 行の ``(oid, relfilenode, xmin)`` を記録する。
+ALTER TABLE / TRUNCATE / DROP + CREATE で pg_class 行が書き換わるとこの値が変わる。
+前回の確認から ``revalidate_s`` 秒以内はサーバに問い合わせずにキャッシュを返し、
+それを過ぎたら 1 往復で値を確認して、変わっていれば列情報を取り直す。
+既定値は環境変数 ``GPUPASER_META_REVALIDATE_S`` (未設定なら 10 秒, 0 で毎回確認)。
+
+fork したプロセスは親の接続を使えないため、プール / キャッシュは PID が変わったら
+作り直す (親の接続は子で close しない。close するとサーバ側のセッションが切れる)。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from .meta_fetch import ColumnMeta, fetch_column_meta
+
+DEFAULT_MAX_IDLE = 8
+DEFAULT_REVALIDATE_S = float(os.environ.get("GPUPASER_META_REVALIDATE_S", "10"))
+
+
+def build_dsn(dbname: str = "postgres", user: str = "postgres", password: str = "postgres",
+              host: str = "localhost") -> str:
+    """個別パラメータから psycopg 用の DSN 文字列を作る"""
+    return f"dbname='{dbname}' user='{user}' password='{password}' host='{host}'"
+
+
+def _psycopg_connect(dsn: str):
+    import psycopg
+    return psycopg.connect(dsn)
+
+
+def _is_reusable(conn) -> bool:
+    """返却された接続を再利用できるか (トランザクション中ならロールバックする)"""
+    if getattr(conn, "closed", False) or getattr(conn, "broken", False):
+        return False
+    try:
+        from psycopg.pq import TransactionStatus
+        status = conn.info.transaction_status
+        if status == TransactionStatus.IDLE:
+            return True
+        if status in (TransactionStatus.INTRANS, TransactionStatus.INERROR):
+            conn.rollback()
+            return True
+        return False    # ACTIVE (COPY 途中など) / UNKNOWN
+    except Exception:   # noqa: BLE001  (壊れた接続は捨てる)
+        return False
+
+
+class ConnectionPool:
+    """
+    1 つの DSN に対するアイドル接続のプール (スレッドセーフ)。
+
+    ``getconn`` はアイドル接続があればそれを、なければ新しく接続して返す
+    (同時に使う接続数は制限しない)。``putconn`` で返却された接続は
+    トランザクションを閉じてからアイドルに戻し、``max_idle`` を超えた分は閉じる。
+
+    Parameters
+    ----------
+    dsn : str
+    max_idle : int
+        保持するアイドル接続の最大数
+    connect : callable, optional
+        ``connect(dsn)`` で新しい接続を返す関数 (既定 psycopg.connect)
+    """
+
+    def __init__(self, dsn: str, max_idle: int = DEFAULT_MAX_IDLE,
+                 connect: Optional[Callable[[str], Any]] = None):
+        self.dsn = dsn
+        self.max_idle = max_idle
+        self._connect = connect or _psycopg_connect
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self.connects = 0    # 新規接続した回数
+        self.reuses = 0      # アイドル接続を再利用した回数
+
+    def getconn(self):
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not getattr(conn, "closed", False):
+                    self.reuses += 1
+                    return conn
+            self.connects += 1
+        return self._connect(self.dsn)
+
+    def putconn(self, conn) -> None:
+        if conn is None:
+            return
+        if _is_reusable(conn):
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        try:
+            conn.close()
+        except Exception:   # noqa: BLE001
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """``with pool.connection() as conn:`` で借りて、抜けるときに返却する"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self) -> None:
+        """アイドル接続をすべて閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:   # noqa: BLE001
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"idle": len(self._idle), "connects": self.connects, "reuses": self.reuses}
+
+
+# ----------------------------------------------------------------------
+# メタデータキャッシュ
+# ----------------------------------------------------------------------
+RelationStamp = Tuple[int, int, str]    # (oid, relfilenode, xmin)
+
+
+def relation_stamp(conn, table_name: str) -> Optional[RelationStamp]:
+    """テーブルの pg_class 行の (oid, relfilenode, xmin)。存在しなければ None"""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT oid::int8, relfilenode::int8, xmin::text FROM pg_class WHERE oid = to_regclass(%s)",
+            (table_name,),
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    return None if row is None else (int(row[0]), int(row[1]), str(row[2]))
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    stamp: Any
+    checked_at: float
+
+
+class MetadataCache:
+    """
+    ``(dsn, query)`` → メタデータ のキャッシュ (スレッドセーフ)。
+
+    Parameters
+    ----------
+    revalidate_s : float
+        前回の確認からこの秒数以内は stamp を問い合わせずにキャッシュを返す
+    clock : callable
+        現在時刻 (秒) を返す関数 (既定 time.monotonic)
+    """
+
+    def __init__(self, revalidate_s: float = DEFAULT_REVALIDATE_S,
+                 clock: Callable[[], float] = time.monotonic):
+        self.revalidate_s = revalidate_s
+        self._clock = clock
+        self._entries: Dict[Hashable, _CacheEntry] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.validations = 0
+
+    def get(self, key: Hashable, stamp: Callable[[], Any], load: Callable[[], Any]) -> Any:
+        """
+        key のキャッシュ値を返す。
+
+        revalidate_s を過ぎていれば ``stamp()`` を呼び、記録した値と同じならそのまま、
+        違えば (またはエントリが無ければ) ``load()`` で取り直して保存する。
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked_at < self.revalidate_s:
+                self.hits += 1
+                return entry.value
+
+        current = stamp()
+        with self._lock:
+            self.validations += 1
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == current:
+                entry.checked_at = now
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+
+        value = load()
+        with self._lock:
+            self._entries[key] = _CacheEntry(value, current, now)
+        return value
+
+    def table_columns(self, conn, dsn: str, table_name: str, query: Optional[str] = None) -> List[ColumnMeta]:
+        """
+        table_name を読む query (既定 ``SELECT * FROM table_name``) の ColumnMeta。
+
+        テーブル存在確認と列情報取得を兼ねる。テーブルが無ければ ValueError。
+        """
+        query = query or f"SELECT * FROM {table_name}"
+
+        def stamp():
+            s = relation_stamp(conn, table_name)
+            if s is None:
+                self.invalidate(dsn, query)
+                raise ValueError(f"Table {table_name} does not exist")
+            return s
+
+        return self.get((dsn, query), stamp, lambda: fetch_column_meta(conn, query))
+
+    def invalidate(self, dsn: Optional[str] = None, query: Optional[str] = None) -> None:
+        """エントリを捨てる (引数なしで全件, dsn のみでその DSN の全件)"""
+        with self._lock:
+            if dsn is None:
+                self._entries.clear()
+            elif query is not None:
+                self._entries.pop((dsn, query), None)
+            else:
+                for k in [k for k in self._entries if isinstance(k, tuple) and k[0] == dsn]:
+                    del self._entries[k]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "validations": self.validations}
+
+
+# ----------------------------------------------------------------------
+# プロセス単位のインスタンス
+# ----------------------------------------------------------------------
+_pid = os.getpid()
+_pools: Dict[str, ConnectionPool] = {}
+_metadata_cache: Optional[MetadataCache] = None
+_forked_pools: List[ConnectionPool] = []    # 親の接続 (子では触らず参照だけ保持する)
+_registry_lock = threading.Lock()
+
+
+def _check_fork() -> None:
+    global _pid, _pools, _metadata_cache
+    if os.getpid() != _pid:
+        _forked_pools.extend(_pools.values())
+        _pools = {}
+        _metadata_cache = None
+        _pid = os.getpid()
+
+
+def get_pool(dsn: str) -> ConnectionPool:
+    """このプロセスで dsn に対して共有する ConnectionPool"""
+    with _registry_lock:
+        _check_fork()
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = ConnectionPool(dsn)
+        return pool
+
+
+def get_metadata_cache() -> MetadataCache:
+    """このプロセスで共有する MetadataCache"""
+    global _metadata_cache
+    with _registry_lock:
+        _check_fork()
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache()
+        return _metadata_cache
+
+
+def close_pools() -> None:
+    """このプロセスのプールのアイドル接続をすべて閉じる"""
+    with _registry_lock:
+        _check_fork()
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+__all__ = [
+    "ConnectionPool",
+    "MetadataCache",
+    "build_dsn",
+    "relation_stamp",
+    "get_pool",
+    "get_metadata_cache",
+    "close_pools",
+    "DEFAULT_MAX_IDLE",
+    "DEFAULT_REVALIDATE_S",
+]
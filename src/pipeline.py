@@ -0,0 +1,338 @@
+"""
+COPY 受信 → GPU 変換 → 書き出し のパイプライン実行
+--------------------------------------------------
+3 ステージを有界キューでつなぎ、各ステージを重ねて実行する。
+
+* reader スレッド : COPY ストリーム (CopyChunk の iterable) からホストバッファを受信
+* GPU ステージ    : 呼び出し元スレッドで H2D 転送 (PinnedBufferRing の stream) →
+                    ``parse_binary_chunk_gpu`` → ``decode_chunk``。
+                    チャンク k の転送を発行してからチャンク k-1 を変換する
+* writer スレッド : RecordBatch を sink へ書き出す
+
+``replay_batches`` は同じ reader / writer で、保存済みの RecordBatch
+(IPC ファイルなど) を変換なしに sink へ流す (書き出し側のベンチマーク用)。
+
+キューの長さ (queue_depth) でホスト側に溜まるチャンク / バッチ数が抑えられ、
+遅いステージが前段を待たせる (バックプレッシャ)。各ステージの処理時間と
+待ち時間を ``PipelineStats`` に記録し、どこが律速かを確認できる。
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
+
+import pyarrow as pa
+
+from .cpu_decoder import decode_chunk_cpu
+from .cpu_parse_utils import parse_binary_chunk_cpu
+from .device_table import DeviceTable
+from .gpu_decoder_v2 import decode_chunk
+from .predicate import compile_predicate
+from .gpu_parse_wrapper import parse_binary_chunk_gpu
+from .psql_copy_stream import CopyChunk, DEFAULT_CHUNK_BYTES, transfer_chunks_to_gpu
+from .type_map import ColumnMeta
+
+DEFAULT_QUEUE_DEPTH = 2
+_DONE = object()    # キュー終端
+
+
+@dataclass
+class StageStats:
+    """1 ステージ分の計測値 (秒)"""
+    busy_s: float = 0.0    # 処理に使った時間
+    wait_s: float = 0.0    # 前段 / 後段のキューを待った時間
+    items: int = 0
+
+
+@dataclass
+class PipelineStats:
+    """パイプライン全体の計測値"""
+    fetch: StageStats = field(default_factory=StageStats)
+    decode: StageStats = field(default_factory=StageStats)
+    write: StageStats = field(default_factory=StageStats)
+    wall_s: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+
+    @property
+    def bottleneck(self) -> str:
+        """処理時間が最も長いステージ名 ("fetch" / "decode" / "write")"""
+        stages = {"fetch": self.fetch, "decode": self.decode, "write": self.write}
+        return max(stages, key=lambda k: stages[k].busy_s)
+
+    def report(self) -> str:
+        lines = [f"[pipeline] {self.rows} rows / {self.bytes / 1024 ** 2:.1f} MB in {self.wall_s:.3f}s"]
+        for name in ("fetch", "decode", "write"):
+            s = getattr(self, name)
+            lines.append(f"  {name:<6}: busy {s.busy_s:8.3f}s  wait {s.wait_s:8.3f}s  items {s.items}")
+        lines.append(f"  bottleneck: {self.bottleneck}")
+        return "\n".join(lines)
+
+
+class _StageError:
+    """別スレッドで発生した例外をキュー経由で伝える"""
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """stop が立つまで put を試みる (False = 中断)"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _reader(chunks: Iterable[CopyChunk], out_q: queue.Queue, stats: StageStats, stop: threading.Event):
+    it = iter(chunks)
+    try:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                chunk = next(it)
+            except StopIteration:
+                break
+            stats.busy_s += time.perf_counter() - t0
+            stats.items += 1
+            t0 = time.perf_counter()
+            if not _put(out_q, chunk, stop):
+                return
+            stats.wait_s += time.perf_counter() - t0
+    except BaseException as e:   # noqa: BLE001  (GPU ステージで再送出する)
+        _put(out_q, _StageError(e), stop)
+        return
+    _put(out_q, _DONE, stop)
+
+
+def _writer(write: Callable, in_q: queue.Queue, stats: StageStats, errors: list):
+    while True:
+        t0 = time.perf_counter()
+        batch = in_q.get()
+        stats.wait_s += time.perf_counter() - t0
+        if batch is _DONE:
+            return
+        if errors:
+            continue    # 失敗後は GPU ステージを止めないよう読み捨てる
+        t0 = time.perf_counter()
+        try:
+            write(batch)
+        except BaseException as e:   # noqa: BLE001
+            errors.append(e)
+        stats.busy_s += time.perf_counter() - t0
+        stats.items += 1
+
+
+def _drain(in_q: queue.Queue, stats: StageStats) -> Iterator[CopyChunk]:
+    """reader のキューを CopyChunk の iterator として読む (待ち時間を計上)"""
+    while True:
+        t0 = time.perf_counter()
+        item = in_q.get()
+        stats.wait_s += time.perf_counter() - t0
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.exc
+        yield item
+
+
+def run_pipeline(
+    chunks: Iterable[CopyChunk],
+    columns: List[ColumnMeta],
+    sink,
+    backend: str = "gpu",
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    threads_per_block: int = 256,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    num_buffers: int = 2,
+    output: str = "arrow",
+    projection: Optional[Sequence[Union[int, str]]] = None,
+    predicate=None,
+) -> PipelineStats:
+    """
+    CopyChunk の列を変換して sink へ書き出す。
+
+    Parameters
+    ----------
+    chunks : iterable of CopyChunk
+        ``iter_copy_chunks`` / ``iter_binary_data`` の戻り値など (reader スレッドで消費する)
+    columns : list[ColumnMeta]
+        COPY ストリームの全列
+    sink : callable or object with ``write_batch``
+        RecordBatch を受け取る書き出し先 (``output_handler.ArrowParquetSink`` など)。
+        writer スレッドから呼ばれる
+    backend : {"gpu", "cpu"}
+        "cpu" は parse_binary_chunk_cpu + decode_chunk_cpu で変換する (GPU 無し環境・比較用)
+    queue_depth : int
+        reader → GPU, GPU → writer の各キューの長さ
+    threads_per_block : int
+        parse_binary_chunk_gpu のブロックサイズ
+    chunk_bytes, num_buffers
+        H2D 転送用 PinnedBufferRing の初期サイズとバッファ数
+    output : {"arrow", "device"}
+        "device" では sink へ RecordBatch の代わりに GPU 常駐の DeviceTable を渡す
+        (backend="cpu" ではデコード結果を GPU へ転送して渡す)
+    projection : list of str or int, optional
+        出力する列。parse は全列のフィールド位置を記録し、decode は射影した列だけを変換する
+        (COPY のクエリ自体を射影できない固定のストリーム / ファイル向け)
+    predicate : predicate.Expr, optional
+        残す行の条件 (``predicate.col`` から作る)。parse と decode の間で評価し、
+        落とした行はデコードしない。projection に含まれない列も参照できる
+
+    Returns
+    -------
+    PipelineStats
+    """
+    if backend not in ("gpu", "cpu"):
+        raise ValueError(f"unknown backend: {backend!r} (expected 'gpu' or 'cpu')")
+    if queue_depth < 1:
+        raise ValueError("queue_depth must be >= 1")
+    if output not in ("arrow", "device"):
+        raise ValueError(f"unknown output: {output!r} (expected 'arrow' or 'device')")
+    write = sink.write_batch if hasattr(sink, "write_batch") else sink
+    if predicate is not None:
+        # 列名の解決と定数の型検査はスレッドを起動する前に 1 回だけ行う
+        predicate = compile_predicate(predicate, columns)
+
+    stats = PipelineStats()
+    stop = threading.Event()
+    fetch_q: queue.Queue = queue.Queue(maxsize=queue_depth)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_depth)
+    write_errors: list = []
+    reader = threading.Thread(target=_reader, args=(chunks, fetch_q, stats.fetch, stop),
+                              name="copy-reader", daemon=True)
+    writer = threading.Thread(target=_writer, args=(write, write_q, stats.write, write_errors),
+                              name="batch-writer", daemon=True)
+
+    ncols = len(columns)
+
+    def emit(batch: Optional[Union[pa.RecordBatch, DeviceTable]], nbytes: int):
+        stats.decode.items += 1
+        stats.bytes += nbytes
+        if batch is None or batch.num_rows == 0:
+            return
+        stats.rows += batch.num_rows
+        t0 = time.perf_counter()
+        write_q.put(batch)
+        stats.decode.wait_s += time.perf_counter() - t0
+        if write_errors:
+            raise write_errors[0]
+
+    def process_gpu(raw_dev, nbytes):
+        t0 = time.perf_counter()
+        field_offsets_dev, field_lengths_dev = parse_binary_chunk_gpu(raw_dev, ncols, threads_per_block)
+        batch = None
+        if field_offsets_dev.shape[0] > 0:
+            batch = decode_chunk(raw_dev, field_offsets_dev, field_lengths_dev, columns, output=output,
+                                 projection=projection, predicate=predicate)
+        stats.decode.busy_s += time.perf_counter() - t0
+        emit(batch, nbytes)
+
+    def process_cpu(chunk: CopyChunk):
+        t0 = time.perf_counter()
+        offs, lens = parse_binary_chunk_cpu(chunk.data, ncols, header_size=chunk.header_size)
+        batch = None
+        if offs.shape[0] > 0:
+            batch = decode_chunk_cpu(chunk.data, offs, lens, columns, projection, predicate)
+        if batch is not None and output == "device":
+            batch = DeviceTable.from_arrow(batch)
+        stats.decode.busy_s += time.perf_counter() - t0
+        emit(batch, chunk.nbytes)
+
+    t_start = time.perf_counter()
+    reader.start()
+    writer.start()
+    try:
+        if backend == "gpu":
+            transfer_chunks_to_gpu(_drain(fetch_q, stats.decode), process_gpu, chunk_bytes, num_buffers)
+        else:
+            for chunk in _drain(fetch_q, stats.decode):
+                process_cpu(chunk)
+    finally:
+        stop.set()
+        write_q.put(_DONE)
+        writer.join()
+        reader.join()
+        stats.wall_s = time.perf_counter() - t_start
+    if write_errors:
+        raise write_errors[0]
+    return stats
+
+
+def replay_batches(
+    batches: Iterable[pa.RecordBatch],
+    sink,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    output: str = "arrow",
+) -> PipelineStats:
+    """
+    デコード済みの RecordBatch の列 (``output_handler.ArrowIPCSource`` など) を sink へ流す。
+
+    PostgreSQL と変換を経由せずに、run_pipeline と同じ reader / writer スレッドと
+    キューで書き出し側だけを計測するためのもの (decode ステージは受け渡しのみ、
+    output="device" なら GPU への転送)。
+
+    Parameters
+    ----------
+    batches : iterable of pyarrow.RecordBatch
+    sink : callable or object with ``write_batch``
+    queue_depth : int
+    output : {"arrow", "device"}
+
+    Returns
+    -------
+    PipelineStats
+    """
+    if queue_depth < 1:
+        raise ValueError("queue_depth must be >= 1")
+    if output not in ("arrow", "device"):
+        raise ValueError(f"unknown output: {output!r} (expected 'arrow' or 'device')")
+    write = sink.write_batch if hasattr(sink, "write_batch") else sink
+
+    stats = PipelineStats()
+    stop = threading.Event()
+    fetch_q: queue.Queue = queue.Queue(maxsize=queue_depth)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_depth)
+    write_errors: list = []
+    reader = threading.Thread(target=_reader, args=(batches, fetch_q, stats.fetch, stop),
+                              name="batch-reader", daemon=True)
+    writer = threading.Thread(target=_writer, args=(write, write_q, stats.write, write_errors),
+                              name="batch-writer", daemon=True)
+
+    t_start = time.perf_counter()
+    reader.start()
+    writer.start()
+    try:
+        for batch in _drain(fetch_q, stats.decode):
+            stats.decode.items += 1
+            stats.bytes += batch.nbytes
+            if batch.num_rows == 0:
+                continue
+            t0 = time.perf_counter()
+            item = DeviceTable.from_arrow(batch) if output == "device" else batch
+            stats.decode.busy_s += time.perf_counter() - t0
+            stats.rows += batch.num_rows
+            t0 = time.perf_counter()
+            write_q.put(item)
+            stats.decode.wait_s += time.perf_counter() - t0
+            if write_errors:
+                raise write_errors[0]
+    finally:
+        stop.set()
+        write_q.put(_DONE)
+        writer.join()
+        reader.join()
+        stats.wall_s = time.perf_counter() - t_start
+    if write_errors:
+        raise write_errors[0]
+    return stats
+
+
+__all__ = ["run_pipeline", "replay_batches", "PipelineStats", "StageStats", "DEFAULT_QUEUE_DEPTH"]
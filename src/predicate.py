@@ -0,0 +1,420 @@
+"""parse と decode の間で行を絞り込む述語 (WHERE) API
+
+出力済みの COPY ファイルへの ``WHERE lo_orderdate >= X`` (増分ロード) や、
+重い条件を負荷の高いプライマリへ送らずに GPU 側で評価する用途のための小さな式 API。
+
+    >>> from src.predicate import col
+    >>> pred = (col("lo_orderdate") >= 19940101) & col("lo_discount").isin([1, 2, 3])
+    >>> pred = pred | col("lo_tax").is_null()
+
+* 比較 (``== != < <= > >=``) は固定長列 (int2/4/8, float4/8, bool, date, timestamp) のみ
+* ``is_null()`` / ``is_not_null()`` は全列、``isin([...])`` は比較と同じ固定長列
+* ``&`` (AND) / ``|`` (OR) で結合する (Python の and / or は使えない)
+
+``compile_predicate`` が式を列番号つきの後置記法プログラム (``CompiledPredicate``) に
+変換し、``cuda_kernels.predicate_kernels`` のカーネルが ``raw_dev`` / ``field_offsets_dev``
+から直接評価する。残す行の番号を詰めた選択ベクトルで field 行列を詰め直してから
+pass-1 / pass-2 を行うので、落とした行はデコード時間も出力メモリも使わない
+(``decode_chunk(..., predicate=...)`` / ``run_pipeline(..., predicate=...)``)。
+
+NULL の扱いは SQL と同じ (NULL との比較・IN は偽)。
+"""
+
+from __future__ import annotations
+
+import datetime
+import math
+from dataclasses import dataclass, field
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numba import cuda, njit
+
+from .type_map import (
+    ColumnMeta,
+    INT16, INT32, INT64, FLOAT32, FLOAT64, BOOL, DATE32, TS64_US,
+)
+from .arrow_utils import projection_indices
+from .cuda_kernels.predicate_kernels import (
+    predicate_row, predicate_flags, compact_rows, gather_rows,
+    OP_CMP, OP_IN, OP_ISNULL, OP_AND, OP_OR,
+    CMP_EQ, CMP_NE, CMP_LT, CMP_LE, CMP_GT, CMP_GE,
+    PREDICATE_MAX_DEPTH, PREDICATE_THREADS,
+)
+
+ColumnRef = Union[str, int]
+
+# 比較できる列 (Arrow 型 ID → COPY BINARY 上のバイト幅)
+_COMPARABLE_WIDTH = {
+    INT16: 2, INT32: 4, INT64: 8, FLOAT32: 4, FLOAT64: 8, BOOL: 1, DATE32: 4, TS64_US: 8,
+}
+_CMP_OPS = {"==": CMP_EQ, "!=": CMP_NE, "<": CMP_LT, "<=": CMP_LE, ">": CMP_GT, ">=": CMP_GE}
+
+_PG_EPOCH_DATE = datetime.date(2000, 1, 1)
+_PG_EPOCH_TS = datetime.datetime(2000, 1, 1)
+
+
+# ----------------------------------------------------------------------
+# 式
+# ----------------------------------------------------------------------
+class Expr:
+    """述語の基底クラス (``&`` / ``|`` で結合する)"""
+
+    def __and__(self, other: "Expr") -> "Expr":
+        return BoolOp("and", self, _check_expr(other))
+
+    def __or__(self, other: "Expr") -> "Expr":
+        return BoolOp("or", self, _check_expr(other))
+
+    def __bool__(self):
+        raise TypeError("predicates cannot be used as bool; combine them with & and | instead of and / or")
+
+    def columns(self) -> List[ColumnRef]:
+        """式が参照する列 (出現順, 重複なし)"""
+        out: List[ColumnRef] = []
+        for ref in self._refs():
+            if ref not in out:
+                out.append(ref)
+        return out
+
+    def _refs(self) -> Iterable[ColumnRef]:
+        raise NotImplementedError
+
+
+def _check_expr(other) -> Expr:
+    if not isinstance(other, Expr):
+        raise TypeError(f"expected a predicate, got {type(other).__name__}")
+    return other
+
+
+@dataclass(frozen=True, eq=False)
+class Compare(Expr):
+    column: ColumnRef
+    op: str
+    value: Any
+
+    def _refs(self):
+        yield self.column
+
+    def __repr__(self):
+        return f"({self.column!r} {self.op} {self.value!r})"
+
+
+@dataclass(frozen=True, eq=False)
+class IsIn(Expr):
+    column: ColumnRef
+    values: Tuple[Any, ...]
+
+    def _refs(self):
+        yield self.column
+
+    def __repr__(self):
+        return f"({self.column!r} IN {list(self.values)!r})"
+
+
+@dataclass(frozen=True, eq=False)
+class IsNull(Expr):
+    column: ColumnRef
+    negate: bool = False
+
+    def _refs(self):
+        yield self.column
+
+    def __repr__(self):
+        return f"({self.column!r} IS {'NOT ' if self.negate else ''}NULL)"
+
+
+@dataclass(frozen=True, eq=False)
+class BoolOp(Expr):
+    op: str           # "and" / "or"
+    left: Expr
+    right: Expr
+
+    def _refs(self):
+        yield from self.left._refs()
+        yield from self.right._refs()
+
+    def __repr__(self):
+        return f"({self.left!r} {self.op.upper()} {self.right!r})"
+
+
+class Col:
+    """列への参照。比較演算子・is_null・isin で述語を作る"""
+
+    __slots__ = ("name",)
+    __hash__ = None
+
+    def __init__(self, name: ColumnRef):
+        self.name = name
+
+    def _cmp(self, op: str, value) -> Compare:
+        if value is None:
+            raise TypeError("comparison with None is always unknown; use is_null() / is_not_null()")
+        if isinstance(value, (Col, Expr)):
+            raise TypeError("only comparisons against constants are supported")
+        return Compare(self.name, op, value)
+
+    def __eq__(self, value):
+        return self._cmp("==", value)
+
+    def __ne__(self, value):
+        return self._cmp("!=", value)
+
+    def __lt__(self, value):
+        return self._cmp("<", value)
+
+    def __le__(self, value):
+        return self._cmp("<=", value)
+
+    def __gt__(self, value):
+        return self._cmp(">", value)
+
+    def __ge__(self, value):
+        return self._cmp(">=", value)
+
+    def is_null(self) -> IsNull:
+        return IsNull(self.name)
+
+    def is_not_null(self) -> IsNull:
+        return IsNull(self.name, negate=True)
+
+    def isin(self, values: Iterable[Any]) -> IsIn:
+        # NULL を含む IN は NULL の要素が一致しないだけなので取り除く
+        return IsIn(self.name, tuple(v for v in values if v is not None))
+
+    def __repr__(self):
+        return f"col({self.name!r})"
+
+
+def col(name: ColumnRef) -> Col:
+    """列名 (または列番号) への参照を作る"""
+    return Col(name)
+
+
+# ----------------------------------------------------------------------
+# コンパイル
+# ----------------------------------------------------------------------
+@dataclass
+class CompiledPredicate:
+    """列番号に解決済みの後置記法プログラム (カーネルへそのまま渡す配列)"""
+    expr: Expr
+    ncols: int
+    program: np.ndarray          # int64 (n_instr, 4)
+    consts: np.ndarray           # int64
+    col_width: np.ndarray        # int32 (ncols,)
+    col_float: np.ndarray        # int32 (ncols,)
+    _device: Optional[tuple] = field(default=None, repr=False)
+
+    def device_arrays(self) -> tuple:
+        """(program, consts, col_width, col_float) のデバイス配列 (初回のみ転送)"""
+        if self._device is None:
+            self._device = tuple(cuda.to_device(a) for a in
+                                 (self.program, self.consts, self.col_width, self.col_float))
+        return self._device
+
+
+def _float_key(value: float, width: int) -> int:
+    """float → カーネルと同じ比較キー (IEEE ビット列を符号付き整数の大小に写す)"""
+    if value != value:
+        # NaN は符号・ペイロードによらず正の quiet NaN (NaN 同士は等しく最大)
+        return 0x7FC00000 if width == 4 else 0x7FF8000000000000
+    bits = int(np.array(value, dtype=np.float32 if width == 4 else np.float64).view(
+        np.int32 if width == 4 else np.int64))
+    if bits < 0:
+        bits ^= (1 << (8 * width - 1)) - 1
+        if bits == -1:
+            bits = 0        # -0.0 == 0.0
+    return bits
+
+
+def _const_key(col: ColumnMeta, value) -> int:
+    """定数を列の COPY BINARY 表現 (比較キー) に変換する"""
+    aid = col.arrow_id
+    if aid in (INT16, INT32, INT64):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, np.integer)):
+            raise TypeError(f"column {col.name}: expected an integer, got {value!r}")
+        value = int(value)
+        if not -(1 << 63) <= value < (1 << 63):
+            raise OverflowError(f"column {col.name}: {value} does not fit in int64")
+        return value
+    if aid in (FLOAT32, FLOAT64):
+        if not isinstance(value, (int, float, np.integer, np.floating)) or isinstance(value, bool):
+            raise TypeError(f"column {col.name}: expected a number, got {value!r}")
+        return _float_key(float(value), _COMPARABLE_WIDTH[aid])
+    if aid == BOOL:
+        if not isinstance(value, (bool, np.bool_)):
+            raise TypeError(f"column {col.name}: expected a bool, got {value!r}")
+        return int(bool(value))
+    if aid == DATE32:
+        if isinstance(value, str):
+            value = datetime.date.fromisoformat(value)
+        if isinstance(value, datetime.datetime) or not isinstance(value, datetime.date):
+            raise TypeError(f"column {col.name}: expected a datetime.date, got {value!r}")
+        return (value - _PG_EPOCH_DATE).days
+    if aid == TS64_US:
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        if not isinstance(value, datetime.datetime):
+            raise TypeError(f"column {col.name}: expected a datetime.datetime, got {value!r}")
+        if value.tzinfo is not None:
+            # timestamptz は UTC の µs で送られてくる
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        delta = value - _PG_EPOCH_TS
+        return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    raise TypeError(f"column {col.name}: comparisons are only supported on fixed-width "
+                    f"integer / float / bool / date / timestamp columns")
+
+
+def compile_predicate(expr: Union[Expr, CompiledPredicate], columns: List[ColumnMeta]) -> CompiledPredicate:
+    """
+    式を COPY ストリームの列 (columns) に対してコンパイルする
+
+    Parameters
+    ----------
+    expr : Expr or CompiledPredicate
+        ``col(...)`` から作った述語 (コンパイル済みならそのまま返す)
+    columns : list of ColumnMeta
+        COPY ストリームの全列 (field 行列の列数と一致)
+
+    Raises
+    ------
+    KeyError
+        存在しない列名
+    TypeError
+        比較できない列 (numeric / 文字列など) や列の型に合わない定数
+    ValueError
+        式が深すぎる (スタック深さ PREDICATE_MAX_DEPTH を超える)
+    """
+    if isinstance(expr, CompiledPredicate):
+        if expr.ncols != len(columns):
+            raise ValueError(f"predicate was compiled for {expr.ncols} columns, got {len(columns)}")
+        return expr
+    _check_expr(expr)
+
+    col_width = np.zeros(len(columns), dtype=np.int32)
+    col_float = np.zeros(len(columns), dtype=np.int32)
+    program: List[Tuple[int, int, int, int]] = []
+    consts: List[int] = []
+
+    def resolve(ref: ColumnRef) -> int:
+        cidx = projection_indices(columns, [ref])[0]
+        aid = columns[cidx].arrow_id
+        col_width[cidx] = _COMPARABLE_WIDTH.get(aid, 0)
+        col_float[cidx] = int(aid in (FLOAT32, FLOAT64))
+        return cidx
+
+    def emit(node: Expr) -> int:
+        """node を後置記法で追加し、評価に必要なスタック深さを返す"""
+        if isinstance(node, BoolOp):
+            d_left = emit(node.left)
+            d_right = emit(node.right)
+            program.append((OP_AND if node.op == "and" else OP_OR, 0, 0, 0))
+            return max(d_left, d_right + 1)
+        cidx = resolve(node.column)
+        if isinstance(node, IsNull):
+            program.append((OP_ISNULL, cidx, int(node.negate), 0))
+        elif isinstance(node, Compare):
+            program.append((OP_CMP, cidx, _CMP_OPS[node.op], len(consts)))
+            consts.append(_const_key(columns[cidx], node.value))
+        elif isinstance(node, IsIn):
+            keys = [_const_key(columns[cidx], v) for v in node.values]
+            if not keys and not col_width[cidx]:
+                _const_key(columns[cidx], 0)     # 空リストでも比較できない列は型エラーにする
+            program.append((OP_IN, cidx, len(consts), len(keys)))
+            consts.extend(keys)
+        else:
+            raise TypeError(f"unsupported predicate node: {type(node).__name__}")
+        return 1
+
+    depth = emit(expr)
+    if depth > PREDICATE_MAX_DEPTH:
+        raise ValueError(f"predicate is too deeply nested (stack depth {depth} > {PREDICATE_MAX_DEPTH})")
+    return CompiledPredicate(
+        expr=expr,
+        ncols=len(columns),
+        program=np.array(program, dtype=np.int64).reshape(-1, 4),
+        consts=np.array(consts or [0], dtype=np.int64),
+        col_width=col_width,
+        col_float=col_float,
+    )
+
+
+# ----------------------------------------------------------------------
+# 評価 (CPU / GPU)
+# ----------------------------------------------------------------------
+_predicate_row_cpu = njit(predicate_row)
+
+
+@njit
+def _predicate_mask(raw, field_offsets, field_lengths, program, consts, col_width, col_float, mask):
+    for row in range(field_lengths.shape[0]):
+        mask[row] = _predicate_row_cpu(raw, field_offsets, field_lengths, row, program, consts,
+                                       col_width, col_float) != 0
+
+
+def predicate_mask_cpu(raw, field_offsets, field_lengths, predicate: CompiledPredicate) -> np.ndarray:
+    """行ごとの評価結果 (bool[rows]) を CPU で求める"""
+    raw = np.frombuffer(raw, dtype=np.uint8) if isinstance(raw, (bytes, bytearray, memoryview)) \
+        else np.asarray(raw)
+    mask = np.empty(field_lengths.shape[0], dtype=np.bool_)
+    _predicate_mask(raw, np.asarray(field_offsets), np.asarray(field_lengths), predicate.program,
+                    predicate.consts, predicate.col_width, predicate.col_float, mask)
+    return mask
+
+
+def filter_rows_cpu(raw, field_offsets, field_lengths, predicate: CompiledPredicate):
+    """述語を満たす行だけの (field_offsets, field_lengths) を返す (CPU 版)"""
+    mask = predicate_mask_cpu(raw, field_offsets, field_lengths, predicate)
+    return np.ascontiguousarray(field_offsets[mask]), np.ascontiguousarray(field_lengths[mask])
+
+
+def selection_vector_gpu(raw_dev, field_offsets_dev, field_lengths_dev, predicate: CompiledPredicate):
+    """
+    述語を満たす行番号 (int32, 元の順) の選択ベクトルを GPU 上で作る
+
+    ブロックごとの件数だけをホストへ読み戻して (rows / PREDICATE_THREADS 要素)
+    書き込み位置を決める。戻り値は (sel_dev, 件数)
+    """
+    rows = field_lengths_dev.shape[0]
+    blocks = max(1, math.ceil(rows / PREDICATE_THREADS))
+    program, consts, col_width, col_float = predicate.device_arrays()
+    flags = cuda.device_array(rows, dtype=np.int32)
+    d_counts = cuda.device_array(blocks, dtype=np.int32)
+    predicate_flags[blocks, PREDICATE_THREADS](raw_dev, field_offsets_dev, field_lengths_dev, program, consts,
+                                               col_width, col_float, flags, d_counts)
+    counts = d_counts.copy_to_host()
+    block_offsets = np.zeros(blocks, dtype=np.int32)
+    np.cumsum(counts[:-1], out=block_offsets[1:])
+    n_sel = int(block_offsets[-1] + counts[-1])
+    sel = cuda.device_array(max(n_sel, 1), dtype=np.int32)
+    if n_sel:
+        compact_rows[blocks, PREDICATE_THREADS](flags, cuda.to_device(block_offsets), sel)
+    return sel[:n_sel], n_sel
+
+
+def filter_rows_gpu(raw_dev, field_offsets_dev, field_lengths_dev, predicate: CompiledPredicate):
+    """
+    述語を満たす行だけを詰めた (field_offsets_dev, field_lengths_dev) を返す (GPU 版)
+
+    全行が残る場合は入力をそのまま返す (gather を省く)
+    """
+    rows, ncols = field_lengths_dev.shape
+    sel, n_sel = selection_vector_gpu(raw_dev, field_offsets_dev, field_lengths_dev, predicate)
+    if n_sel == rows:
+        return field_offsets_dev, field_lengths_dev
+    out_offsets = cuda.device_array((n_sel, ncols), dtype=np.int32)
+    out_lengths = cuda.device_array((n_sel, ncols), dtype=np.int32)
+    if n_sel:
+        tpb = (32, 8)
+        grid = ((n_sel + tpb[0] - 1) // tpb[0], (ncols + tpb[1] - 1) // tpb[1])
+        gather_rows[grid, tpb](sel, field_offsets_dev, field_lengths_dev, out_offsets, out_lengths)
+    return out_offsets, out_lengths
+
+
+__all__ = [
+    "Expr", "Col", "Compare", "IsIn", "IsNull", "BoolOp", "col",
+    "CompiledPredicate", "compile_predicate",
+    "predicate_mask_cpu", "filter_rows_cpu", "selection_vector_gpu", "filter_rows_gpu",
+]
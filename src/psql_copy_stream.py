@@ -0,0 +1,389 @@
+"""
+COPY BINARY ストリーミング受信
+------------------------------
+``cursor.copy()`` が返すデータ片を固定サイズ・行境界揃えのホストバッファへ
+詰め直し、チャンク単位で順次返す。結果全体をホストメモリに溜め込まないため、
+ピークメモリは ``chunk_bytes`` の数倍 (受信中バッファ + 呼び出し側が保持中の
+チャンク) に収まる。
+
+各チャンクは完結した行だけを含み、行の途中で切れた末尾は次のチャンクの
+先頭へ持ち越す。先頭チャンクのみ COPY ヘッダを含み ``header_size`` が 0 以外になる。
+
+GPU への転送は ``PinnedBufferRing`` (pinned ホストバッファ + CUDA stream のリング) を
+使った ``transfer_chunks_to_gpu`` / ``copy_binary_to_gpu_chunks`` で行う。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pyarrow as pa
+from numba import cuda
+
+from .cpu_parse_utils import scan_row_boundaries
+from .gpu_parse_wrapper import parse_binary_chunk_gpu, detect_pg_header_size
+from .gpu_decoder_v2 import decode_chunk
+from .predicate import compile_predicate
+from .type_map import ColumnMeta
+
+DEFAULT_CHUNK_BYTES = 64 << 20   # 64 MiB
+MIN_CHUNK_BYTES = 64             # COPY ヘッダ (19B + 拡張) が先頭チャンクに収まる最小値
+
+
+@dataclass
+class CopyChunk:
+    """行境界で終わる COPY BINARY バッファ 1 個分"""
+    data: np.ndarray      # uint8[:] (先頭チャンクはヘッダ込み)
+    header_size: int      # 先頭チャンクは COPY ヘッダ長, 以降は 0
+    rows: int             # 含まれる行数
+    index: int            # 0 始まりのチャンク番号
+    stream_offset: int    # ストリーム先頭から data[0] までのバイト位置
+    partition: int = 0    # 並列 COPY (pg_partition) の場合のパーティション番号
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.size)
+
+
+class _RowAlignedBuffer:
+    """受信データを溜め、行境界で切り出すための内部バッファ"""
+
+    def __init__(self, chunk_bytes: Union[int, Callable[[], int]]):
+        self._target = chunk_bytes if callable(chunk_bytes) else None
+        self.chunk_bytes = self._target_bytes() if self._target else chunk_bytes
+        self.buf = np.empty(self.chunk_bytes, dtype=np.uint8)
+        self.fill = 0
+        self.header_size = None   # 先頭チャンクを切り出すまで未確定
+        self.index = 0
+        self.stream_offset = 0
+        self.finished = False     # 終端マーカー検出済み
+
+    def feed(self, piece) -> Iterator[CopyChunk]:
+        if self.finished:
+            return
+        src = np.frombuffer(piece, dtype=np.uint8)
+        off = 0
+        while off < src.size:
+            if self._target is not None:
+                self._retarget()
+            n = min(src.size - off, self.buf.size - self.fill)
+            self.buf[self.fill:self.fill + n] = src[off:off + n]
+            self.fill += n
+            off += n
+            if self.fill == self.buf.size:
+                chunk = self._cut(final=False)
+                if chunk is not None:
+                    yield chunk
+                if self.finished:
+                    return
+
+    def _target_bytes(self) -> int:
+        return max(int(self._target()), MIN_CHUNK_BYTES)
+
+    def _retarget(self):
+        """チャンクサイズが変わっていたら受信中のバッファを新しいサイズへ付け替える"""
+        target = self._target_bytes()
+        if target == self.chunk_bytes:
+            return
+        self.chunk_bytes = target
+        # 既に target 以上溜まっている場合はバッファを fill ちょうどにして直後に切り出す
+        resized = np.empty(max(target, self.fill), dtype=np.uint8)
+        resized[:self.fill] = self.buf[:self.fill]
+        self.buf = resized
+
+    def flush(self) -> Iterator[CopyChunk]:
+        if self.finished or self.fill == 0:
+            return
+        chunk = self._cut(final=True)
+        if chunk is not None:
+            yield chunk
+        if not self.finished and self.fill > 0:
+            raise ValueError(
+                f"COPY stream ended inside a row ({self.fill} trailing bytes at offset {self.stream_offset})"
+            )
+
+    def _cut(self, final: bool):
+        first = self.header_size is None
+        if first:
+            self.header_size = detect_pg_header_size(self.buf[:self.fill])
+        start = self.header_size if first else 0
+
+        row_end, rows, eof = scan_row_boundaries(self.buf, start, self.fill)
+        row_end, rows = int(row_end), int(rows)
+        if eof:
+            self.finished = True
+
+        if rows == 0 and not eof and not final:
+            # 1 行がバッファより大きい → 拡張して受信を続ける
+            grown = np.empty(self.buf.size * 2, dtype=np.uint8)
+            grown[:self.fill] = self.buf[:self.fill]
+            self.buf = grown
+            if first:
+                self.header_size = None
+            return None
+
+        chunk = None
+        if rows > 0:
+            chunk = CopyChunk(
+                data=self.buf[:row_end],
+                header_size=start,
+                rows=rows,
+                index=self.index,
+                stream_offset=self.stream_offset,
+            )
+            self.index += 1
+
+        if self.finished:
+            self.fill = 0
+            return chunk
+
+        # 未完の行を新しいバッファの先頭へ持ち越す (返したチャンクは呼び出し側が所有)
+        tail = self.fill - row_end
+        fresh = np.empty(max(self.chunk_bytes, 2 * tail), dtype=np.uint8)
+        fresh[:tail] = self.buf[row_end:self.fill]
+        self.stream_offset += row_end
+        self.buf = fresh
+        self.fill = tail
+        return chunk
+
+
+def iter_copy_chunks(
+    source: Iterable,
+    chunk_bytes: Union[int, Callable[[], int]] = DEFAULT_CHUNK_BYTES,
+) -> Iterator[CopyChunk]:
+    """
+    COPY BINARY のデータ片の列を行境界揃えの CopyChunk 列へ変換するジェネレータ
+
+    Parameters
+    ----------
+    source : iterable of bytes-like
+        ``cursor.copy()`` の Copy オブジェクト、または ``iter_copy_file`` など
+    chunk_bytes : int or callable
+        1 チャンクの目標バイト数 (1 行がこれを超える場合のみ拡張される)。
+        引数なしの callable (``chunk_planner.StreamPlanner.chunk_bytes`` など) を渡すと
+        受信データを詰めるたびに問い合わせ、変わっていれば次の切り出しから新しいサイズを使う
+
+    Notes
+    -----
+    返される ``CopyChunk.data`` は新しく確保したバッファのビューで、
+    次のチャンク受信時に上書きされることはない。
+    """
+    if not callable(chunk_bytes) and chunk_bytes < MIN_CHUNK_BYTES:
+        raise ValueError(f"chunk_bytes must be >= {MIN_CHUNK_BYTES}")
+    asm = _RowAlignedBuffer(chunk_bytes)
+    for piece in source:
+        yield from asm.feed(piece)
+    yield from asm.flush()
+
+
+def iter_copy_file(path: str, read_size: int = 1 << 20) -> Iterator[memoryview]:
+    """
+    保存済み COPY BINARY ファイルを ``cursor.copy()`` と同じ形 (データ片の列) で再生する。
+    読み込みバッファは使い回すため、受け取った側で直ちにコピーすること。
+    """
+    scratch = bytearray(read_size)
+    view = memoryview(scratch)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(scratch)
+            if not n:
+                break
+            yield view[:n]
+
+
+class PinnedBufferRing:
+    """
+    ページロック (pinned) ホストバッファ + デバイスバッファ + CUDA stream の組を
+    num_buffers 個持つリング。
+
+    スロット k のホスト→デバイス転送は専用 stream 上で非同期に行われるため、
+    転送中に次のチャンクの受信 (``cursor.copy()`` の読み出し) を進められる。
+    pinned メモリを確保できない環境では通常の (pageable) NumPy 配列へ
+    フォールバックする (転送は同期的になるが動作は同じ)。
+    """
+
+    def __init__(self, num_buffers: int, nbytes: int, pinned: bool = True):
+        if num_buffers < 2:
+            raise ValueError("num_buffers must be >= 2 for double buffering")
+        self.pinned = pinned
+        self.hosts: List[np.ndarray] = []
+        self.devs = []
+        self.streams = []
+        for _ in range(num_buffers):
+            self.hosts.append(self._alloc_host(nbytes))
+            self.devs.append(cuda.device_array(nbytes, dtype=np.uint8))
+            self.streams.append(cuda.stream())
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def _alloc_host(self, nbytes: int) -> np.ndarray:
+        if self.pinned:
+            try:
+                return cuda.pinned_array(nbytes, dtype=np.uint8)
+            except Exception as e:
+                print(f"pinned メモリの確保に失敗したため pageable バッファを使用します: {e}")
+                self.pinned = False
+        return np.empty(nbytes, dtype=np.uint8)
+
+    def acquire(self, slot: int, nbytes: int) -> None:
+        """スロットの前回の転送完了を待ち、nbytes 以上の容量を保証する"""
+        self.streams[slot].synchronize()
+        if self.hosts[slot].size < nbytes:
+            # チャンクサイズを超える行を含むチャンク → このスロットだけ拡張
+            self.hosts[slot] = self._alloc_host(nbytes)
+            self.devs[slot] = cuda.device_array(nbytes, dtype=np.uint8)
+
+    def upload(self, slot: int, data: np.ndarray) -> None:
+        """data をスロットのホストバッファへ詰め、デバイスへ非同期転送する"""
+        n = data.size
+        host = self.hosts[slot][:n]
+        host[:] = data
+        self.devs[slot][:n].copy_to_device(host, stream=self.streams[slot])
+
+    def wait(self, slot: int, nbytes: int):
+        """スロットの転送完了を待ち、有効範囲のデバイス配列ビューを返す"""
+        self.streams[slot].synchronize()
+        return self.devs[slot][:nbytes]
+
+
+def transfer_chunks_to_gpu(
+    chunks: Iterable[CopyChunk],
+    process_chunk: Callable,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    num_buffers: int = 2,
+    pinned: bool = True,
+) -> dict:
+    """
+    行境界揃えのチャンク列をダブルバッファリングで GPU へ転送し、
+    転送済みチャンクごとに ``process_chunk(dev_array, nbytes)`` を呼ぶ。
+
+    チャンク k の非同期 H2D 転送を発行した後にチャンク k-1 を処理し、
+    その後チャンク k+1 を受信するため、転送と受信・処理が重なる。
+
+    Parameters
+    ----------
+    chunks : iterable of CopyChunk
+    process_chunk : callable
+        (gpu_dev_array, nbytes) を受け取るコールバック。dev_array はリングの
+        バッファのビューなので、コールバック終了後に参照し続けてはならない。
+        先頭チャンクのみ COPY ヘッダを含む (``detect_pg_header_size`` で判別可能)。
+    chunk_bytes : int
+        リングの各バッファの初期サイズ
+    num_buffers : int
+        リングのバッファ数 (2 でダブルバッファ)
+    pinned : bool
+        False の場合は最初から pageable バッファを使う
+
+    Returns
+    -------
+    dict
+        chunks / bytes / rows / pinned
+    """
+    ring = PinnedBufferRing(num_buffers, chunk_bytes, pinned)
+    stats = {"chunks": 0, "bytes": 0, "rows": 0, "pinned": ring.pinned}
+    pending: Optional[tuple] = None   # (slot, nbytes) 転送発行済み・未処理のチャンク
+
+    for k, chunk in enumerate(chunks):
+        slot = k % len(ring)
+        ring.acquire(slot, chunk.nbytes)
+        ring.upload(slot, chunk.data)
+        if pending is not None:
+            process_chunk(ring.wait(*pending), pending[1])
+        pending = (slot, chunk.nbytes)
+        stats["chunks"] += 1
+        stats["bytes"] += chunk.nbytes
+        stats["rows"] += chunk.rows
+
+    if pending is not None:
+        process_chunk(ring.wait(*pending), pending[1])
+    stats["pinned"] = ring.pinned
+    return stats
+
+
+def copy_binary_to_gpu_chunks(
+    dsn: str,
+    query: str,
+    chunk_bytes: int,
+    process_chunk: Callable,
+    num_buffers: int = 2,
+    pinned: bool = True,
+) -> dict:
+    """
+    ``COPY (query) TO STDOUT (FORMAT BINARY)`` を psycopg3 で受信し、
+    pinned バッファ経由でチャンクごとに GPU へ転送する。
+
+    Parameters
+    ----------
+    dsn : str
+        接続文字列 (接続はプロセス単位のプール ``pg_pool.get_pool(dsn)`` から借りる)
+    query : str
+        SELECT クエリ文字列
+    chunk_bytes : int
+        1チャンクのバイト数
+    process_chunk : callable
+        (gpu_dev_array, nbytes) を受け取るコールバック
+    num_buffers, pinned
+        ``transfer_chunks_to_gpu`` を参照
+
+    Returns
+    -------
+    dict
+        転送統計 (chunks / bytes / rows / pinned)
+    """
+    from .pg_pool import get_pool
+
+    with get_pool(dsn).connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY ({query}) TO STDOUT (FORMAT BINARY)") as copy:
+                return transfer_chunks_to_gpu(
+                    iter_copy_chunks(copy, chunk_bytes),
+                    process_chunk,
+                    chunk_bytes,
+                    num_buffers,
+                    pinned,
+                )
+
+
+def decode_copy_stream(
+    chunks: Iterable[CopyChunk],
+    columns: List[ColumnMeta],
+    threads_per_block: int = 256,
+    projection: Optional[Sequence[Union[int, str]]] = None,
+    predicate=None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    CopyChunk を 1 個ずつ GPU へ転送し parse → decode した RecordBatch を返す
+
+    projection を指定すると parse は全列のフィールド位置を記録し、decode は射影した列だけを変換する。
+    predicate (``predicate.col`` から作った述語) を指定すると条件を満たす行だけをデコードする
+    (全行が落ちたチャンクは返さない)
+    """
+    ncols = len(columns)
+    if predicate is not None:
+        predicate = compile_predicate(predicate, columns)
+    for chunk in chunks:
+        raw_dev = cuda.to_device(chunk.data)
+        field_offsets_dev, field_lengths_dev = parse_binary_chunk_gpu(
+            raw_dev, ncols, threads_per_block, header_size=chunk.header_size
+        )
+        if field_offsets_dev.shape[0] == 0:
+            continue
+        batch = decode_chunk(raw_dev, field_offsets_dev, field_lengths_dev, columns, projection=projection,
+                             predicate=predicate)
+        if batch.num_rows:
+            yield batch
+
+
+__all__ = [
+    "CopyChunk",
+    "DEFAULT_CHUNK_BYTES",
+    "iter_copy_chunks",
+    "iter_copy_file",
+    "PinnedBufferRing",
+    "transfer_chunks_to_gpu",
+    "copy_binary_to_gpu_chunks",
+    "decode_copy_stream",
+]
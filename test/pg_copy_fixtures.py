@@ -0,0 +1,193 @@
+"""
+テスト用 PostgreSQL COPY BINARY エンコーダ
+
+PostgreSQL なしで COPY (FORMAT BINARY) ストリームを組み立てるための補助関数群。
+値は Python オブジェクト (None = NULL) で与え、列の型は PG OID で指定する。
+``SAMPLE_OIDS`` / ``sample_copy_binary`` は sink / パイプラインのテストで共通に使うデータセット、
+``pipeline_batches`` はパイプラインの出力バッチを集めながら sink へも書く補助、
+``device_backed_batch`` は RecordBatch のバッファを GPU へ載せ替える (sink のテスト用)。
+"""
+
+from __future__ import annotations
+
+import datetime
+import struct
+from decimal import Decimal
+from typing import Iterable, List, Optional, Sequence
+
+from src.type_map import ColumnMeta, PG_OID_TO_ARROW, DECIMAL128, UTF8, UNKNOWN
+
+PGCOPY_HEADER = b"PGCOPY\n\377\r\n\0" + b"\0\0\0\0" + b"\0\0\0\0"  # 19 bytes
+PGCOPY_TRAILER = b"\xff\xff"
+
+SAMPLE_OIDS = [23, 25, 20, 701]   # int4, text, int8, float8
+SAMPLE_NAMES = ["id", "txt", "big", "dbl"]
+
+PG_EPOCH_DATE = datetime.date(2000, 1, 1)
+PG_EPOCH_TS = datetime.datetime(2000, 1, 1)
+
+
+def encode_numeric(value: Decimal) -> bytes:
+    """Decimal → NUMERIC バイナリ (ndigits, weight, sign, dscale, base-10000 digits)"""
+    if value.is_nan():
+        return struct.pack(">hhHh", 0, 0, 0xC000, 0)
+    if value.is_infinite():
+        return struct.pack(">hhHh", 0, 0, 0xF000 if value < 0 else 0xD000, 0)
+    sign, digits, exp = value.as_tuple()
+    dscale = max(0, -exp)
+    s = "".join(map(str, digits))
+    if exp < 0:
+        s = s.zfill(-exp)
+    if exp > 0:
+        s += "0" * exp
+        frac = ""
+    else:
+        frac = s[len(s) + exp:] if exp < 0 else ""
+        s = s[: len(s) + exp] if exp < 0 else s
+    int_part = s.lstrip("0")
+    int_part = "0" * (-len(int_part) % 4) + int_part
+    frac = frac + "0" * (-len(frac) % 4)
+    groups = [int(int_part[i:i + 4]) for i in range(0, len(int_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(frac[i:i + 4]) for i in range(0, len(frac), 4)]
+    # 先頭・末尾のゼロ桁は PostgreSQL と同様に取り除く
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    pg_sign = 0x4000 if sign else 0x0000
+    return struct.pack(">hhHh", len(groups), weight, pg_sign, dscale) + b"".join(
+        struct.pack(">h", g) for g in groups
+    )
+
+
+def encode_value(pg_oid: int, value) -> Optional[bytes]:
+    """1 値を COPY BINARY のフィールドペイロードへ変換 (None → None)"""
+    if value is None:
+        return None
+    if pg_oid == 21:
+        return struct.pack(">h", value)
+    if pg_oid == 23:
+        return struct.pack(">i", value)
+    if pg_oid == 20:
+        return struct.pack(">q", value)
+    if pg_oid == 700:
+        return struct.pack(">f", value)
+    if pg_oid == 701:
+        return struct.pack(">d", value)
+    if pg_oid == 16:
+        return b"\x01" if value else b"\x00"
+    if pg_oid == 1082:
+        return struct.pack(">i", (value - PG_EPOCH_DATE).days)
+    if pg_oid in (1114, 1184):
+        delta = value - PG_EPOCH_TS
+        return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+    if pg_oid == 1700:
+        return encode_numeric(Decimal(value))
+    if pg_oid in (25, 1042, 1043):
+        return value.encode("utf-8")
+    if pg_oid == 17 or isinstance(value, (bytes, bytearray)):
+        # bytea / 未対応型 (uuid 等) は生バイトをそのまま書く
+        return bytes(value)
+    raise ValueError(f"unsupported pg_oid {pg_oid}")
+
+
+def encode_row(pg_oids: Sequence[int], row: Sequence) -> bytes:
+    """1 行分 (num_fields + 各フィールド) のバイト列"""
+    out = [struct.pack(">h", len(pg_oids))]
+    for oid, v in zip(pg_oids, row):
+        payload = encode_value(oid, v)
+        if payload is None:
+            out.append(struct.pack(">i", -1))
+        else:
+            out.append(struct.pack(">i", len(payload)))
+            out.append(payload)
+    return b"".join(out)
+
+
+def build_copy_binary(pg_oids: Sequence[int], rows: Iterable[Sequence], trailer: bool = True) -> bytes:
+    """ヘッダ + 全行 (+ 終端マーカー) の COPY BINARY ストリーム"""
+    body = b"".join(encode_row(pg_oids, r) for r in rows)
+    return PGCOPY_HEADER + body + (PGCOPY_TRAILER if trailer else b"")
+
+
+def make_column_meta(names: Sequence[str], pg_oids: Sequence[int],
+                     numeric_params: Optional[dict] = None) -> List[ColumnMeta]:
+    """fetch_column_meta 相当の ColumnMeta を DB なしで生成"""
+    numeric_params = numeric_params or {}
+    metas = []
+    for name, oid in zip(names, pg_oids):
+        arrow_id, elem = PG_OID_TO_ARROW.get(oid, (UNKNOWN, None))
+        arrow_param = None
+        if arrow_id == DECIMAL128:
+            arrow_param = numeric_params.get(name, (38, 0))
+        metas.append(
+            ColumnMeta(
+                name=name,
+                pg_oid=oid,
+                pg_typmod=0,
+                arrow_id=arrow_id,
+                elem_size=elem or 0,
+                arrow_param=arrow_param,
+            )
+        )
+    return metas
+
+
+def sample_rows(n: int) -> List[tuple]:
+    """SAMPLE_OIDS の行 (7 行に 1 行 txt が NULL)"""
+    return [(i, None if i % 7 == 0 else f"s{i % 10}", i * 13, i / 4.0) for i in range(n)]
+
+
+def sample_copy_binary(n: int) -> bytes:
+    return build_copy_binary(SAMPLE_OIDS, sample_rows(n))
+
+
+def pipeline_batches(chunks, columns: List[ColumnMeta], sink=None, **options) -> list:
+    """
+    ``run_pipeline`` (既定 backend="cpu") の出力バッチをリストに集めて返す。
+    sink (callable または ``write_batch`` を持つもの) を渡すと各バッチをそこへも書く
+    """
+    from src.pipeline import run_pipeline
+
+    batches = []
+    write = getattr(sink, "write_batch", sink)
+
+    def collect(batch):
+        batches.append(batch)
+        if write is not None:
+            write(batch)
+
+    options.setdefault("backend", "cpu")
+    run_pipeline(chunks, columns, collect, **options)
+    return batches
+
+
+def device_backed_batch(batch):
+    """
+    バッファをすべて pyarrow.cuda のデバイスバッファへコピーした RecordBatch
+    (decode_chunk のゼロコピー出力と同じく GPU 上を指すバッチ)。pyarrow.cuda と GPU が必要
+    """
+    import pyarrow as pa
+    import pyarrow.cuda as pa_cuda
+
+    ctx = pa_cuda.Context()
+    arrays = [
+        pa.Array.from_buffers(arr.type, len(arr),
+                              [None if b is None else ctx.buffer_from_data(b) for b in arr.buffers()],
+                              null_count=arr.null_count, offset=arr.offset)
+        for arr in batch.columns
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=batch.schema)
+
+
+__all__ = [
+    "PGCOPY_HEADER", "PGCOPY_TRAILER",
+    "encode_numeric", "encode_value", "encode_row",
+    "build_copy_binary", "make_column_meta",
+    "SAMPLE_OIDS", "SAMPLE_NAMES", "sample_rows", "sample_copy_binary",
+    "pipeline_batches", "device_backed_batch",
+]
@@ -0,0 +1,154 @@
+"""
+GPU メモリ予算ベースのチャンクプランナのテスト
+
+- サンプルから求めた行あたりバイト数 / 列の平均長が実データと一致するか
+- 計画した行数が予算に収まり、1 行増やすと収まらないこと
+- 見積りより大きいバッチを観測したら行数を減らして再計画すること
+- StreamPlanner が先頭チャンクから計画し、以降のチャンクを計画したサイズで切り出させること
+- (実 GPU + CuPy) 計画した行数のチャンクを parse / decode したときのピークが見積り以内であること
+"""
+
+import numpy as np
+import pytest
+from numba import config, cuda
+
+from src.chunk_planner import (
+    MIN_PLANNED_CHUNK_BYTES,
+    ChunkPlanner,
+    StreamPlanner,
+    estimate_row_bytes,
+    fixed_overhead_bytes,
+    plan_chunk,
+    sample_copy_stats,
+)
+from src.gpu_memory_pool import CUPY_AVAILABLE, DeviceBufferPool, cupy_pool_enabled
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+OIDS = [23, 20, 25, 1700, 17]
+NAMES = ["i4", "i8", "txt", "num", "bin"]
+
+
+def _rows(n):
+    from decimal import Decimal
+    return [
+        (i, i * 3, None if i % 5 == 0 else "x" * (i % 13), Decimal(i) / 7, b"\x00" * (i % 4))
+        for i in range(n)
+    ]
+
+
+def test_sample_stats_exact():
+    rows = _rows(500)
+    data = build_copy_binary(OIDS, rows)
+    bpr, avg_lens, n = sample_copy_stats(data, len(OIDS), sample_bytes=len(data))
+    assert n == 500
+    assert bpr == pytest.approx((len(data) - 19 - 2) / 500)
+    assert avg_lens[2] == pytest.approx(np.mean([0 if r[2] is None else len(r[2]) for r in rows]))
+    assert avg_lens[4] == pytest.approx(np.mean([len(r[4]) for r in rows]))
+
+
+def test_sample_stats_partial():
+    data = build_copy_binary(OIDS, _rows(500))
+    bpr, _, n = sample_copy_stats(data, len(OIDS), sample_bytes=1000)
+    assert 0 < n < 500
+    assert n * bpr <= 1000
+
+
+@pytest.mark.parametrize("free_bytes", [1 << 20, 10 << 20, 3_333_333])
+def test_plan_fits_budget(free_bytes):
+    cols = make_column_meta(NAMES, OIDS)
+    avg = np.array([0, 0, 10.5, 0, 2.0])
+    plan = plan_chunk(cols, 60.0, avg, free_bytes=free_bytes, headroom=0.2)
+    assert plan.budget_bytes == int(free_bytes * 0.8)
+    assert plan.device_bytes <= plan.budget_bytes
+    overhead = fixed_overhead_bytes(cols)
+    assert (plan.rows + 1) * plan.row_bytes + overhead > plan.budget_bytes
+    assert plan.row_bytes == estimate_row_bytes(cols, 60.0, avg)
+    assert plan.raw_bytes == plan.rows * 60
+
+
+def test_plan_limits():
+    cols = make_column_meta(NAMES, OIDS)
+    assert plan_chunk(cols, 60.0, free_bytes=1 << 30, max_rows=1234).rows == 1234
+    with pytest.raises(RuntimeError):
+        plan_chunk(cols, 60.0, free_bytes=1000)
+    with pytest.raises(ValueError):
+        plan_chunk(cols, 60.0, free_bytes=1 << 20, headroom=1.0)
+
+
+def test_replan_on_larger_batch():
+    cols = make_column_meta(NAMES, OIDS)
+    data = build_copy_binary(OIDS, _rows(200))
+    planner = ChunkPlanner.from_sample(cols, data, free_bytes=4 << 20)
+    first = planner.current
+
+    # 見積り以下のバッチでは再計画しない
+    assert not planner.observe(100, int(100 * planner.raw_bytes_per_row * 0.9))
+    assert planner.current is first
+
+    # raw が見積りの 2 倍 → 行数が減る
+    assert planner.observe(100, int(100 * first.raw_bytes / first.rows * 2))
+    assert planner.current.rows < first.rows
+    assert planner.current.device_bytes <= planner.current.budget_bytes
+
+    # 可変長列の合計が見積り超過でも再計画する
+    rows_before = planner.current.rows
+    assert planner.observe(100, 100, varlen_bytes={2: 100 * 500})
+    assert planner.current.rows < rows_before
+    assert planner.replans == 2
+
+
+def test_stream_planner_sizes_chunks():
+    cols = make_column_meta(NAMES, OIDS)
+    data = build_copy_binary(OIDS, _rows(20000))
+    pieces = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+    stream = StreamPlanner(cols, initial_bytes=1 << 16, free_bytes=1 << 20)
+    assert stream.chunk_bytes() == 1 << 16
+
+    chunks = list(stream.track(iter_copy_chunks(pieces, stream.chunk_bytes)))
+    assert sum(c.rows for c in chunks) == 20000
+
+    # 先頭チャンクは計画前の initial_bytes, 以降は計画 (再計画後はその値) の raw バイト数で切り出す
+    target = max(stream.planner.current.raw_bytes, MIN_PLANNED_CHUNK_BYTES)
+    assert target > 1 << 16
+    assert chunks[0].nbytes <= 1 << 16
+    assert len(chunks) > 3
+    assert all(1 << 16 < c.nbytes for c in chunks[1:-1])
+    assert target - 64 < chunks[-2].nbytes <= target
+
+
+@pytest.mark.skipif(config.ENABLE_CUDASIM or not CUPY_AVAILABLE,
+                    reason="decode_chunk の prefix-sum は CuPy と実 GPU が必要")
+@pytest.mark.parametrize("filtered", [False, True])
+def test_planned_chunk_peak_within_estimate(filtered, monkeypatch):
+    import cupy as cp
+    from src import gpu_memory_pool
+    from src.gpu_decoder_v2 import decode_chunk
+    from src.gpu_parse_wrapper import parse_binary_chunk_gpu
+    from src.predicate import col
+
+    cols = make_column_meta(NAMES, OIDS)
+    rows = _rows(20000)
+    data = build_copy_binary(OIDS, rows)
+    plan = ChunkPlanner.from_sample(cols, data, sample_bytes=len(data), free_bytes=1 << 30,
+                                    max_rows=len(rows), filtered=filtered).current
+    assert plan.rows == len(rows)
+
+    pool = DeviceBufferPool()
+    monkeypatch.setattr(gpu_memory_pool, "_default_pool", pool)
+    mp = cp.get_default_memory_pool()
+    mp.free_all_blocks()
+    base = mp.total_bytes()
+
+    raw_dev = cuda.to_device(np.frombuffer(data, dtype=np.uint8))
+    offs, lens = parse_binary_chunk_gpu(raw_dev, len(cols))
+    batch = decode_chunk(raw_dev, offs, lens, cols, predicate=(col("i4") >= 10000) if filtered else None)
+    cuda.synchronize()
+    assert batch.num_rows == (10000 if filtered else len(rows))
+
+    assert pool.peak_bytes <= plan.device_bytes
+    if cupy_pool_enabled():
+        # Numba の確保も CuPy のプールから行われ、プールは返却分を保持し続けるので
+        # total_bytes の増分は parse / decode 中の全確保のピーク以上になる
+        assert mp.total_bytes() - base <= plan.device_bytes
+
@@ -0,0 +1,129 @@
+"""
+COPY BINARY ストリーミング受信のテスト
+
+記録済み COPY ストリームを ``iter_copy_file`` で細切れに再生し、
+``iter_copy_chunks`` が以下を満たすか検証:
+- 各チャンクが行境界で終わる (連結すると元の行データと一致)
+- 行数の合計が元データと一致
+- チャンクサイズを超える 1 行を持ち越して正しく扱う
+- ピークメモリがチャンクサイズの数倍に収まる
+"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from src.cpu_parse_utils import scan_row_boundaries
+from src.psql_copy_stream import iter_copy_chunks, iter_copy_file
+from test.pg_copy_fixtures import PGCOPY_HEADER, build_copy_binary
+
+PG_OIDS = [23, 25, 20, 701]   # int4, text, int8, float8
+
+
+def _make_rows(n, big_row_at=None, big_len=0):
+    rows = []
+    for i in range(n):
+        text = f"row-{i}-" + "x" * (i % 37)
+        if i == big_row_at:
+            text = "B" * big_len
+        rows.append((i, None if i % 11 == 0 else text, i * 1000003, i / 7.0))
+    return rows
+
+
+@pytest.fixture
+def copy_file(tmp_path):
+    rows = _make_rows(3000, big_row_at=1234, big_len=40000)
+    data = build_copy_binary(PG_OIDS, rows)
+    path = tmp_path / "stream.bin"
+    path.write_bytes(data)
+    return path, data, len(rows)
+
+
+def test_chunks_are_row_aligned(copy_file):
+    path, data, nrows = copy_file
+    chunks = list(iter_copy_chunks(iter_copy_file(str(path), read_size=4096), chunk_bytes=16384))
+
+    assert len(chunks) > 1
+    assert chunks[0].header_size == len(PGCOPY_HEADER)
+    assert all(c.header_size == 0 for c in chunks[1:])
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    assert sum(c.rows for c in chunks) == nrows
+
+    # ヘッダを除いた本体を連結すると終端マーカー前までと一致する
+    body = b"".join(bytes(c.data[c.header_size:]) for c in chunks)
+    assert body == data[len(PGCOPY_HEADER):-2]
+
+    for c in chunks:
+        # 各チャンクは完結した行のみを含む
+        end, rows, _ = scan_row_boundaries(c.data, c.header_size, c.nbytes)
+        assert (int(end), int(rows)) == (c.nbytes, c.rows)
+        assert data[c.stream_offset:c.stream_offset + c.nbytes] == bytes(c.data)
+
+    # 16KiB を超える行を含むチャンクが 1 つだけ存在する
+    assert sum(1 for c in chunks if c.nbytes > 16384) == 1
+
+
+def test_stream_without_trailer_and_truncated():
+    rows = _make_rows(50)
+    data = build_copy_binary(PG_OIDS, rows, trailer=False)
+    chunks = list(iter_copy_chunks([data[i:i + 100] for i in range(0, len(data), 100)], chunk_bytes=512))
+    assert sum(c.rows for c in chunks) == 50
+
+    with pytest.raises(ValueError):
+        list(iter_copy_chunks([data[:-3]], chunk_bytes=512))
+
+
+def test_peak_memory_bounded_by_chunk_size(tmp_path):
+    chunk_bytes = 64 << 10
+    data = build_copy_binary(PG_OIDS, _make_rows(60000))
+    assert len(data) > 20 * chunk_bytes
+    path = tmp_path / "large.bin"
+    path.write_bytes(data)
+    del data
+
+    # numba の JIT コンパイルを計測対象から外す
+    scan_row_boundaries(np.zeros(8, dtype=np.uint8), 0, 0)
+
+    tracemalloc.start()
+    try:
+        total_rows = 0
+        for chunk in iter_copy_chunks(iter_copy_file(str(path), read_size=16 << 10), chunk_bytes=chunk_bytes):
+            total_rows += chunk.rows
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert total_rows == 60000
+    assert peak < 4 * chunk_bytes + (16 << 10)
+
+
+@pytest.mark.parametrize("pinned", [True, False])
+def test_transfer_chunks_to_gpu(copy_file, pinned):
+    from src.gpu_parse_wrapper import detect_pg_header_size
+    from src.psql_copy_stream import transfer_chunks_to_gpu
+
+    path, data, nrows = copy_file
+    received = []
+
+    def process_chunk(dev_array, nbytes):
+        assert dev_array.size == nbytes
+        received.append(dev_array.copy_to_host())
+
+    stats = transfer_chunks_to_gpu(
+        iter_copy_chunks(iter_copy_file(str(path), read_size=4096), chunk_bytes=16384),
+        process_chunk,
+        chunk_bytes=16384,
+        num_buffers=3,
+        pinned=pinned,
+    )
+
+    assert stats["rows"] == nrows
+    assert stats["chunks"] == len(received)
+    assert stats["bytes"] == len(data) - 2
+    assert b"".join(r.tobytes() for r in received) == data[:-2]
+    # 先頭チャンクのみヘッダ付き
+    assert detect_pg_header_size(received[0]) == len(PGCOPY_HEADER)
+    assert all(detect_pg_header_size(r) == 0 for r in received[1:])
+    if not pinned:
+        assert stats["pinned"] is False
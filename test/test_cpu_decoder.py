@@ -0,0 +1,121 @@
+"""
+CPU デコーダ (decode_chunk_cpu) のテスト
+
+- 全型の値 / NULL / 日付・タイムスタンプのエポック変換
+- NUMERIC → decimal128 の丸め (half away from zero) と NaN / オーバーフロー
+- decode_chunk(backend="cpu") のディスパッチ
+"""
+
+import datetime
+import random
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from src.cpu_decoder import decode_chunk_cpu
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+# int2, int4, int8, float4, float8, text, bytea, bool, date, timestamp, numeric, uuid(UNKNOWN)
+ALL_OIDS = [21, 23, 20, 700, 701, 25, 17, 16, 1082, 1114, 1700, 2950]
+ALL_NAMES = [f"c{i}" for i in range(len(ALL_OIDS))]
+
+
+def _decode(oids, names, rows, numeric_params=None):
+    data = build_copy_binary(oids, rows)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offs, lens = parse_binary_chunk_cpu(raw, len(oids))
+    cols = make_column_meta(names, oids, numeric_params)
+    return decode_chunk_cpu(raw, offs, lens, cols)
+
+
+def test_all_types_and_nulls():
+    rows = [
+        (1, 10, 1 << 40, 1.5, -2.25, "héllo", b"\x00\xff", True,
+         datetime.date(1999, 12, 31), datetime.datetime(2024, 5, 1, 12, 0, 0, 123456),
+         Decimal("-12.345"), b"0123456789abcdef"),
+        tuple([None] * len(ALL_OIDS)),
+        (-1, -10, -(1 << 40), 0.0, 1e300, "", b"", False,
+         datetime.date(1970, 1, 1), datetime.datetime(1960, 1, 1),
+         Decimal("0"), b"\x01" * 16),
+    ]
+    batch = _decode(ALL_OIDS, ALL_NAMES, rows, {"c10": (10, 2)})
+
+    assert batch.num_rows == 3
+    assert batch.column(10).type == pa.decimal128(10, 2)
+    assert batch.column(11).type == pa.binary()
+    got = batch.to_pylist()
+    assert list(got[0].values()) == [
+        1, 10, 1 << 40, 1.5, -2.25, "héllo", b"\x00\xff", True,
+        datetime.date(1999, 12, 31), datetime.datetime(2024, 5, 1, 12, 0, 0, 123456),
+        Decimal("-12.35"), b"0123456789abcdef",
+    ]
+    assert all(v is None for v in got[1].values())
+    assert got[2]["c8"] == datetime.date(1970, 1, 1)
+    assert got[2]["c9"] == datetime.datetime(1960, 1, 1)
+    assert got[2]["c10"] == Decimal("0.00")
+
+
+def test_no_nulls_has_no_validity_buffer():
+    batch = _decode([23, 25], ["a", "b"], [(i, str(i)) for i in range(20)])
+    for col in batch.columns:
+        assert col.null_count == 0
+        assert col.buffers()[0] is None
+    assert batch.column(1).to_pylist() == [str(i) for i in range(20)]
+
+
+@pytest.mark.parametrize("scale", [0, 2, 6])
+def test_decimal_rounding_matches_python(scale):
+    rng = random.Random(scale)
+    values = [Decimal("0.5"), Decimal("-0.005"), Decimal("1.0000000001"), Decimal("99999.99995")]
+    for _ in range(300):
+        digits = rng.randrange(-10 ** rng.randrange(1, 30), 10 ** rng.randrange(1, 30))
+        values.append(Decimal(digits).scaleb(-rng.randrange(0, 20)))
+    batch = _decode([1700], ["n"], [(v,) for v in values], {"n": (38, scale)})
+
+    quantum = Decimal(1).scaleb(-scale)
+    with localcontext() as ctx:
+        ctx.prec = 60
+        expected = [v.quantize(quantum, rounding=ROUND_HALF_UP) for v in values]
+    assert batch.column(0).to_pylist() == expected
+
+
+def test_decimal_nan_and_overflow_become_null():
+    rows = [(Decimal("NaN"),), (Decimal("1"),), (Decimal("9" * 40),)]
+    with pytest.warns(UserWarning, match="overflowed"):
+        batch = _decode([1700], ["n"], rows, {"n": (38, 0)})
+    assert batch.column(0).to_pylist() == [None, Decimal("1"), None]
+    assert batch.column(0).null_count == 2
+
+
+def test_matches_decode_chunk_dispatch():
+    from src.gpu_decoder_v2 import decode_chunk
+
+    rows = [(i, f"s{i}", None if i % 3 else Decimal(i) / 7) for i in range(50)]
+    oids, names = [23, 25, 1700], ["a", "b", "n"]
+    data = build_copy_binary(oids, rows)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offs, lens = parse_binary_chunk_cpu(raw, len(oids))
+    cols = make_column_meta(names, oids, {"n": (12, 4)})
+
+    expected = decode_chunk_cpu(raw, offs, lens, cols)
+    assert decode_chunk(raw, offs, lens, cols, backend="cpu").equals(expected)
+    with pytest.raises(ValueError):
+        decode_chunk(raw, offs, lens, cols, backend="tpu")
+
+
+def test_column_count_mismatch():
+    data = build_copy_binary([23], [(1,)])
+    offs, lens = parse_binary_chunk_cpu(data, 1)
+    with pytest.raises(ValueError):
+        decode_chunk_cpu(data, offs, lens, make_column_meta(["a", "b"], [23, 23]))
+
+
+def test_decimal_precision_overflow():
+    rows = [(Decimal("999.994"),), (Decimal("999.995"),), (Decimal("-1000"),)]
+    with pytest.warns(UserWarning, match="overflowed"):
+        batch = _decode([1700], ["n"], rows, {"n": (5, 2)})
+    assert batch.column(0).to_pylist() == [Decimal("999.99"), None, None]
+    batch.validate(full=True)
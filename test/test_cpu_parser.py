@@ -0,0 +1,94 @@
+"""
+CPU パーサー (parse_binary_chunk_cpu) のテスト
+
+- マルチコア分割 (小さいセグメント) でも逐次走査と同じ行先頭になるか
+- field_offsets / field_lengths が GPU パーサーと一致するか (GPU パスのオラクル)
+- calculate_row_starts_cpu の互換性
+"""
+
+import numpy as np
+import pytest
+from numba import cuda
+
+from src.cpu_parse_utils import (
+    calculate_row_starts_cpu,
+    detect_pg_header_size,
+    find_row_starts_cpu,
+    parse_binary_chunk_cpu,
+)
+from src.gpu_parse_wrapper import build_pg_row_starts_cpu, parse_binary_chunk_gpu
+from test.pg_copy_fixtures import PGCOPY_HEADER, build_copy_binary, encode_row
+from test.test_parallel_row_detection import PG_OIDS, _adversarial_rows
+
+
+@pytest.mark.parametrize("segment_size", [8, 33, 1 << 16])
+@pytest.mark.parametrize("trailer", [True, False])
+def test_row_starts_match_sequential_scan(segment_size, trailer):
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(300, 7), trailer=trailer)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    expected = build_pg_row_starts_cpu(raw, len(PGCOPY_HEADER), raw.size)
+    expected = expected[expected >= 0]
+    got = find_row_starts_cpu(raw, len(PGCOPY_HEADER), len(PG_OIDS), segment_size)
+    np.testing.assert_array_equal(got, expected)
+
+
+def test_field_matrices():
+    rows = [(1, "ab", b"\x00"), (None, None, None), (3, "", b"")]
+    data = build_copy_binary(PG_OIDS, rows)
+    offs, lens = parse_binary_chunk_cpu(data, len(PG_OIDS))
+
+    base = len(PGCOPY_HEADER)
+    np.testing.assert_array_equal(lens, [[4, 2, 1], [-1, -1, -1], [4, 0, 0]])
+    assert offs[0, 0] == base + 2 + 4
+    assert offs[1].tolist() == [0, 0, 0]
+    assert data[offs[0, 1]:offs[0, 1] + 2] == b"ab"
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_matches_gpu_parser(seed):
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(80, seed))
+    raw = np.frombuffer(data, dtype=np.uint8)
+    cpu_offs, cpu_lens = parse_binary_chunk_cpu(raw, len(PG_OIDS), segment_size=64)
+    gpu_offs, gpu_lens = parse_binary_chunk_gpu(cuda.to_device(raw), len(PG_OIDS))
+    np.testing.assert_array_equal(cpu_offs, gpu_offs.copy_to_host())
+    np.testing.assert_array_equal(cpu_lens, gpu_lens.copy_to_host())
+
+
+def test_continuation_chunk_and_empty():
+    body = b"".join(encode_row(PG_OIDS, r) for r in _adversarial_rows(20, 2))
+    assert detect_pg_header_size(np.frombuffer(body, np.uint8)) == 0
+    offs, _ = parse_binary_chunk_cpu(body, len(PG_OIDS))
+    assert offs.shape == (20, 3)
+
+    offs, lens = parse_binary_chunk_cpu(PGCOPY_HEADER + b"\xff\xff", 3)
+    assert offs.shape == lens.shape == (0, 3)
+
+
+def test_calculate_row_starts_cpu_compat():
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(10, 4))
+    raw = np.frombuffer(data, dtype=np.uint8)
+    expected = build_pg_row_starts_cpu(raw, len(PGCOPY_HEADER), 12)
+    got = calculate_row_starts_cpu(raw, len(PGCOPY_HEADER), 12)
+    np.testing.assert_array_equal(got, expected)
+    assert (got[10:] == -1).all()
+
+
+@pytest.mark.parametrize("layout", ["col", "row"])
+def test_field_index_layout(layout):
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(40, 5))
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ref_offs, ref_lens = parse_binary_chunk_cpu(raw, len(PG_OIDS), layout="row")
+
+    cpu_offs, cpu_lens = parse_binary_chunk_cpu(raw, len(PG_OIDS), layout=layout)
+    gpu_offs, gpu_lens = parse_binary_chunk_gpu(cuda.to_device(raw), len(PG_OIDS), layout=layout)
+    gpu_offs, gpu_lens = gpu_offs.copy_to_host(), gpu_lens.copy_to_host()
+    for arr in (cpu_offs, cpu_lens, gpu_offs, gpu_lens):
+        assert arr.flags.f_contiguous == (layout == "col")
+        assert arr[:, 1].flags.c_contiguous == (layout == "col")
+    np.testing.assert_array_equal(cpu_offs, ref_offs)
+    np.testing.assert_array_equal(cpu_lens, ref_lens)
+    np.testing.assert_array_equal(gpu_offs, ref_offs)
+    np.testing.assert_array_equal(gpu_lens, ref_lens)
+
+    with pytest.raises(ValueError):
+        parse_binary_chunk_cpu(raw, len(PG_OIDS), layout="diag")
@@ -0,0 +1,131 @@
+"""
+パーティション分割 Parquet データセット (ParquetDatasetWriter) のテスト
+
+- YYYYMMDD 整数列の年で Hive 形式に分割し、_metadata から読み戻すと一致するか
+- ファイルが target_file_bytes 前後で切られるか (パーティションごとに複数ファイル)
+- _metadata だけでパーティション・統計による絞り込みができるか
+- identity 分割では列をファイルから除き、パスから復元するか
+- 複数ワーカの出力を write_dataset_metadata でまとめられるか
+- (pyarrow.cuda + GPU) GPU 上のバッファを指すバッチも分割して書けるか
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from src.dataset_writer import ParquetDatasetWriter, write_dataset_metadata
+from src.pipeline import run_pipeline
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, device_backed_batch, make_column_meta, pipeline_batches
+
+OIDS = [23, 23, 25, 701]
+NAMES = ["id", "lo_orderdate", "txt", "dbl"]
+YEARS = range(1992, 1999)
+
+
+def _rows(start, n):
+    return [(i, YEARS[i % len(YEARS)] * 10000 + (i % 12 + 1) * 100 + i % 28 + 1,
+             None if i % 9 == 0 else f"text-{i % 100}", i / 3.0) for i in range(start, start + n)]
+
+
+def _write(writer, start=0, n=20000):
+    cols = make_column_meta(NAMES, OIDS)
+    batches = pipeline_batches(iter_copy_chunks([build_copy_binary(OIDS, _rows(start, n))], 16384), cols, writer)
+    return pa.Table.from_batches(batches)
+
+
+def _sorted(table):
+    return table.sort_by("id")
+
+
+def test_year_partitions_and_metadata(tmp_path):
+    base = str(tmp_path / "ds")
+    target = 12 << 10
+    cols = make_column_meta(NAMES, OIDS)
+    writer = ParquetDatasetWriter(base, cols, partition_by="lo_orderdate", partition_transform="year",
+                                  target_file_bytes=target, row_group_size=2000, max_workers=3)
+    expected = _write(writer)
+    files = writer.close()
+
+    assert sorted(os.listdir(base)) == ["_common_metadata", "_metadata"] + \
+        [f"lo_orderdate_year={y}" for y in YEARS]
+    assert sum(f.rows for f in files) == writer.rows_written == 20000
+    per_dir = {}
+    for f in files:
+        per_dir.setdefault(f.partition, []).append(f)
+        assert f.bytes == os.path.getsize(os.path.join(base, f.path))
+    assert all(len(v) > 1 for v in per_dir.values())
+    # 最初のファイル以外は実測比で切るので目標サイズを大きく超えない
+    assert max(f.bytes for f in files) < target * 1.5
+
+    # _metadata だけでデータセットを組み立て、パーティションで絞り込む
+    dataset = ds.parquet_dataset(os.path.join(base, "_metadata"), partitioning="hive")
+    assert len(dataset.files) == len(files)
+    table = dataset.to_table(columns=NAMES)
+    assert _sorted(table).equals(_sorted(expected))
+    flt = ds.field("lo_orderdate_year") == 1995
+    assert len(list(dataset.get_fragments(filter=flt))) == len(per_dir["lo_orderdate_year=1995"])
+    got = dataset.to_table(columns=NAMES, filter=flt)
+    want = expected.filter(pc.equal(pc.divide(expected["lo_orderdate"], 10000), 1995))
+    assert _sorted(got).equals(_sorted(want))
+
+    md = pq.read_metadata(os.path.join(base, "_metadata"))
+    assert md.num_rows == 20000
+    assert pq.read_schema(os.path.join(base, "_common_metadata")).equals(expected.schema)
+
+
+def test_identity_partition_drops_column(tmp_path):
+    base = str(tmp_path / "ds")
+    cols = make_column_meta(["id", "g"], [23, 25])
+    rows = [(i, None if i % 5 == 0 else f"g/{i % 3}") for i in range(3000)]
+    writer = ParquetDatasetWriter(base, cols, partition_by="g")
+    run_pipeline(iter_copy_chunks([build_copy_binary([23, 25], rows)], 8192), cols, writer, backend="cpu")
+    files = writer.close()
+
+    assert {f.partition for f in files} == {"g=g%2F0", "g=g%2F1", "g=g%2F2", "g=__HIVE_DEFAULT_PARTITION__"}
+    assert pq.read_schema(os.path.join(base, files[0].path)).names == ["id"]
+    part = ds.partitioning(pa.schema([("g", pa.string())]), flavor="hive")
+    table = ds.parquet_dataset(os.path.join(base, "_metadata"), partitioning=part).to_table()
+    assert sorted(zip(table["id"].to_pylist(), table["g"].to_pylist())) == rows
+
+
+def test_device_backed_batches(tmp_path):
+    pytest.importorskip("pyarrow.cuda")
+    base = str(tmp_path / "ds")
+    cols = make_column_meta(NAMES, OIDS)
+    batches = pipeline_batches(iter_copy_chunks([build_copy_binary(OIDS, _rows(0, 5000))], 16384), cols)
+    with ParquetDatasetWriter(base, cols, partition_by="lo_orderdate", partition_transform="year") as writer:
+        for b in batches:
+            writer.write_batch(device_backed_batch(b))
+    table = ds.parquet_dataset(os.path.join(base, "_metadata"), partitioning="hive").to_table(columns=NAMES)
+    assert _sorted(table).equals(_sorted(pa.Table.from_batches(batches)))
+
+
+def test_merge_worker_metadata(tmp_path):
+    base = str(tmp_path / "ds")
+    expected = []
+    for worker in range(2):
+        writer = ParquetDatasetWriter(base, partition_by="lo_orderdate", partition_transform="month",
+                                      file_prefix=f"chunk{worker:04d}-", write_metadata=False)
+        expected.append(_write(writer, start=worker * 5000, n=5000))
+        writer.close()
+    assert not os.path.exists(os.path.join(base, "_metadata"))
+
+    n = write_dataset_metadata(base)
+    dataset = ds.parquet_dataset(os.path.join(base, "_metadata"), partitioning="hive")
+    assert n == len(dataset.files) == 2 * 7 * 12
+    assert _sorted(dataset.to_table(columns=NAMES)).equals(_sorted(pa.concat_tables(expected)))
+
+
+def test_invalid_options(tmp_path):
+    cols = make_column_meta(NAMES, OIDS)
+    with pytest.raises(KeyError):
+        ParquetDatasetWriter(str(tmp_path), cols, partition_by="missing")
+    with pytest.raises(TypeError):
+        ParquetDatasetWriter(str(tmp_path), cols, partition_by="txt", partition_transform="year")
+    with pytest.raises(ValueError):
+        ParquetDatasetWriter(str(tmp_path), cols, partition_by="id", partition_transform=lambda a: a)
@@ -0,0 +1,113 @@
+"""
+GPU 常駐出力 (DeviceTable) のテスト
+
+- 全型の RecordBatch → DeviceTable → RecordBatch が一致するか (レイアウトの検証)
+- 固定長列の型付き values / BOOL (1 バイト/行) / DECIMAL128 (下位, 上位 64bit)
+- decode_chunk / run_pipeline の output="device"
+- cuDF がある場合は to_cudf の値が一致するか
+"""
+
+import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pytest
+from numba import config
+
+from src.cpu_decoder import decode_chunk_cpu
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.device_table import DeviceColumn, DeviceTable
+from src.gpu_decoder_v2 import decode_chunk
+from src.pipeline import run_pipeline
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+# int2, int4, int8, float4, float8, text, bytea, bool, date, timestamp, numeric
+OIDS = [21, 23, 20, 700, 701, 25, 17, 16, 1082, 1114, 1700]
+NAMES = [f"c{i}" for i in range(len(OIDS))]
+
+
+def _rows(n):
+    return [
+        None if i % 11 == 3 else (
+            i, i * 7, i << 33, i / 2, -i / 3, "s" * (i % 5), bytes([i % 256]) * (i % 3), i % 2 == 0,
+            datetime.date(2000, 1, 1) + datetime.timedelta(days=i),
+            datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=i),
+            Decimal(i) / 100,
+        )
+        for i in range(n)
+    ]
+
+
+def _decode(n):
+    rows = [r if r is not None else tuple([None] * len(OIDS)) for r in _rows(n)]
+    data = build_copy_binary(OIDS, rows)
+    offs, lens = parse_binary_chunk_cpu(data, len(OIDS))
+    cols = make_column_meta(NAMES, OIDS, {"c10": (12, 2)})
+    return data, offs, lens, cols
+
+
+def test_roundtrip_all_types():
+    data, offs, lens, cols = _decode(50)
+    batch = decode_chunk_cpu(data, offs, lens, cols)
+    table = DeviceTable.from_arrow(batch)
+    assert table.num_rows == 50 and table.column_names == NAMES
+    assert table.schema.equals(batch.schema)
+    assert table.to_arrow().equals(batch)
+
+    # 固定長は型付きで読め、NULL のある列は validity ビットマップを持つ
+    assert table["c1"].values.copy_to_host()[:3].tolist() == [0, 7, 14]
+    assert table["c7"].values.copy_to_host()[:3].tolist() == [True, False, True]
+    assert table["c10"].values.copy_to_host()[1].tolist() == [1, 0]    # 0.01 → 1 (scale 2)
+    assert table["c1"].null_count == 5 and table["c1"].validity is not None
+    with pytest.raises(TypeError):
+        table["c5"].values
+
+
+def test_sliced_and_empty_strings():
+    arr = pa.array(["", None, "abc", ""]).slice(1)
+    col = DeviceColumn.from_arrow("s", arr)
+    assert col.to_arrow().to_pylist() == [None, "abc", ""]
+    col = DeviceColumn.from_arrow("s", pa.array(["", ""]))
+    assert col.to_arrow().to_pylist() == ["", ""]
+    with pytest.raises(ValueError):
+        DeviceTable([col, DeviceColumn.from_arrow("x", pa.array([1]))])
+
+
+def test_decode_chunk_cpu_device_output():
+    data, offs, lens, cols = _decode(30)
+    out = decode_chunk(data, offs, lens, cols, backend="cpu", output="device")
+    assert isinstance(out, DeviceTable)
+    assert out.to_arrow().equals(decode_chunk_cpu(data, offs, lens, cols))
+    with pytest.raises(ValueError):
+        decode_chunk(data, offs, lens, cols, backend="cpu", output="host")
+
+
+def test_pipeline_device_output():
+    rows = [r if r is not None else tuple([None] * len(OIDS)) for r in _rows(600)]
+    data = build_copy_binary(OIDS, rows)
+    cols = make_column_meta(NAMES, OIDS, {"c10": (12, 2)})
+    tables, batches = [], []
+    run_pipeline(iter_copy_chunks([data], 4096), cols, tables.append, backend="cpu", output="device")
+    run_pipeline(iter_copy_chunks([data], 4096), cols, batches.append, backend="cpu")
+    assert len(tables) > 1 and all(isinstance(t, DeviceTable) for t in tables)
+    assert pa.Table.from_batches([t.to_arrow() for t in tables]).equals(pa.Table.from_batches(batches))
+
+
+@pytest.mark.skipif(config.ENABLE_CUDASIM, reason="simulator arrays have no __cuda_array_interface__")
+def test_cuda_array_interface():
+    table = DeviceTable.from_arrow(pa.record_batch({"i": pa.array([1, 2, 3], pa.int32()), "s": ["a", "b", "c"]}))
+    iface = table["i"].__cuda_array_interface__
+    assert iface["shape"] == (3,) and iface["typestr"] == "<i4"
+    assert not hasattr(table["s"], "__cuda_array_interface__")
+
+
+def test_to_cudf():
+    cudf = pytest.importorskip("cudf")
+    data, offs, lens, cols = _decode(40)
+    batch = decode_chunk_cpu(data, offs, lens, cols)
+    df = DeviceTable.from_arrow(batch).to_cudf()
+    assert len(df) == 40
+    for name in ["c0", "c1", "c2", "c4", "c5", "c7", "c10"]:
+        assert df[name].to_arrow().to_pylist() == batch.column(name).to_pylist(), name
+    assert isinstance(df, cudf.DataFrame)
@@ -0,0 +1,129 @@
+"""
+保存済み COPY BINARY ファイルのメモリマップ読み込み (FileSource) のテスト
+
+- ファイル / ディレクトリを行境界揃えのチャンクに切り、チャンクがメモリマップのビューか
+- 複数ファイル (各ファイルがヘッダ付き) と空ファイル、チャンクより大きい行
+- run_pipeline に流した結果がバイト列から変換したものと一致するか (射影・述語つき)
+- 途中で切れたファイル・列数の不一致はエラー、サイドカー JSON の列情報
+"""
+
+import mmap
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from src.file_source import FileSource, load_column_meta, save_column_meta
+from src.pipeline import run_pipeline
+from src.predicate import col
+from src.psql_copy_stream import iter_copy_chunks
+from src.type_map import UTF8, ColumnMeta
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+OIDS = [23, 25, 701, 1700]
+NAMES = ["id", "txt", "dbl", "num"]
+
+
+def _rows(start, n):
+    return [(i, None if i % 6 == 0 else "x" * (i % 40), i / 8.0, None) for i in range(start, start + n)]
+
+
+def _cols():
+    return make_column_meta(NAMES, OIDS, {"num": (12, 2)})
+
+
+def _write(path, rows):
+    data = build_copy_binary(OIDS, rows)
+    path.write_bytes(data)
+    return data
+
+
+def _expected(datas, **options):
+    batches = []
+    for data in datas:
+        run_pipeline(iter_copy_chunks([data], 1 << 16), _cols(), batches.append, backend="cpu", **options)
+    return pa.Table.from_batches(batches)
+
+
+def _base_mmap(arr):
+    while isinstance(arr, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+def test_directory_chunks_are_memory_mapped(tmp_path):
+    datas = [_write(tmp_path / "part-000.bin", _rows(0, 900)), _write(tmp_path / "part-001.bin", _rows(900, 500))]
+    (tmp_path / "part-002.bin").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("not a copy file")
+
+    source = FileSource(str(tmp_path), columns=_cols(), chunk_bytes=4096)
+    assert [p.rsplit("/", 1)[1] for p in source.files] == ["part-000.bin", "part-001.bin", "part-002.bin"]
+    assert source.nbytes == sum(len(d) for d in datas) and source.ncols() == len(OIDS)
+
+    chunks = list(source)
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    assert sum(c.rows for c in chunks) == 1400
+    assert all(c.nbytes <= 4096 for c in chunks)
+    for file_index, data in enumerate(datas):
+        mine = [c for c in chunks if c.partition == file_index]
+        assert mine[0].header_size > 0 and all(c.header_size == 0 for c in mine[1:])
+        joined = b"".join(c.data.tobytes() for c in mine)
+        assert joined == data[:len(joined)] and data[len(joined):] == b"\xff\xff"
+        assert all(c.stream_offset == sum(m.nbytes for m in mine[:k]) for k, c in enumerate(mine))
+    # ファイルを bytes に読み込まず、読み取り専用のメモリマップのビューを返す
+    assert all(isinstance(_base_mmap(c.data), mmap.mmap) and not c.data.flags.writeable for c in chunks)
+
+
+def test_run_pipeline_matches_bytes(tmp_path):
+    datas = [_write(tmp_path / f"{k}.bin", _rows(k * 700, 700)) for k in range(3)]
+    source = FileSource([str(tmp_path / f"{k}.bin") for k in range(3)], columns=_cols(), chunk_bytes=8192)
+    got = []
+    stats = source.run(got.append, backend="cpu")
+    assert stats.rows == 2100 and len(got) > 3
+    assert pa.Table.from_batches(got).equals(_expected(datas))
+
+    options = dict(projection=["txt", "id"], predicate=(col("id") >= 1000) & (col("dbl") < 200.0))
+    assert source.read_table(backend="cpu", **options).equals(_expected(datas, **options))
+    assert source.read_table(backend="cpu", predicate=col("id") < 0) is None
+
+
+def test_row_larger_than_chunk(tmp_path):
+    rows = [(1, "a" * 10000, 1.0, None)] + _rows(2, 300)
+    data = _write(tmp_path / "big.bin", rows)
+    chunks = list(FileSource(str(tmp_path / "big.bin"), columns=_cols(), chunk_bytes=1024))
+    # 大きい行の間だけ窓を広げ、次のチャンクから元の大きさに戻す
+    assert chunks[0].nbytes > 10000 and all(c.nbytes <= 1024 for c in chunks[1:]) and len(chunks) > 2
+    assert sum(c.rows for c in chunks) == 301
+    assert b"".join(c.data.tobytes() for c in chunks) + b"\xff\xff" == data
+
+
+def test_file_without_trailer_and_truncated(tmp_path):
+    data = build_copy_binary(OIDS, _rows(0, 50))
+    (tmp_path / "notrailer.bin").write_bytes(data[:-2])
+    assert sum(c.rows for c in FileSource(str(tmp_path / "notrailer.bin"), chunk_bytes=512)) == 50
+
+    (tmp_path / "cut.bin").write_bytes(data[:-30])
+    with pytest.raises(ValueError, match="inside a row"):
+        list(FileSource(str(tmp_path / "cut.bin"), chunk_bytes=512))
+
+
+def test_column_sidecar_and_errors(tmp_path):
+    _write(tmp_path / "t.bin", _rows(0, 10))
+    with pytest.raises(ValueError, match="column metadata"):
+        FileSource(str(tmp_path / "t.bin")).run(lambda b: None, backend="cpu")
+
+    sidecar = save_column_meta(str(tmp_path / "t.bin"), _cols())
+    assert sidecar.endswith("t.bin.columns.json") and load_column_meta(sidecar) == _cols()
+    assert FileSource(str(tmp_path / "t.bin")).columns == _cols()
+    save_column_meta(str(tmp_path), _cols())
+    assert FileSource(str(tmp_path)).columns == _cols()
+    # varchar(20) は arrow_param が int (meta_fetch: typmod - 4)
+    varchar = _cols() + [ColumnMeta("s", 1043, 24, UTF8, 0, 20)]
+    assert load_column_meta(save_column_meta(str(tmp_path / "v.bin"), varchar)) == varchar
+
+    with pytest.raises(ValueError, match="ncols mismatch"):
+        FileSource(str(tmp_path / "t.bin"), columns=_cols()[:3]).run(lambda b: None, backend="cpu")
+    with pytest.raises(FileNotFoundError):
+        FileSource(str(tmp_path / "missing.bin"))
+    with pytest.raises(FileNotFoundError):
+        FileSource(str(tmp_path), pattern="*.copy")
@@ -0,0 +1,157 @@
+"""
+NUMERIC → Decimal128 GPU カーネルのプロパティテスト (CUDA シミュレータで実行可)
+
+- ランダムな NUMERIC (最大 38 桁, 様々な weight / 符号 / 小数桁) を列の (precision, scale)
+  へ丸めた結果が Python decimal (ROUND_HALF_UP) と一致するか
+- NaN / ±Inf / 桁あふれ (128 bit, 10**precision) が NULL になりビットマップに反映されるか
+- 複数の DECIMAL 列 (列ごとに異なる scale) を 1 launch で変換した結果が列ごとの変換と一致するか
+- 128 bit 演算ヘルパ (乗算・除算・符号反転) が Python int と一致するか
+"""
+
+import random
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+
+import numpy as np
+import pyarrow as pa
+import pytest
+from numba import cuda
+
+from src.cuda_kernels.arrow_gpu_pass2_decimal128 import divmod128_u32, mul128_u32, neg128
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.gpu_decoder_v2 import run_pass2_decimal128, run_pass2_decimal128_multi
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+MASK64 = (1 << 64) - 1
+
+
+def _random_decimals(n, seed):
+    rng = random.Random(seed)
+    values = [Decimal("0"), Decimal("0.5"), Decimal("-0.5"), Decimal("-0.005"),
+              Decimal("9" * 38), Decimal("-" + "9" * 38), Decimal("1E+37"), Decimal("1E-40")]
+    for _ in range(n):
+        ndigits = rng.randrange(1, 39)
+        digits = rng.randrange(10 ** (ndigits - 1), 10 ** ndigits)
+        v = Decimal(digits).scaleb(rng.randrange(-45, 10))
+        values.append(-v if rng.random() < 0.5 else v)
+    return values
+
+
+def _expected(values, precision, scale):
+    quantum = Decimal(1).scaleb(-scale)
+    out = []
+    with localcontext() as ctx:
+        ctx.prec = 100
+        for v in values:
+            if not v.is_finite():
+                out.append(None)
+                continue
+            q = v.quantize(quantum, rounding=ROUND_HALF_UP)
+            out.append(None if abs(q.scaleb(scale)) >= 10 ** precision else q)
+    return out
+
+
+def _run_gpu(values, precision, scale):
+    data = build_copy_binary([1700], [(v,) for v in values])
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offs, lens = parse_binary_chunk_cpu(raw, 1)
+    rows = len(values)
+    bitmap = np.packbits(lens[:, 0] != -1, bitorder="little")
+
+    pa_type = pa.decimal128(precision, scale)
+    d_vals = cuda.device_array(rows * 16, dtype=np.uint8)
+    d_bitmap = cuda.to_device(bitmap)
+    cleared, overflow = run_pass2_decimal128(
+        cuda.to_device(raw), cuda.to_device(offs[:, 0].copy()), cuda.to_device(lens[:, 0].copy()),
+        pa_type, d_vals, d_bitmap, threads=64,
+    )
+    arr = pa.Array.from_buffers(
+        pa_type, rows,
+        [pa.py_buffer(d_bitmap.copy_to_host()), pa.py_buffer(d_vals.copy_to_host())],
+        null_count=int(rows - np.unpackbits(d_bitmap.copy_to_host(), bitorder="little")[:rows].sum()),
+    )
+    return arr, cleared, overflow
+
+
+@pytest.mark.parametrize("precision,scale", [(38, 0), (38, 10), (18, 4), (10, 2), (38, 38), (5, 5)])
+def test_matches_python_decimal(precision, scale):
+    values = _random_decimals(150, precision * 100 + scale)
+    arr, cleared, overflow = _run_gpu(values, precision, scale)
+    expected = _expected(values, precision, scale)
+    assert arr.to_pylist() == expected
+    assert cleared == overflow == sum(v is None for v in expected)
+
+
+def test_special_values_and_nulls():
+    values = [Decimal("NaN"), Decimal("Infinity"), Decimal("-Infinity"), Decimal("12.345"), None,
+              Decimal("1000.00")]
+    arr, cleared, overflow = _run_gpu(values, 5, 2)
+    assert arr.to_pylist() == [None, None, None, Decimal("12.35"), None, None]
+    assert (cleared, overflow) == (4, 1)
+    assert arr.null_count == 5
+
+
+def test_multi_column_single_launch():
+    specs = [(38, 10), (10, 2), (5, 5)]
+    per_col = [_random_decimals(60, 7 + k) + [None, Decimal("NaN")] for k in range(len(specs))]
+    rows = len(per_col[0])
+    data = build_copy_binary([23] + [1700] * len(specs), [(i,) + vals for i, vals in enumerate(zip(*per_col))])
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offs, lens = parse_binary_chunk_cpu(raw, 1 + len(specs))
+    names = ["i"] + [f"d{k}" for k in range(len(specs))]
+    cols = make_column_meta(names, [23] + [1700] * len(specs), dict(zip(names[1:], specs)))
+    bitmaps = np.stack([np.packbits(lens[:, c] != -1, bitorder="little") for c in range(1, 1 + len(specs))])
+
+    d_bitmaps = cuda.to_device(bitmaps)
+    _, views, cleared, overflow = run_pass2_decimal128_multi(
+        cuda.to_device(raw), cuda.to_device(offs), cuda.to_device(lens), cols,
+        [1, 2, 3], d_bitmaps, [0, 1, 2], threads=64,
+    )
+    host_bitmaps = d_bitmaps.copy_to_host()
+    for k, (precision, scale) in enumerate(specs):
+        expected = _expected(per_col[k][:-2], precision, scale) + [None, None]
+        pa_type = pa.decimal128(precision, scale)
+        valid = np.unpackbits(host_bitmaps[k], bitorder="little")[:rows]
+        arr = pa.Array.from_buffers(
+            pa_type, rows, [pa.py_buffer(host_bitmaps[k]), pa.py_buffer(views[k + 1].copy_to_host())],
+            null_count=int(rows - valid.sum()),
+        )
+        assert arr.to_pylist() == expected
+        assert cleared[k] == sum(v is None for v in expected) - 1    # 元から NULL の 1 行を除く
+        assert overflow[k] == cleared[k] - 1                         # NaN の 1 行を除く
+
+
+@cuda.jit
+def _arith_kernel(his, los, ms, out):
+    i = cuda.grid(1)
+    if i >= his.size:
+        return
+    hi, lo, ovf = mul128_u32(his[i], los[i], ms[i])
+    out[i, 0] = hi
+    out[i, 1] = lo
+    out[i, 2] = 1 if ovf else 0
+    qh, ql, rem = divmod128_u32(his[i], los[i], ms[i])
+    out[i, 3] = qh
+    out[i, 4] = ql
+    out[i, 5] = rem
+    nh, nl = neg128(his[i], los[i])
+    out[i, 6] = nh
+    out[i, 7] = nl
+
+
+def test_128bit_helpers():
+    rng = random.Random(0)
+    vals = [0, 1, MASK64, (1 << 127) - 1, (1 << 128) - 1, 1 << 64] + \
+        [rng.getrandbits(rng.randrange(1, 129)) for _ in range(100)]
+    ms = [1, 10, 10000, (1 << 32) - 1] + [rng.randrange(1, 1 << 32) for _ in range(len(vals) - 4)]
+    his = np.array([v >> 64 for v in vals], np.uint64)
+    los = np.array([v & MASK64 for v in vals], np.uint64)
+    out = cuda.to_device(np.zeros((len(vals), 8), np.uint64))
+    _arith_kernel[1, 128](cuda.to_device(his), cuda.to_device(los), cuda.to_device(np.array(ms, np.uint64)), out)
+    out = out.copy_to_host()
+    for i, (v, m) in enumerate(zip(vals, ms)):
+        prod = v * m
+        assert (int(out[i, 0]) << 64 | int(out[i, 1])) == prod & ((1 << 128) - 1)
+        assert bool(out[i, 2]) == (prod >> 128 != 0)
+        assert (int(out[i, 3]) << 64 | int(out[i, 4])) == v // m
+        assert int(out[i, 5]) == v % m
+        assert (int(out[i, 6]) << 64 | int(out[i, 7])) == (-v) & ((1 << 128) - 1)
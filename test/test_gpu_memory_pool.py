@@ -0,0 +1,179 @@
+"""
+可変長列の 2 段階確保とサイズクラス別プールのテスト (CUDA シミュレータで実行可)
+
+- initialize_device_buffers では values を確保せず、ピーク確保量が実出力サイズに近いこと
+- 繰り返しバッチでプールのブロックが再利用されること
+- サイズクラスの丸め誤差が 12.5% 以内であること
+- release() で offsets を含む全バッファが返却されること、キャッシュ上限での trim
+- lease() のリースは包んだバッファの利用者が全て無くなった時点でプールへ返却されること
+- (実 GPU + CuPy) Numba の device_array が CuPy のメモリプールから確保されること
+"""
+
+import gc
+
+import numpy as np
+import pytest
+from numba import config, cuda
+
+from src.gpu_memory_manager_v2 import GPUMemoryManagerV2
+from src.gpu_memory_pool import (
+    CUPY_AVAILABLE, NUMBA_EMM_AVAILABLE, SHARE_CUPY_POOL, DeviceBufferPool, cupy_pool_enabled, size_class,
+    use_cupy_pool_for_numba,
+)
+from test.pg_copy_fixtures import make_column_meta
+
+ROWS = 10_000
+OIDS = [25, 25, 17, 23]
+NAMES = ["a", "b", "c", "i"]
+
+
+@pytest.mark.parametrize("n", [1, 511, 512, 513, 1000, 1024, 1025, 77_777, 10 ** 9 + 7])
+def test_size_class(n):
+    cls = size_class(n)
+    assert cls >= n
+    if n > 512:
+        assert cls <= n * 1.125
+    assert size_class(cls) == cls
+
+
+def test_peak_close_to_actual_output():
+    gmm = GPUMemoryManagerV2(pool=DeviceBufferPool())
+    cols = make_column_meta(NAMES, OIDS)
+    bufs = gmm.initialize_device_buffers(cols, ROWS)
+    for name in ("a", "b", "c"):
+        assert bufs[name][0].size == 0   # values は未確保
+        assert len(bufs[name]) == 3      # NULL フラグ配列は確保しない (validity は pass-1 のビットマップ)
+    assert len(bufs["i"]) == 2
+
+    totals = {"a": 80_000, "b": 5_000, "c": 0}
+    for name, total in totals.items():
+        buf = gmm.allocate_varlen_data_buffer(name, total)
+        assert buf.size == max(total, 1)
+        assert bufs[name][0] is buf
+
+    actual = 3 * (ROWS + 1) * 4 + ROWS * 4 + sum(totals.values())
+    assert gmm.peak_device_bytes <= actual * 1.125 + 3 * 512
+    # 旧実装 (rows * 256 を先に確保) の 1 列分より小さい
+    assert gmm.peak_device_bytes < ROWS * 256
+
+
+def test_pool_reuse_across_batches():
+    pool = DeviceBufferPool()
+    cols = make_column_meta(NAMES, OIDS)
+    for batch in range(3):
+        gmm = GPUMemoryManagerV2(pool=pool, verbose=False)
+        gmm.initialize_device_buffers(cols, ROWS)
+        gmm.allocate_varlen_data_buffer("a", 80_000 + batch * 100)
+        gmm.allocate_varlen_data_buffer("b", 5_000 - batch * 10)
+        if batch == 0:
+            first = pool.stats()
+        gmm.release()
+        assert pool.bytes_in_use == 0
+        assert gmm.device_bytes == 0
+
+    # 2 バッチ目以降は新規確保なし (offsets 3 + 固定長 1 + values 2 = 6 個)
+    assert first["misses"] == 6 and first["hits"] == 0
+    assert pool.misses == 6
+    assert pool.hits == 12
+    assert pool.peak_bytes == first["bytes_in_use"]
+    assert pool.bytes_cached == first["bytes_in_use"]
+
+
+def test_detach_and_realloc():
+    pool = DeviceBufferPool()
+    gmm = GPUMemoryManagerV2(pool=pool, verbose=False)
+    gmm.initialize_device_buffers(make_column_meta(NAMES, OIDS), 100)
+    gmm.allocate_varlen_data_buffer("a", 1000)
+    gmm.allocate_varlen_data_buffer("a", 3000)   # 借り直し: 前のブロックはプールへ
+    assert pool.bytes_cached == size_class(1000)
+    gmm.detach()
+    assert pool.bytes_in_use == 0
+    assert pool.bytes_cached == size_class(1000)
+
+
+def test_lease_returns_buffers_when_last_user_dies():
+    pool = DeviceBufferPool()
+    gmm = GPUMemoryManagerV2(pool=pool, verbose=False)
+    bufs = gmm.initialize_device_buffers(make_column_meta(NAMES, OIDS), ROWS)
+    gmm.allocate_varlen_data_buffer("a", 1000)
+    in_use = pool.bytes_in_use
+
+    lease = gmm.lease()
+    assert gmm.device_bytes == 0 and lease.nbytes == in_use
+    wrapped = [lease.wrap(bufs["a"][0]), lease.wrap(bufs["a"][1])]
+    if not config.ENABLE_CUDASIM:
+        assert wrapped[1].__cuda_array_interface__ == bufs["a"][1].__cuda_array_interface__
+    del lease
+    gc.collect()
+    assert pool.bytes_in_use == in_use       # 包んだバッファ (Arrow 側) がまだ生きている
+    del wrapped
+    gc.collect()
+    assert pool.bytes_in_use == 0 and pool.bytes_cached == in_use
+
+    # 返却分は次のバッチで再利用される
+    misses = pool.misses
+    gmm.initialize_device_buffers(make_column_meta(NAMES, OIDS), ROWS)
+    assert pool.misses == misses
+
+
+def test_typed_views_share_pool_blocks():
+    pool = DeviceBufferPool()
+    gmm = GPUMemoryManagerV2(pool=pool, verbose=False)
+    bufs = gmm.initialize_device_buffers(make_column_meta(NAMES, OIDS), ROWS)
+    d_offsets = bufs["a"][1]
+    assert d_offsets.dtype == np.int32 and d_offsets.size == ROWS + 1
+    d_offsets.copy_to_device(np.arange(ROWS + 1, dtype=np.int32))
+    assert d_offsets.copy_to_host()[-1] == ROWS
+    # 次の initialize は前回分を自動で返却してから借り直す
+    gmm.initialize_device_buffers(make_column_meta(NAMES, OIDS), ROWS)
+    assert pool.hits == pool.misses
+
+
+def test_high_water_trim():
+    pool = DeviceBufferPool(max_cached_bytes=3 * 4096)
+    views = [pool.acquire(4096) for _ in range(3)] + [pool.acquire(8192)]
+    for v in views:
+        pool.release(v)
+    # 8192 を返却した時点で上限超過 → 大きいクラスから解放
+    assert pool.bytes_cached <= 3 * 4096
+    assert pool.trimmed_bytes == 8192
+    assert pool.stats()["bytes_cached"] == 3 * 4096
+
+    assert pool.trim(4096) == 2 * 4096
+    pool.clear()
+    assert pool.bytes_cached == 0
+    assert pool.stats()["trimmed_bytes"] == 8192 + 3 * 4096
+    assert pool.acquire(4096).size == 4096 and pool.misses == 5
+
+
+def test_unlimited_cache():
+    pool = DeviceBufferPool(max_cached_bytes=0)
+    views = [pool.acquire(1 << 16) for _ in range(4)]
+    for v in views:
+        pool.release(v)
+    assert pool.bytes_cached == 4 << 16 and pool.trimmed_bytes == 0
+
+
+@pytest.mark.skipif(config.ENABLE_CUDASIM or not (CUPY_AVAILABLE and NUMBA_EMM_AVAILABLE and SHARE_CUPY_POOL),
+                    reason="needs CuPy, a real CUDA device and GPUPASER_CUPY_POOL=1")
+def test_numba_allocations_served_from_cupy_pool():
+    import cupy as cp
+
+    # 他のテストが先にコンテキストを作っていると登録は反映されない (RuntimeError)
+    try:
+        use_cupy_pool_for_numba()
+    except RuntimeError as exc:
+        pytest.skip(str(exc))
+    assert cupy_pool_enabled()
+    mp = cp.get_default_memory_pool()
+    before = mp.used_bytes()
+    arr = cuda.device_array(1 << 20, dtype=np.uint8)
+    assert mp.used_bytes() >= before + (1 << 20)
+    del arr
+    gc.collect()
+    assert mp.used_bytes() == before
+    # 解放したブロックは CuPy 側の確保で再利用される
+    total = mp.total_bytes()
+    x = cp.empty(1 << 20, dtype=cp.uint8)
+    assert mp.total_bytes() == total
+    del x
@@ -0,0 +1,73 @@
+"""
+可変長 pass-2 の協調コピー (pass2_scatter_varlen_group) のテスト
+
+- 1 / 8 / 16 / 32 スレッド/行 のどれでも同じ values バッファになるか
+  (src/dst のアライメント違い、先頭・末尾の端数、NULL / 空文字列を含む)
+- raw 末尾の端数 word (終端マーカー無しでデータが切れる場合)
+- 平均長によるモード選択
+"""
+
+import numpy as np
+import pytest
+from numba import cuda
+
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.gpu_decoder_v2 import choose_varlen_group, run_pass2_varlen
+from test.pg_copy_fixtures import build_copy_binary
+
+OIDS = [23, 25]
+
+
+def _rows(n, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        if i % 7 == 6:
+            rows.append((i, None))
+        else:
+            ln = int(rng.choice([0, 1, 3, 5, 33, 130, 257]))
+            rows.append((i, "".join(chr(97 + int(c)) for c in rng.integers(0, 26, ln))))
+    return rows
+
+
+def _run(rows, group, trailer=True):
+    data = build_copy_binary(OIDS, rows, trailer=trailer)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    offs, lens = parse_binary_chunk_cpu(raw, len(OIDS))
+    flen = np.maximum(lens[:, 1], 0)
+    offsets = np.zeros(len(rows) + 1, np.int32)
+    offsets[1:] = np.cumsum(flen)
+    total = int(offsets[-1])
+
+    d_values = cuda.to_device(np.zeros(max(total, 1), np.uint8))
+    used = run_pass2_varlen(
+        cuda.to_device(raw), cuda.to_device(offs[:, 1].copy()), cuda.to_device(lens[:, 1].copy()),
+        cuda.to_device(offsets), d_values, total, threads=64, group=group,
+    )
+    expected = b"".join((r[1] or "").encode() for r in rows)
+    return used, d_values.copy_to_host()[:total].tobytes(), expected
+
+
+@pytest.mark.parametrize("group", [1, 8, 16, 32])
+def test_group_copy_matches(group):
+    used, got, expected = _run(_rows(60, group), group)
+    assert used == group
+    assert got == expected
+
+
+def test_unaligned_raw_tail():
+    # 終端マーカー無し + 最終フィールドが raw の最後の端数 word にかかる
+    rows = [(1, "x" * 37), (2, "y" * 41)]
+    for pad in range(4):
+        rows_p = rows + [(3, "z" * (45 + pad))]
+        _, got, expected = _run(rows_p, 8, trailer=False)
+        assert got == expected
+
+
+def test_choose_varlen_group():
+    assert choose_varlen_group(0.0) == 1
+    assert choose_varlen_group(10) == 1
+    assert choose_varlen_group(40) == 8
+    assert choose_varlen_group(100) == 16
+    assert choose_varlen_group(200) == 16
+    assert choose_varlen_group(1000) == 32
@@ -0,0 +1,104 @@
+"""
+RecordBatch → Arrow IPC sink / source (ArrowIPCSink, ArrowIPCSource) のテスト
+
+- file / stream 形式、LZ4 / ZSTD 圧縮で書いたものを読み戻すと一致するか
+- 非圧縮ファイルをメモリマップで読むとバッファを確保しない (コピーなし) か
+- replay_batches で IPC ファイルを sink へ流し直せるか
+- open_sink が拡張子で sink を選ぶか
+- (pyarrow.cuda + GPU) GPU 上のバッファを指すバッチもホストへコピーして書けるか
+"""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.arrow_utils import arrow_schema_for
+from src.device_table import DeviceTable
+from src.output_handler import ArrowIPCSink, ArrowIPCSource, ArrowParquetSink, open_sink
+from src.pipeline import replay_batches
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import (
+    SAMPLE_NAMES, SAMPLE_OIDS, device_backed_batch, make_column_meta, pipeline_batches, sample_copy_binary,
+)
+
+
+def _write(path, cols, n=3000, **options):
+    with ArrowIPCSink(path, cols, **options) as sink:
+        batches = pipeline_batches(iter_copy_chunks([sample_copy_binary(n)], 2048), cols, sink)
+    assert sink.rows_written == n and sink.batches_written == len(batches)
+    return batches
+
+
+@pytest.mark.parametrize("fmt", ["file", "stream"])
+@pytest.mark.parametrize("compression", [None, "lz4", "zstd"])
+def test_roundtrip(tmp_path, fmt, compression):
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    path = str(tmp_path / "out.arrow")
+    batches = _write(path, cols, format=fmt, compression=compression)
+    assert len(batches) > 4
+
+    with ArrowIPCSource(path) as src:
+        assert src.format == fmt
+        assert src.schema.equals(arrow_schema_for(cols))
+        assert src.num_batches == (len(batches) if fmt == "file" else None)
+        replayed = list(src)
+    assert [b.num_rows for b in replayed] == [b.num_rows for b in batches]
+    assert pa.Table.from_batches(replayed).equals(pa.Table.from_batches(batches))
+
+
+@pytest.mark.parametrize("fmt", ["file", "stream"])
+def test_device_backed_batches(tmp_path, fmt):
+    pytest.importorskip("pyarrow.cuda")
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    path = str(tmp_path / "out.arrow")
+    batches = pipeline_batches(iter_copy_chunks([sample_copy_binary(3000)], 2048), cols)
+    with ArrowIPCSink(path, cols, format=fmt) as sink:
+        for b in batches:
+            sink.write_batch(device_backed_batch(b))
+    assert sink.batches_written == len(batches)
+    with ArrowIPCSource(path) as src:
+        assert src.read_all().equals(pa.Table.from_batches(batches))
+
+
+def test_memory_mapped_read_is_zero_copy(tmp_path):
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    path = str(tmp_path / "out.arrow")
+    expected = pa.Table.from_batches(_write(path, cols, n=20000))
+
+    before = pa.total_allocated_bytes()
+    with ArrowIPCSource(path) as src:
+        table = src.read_all()
+        assert pa.total_allocated_bytes() == before
+        assert table.equals(expected)
+        del table
+    with ArrowIPCSource(path, memory_map=False) as src:
+        assert src.read_all().equals(expected)
+
+
+def test_replay_into_sinks(tmp_path):
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    path = str(tmp_path / "out.arrows")
+    batches = _write(path, cols, format="stream", compression="lz4")
+
+    out = str(tmp_path / "replay.parquet")
+    with ArrowIPCSource(path) as src, ArrowParquetSink(out, src.schema, background=False) as sink:
+        stats = replay_batches(src, sink)
+    assert stats.rows == 3000 and stats.write.items == len(batches)
+    assert pq.read_table(out).equals(pa.Table.from_batches(batches))
+
+    tables = []
+    with ArrowIPCSource(path) as src:
+        replay_batches(src, tables.append, output="device")
+    assert all(isinstance(t, DeviceTable) for t in tables)
+    assert pa.Table.from_batches([t.to_arrow() for t in tables]).equals(pa.Table.from_batches(batches))
+
+
+def test_open_sink_by_extension(tmp_path):
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    for name, cls, fmt in [("a.arrow", ArrowIPCSink, "file"), ("a.feather", ArrowIPCSink, "file"),
+                           ("a.arrows", ArrowIPCSink, "stream"), ("a.parquet", ArrowParquetSink, None)]:
+        sink = open_sink(str(tmp_path / name), cols, background=False)
+        sink.close()
+        assert isinstance(sink, cls) and getattr(sink, "format", None) == fmt
+    with pytest.raises(ValueError, match="compression"):
+        ArrowIPCSink(str(tmp_path / "x.arrow"), cols, compression="snappy")
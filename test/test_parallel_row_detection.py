@@ -0,0 +1,84 @@
+"""
+並列行先頭検出 (detect_row_starts_gpu) のテスト
+
+逐次走査の ``build_pg_row_starts_cpu`` と完全一致するかを、行ヘッダに見える
+ペイロードを含む敵対的なデータで検証する:
+- text / bytea の中身が「num_fields + 妥当なフィールド長」の並びになっている
+- bytea の中に完全な COPY 行の列を埋め込む (投機的推定が誤る)
+- 複数セグメントにまたがる長い行、NULL、終端マーカーなし・途中切れ
+"""
+
+import random
+import struct
+
+import numpy as np
+import pytest
+from numba import cuda
+
+from src.gpu_parse_wrapper import build_pg_row_starts_cpu, detect_row_starts_gpu, detect_pg_header_size
+from test.pg_copy_fixtures import build_copy_binary, encode_row
+
+PG_OIDS = [23, 25, 17]   # int4, text, bytea
+
+
+def _cpu_row_starts(raw):
+    header_size = detect_pg_header_size(raw)
+    starts = build_pg_row_starts_cpu(raw, header_size, raw.size)
+    return starts[starts >= 0]
+
+
+def _gpu_row_starts(raw, segment_size):
+    header_size = detect_pg_header_size(raw)
+    dev = cuda.to_device(raw)
+    return detect_row_starts_gpu(dev, header_size, len(PG_OIDS), segment_size=segment_size).copy_to_host()
+
+
+def _adversarial_rows(n, seed):
+    rng = random.Random(seed)
+    fake_row = encode_row(PG_OIDS, (7, "abc", b"\x00\x03"))
+    rows = []
+    for i in range(n):
+        kind = rng.randrange(5)
+        if kind == 0:
+            # 行ヘッダ (0x0003) と妥当なフィールド長の並びに見えるテキスト
+            text = "\x00\x03\x00\x00\x00\x04" * rng.randrange(1, 8)
+            blob = b""
+        elif kind == 1:
+            # bytea に完全な行の列を埋め込む
+            text = "x"
+            blob = fake_row * rng.randrange(1, 20)
+        elif kind == 2:
+            # セグメントをまたぐ長い行
+            text = "L" * rng.randrange(100, 400)
+            blob = bytes(rng.randrange(256) for _ in range(rng.randrange(0, 200)))
+        elif kind == 3:
+            text, blob = None, None
+        else:
+            text = f"r{i}"
+            blob = struct.pack(">hi", 3, 4)
+        rows.append((i, text, blob))
+    return rows
+
+
+@pytest.mark.parametrize("segment_size", [16, 64, 257])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_matches_cpu_on_adversarial_payloads(segment_size, seed):
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(120, seed))
+    raw = np.frombuffer(data, dtype=np.uint8)
+    expected = _cpu_row_starts(raw)
+    assert expected.size == 120
+    np.testing.assert_array_equal(_gpu_row_starts(raw, segment_size), expected)
+
+
+@pytest.mark.parametrize("cut", [0, 1, 5, 23])
+def test_truncated_and_no_trailer(cut):
+    data = build_copy_binary(PG_OIDS, _adversarial_rows(60, 3), trailer=False)
+    raw = np.frombuffer(data[:len(data) - cut], dtype=np.uint8)
+    np.testing.assert_array_equal(_gpu_row_starts(raw, 32), _cpu_row_starts(raw))
+
+
+def test_continuation_chunk_without_header():
+    data = b"".join(encode_row(PG_OIDS, r) for r in _adversarial_rows(40, 5))
+    raw = np.frombuffer(data, dtype=np.uint8)
+    assert detect_pg_header_size(raw) == 0
+    np.testing.assert_array_equal(_gpu_row_starts(raw, 48), _cpu_row_starts(raw))
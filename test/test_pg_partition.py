@@ -0,0 +1,225 @@
+"""
+ctid 範囲による並列 COPY のテスト
+
+- ブロック範囲の分割が隙間・重複なく全体を覆い、最後の範囲が上限なしになるか
+- キー範囲 / ハッシュ分割の ChunkSpec が全行 (NULL を含む) をちょうど 1 回ずつ覆うか
+- パーティションごとのストリームの合流 (順序あり / 到着順) と例外の伝播
+- 途中で止めたストリームの後始末 (COPY の終了・接続の返却) が読み出しスレッドで行われるか
+- 合流したストリームをパイプライン (backend="cpu") へ流した結果が元データと一致するか
+- GPUPASER_PG_DSN がある場合は実テーブルで単一 COPY と行集合が一致するか
+"""
+
+import os
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+from src.pg_partition import (
+    CtidRange,
+    HashChunk,
+    KeyRangeChunk,
+    ParallelCopyReader,
+    merge_partition_streams,
+    partition_query,
+    plan_chunks,
+    plan_hash_chunks,
+    split_ctid_ranges,
+    split_key_range,
+)
+from src.pipeline import run_pipeline
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+OIDS = [23, 25]
+NAMES = ["id", "txt"]
+
+
+@pytest.mark.parametrize("nblocks,parts", [(0, 4), (1, 4), (10, 3), (1000, 8), (7, 7)])
+def test_split_ctid_ranges(nblocks, parts):
+    ranges = split_ctid_ranges(nblocks, parts)
+    assert 1 <= len(ranges) <= max(1, min(parts, nblocks))
+    assert ranges[0].start_block == 0
+    assert ranges[-1].end_block is None
+    for a, b in zip(ranges, ranges[1:]):
+        assert a.end_block == b.start_block
+        assert a.end_block > a.start_block
+    assert [r.index for r in ranges] == list(range(len(ranges)))
+
+
+def test_where_clause():
+    assert CtidRange(0, 0, None).where_clause() == "TRUE"
+    assert CtidRange(0, 0, 10).where_clause() == "ctid < '(10,0)'::tid"
+    assert CtidRange(1, 10, 20).where_clause() == "ctid >= '(10,0)'::tid AND ctid < '(20,0)'::tid"
+    assert partition_query("t", CtidRange(2, 20, None)) == "SELECT * FROM t WHERE ctid >= '(20,0)'::tid"
+    with pytest.raises(ValueError):
+        split_ctid_ranges(10, 0)
+
+
+def _in_key_chunk(spec, v):
+    if v is None:
+        return spec.include_nulls
+    return (spec.lo is None or v >= spec.lo) and (spec.hi is None or v < spec.hi)
+
+
+@pytest.mark.parametrize("lo,hi,parts", [(1, 100, 4), (-50, 50, 3), (5, 5, 4), (0, 2, 8)])
+def test_split_key_range_covers_each_value_once(lo, hi, parts):
+    specs = split_key_range(lo, hi, parts, "id")
+    assert 1 <= len(specs) <= min(parts, hi - lo + 1)
+    assert specs[0].lo is None and specs[0].include_nulls
+    assert specs[-1].hi is None
+    assert not any(s.include_nulls for s in specs[1:])
+    # 範囲外の値 (計画後に挿入された行など) と NULL もちょうど 1 チャンクに入る
+    for v in [None, lo - 10, hi + 10] + list(range(lo, hi + 1)):
+        assert sum(_in_key_chunk(s, v) for s in specs) == 1, v
+
+
+def test_key_and_hash_where_clause():
+    assert KeyRangeChunk(0, "id", None, 10, include_nulls=True).where_clause() == "(id < 10 OR id IS NULL)"
+    assert KeyRangeChunk(1, "id", 10, 20).where_clause() == "id >= 10 AND id < 20"
+    assert KeyRangeChunk(2, "id", 20, None).query("t", "id, txt") == "SELECT id, txt FROM t WHERE id >= 20"
+    assert KeyRangeChunk(0, "id", None, None).where_clause() == "id IS NOT NULL"
+    assert HashChunk(1, "id", 4).where_clause() == "(hashtext(id::text) & 2147483647) % 4 = 1"
+    assert HashChunk(0, "id", 4).where_clause().endswith("OR id IS NULL)")
+    assert [c.index for c in plan_hash_chunks("id", 3)] == [0, 1, 2]
+
+
+def test_plan_chunks_arguments():
+    with pytest.raises(ValueError):
+        plan_chunks(None, "t", 4, method="offset")
+    with pytest.raises(ValueError):
+        plan_chunks(None, "t", 4, method="key")
+    with pytest.raises(ValueError):
+        plan_hash_chunks("id", 0)
+    assert plan_chunks(None, "t", 2, method="hash", key="id") == [HashChunk(0, "id", 2), HashChunk(1, "id", 2)]
+
+
+def _partition_streams(nparts, rows_per_part, delay=0.0):
+    datas, streams = [], []
+    for p in range(nparts):
+        rows = [(p * 100000 + i, f"p{p}-{i}" * (i % 4)) for i in range(rows_per_part)]
+        data = build_copy_binary(OIDS, rows)
+        datas.append(rows)
+
+        def gen(data=data, delay=delay * (nparts - p)):
+            for c in iter_copy_chunks([data], 512):
+                time.sleep(delay)
+                yield c
+        streams.append(gen())
+    return datas, streams
+
+
+def test_merge_ordered():
+    datas, streams = _partition_streams(3, 300, delay=0.001)
+    chunks = list(merge_partition_streams(streams, ordered=True, queue_depth=1))
+    parts = [c.partition for c in chunks]
+    assert parts == sorted(parts)
+    for p in range(3):
+        idx = [c.index for c in chunks if c.partition == p]
+        assert idx == list(range(len(idx)))
+        assert sum(c.rows for c in chunks if c.partition == p) == 300
+        assert chunks[parts.index(p)].header_size > 0
+
+
+def test_merge_unordered_keeps_partition_order():
+    datas, streams = _partition_streams(4, 200, delay=0.001)
+    chunks = list(merge_partition_streams(streams, ordered=False))
+    assert len({c.partition for c in chunks}) == 4
+    for p in range(4):
+        idx = [c.index for c in chunks if c.partition == p]
+        assert idx == list(range(len(idx)))
+
+
+def test_merge_error_propagates():
+    def bad():
+        yield from iter_copy_chunks([build_copy_binary(OIDS, [(1, "a")])], 512)
+        raise ConnectionError("backend terminated")
+
+    for ordered in (True, False):
+        _, streams = _partition_streams(2, 50)
+        with pytest.raises(ConnectionError):
+            list(merge_partition_streams(streams + [bad()], ordered=ordered))
+
+
+def test_merged_stream_through_pipeline():
+    datas, streams = _partition_streams(3, 400)
+    batches = []
+    stats = run_pipeline(merge_partition_streams(streams), make_column_meta(NAMES, OIDS), batches.append,
+                         backend="cpu")
+    got = pa.Table.from_batches(batches).sort_by("id")
+    expected = sorted(r for rows in datas for r in rows)
+    assert stats.rows == 1200
+    assert got.column("id").to_pylist() == [r[0] for r in expected]
+    assert got.column("txt").to_pylist() == [r[1] for r in expected]
+
+
+def test_merge_stops_producers_on_early_close():
+    _, streams = _partition_streams(3, 2000)
+    it = merge_partition_streams(streams, queue_depth=1)
+    next(it)
+    it.close()
+    assert not [t for t in threading.enumerate() if t.name.startswith("copy-part-")]
+
+
+def test_early_close_cleans_up_in_pump_thread():
+    closed_in = []
+
+    def stream(data):
+        try:
+            yield from iter_copy_chunks([data], 512)
+        finally:
+            closed_in.append(threading.current_thread().name)
+
+    data = build_copy_binary(OIDS, [(i, "x" * 40) for i in range(2000)])
+    it = merge_partition_streams([stream(data), stream(data)], queue_depth=1)
+    next(it)
+    it.close()
+    assert sorted(closed_in) == ["copy-part-0", "copy-part-1"]
+
+
+@pytest.mark.skipif("GPUPASER_PG_DSN" not in os.environ, reason="GPUPASER_PG_DSN not set")
+def test_parallel_copy_matches_single_copy():
+    import psycopg
+
+    dsn = os.environ["GPUPASER_PG_DSN"]
+    table = "gpupaser_partition_test"
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} AS SELECT g AS id, repeat('x', g % 50) AS txt "
+                     f"FROM generate_series(1, 50000) g")
+    try:
+        batches = []
+        reader = ParallelCopyReader(dsn, table, partitions=4, chunk_bytes=1 << 16)
+        run_pipeline(reader, make_column_meta(NAMES, OIDS), batches.append, backend="cpu")
+        assert len(reader.ranges) == 4
+        ids = sorted(pa.Table.from_batches(batches).column("id").to_pylist())
+        assert ids == list(range(1, 50001))
+    finally:
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+@pytest.mark.skipif("GPUPASER_PG_DSN" not in os.environ, reason="GPUPASER_PG_DSN not set")
+@pytest.mark.parametrize("method", ["ctid", "key", "hash"])
+def test_chunk_specs_partition_table(method):
+    import psycopg
+
+    dsn = os.environ["GPUPASER_PG_DSN"]
+    table = "gpupaser_chunkspec_test"
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} AS SELECT CASE WHEN g % 97 = 0 THEN NULL ELSE g END AS id, "
+                     f"repeat('x', g % 50) AS txt FROM generate_series(1, 20000) g")
+    try:
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            specs = plan_chunks(conn, table, 4, method, key="id")
+        batches = []
+        reader = ParallelCopyReader(dsn, table, specs=specs, chunk_bytes=1 << 16)
+        run_pipeline(reader, make_column_meta(NAMES, OIDS), batches.append, backend="cpu")
+        txt = pa.Table.from_batches(batches).column("txt").to_pylist()
+        assert len(txt) == 20000
+        assert sorted(txt) == sorted("x" * (g % 50) for g in range(1, 20001))
+    finally:
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
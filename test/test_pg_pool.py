@@ -0,0 +1,140 @@
+"""
+接続プールとメタデータキャッシュのテスト
+
+- 返却した接続が再利用され、閉じた接続・上限を超えたアイドル接続は捨てられるか
+- キャッシュが revalidate_s 以内は stamp を問い合わせず、stamp が変わったら取り直すか
+- fork 後の子プロセスでは親のプールを使わないか
+- GPUPASER_PG_DSN がある場合は実テーブルの ALTER TABLE で列情報が更新されるか
+"""
+
+import os
+
+import pytest
+from psycopg.pq import TransactionStatus
+
+from src import pg_pool
+from src.pg_pool import ConnectionPool, MetadataCache, get_metadata_cache, get_pool
+
+
+class FakeConn:
+    class info:
+        transaction_status = TransactionStatus.IDLE
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_reuses_connections():
+    pool = ConnectionPool("dbname=x", max_idle=1, connect=lambda dsn: FakeConn())
+    with pool.connection() as a:
+        pass
+    with pool.connection() as b:
+        assert b is a
+    assert pool.stats() == {"idle": 1, "connects": 1, "reuses": 1}
+
+    # 同時に借りた分は新規接続し、max_idle を超えた返却分は閉じる
+    c, d = pool.getconn(), pool.getconn()
+    pool.putconn(c)
+    pool.putconn(d)
+    assert pool.stats()["idle"] == 1 and pool.connects == 2
+    assert d.closed and not c.closed
+
+    # 閉じられた接続はアイドルに戻さない
+    c = pool.getconn()
+    c.close()
+    pool.putconn(c)
+    assert pool.stats()["idle"] == 0
+    pool.close()
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_metadata_cache_revalidation():
+    clock = Clock()
+    cache = MetadataCache(revalidate_s=5, clock=clock)
+    stamp = {"v": (1, 100, "10")}
+    calls = {"stamp": 0, "load": 0}
+
+    def get():
+        def s():
+            calls["stamp"] += 1
+            return stamp["v"]
+
+        def load():
+            calls["load"] += 1
+            return ["cols", calls["load"]]
+        return cache.get(("dsn", "SELECT * FROM t"), s, load)
+
+    first = get()
+    assert calls == {"stamp": 1, "load": 1}
+
+    # revalidate_s 以内: 往復なし
+    clock.t = 4.9
+    assert get() is first
+    assert calls == {"stamp": 1, "load": 1}
+
+    # 期限切れ, stamp 同じ: 確認 1 回のみ
+    clock.t = 6
+    assert get() is first
+    assert calls == {"stamp": 2, "load": 1}
+
+    # ALTER TABLE 相当 (xmin が変わる): 取り直す
+    stamp["v"] = (1, 100, "42")
+    clock.t = 12
+    second = get()
+    assert second == ["cols", 2]
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 2, "validations": 3}
+
+    cache.invalidate("dsn")
+    assert cache.stats()["entries"] == 0
+
+
+def test_missing_table_not_cached(monkeypatch):
+    monkeypatch.setattr(pg_pool, "relation_stamp", lambda conn, table: None)
+    cache = MetadataCache(revalidate_s=60)
+    with pytest.raises(ValueError):
+        cache.table_columns(object(), "dsn", "no_such_table")
+    assert cache.stats()["entries"] == 0
+
+
+def test_registry_is_per_process(monkeypatch):
+    pool = get_pool("dbname=fork_test")
+    cache = get_metadata_cache()
+    assert get_pool("dbname=fork_test") is pool
+
+    # fork 後の子プロセス (PID が変わる) では作り直し、親の接続は閉じずに保持する
+    pid = os.getpid()
+    monkeypatch.setattr(pg_pool.os, "getpid", lambda: pid + 1)
+    assert get_pool("dbname=fork_test") is not pool
+    assert get_metadata_cache() is not cache
+    assert pool in pg_pool._forked_pools
+
+
+@pytest.mark.skipif("GPUPASER_PG_DSN" not in os.environ, reason="GPUPASER_PG_DSN not set")
+def test_table_columns_invalidated_by_alter():
+    dsn = os.environ["GPUPASER_PG_DSN"]
+    table = "gpupaser_meta_cache_test"
+    cache = MetadataCache(revalidate_s=0)
+    with get_pool(dsn).connection() as conn:
+        conn.autocommit = True
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} (id int4)")
+        try:
+            assert [c.name for c in cache.table_columns(conn, dsn, table)] == ["id"]
+            assert [c.name for c in cache.table_columns(conn, dsn, table)] == ["id"]
+            assert cache.misses == 1
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN txt text")
+            assert [c.name for c in cache.table_columns(conn, dsn, table)] == ["id", "txt"]
+            assert cache.misses == 2
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.autocommit = False
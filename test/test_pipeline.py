@@ -0,0 +1,101 @@
+"""
+COPY 受信 → 変換 → 書き出し パイプラインのテスト (backend="cpu" で GPU 無しでも実行可)
+
+- チャンクごとの RecordBatch を連結すると一括変換と一致するか
+- 有界キューによるバックプレッシャ (遅い sink の間 reader が先行しすぎない)
+- reader / sink の例外が呼び出し元へ伝わるか
+- ステージ計測値と律速ステージの判定
+"""
+
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+from src.cpu_decoder import decode_chunk_cpu
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.pipeline import run_pipeline
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import SAMPLE_NAMES, SAMPLE_OIDS, make_column_meta, sample_copy_binary
+
+
+def test_pipeline_matches_single_decode():
+    data = sample_copy_binary(2000)
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    batches = []
+    stats = run_pipeline(iter_copy_chunks([data], 4096), cols, batches.append, backend="cpu")
+
+    offs, lens = parse_binary_chunk_cpu(data, len(SAMPLE_OIDS))
+    expected = pa.Table.from_batches([decode_chunk_cpu(data, offs, lens, cols)])
+    assert len(batches) > 1
+    assert pa.Table.from_batches(batches).equals(expected)
+    assert stats.rows == 2000
+    assert stats.fetch.items == stats.decode.items == stats.write.items == len(batches)
+    assert stats.bytes == len(data) - 2   # 終端マーカーを除く
+
+
+def test_backpressure_bounds_reader():
+    data = sample_copy_binary(4000)
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    produced = []
+    written = []
+    lock = threading.Lock()
+
+    def chunks():
+        for c in iter_copy_chunks([data], 2048):
+            with lock:
+                produced.append(c.index)
+            yield c
+
+    def slow_sink(batch):
+        time.sleep(0.01)
+        with lock:
+            written.append(batch.num_rows)
+            # reader はキュー 2 本 (各 depth) + 処理中 1 + 書き込み中 1 より先へ進めない
+            assert len(produced) - len(written) <= 2 * 1 + 2 + 1
+
+    stats = run_pipeline(chunks(), cols, slow_sink, backend="cpu", queue_depth=1)
+    assert sum(written) == 4000
+    assert stats.bottleneck == "write"
+    assert stats.fetch.wait_s > 0
+
+
+def test_sink_object_with_write_batch():
+    class Sink:
+        def __init__(self):
+            self.rows = 0
+
+        def write_batch(self, batch):
+            self.rows += batch.num_rows
+
+    sink = Sink()
+    run_pipeline(iter_copy_chunks([sample_copy_binary(300)], 1024), make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS), sink,
+                 backend="cpu")
+    assert sink.rows == 300
+
+
+def test_reader_error_propagates():
+    def chunks():
+        yield from iter_copy_chunks([sample_copy_binary(300)], 1024)
+        raise ConnectionError("copy aborted")
+
+    with pytest.raises(ConnectionError):
+        run_pipeline(chunks(), make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS), lambda b: None, backend="cpu")
+
+
+def test_sink_error_propagates():
+    def bad_sink(batch):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        run_pipeline(iter_copy_chunks([sample_copy_binary(3000)], 1024), make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS),
+                     bad_sink, backend="cpu", queue_depth=1)
+
+
+def test_invalid_arguments():
+    cols = make_column_meta(SAMPLE_NAMES, SAMPLE_OIDS)
+    with pytest.raises(ValueError):
+        run_pipeline([], cols, print, backend="tpu")
+    with pytest.raises(ValueError):
+        run_pipeline([], cols, print, queue_depth=0)
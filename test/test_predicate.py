@@ -0,0 +1,209 @@
+"""
+parse と decode の間の行フィルタ (src.predicate) のテスト
+
+- 比較 / IN / IS NULL / AND / OR の結果が pyarrow.compute で絞り込んだものと一致するか
+  (int2/4/8, float4/8 の NaN・-0.0・負数, bool, date, timestamp)
+- GPU カーネル (評価 → ブロック内走査での詰め → gather) が CPU 版と同じ行を同じ順に残すか
+- run_pipeline で射影に含まれない列の条件が使えるか、全行が落ちたチャンクの扱い
+- 比較できない列・型の合わない定数・未知の列はコンパイル時にエラーになるか
+"""
+
+import datetime
+import struct
+from decimal import Decimal
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+from numba import cuda
+
+from src.cpu_decoder import decode_chunk_cpu
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.pipeline import run_pipeline
+from src.predicate import col, compile_predicate, filter_rows_cpu, filter_rows_gpu, selection_vector_gpu
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+# int2, int4, int8, float4, float8, bool, date, timestamp, text, numeric
+OIDS = [21, 23, 20, 700, 701, 16, 1082, 1114, 25, 1700]
+NAMES = ["s", "i", "b", "f", "d", "flag", "day", "ts", "txt", "num"]
+NEG_NAN = -float("nan")                                           # 符号ビットの立った NaN
+PAYLOAD_NAN = struct.unpack(">d", bytes.fromhex("7ff8000000012345"))[0]
+SPECIAL = [float("nan"), -0.0, 0.0, float("inf"), -float("inf"), -1.5, NEG_NAN, PAYLOAD_NAN]
+
+
+def _rows(n):
+    rows = []
+    for k in range(n):
+        rows.append((
+            None if k % 13 == 0 else k % 200 - 100,
+            None if k % 7 == 0 else 19920101 + (k % 2500) * 3,
+            (k - n // 2) << 31,
+            SPECIAL[k % len(SPECIAL)] if k % 5 == 0 else (k % 97) / 4 - 10,
+            None if k % 11 == 0 else SPECIAL[k % len(SPECIAL)] if k % 3 == 0 else -k / 3,
+            None if k % 17 == 0 else k % 2 == 0,
+            datetime.date(1999, 12, 1) + datetime.timedelta(days=k % 90),
+            datetime.datetime(1999, 12, 31, 23) + datetime.timedelta(minutes=17 * k),
+            None if k % 4 == 0 else f"t{k}",
+            Decimal(k) / 10,
+        ))
+    return rows
+
+
+def _decode(n=700):
+    data = build_copy_binary(OIDS, _rows(n))
+    offs, lens = parse_binary_chunk_cpu(data, len(OIDS))
+    cols = make_column_meta(NAMES, OIDS, {"num": (10, 1)})
+    return np.frombuffer(data, np.uint8), offs, lens, cols
+
+
+def _and(a, b):
+    return pc.and_kleene(a, b)
+
+
+CASES = [
+    (col("i") >= 19921000, lambda t: pc.greater_equal(t["i"], 19921000)),
+    (col("s") < -50, lambda t: pc.less(t["s"], -50)),
+    (col("b") > 0, lambda t: pc.greater(t["b"], 0)),
+    (col("b") <= -(1 << 31) * 100, lambda t: pc.less_equal(t["b"], -(1 << 31) * 100)),
+    (col("s").isin([-1, 0, 1, 99, None]), lambda t: pc.is_in(t["s"], pa.array([-1, 0, 1, 99], pa.int16()))),
+    (col("s").isin([]), lambda t: pc.is_in(t["s"], pa.array([], pa.int16()))),
+    (col("i").is_null() | (col("s") != 5), lambda t: pc.or_kleene(pc.is_null(t["i"]), pc.not_equal(t["s"], 5))),
+    (col("txt").is_not_null() & col("i").is_null(), lambda t: _and(pc.is_valid(t["txt"]), pc.is_null(t["i"]))),
+    (col("num").is_not_null() & (col("d") != 0.0), lambda t: _and(pc.is_valid(t["num"]), pc.not_equal(t["d"], 0.0))),
+    (col("flag") == True, lambda t: pc.equal(t["flag"], True)),            # noqa: E712
+    (col("day") >= datetime.date(2000, 1, 15), lambda t: pc.greater_equal(t["day"], pa.scalar(datetime.date(2000, 1, 15)))),
+    (col("day") < "2000-01-01", lambda t: pc.less(t["day"], pa.scalar(datetime.date(2000, 1, 1)))),
+    (col("ts") > datetime.datetime(2000, 1, 3, 12),
+     lambda t: pc.greater(t["ts"], pa.scalar(datetime.datetime(2000, 1, 3, 12), pa.timestamp("us")))),
+    ((col("s") > 0) & (col("i") < 19950000) | (col("b") == 0) & col("f").is_not_null(),
+     lambda t: pc.or_kleene(_and(pc.greater(t["s"], 0), pc.less(t["i"], 19950000)),
+                            _and(pc.equal(t["b"], 0), pc.is_valid(t["f"])))),
+]
+
+
+def _same(a, b):
+    """NaN 同士も等しいとみなして比較する (RecordBatch.equals は NaN != NaN)"""
+    return a.schema.equals(b.schema) and repr(a.to_pylist()) == repr(b.to_pylist())
+
+
+def _expected(batch, mask_fn):
+    mask = pc.fill_null(mask_fn(pa.Table.from_batches([batch])), False)
+    return batch.filter(mask.combine_chunks() if hasattr(mask, "combine_chunks") else mask)
+
+
+@pytest.mark.parametrize("case", range(len(CASES)))
+def test_matches_pyarrow_filter(case):
+    expr, mask_fn = CASES[case]
+    raw, offs, lens, cols = _decode()
+    full = decode_chunk_cpu(raw, offs, lens, cols)
+    got = decode_chunk_cpu(raw, offs, lens, cols, predicate=expr)
+    assert _same(got, _expected(full, mask_fn)), repr(expr)
+
+
+def _float_mask(values, op, x):
+    """PostgreSQL の float 比較 (NaN は最大で NaN = NaN, -0.0 = 0.0)"""
+    def key(v):
+        return (1, 0.0) if np.isnan(v) else (0, v + 0.0)
+    kx = key(x)
+    return [v is not None and op(key(v), kx) for v in values]
+
+
+@pytest.mark.parametrize("name", ["f", "d"])
+@pytest.mark.parametrize("x", [float("nan"), NEG_NAN, -0.0, 0.0, -1.5, 2.25, float("inf")])
+def test_float_ordering(name, x):
+    import operator
+    raw, offs, lens, cols = _decode()
+    full = decode_chunk_cpu(raw, offs, lens, cols, projection=[name])
+    values = full.column(0).to_pylist()
+    for sym, op in [("==", operator.eq), ("<", operator.lt), (">=", operator.ge)]:
+        expr = {"==": col(name) == x, "<": col(name) < x, ">=": col(name) >= x}[sym]
+        got = decode_chunk_cpu(raw, offs, lens, cols, projection=[name], predicate=expr)
+        want = full.filter(pa.array(_float_mask(values, op, x)))
+        assert _same(got, want), (name, sym, x)
+
+
+@pytest.mark.parametrize("case", [0, 4, 6, 13])
+def test_gpu_selection_matches_cpu(case):
+    expr, _ = CASES[case]
+    raw, offs, lens, cols = _decode(600)      # 3 ブロック (端数あり)
+    pred = compile_predicate(expr, cols)
+    want_offs, want_lens = filter_rows_cpu(raw, offs, lens, pred)
+
+    d_offs, d_lens = cuda.to_device(offs), cuda.to_device(lens)
+    sel, n_sel = selection_vector_gpu(cuda.to_device(raw), d_offs, d_lens, pred)
+    assert n_sel == want_offs.shape[0]
+    got_sel = sel.copy_to_host()
+    assert np.all(np.diff(got_sel) > 0)
+    np.testing.assert_array_equal(offs[got_sel], want_offs)
+
+    g_offs, g_lens = filter_rows_gpu(cuda.to_device(raw), d_offs, d_lens, pred)
+    np.testing.assert_array_equal(g_offs.copy_to_host(), want_offs)
+    np.testing.assert_array_equal(g_lens.copy_to_host(), want_lens)
+
+
+def test_gpu_all_or_nothing():
+    raw, offs, lens, cols = _decode(40)
+    d_raw, d_offs, d_lens = cuda.to_device(raw), cuda.to_device(offs), cuda.to_device(lens)
+    keep = compile_predicate(col("b").is_not_null(), cols)
+    assert filter_rows_gpu(d_raw, d_offs, d_lens, keep) == (d_offs, d_lens)    # 全行残れば gather しない
+    drop = compile_predicate(col("i") > 1 << 40, cols)
+    g_offs, g_lens = filter_rows_gpu(d_raw, d_offs, d_lens, drop)
+    assert g_offs.shape == g_lens.shape == (0, len(OIDS))
+
+
+def test_pipeline_with_projection_and_empty_chunks():
+    cols = make_column_meta(NAMES, OIDS, {"num": (10, 1)})
+    data = build_copy_binary(OIDS, _rows(3000))
+    expr = (col("i") >= 19925000) & (col("day") < datetime.date(2000, 1, 20))
+    full, got = [], []
+    run_pipeline(iter_copy_chunks([data], 8192), cols, full.append, backend="cpu")
+    stats = run_pipeline(iter_copy_chunks([data], 8192), cols, got.append, backend="cpu",
+                         projection=["txt", "s"], predicate=expr)
+
+    table = pa.Table.from_batches(full)
+    mask = pc.fill_null(_and(pc.greater_equal(table["i"], 19925000),
+                             pc.less(table["day"], pa.scalar(datetime.date(2000, 1, 20)))), False)
+    want = table.filter(mask).select(["txt", "s"])
+    assert 0 < want.num_rows < table.num_rows
+    assert pa.Table.from_batches(got).equals(want)
+    assert stats.rows == want.num_rows and len(got) <= len(full)
+
+    none = []
+    stats = run_pipeline(iter_copy_chunks([data], 8192), cols, none.append, backend="cpu",
+                         predicate=col("s") > 1000)
+    assert none == [] and stats.rows == 0
+
+
+def test_empty_result_batch():
+    raw, offs, lens, cols = _decode(20)
+    batch = decode_chunk_cpu(raw, offs, lens, cols, projection=["d", "txt"], predicate=col("s") > 1000)
+    assert batch.num_rows == 0 and batch.schema.names == ["d", "txt"]
+
+
+def test_compile_errors():
+    cols = make_column_meta(NAMES, OIDS, {"num": (10, 1)})
+    with pytest.raises(KeyError):
+        compile_predicate(col("missing") == 1, cols)
+    with pytest.raises(TypeError):
+        compile_predicate(col("txt") == "a", cols)
+    with pytest.raises(TypeError):
+        compile_predicate(col("num").isin([]), cols)
+    with pytest.raises(TypeError):
+        compile_predicate(col("i") == 1.5, cols)
+    with pytest.raises(TypeError):
+        compile_predicate(col("day") == datetime.datetime(2000, 1, 1), cols)
+    with pytest.raises(TypeError):
+        col("i") == None                                                    # noqa: E711
+    with pytest.raises(TypeError):
+        (col("i") > 1) and (col("s") > 1)
+    deep = col("s") > 0
+    for _ in range(70):
+        deep = (col("s") > 0) | deep
+    with pytest.raises(ValueError, match="deeply"):
+        compile_predicate(deep, cols)
+    pred = compile_predicate(col("i") > 1, cols)
+    with pytest.raises(ValueError):
+        compile_predicate(pred, cols[:3])
+    assert ((col("i") > 1) | col("s").is_null() | (col("i") < 0)).columns() == ["i", "s"]
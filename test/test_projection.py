@@ -0,0 +1,83 @@
+"""
+列の射影 (projection pushdown) のテスト
+
+- decode_chunk_cpu / decode_chunk(backend="cpu") の projection が全列デコード結果の select と一致するか
+- run_pipeline(projection=...) で固定の COPY ストリームから射影した列だけが出力されるか
+- COPY クエリの SELECT リストの書き換え (テーブル / ChunkSpec / カスタムクエリ)
+"""
+
+import pyarrow as pa
+import pytest
+
+from src.arrow_utils import projection_indices
+from src.cpu_decoder import decode_chunk_cpu
+from src.cpu_parse_utils import parse_binary_chunk_cpu
+from src.gpu_decoder_v2 import decode_chunk
+from src.pg_connector import _build_select_query, project_query, select_list
+from src.pg_partition import CtidRange
+from src.pipeline import run_pipeline
+from src.psql_copy_stream import iter_copy_chunks
+from test.pg_copy_fixtures import build_copy_binary, make_column_meta
+
+# int4, text, int8, float8, bool, numeric, bytea
+OIDS = [23, 25, 20, 701, 16, 1700, 17]
+NAMES = ["id", "txt", "big", "dbl", "flag", "amount", "raw"]
+
+
+def _data(n):
+    rows = [(i, None if i % 7 == 0 else f"s{i}", i * 13, i / 4.0, i % 3 == 0, None, bytes([i % 256]))
+            for i in range(n)]
+    return build_copy_binary(OIDS, rows)
+
+
+def _cols():
+    return make_column_meta(NAMES, OIDS, {"amount": (10, 2)})
+
+
+@pytest.mark.parametrize("projection", [["dbl", "id"], ["txt"], [6, 0, 4], NAMES])
+def test_decode_projection_matches_select(projection):
+    data = _data(300)
+    cols = _cols()
+    offs, lens = parse_binary_chunk_cpu(data, len(cols))
+    full = decode_chunk_cpu(data, offs, lens, cols)
+    names = [NAMES[p] if isinstance(p, int) else p for p in projection]
+    got = decode_chunk_cpu(data, offs, lens, cols, projection)
+    assert got.schema.names == names
+    assert got.equals(full.select(names))
+    assert decode_chunk(data, offs, lens, cols, backend="cpu", projection=projection).equals(got)
+
+
+def test_projection_indices_errors():
+    cols = _cols()
+    assert projection_indices(cols, None) == list(range(len(cols)))
+    with pytest.raises(KeyError):
+        projection_indices(cols, ["nope"])
+    with pytest.raises(ValueError):
+        projection_indices(cols, [7])
+    with pytest.raises(ValueError):
+        projection_indices(cols, ["id", 0])
+
+
+def test_pipeline_projection_on_fixed_stream():
+    data = _data(2000)
+    cols = _cols()
+    full, projected = [], []
+    run_pipeline(iter_copy_chunks([data], 4096), cols, full.append, backend="cpu")
+    stats = run_pipeline(iter_copy_chunks([data], 4096), cols, projected.append, backend="cpu",
+                         projection=["big", "txt"])
+    assert stats.rows == 2000
+    assert all(b.schema.names == ["big", "txt"] for b in projected)
+    assert pa.Table.from_batches(projected).equals(pa.Table.from_batches(full).select(["big", "txt"]))
+
+
+def test_copy_query_rewrite():
+    assert select_list(None) == "*"
+    assert select_list(["id", 'we"ird']) == '"id", "we""ird"'
+    with pytest.raises(ValueError):
+        select_list([])
+    assert _build_select_query("t", 10, None, None, ["id", "txt"]).strip() == 'SELECT "id", "txt" FROM t LIMIT 10'
+    assert _build_select_query("t", None, None, None).strip() == "SELECT * FROM t"
+    assert project_query("SELECT * FROM t WHERE x > 1;", ["a"]) == 'SELECT "a" FROM (SELECT * FROM t WHERE x > 1) AS _q'
+    assert project_query("SELECT 1", None) == "SELECT 1"
+    assert CtidRange(0, 0, 10).query("t", select_list(["id"])) == \
+        'SELECT "id" FROM t WHERE ctid < \'(10,0)\'::tid'
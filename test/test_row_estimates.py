@@ -0,0 +1,76 @@
+"""
+COUNT(*) を使わない行数推定のテスト
+
+- reltuples / relpages の行密度に現在のページ数を掛けること、未 ANALYZE なら None
+- EXPLAIN (FORMAT JSON) の最上位ノードの Plan Rows を返すこと
+- GPUPASER_PG_DSN がある場合は ANALYZE 済みテーブルで実際の行数に近いこと
+"""
+
+import os
+
+import pytest
+
+from src.pg_connector import estimate_query_rows, estimate_table_rows
+
+
+class FakeCursor:
+    def __init__(self, row, log):
+        self.row = row
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, row):
+        self.row = row
+        self.log = []
+
+    def cursor(self):
+        return FakeCursor(self.row, self.log)
+
+
+@pytest.mark.parametrize("row,expected", [
+    ((1000.0, 10, 10), 1000),
+    ((1000.0, 10, 15), 1500),     # ANALYZE 後に 5 ページ増えた
+    ((0.0, 0, 0), 0),
+    ((-1.0, 0, 3), None),         # 未 ANALYZE
+    (None, None),                 # テーブルなし
+])
+def test_estimate_table_rows(row, expected):
+    conn = FakeConn(row)
+    assert estimate_table_rows(conn, "t") == expected
+    assert "COUNT" not in conn.log[0].upper()
+
+
+def test_estimate_query_rows():
+    conn = FakeConn(([{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 4242}}],))
+    assert estimate_query_rows(conn, "SELECT * FROM t WHERE x > 1") == 4242
+    assert conn.log == ["EXPLAIN (FORMAT JSON) SELECT * FROM t WHERE x > 1"]
+    conn = FakeConn(('[{"Plan": {"Plan Rows": 7}}]',))
+    assert estimate_query_rows(conn, "SELECT 1") == 7
+
+
+@pytest.mark.skipif("GPUPASER_PG_DSN" not in os.environ, reason="GPUPASER_PG_DSN not set")
+def test_estimates_on_analyzed_table():
+    import psycopg
+
+    dsn = os.environ["GPUPASER_PG_DSN"]
+    table = "gpupaser_estimate_test"
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} AS SELECT g AS id FROM generate_series(1, 100000) g")
+        try:
+            conn.execute(f"ANALYZE {table}")
+            assert estimate_table_rows(conn, table) == pytest.approx(100000, rel=0.05)
+            assert estimate_query_rows(conn, f"SELECT * FROM {table}") == pytest.approx(100000, rel=0.05)
+            assert estimate_table_rows(conn, "gpupaser_no_such_table") is None
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")